@@ -0,0 +1,534 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from coalesce import CoalesceOptions, coalesce
+from encoding import EncodedEvent, encode_event
+from instrumentation import broadcast_fanout
+from subscription import SubscriptionFilter
+from wire import WireEncoder
+
+# 遅いクライアントのバッファが満杯になったときの方針
+DROP_OLDEST = "drop_oldest"    # 古いメッセージを捨てて新しいものを入れる
+DROP_NEWEST = "drop_newest"    # 新しいメッセージを捨てる
+DISCONNECT = "disconnect"      # クライアントを切断する
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+# 接続時のリプレイを送信タスクが1回に取り出す件数
+REPLAY_BATCH_SIZE = 500
+# 配信テーブルに保持する (プロジェクト, レベル) の組の上限（超えたら作り直す）
+MAX_ROUTES = 4096
+
+# 集計（metrics.py）の定期配信の受け取り方
+METRICS_ON = "on"      # ログに加えて集計も受け取る
+METRICS_ONLY = "only"  # 集計だけを受け取る（ログは配信しない）
+METRICS_MODES = (METRICS_ON, METRICS_ONLY)
+
+
+class EventRing:
+    """
+    固定長のリングバッファ。追加された通算の位置でアクセスでき、
+    上書き済みの位置は読み飛ばすので、読み出し中に追加されても安全に走査できる。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.slots: List[Optional[EncodedEvent]] = [None] * self.capacity
+        self.count = 0  # これまでに追加された件数
+
+    def append(self, event: EncodedEvent):
+        self.slots[self.count % self.capacity] = event
+        self.count += 1
+
+    @property
+    def start(self) -> int:
+        """まだ上書きされていない最も古い位置"""
+        return max(0, self.count - self.capacity)
+
+    def get(self, position: int) -> Optional[EncodedEvent]:
+        if position < self.start or position >= self.count:
+            return None
+        return self.slots[position % self.capacity]
+
+    def bisect(self, key, value) -> int:
+        """key(event) >= value となる最初の位置を返す（key はイベント順に単調増加する前提）"""
+        low, high = self.start, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if key(self.slots[mid % self.capacity]) < value:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def iter_from(self, position: int, end_id: int) -> Iterator[EncodedEvent]:
+        """position 以降のイベントを ID が end_id 以下の範囲で順に返す"""
+        while True:
+            position = max(position, self.start)
+            event = self.get(position)
+            if event is None or event.id > end_id:
+                return
+            yield event
+            position += 1
+
+
+class EventHistory:
+    """
+    最近配信したイベントの履歴。プロジェクトごとに件数を設定できるリングバッファを持ち、
+    接続時のリプレイでは各リングを ID 順にマージしながら遅延的に読み出す（クライアントごとのコピーは作らない）。
+    プロセスごとの履歴なので、複数ワーカーで共有する場合は shared_ring.SharedEventRing を使う。
+    """
+
+    shared = False
+
+    def __init__(self, default_size: int = 1000, project_sizes: Optional[Dict[str, int]] = None):
+        self.default_size = default_size
+        self.project_sizes = project_sizes or {}
+        self.rings: Dict[str, EventRing] = {}
+        # プロセスを再起動しても ID が単調増加するよう、起動時刻（マイクロ秒）から採番する
+        self._ids = itertools.count(time.time_ns() // 1000)
+        self.last_id = 0
+
+    def record(self, event: EncodedEvent):
+        event.set_id(next(self._ids))
+        self.last_id = event.id
+        for project in event.projects:
+            ring = self.rings.get(project)
+            if ring is None:
+                ring = self.rings[project] = EventRing(self.project_sizes.get(project, self.default_size))
+            ring.append(event)
+
+    def _merged(self, starts: Dict[str, int], end_id: int) -> Iterator[EncodedEvent]:
+        iterators = [self.rings[project].iter_from(position, end_id) for project, position in starts.items()]
+        last_id = None
+        for event in heapq.merge(*iterators, key=lambda e: e.id):
+            # 複数プロジェクトを含むバッチは複数のリングに入っているので重複を除く
+            if event.id != last_id:
+                last_id = event.id
+                yield event
+
+    def replay(self, after_id: Optional[int] = None, since: Optional[str] = None,
+               last: Optional[int] = None, projects: Optional[Iterable[str]] = None,
+               end_id: Optional[int] = None) -> Iterator[EncodedEvent]:
+        """
+        現時点（end_id を指定した場合はその ID）までの履歴から条件に合うイベントを ID 順に返すイテレータを作る。
+        - after_id: この ID より後（SSE の Last-Event-ID）
+        - since: タイムスタンプがこの値以降
+        - last: 最新 N 件
+        - projects: 指定したプロジェクトのリングだけを読む
+        """
+        end_id = self.last_id if end_id is None else end_id
+        rings = self.rings
+        if projects is not None:
+            rings = {project: rings[project] for project in projects if project in rings}
+        starts = {}
+        for project, ring in rings.items():
+            position = ring.start
+            if after_id is not None:
+                position = ring.bisect(lambda e: e.id, after_id + 1)
+            if since is not None:
+                position = max(position, ring.bisect(lambda e: e.timestamp, since))
+            starts[project] = position
+
+        if last is not None:
+            # 各リングの末尾 last 件の ID から全体で最新 last 件の境界を求める
+            candidate_ids = []
+            for project, ring in rings.items():
+                for position in range(max(starts[project], ring.count - last), ring.count):
+                    candidate_ids.append(ring.slots[position % ring.capacity].id)
+            newest = heapq.nlargest(last, set(candidate_ids))
+            if not newest:
+                return iter(())
+            threshold = newest[-1]
+            for project, ring in rings.items():
+                starts[project] = max(starts[project], ring.bisect(lambda e: e.id, threshold))
+
+        return self._merged(starts, end_id)
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "memory",
+            "last_id": self.last_id,
+            "projects": {project: ring.count - ring.start for project, ring in self.rings.items()},
+        }
+
+
+class Subscriber:
+    """
+    WebSocket / SSE クライアント1つ分の有界リングバッファ。
+    broadcast 側は push() でバッファに積むだけで await しないため、
+    遅いクライアントが他のクライアントへの配信を遅らせることはない。
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, kind: str, maxsize: int = 1000, policy: str = DROP_OLDEST,
+                 filter: Optional[SubscriptionFilter] = None, metrics: Optional[str] = None,
+                 coalesce: Optional[CoalesceOptions] = None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        if metrics is not None and metrics not in METRICS_MODES:
+            raise ValueError(f"Unknown metrics mode: {metrics}")
+        self.id = next(self._ids)
+        self.kind = kind
+        self.filter = filter
+        self.metrics = metrics
+        # 配信のまとめ方（None なら従来どおりイベントごとに送る）
+        self.coalesce = coalesce
+        self.maxsize = maxsize
+        self.policy = policy
+        self.buffer: Deque[EncodedEvent] = deque()
+        self.closed = False
+        self.connected_at = time.time()
+        self.task: Optional[asyncio.Task] = None
+        # 接続時に送る履歴（EventHistory.replay のイテレータ）。送り終えたら None
+        self.replay: Optional[Iterator[EncodedEvent]] = None
+        # リプレイに含まれる最後の ID。これ以下の ID のライブ配信は（他のワーカー経由で遅れて届いたもの）重複なので捨てる
+        self.replay_until = 0
+
+        # 統計情報
+        self.sent = 0
+        self.dropped = 0
+        self.max_lag = 0
+        self.frames = 0
+        self.collapsed = 0
+
+        # WebSocket でバイナリのサブプロトコルを使う場合の接続ごとのエンコーダー（JSON テキストなら None）
+        self.wire: Optional[WireEncoder] = None
+
+        self._wakeup = asyncio.Event()
+        # まとめたフレームに入りきらず、次のフレームに回すイベント
+        self._carry: List[EncodedEvent] = []
+
+    def push(self, message: EncodedEvent) -> bool:
+        """メッセージをバッファに積む。捨てた場合・切断した場合は False を返す"""
+        if self.closed:
+            return False
+        if message.id is not None and message.id <= self.replay_until:
+            return True
+        buffer = self.buffer
+        if len(buffer) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return False
+            if self.policy == DISCONNECT:
+                self.close()
+                return False
+            buffer.popleft()
+        buffer.append(message)
+        if len(buffer) > self.max_lag:
+            self.max_lag = len(buffer)
+        self._wakeup.set()
+        return True
+
+    def _take_nowait(self) -> List[EncodedEvent]:
+        """リプレイの続き、無ければバッファに溜まっているメッセージを待たずに取り出す（無ければ空リスト）"""
+        if self.replay is not None:
+            batch = list(itertools.islice(self.replay, REPLAY_BATCH_SIZE))
+            if batch and not self.closed:
+                self.sent += len(batch)
+                return batch
+            self.replay = None
+        batch = list(self.buffer)
+        self.buffer.clear()
+        self.sent += len(batch)
+        return batch
+
+    async def next_batch(self) -> List[EncodedEvent]:
+        """
+        バッファに溜まっているメッセージをすべて取り出す。切断済みなら空リストを返す。
+        リプレイが残っている間は、ライブのメッセージより先に履歴を少しずつ返す。
+        """
+        while True:
+            batch = self._take_nowait()
+            if batch or self.closed:
+                return batch
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def next_frames(self) -> List[EncodedEvent]:
+        """
+        送信するフレームを返す。切断済みなら空リスト。
+        まとめない購読者は next_batch() のイベントをそのまま返す。まとめる購読者は最初のイベントから
+        coalesce.interval 秒待つか coalesce.max_events 件たまるまで集めてから、1つの JSON 配列にまとめる。
+        """
+        options = self.coalesce
+        if options is None:
+            # 接続中にまとめるのをやめた場合は、持ち越した分から送る
+            batch, self._carry = self._carry, []
+            if not batch:
+                batch = await self.next_batch()
+            self.frames += len(batch)
+            return batch
+
+        batch, self._carry = self._carry, []
+        if not batch:
+            batch = await self.next_batch()
+            if not batch:
+                return []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + options.interval
+        while len(batch) < options.max_events and not self.closed:
+            more = self._take_nowait()
+            if more:
+                batch.extend(more)
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        if len(batch) > options.max_events:
+            batch, self._carry = batch[:options.max_events], batch[options.max_events:]
+        frames, collapsed = coalesce(batch, options.dedupe)
+        self.frames += len(frames)
+        self.collapsed += collapsed
+        return frames
+
+    def close(self):
+        self.closed = True
+        self._wakeup.set()
+
+    @property
+    def lag(self) -> int:
+        """未送信のメッセージ数"""
+        return len(self.buffer) + len(self._carry)
+
+    def stats(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "policy": self.policy,
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "filter": self.filter.to_dict() if self.filter else None,
+            "metrics": self.metrics,
+            "coalesce": self.coalesce.to_dict() if self.coalesce else None,
+            "frames": self.frames,
+            "collapsed": self.collapsed,
+            "wire": self.wire.stats() if self.wire else None,
+            "closed": self.closed,
+            "connected_at": self.connected_at,
+        }
+
+
+class ConnectionManager:
+    """
+    WebSocket / SSE の購読者を管理し、ログをファンアウト配信する。
+    各購読者は専用のバッファと送信タスク（SSE はレスポンスのジェネレータ）を持つ。
+    購読フィルタは (プロジェクト, レベル) -> 購読者リスト の配信テーブルに事前にまとめておき、
+    イベントごとには該当する購読者だけを見る（一致しない購読者のコストはかからない）。
+    """
+
+    def __init__(self, queue_size: int = 1000, policy: str = DROP_OLDEST,
+                 history: Optional[EventHistory] = None, bus=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.subscribers: Dict[int, Subscriber] = {}
+        self.history = history or EventHistory()
+        # 他のワーカープロセスへイベントを中継するバス（bus.py）。None なら1プロセス内だけで配信する
+        self.bus = bus
+        self._routes: Dict[Tuple[str, str], List[Subscriber]] = {}
+        self._listeners: List = []
+
+    def add_listener(self, listener):
+        """配信するイベントごとに on_event(event) を呼ぶオブジェクトを登録する（他のワーカーから届いたものも含む）"""
+        self._listeners.append(listener)
+
+    # --- Routing ---
+    def _invalidate_routes(self):
+        self._routes = {}
+
+    def _route(self, key: Tuple[str, str]) -> List[Subscriber]:
+        """(プロジェクト, レベル) のイベントを受け取り得る購読者のリスト（初回に作ってキャッシュする）"""
+        targets = self._routes.get(key)
+        if targets is None:
+            if len(self._routes) >= MAX_ROUTES:
+                self._routes = {}
+            targets = [
+                subscriber for subscriber in self.subscribers.values()
+                if subscriber.metrics != METRICS_ONLY
+                and (subscriber.filter is None or subscriber.filter.accepts_key(*key))
+            ]
+            self._routes[key] = targets
+        return targets
+
+    def set_filter(self, subscriber: Subscriber, filter: Optional[SubscriptionFilter]):
+        """購読者のフィルタを差し替える（WebSocket の制御メッセージから呼ばれる）"""
+        subscriber.filter = None if filter is None or filter.is_empty else filter
+        self._invalidate_routes()
+
+    def set_metrics(self, subscriber: Subscriber, mode: Optional[str]):
+        """購読者の集計の受け取り方（None / on / only）を変える"""
+        if mode is not None and mode not in METRICS_MODES:
+            raise ValueError(f"metrics must be one of {', '.join(METRICS_MODES)}")
+        subscriber.metrics = mode
+        self._invalidate_routes()
+
+    def metrics_subscribers(self) -> List[Subscriber]:
+        """集計の定期配信を受け取る購読者"""
+        return [subscriber for subscriber in self.subscribers.values() if subscriber.metrics is not None]
+
+    # --- Connections ---
+    def _create_subscriber(self, kind: str, policy: Optional[str] = None,
+                           replay: Optional[Dict] = None,
+                           filter: Optional[SubscriptionFilter] = None,
+                           metrics: Optional[str] = None,
+                           coalesce: Optional[CoalesceOptions] = None) -> Subscriber:
+        """
+        購読者を登録する。replay には EventHistory.replay() の引数（after_id / since / last）を渡す。
+        履歴のイテレータは登録と同時に作るので、以後の配信と重複も欠落もしない。
+        """
+        if filter is not None and filter.is_empty:
+            filter = None
+        subscriber = Subscriber(kind, maxsize=self.queue_size, policy=policy or self.policy,
+                                filter=filter, metrics=metrics, coalesce=coalesce)
+        if replay:
+            end_id = subscriber.replay_until = self.history.last_id
+            if filter is not None:
+                events = self.history.replay(projects=filter.projects, end_id=end_id, **replay)
+                subscriber.replay = filter.filter_events(events)
+            else:
+                subscriber.replay = self.history.replay(end_id=end_id, **replay)
+        self.subscribers[subscriber.id] = subscriber
+        self._invalidate_routes()
+        return subscriber
+
+    async def connect_ws(self, websocket: WebSocket, policy: Optional[str] = None,
+                         replay: Optional[Dict] = None,
+                         filter: Optional[SubscriptionFilter] = None,
+                         metrics: Optional[str] = None,
+                         coalesce: Optional[CoalesceOptions] = None,
+                         subprotocol: Optional[str] = None) -> Subscriber:
+        """subprotocol（wire.negotiate() で選んだもの）を指定すると、JSON テキストではなくバイナリのフレームで送る"""
+        await websocket.accept(subprotocol=subprotocol)
+        subscriber = self._create_subscriber("ws", policy, replay, filter, metrics, coalesce)
+        if subprotocol is not None:
+            subscriber.wire = WireEncoder()
+        subscriber.task = asyncio.create_task(self._ws_sender(websocket, subscriber))
+        return subscriber
+
+    def disconnect_ws(self, subscriber: Subscriber):
+        self._remove(subscriber)
+        if subscriber.task and not subscriber.task.done():
+            subscriber.task.cancel()
+
+    async def connect_sse(self, policy: Optional[str] = None,
+                          replay: Optional[Dict] = None,
+                          filter: Optional[SubscriptionFilter] = None,
+                          metrics: Optional[str] = None,
+                          coalesce: Optional[CoalesceOptions] = None) -> Subscriber:
+        return self._create_subscriber("sse", policy, replay, filter, metrics, coalesce)
+
+    def disconnect_sse(self, subscriber: Subscriber):
+        self._remove(subscriber)
+
+    def _remove(self, subscriber: Subscriber):
+        subscriber.close()
+        if self.subscribers.pop(subscriber.id, None) is not None:
+            self._invalidate_routes()
+
+    async def _ws_sender(self, websocket: WebSocket, subscriber: Subscriber):
+        """購読者のバッファを WebSocket へ送り出す（クライアントごとに1タスク）"""
+        try:
+            while True:
+                batch = await subscriber.next_frames()
+                if not batch:
+                    break
+                if subscriber.wire is not None:
+                    await websocket.send_bytes(subscriber.wire.encode(batch))
+                    continue
+                for message in batch:
+                    await websocket.send_text(message.json)
+        except (WebSocketDisconnect, RuntimeError):
+            return
+        except Exception as e:
+            print(f"WebSocket sender error: {e}")
+            return
+
+        # ここに来るのは disconnect ポリシーで切り離された場合
+        self._remove(subscriber)
+        try:
+            await websocket.close(code=1013)  # Try Again Later
+        except Exception:
+            pass
+
+    async def broadcast(self, message):
+        """
+        エンコード済みイベント（または JSON 化できる値）を全購読者へ配信する。
+        JSON 化はここで1回だけ行い、各購読者は同じ EncodedEvent を共有する。
+        バスがあれば他のワーカープロセスにも同じバイト列を送る。
+        """
+        if not isinstance(message, EncodedEvent):
+            message = encode_event(message)
+        self.deliver(message)
+        if self.bus is not None:
+            self.bus.publish(message)
+
+    def receive(self, message: EncodedEvent):
+        """
+        バスから届いた他のワーカーのイベントを、このプロセスの購読者だけに配信する（再送はしない）。
+        共有の履歴なら送信元のワーカーが記録済みなので、そのとき採番された ID のまま配信する。
+        """
+        if self.history.shared and message.id is not None:
+            self._fan_out(message)
+        else:
+            self.deliver(message)
+
+    def deliver(self, message: EncodedEvent):
+        """履歴に記録してから、このプロセスの購読者だけに配信する"""
+        self.history.record(message)
+        self._fan_out(message)
+
+    def _fan_out(self, message: EncodedEvent):
+        start = time.perf_counter()
+        for listener in self._listeners:
+            try:
+                listener.on_event(message)
+            except Exception as e:
+                print(f"ConnectionManager: listener {type(listener).__name__}.on_event failed: {e}")
+
+        keys = message.keys
+        if not keys:
+            targets = [subscriber for subscriber in self.subscribers.values() if subscriber.metrics != METRICS_ONLY]
+        elif len(keys) == 1:
+            targets = self._route(keys[0])
+        else:
+            # 複数の (プロジェクト, レベル) を含むバッチは各経路の購読者をまとめる
+            merged = {}
+            for key in keys:
+                for subscriber in self._route(key):
+                    merged[subscriber.id] = subscriber
+            targets = list(merged.values())
+
+        # バッチの一部だけを受け取る購読者向けの再エンコード結果を、同じ条件のフィルタ間で共有する
+        selections = {}
+        closed = []
+        # 各購読者のバッファに積むだけなので、購読者数が増えても await は発生しない
+        for subscriber in targets:
+            event = message
+            if subscriber.filter is not None and (len(keys) > 1 or subscriber.filter.needs_log_check):
+                event = subscriber.filter.select(message, selections)
+                if event is None:
+                    continue
+            subscriber.push(event)
+            if subscriber.closed:
+                closed.append(subscriber)
+        for subscriber in closed:
+            self._remove(subscriber)
+        broadcast_fanout.observe(time.perf_counter() - start)
+
+    def stats(self) -> List[Dict]:
+        return [subscriber.stats() for subscriber in self.subscribers.values()]
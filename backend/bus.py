@@ -0,0 +1,430 @@
+import asyncio
+import hashlib
+import os
+import struct
+import tempfile
+from array import array
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from encoding import EncodedEvent, decode_event
+
+# 複数プロセスのうち1つだけがメンテナンス（圧縮・保持ポリシー）を行うための排他には fcntl.flock を使う（POSIX のみ）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ブロードキャストバスの種類
+BUS_LOCAL = "local"  # 1プロセス内だけで配信する（既定）
+BUS_UNIX = "unix"    # 同じホストのワーカープロセス間で Unix ドメインソケットを使って配信する
+BUS_BACKENDS = (BUS_LOCAL, BUS_UNIX)
+
+# フレームは「4バイトのビッグエンディアン長 + 8バイトのイベント ID（未採番なら 0） + イベントの JSON」
+_FRAME_HEADER = struct.Struct(">IQ")
+# 接続したときに最初にお互いに送る pid
+_HELLO = struct.Struct(">Q")
+# 接続先が pid を返すまで待つ秒数
+HELLO_TIMEOUT = 5.0
+
+
+def default_bus_dir(log_dir: Path) -> Path:
+    """
+    LOG_DIR ごとのソケットディレクトリ。同じ LOG_DIR を使うワーカー同士だけが同じバスに参加する。
+    Unix ドメインソケットのパスは 108 バイト程度までなので、LOG_DIR の下ではなく一時ディレクトリに置く。
+    """
+    digest = hashlib.sha1(str(Path(log_dir).resolve()).encode("utf-8")).hexdigest()[:12]
+    return Path(tempfile.gettempdir()) / f"vibelogger-bus-{digest}"
+
+
+class InProcessBus:
+    """
+    1プロセスだけで動かす場合のバス。他のワーカーが存在しないので publish() は何もしない。
+    ConnectionManager は配信先のプロセス内の購読者へ直接配信する。
+    """
+
+    name = BUS_LOCAL
+
+    async def start(self, deliver: Callable[[EncodedEvent], None], history=None):
+        pass
+
+    async def stop(self):
+        pass
+
+    def publish(self, event: EncodedEvent):
+        pass
+
+    def try_lead(self) -> bool:
+        return True
+
+    def stats(self) -> Dict:
+        return {"backend": self.name, "leader": True}
+
+
+class _Peer:
+    """
+    接続先のワーカー1つぶんの送信状態。接続が切れても、そのワーカーが生きているあいだは残しておく。
+
+    - frames: publish() が積んだ未送信のフレーム（イベント ID, フレーム）
+    - resync_ids: フレームの代わりに控えたイベント ID。共有リングから読み直して送る
+    - inflight_*: 送信タスクが書き込み中（drain() を待っている）のもの。接続が切れたら送り直す
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.task: Optional[asyncio.Task] = None
+        self.frames: Deque[Tuple[int, bytes]] = deque()
+        self.queued_bytes = 0
+        self.resync_ids = array("Q")
+        self.inflight_ids = array("Q")
+        self.inflight_frames: Deque[Tuple[int, bytes]] = deque()
+        self.wakeup = asyncio.Event()
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    @property
+    def sending(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @property
+    def pending(self) -> int:
+        return len(self.frames) + len(self.resync_ids) + len(self.inflight_ids)
+
+
+class UnixSocketBus:
+    """
+    同じホストで動く複数のワーカープロセス（uvicorn --workers）の間でイベントを配信するバス。
+
+    - 各ワーカーは bus_dir/<pid>.sock で待ち受け、起動時と discovery_interval 秒ごとにディレクトリを見て
+      まだ接続していないワーカーへ接続する（接続できないソケットは終了したワーカーのものとして削除する）
+    - 接続したらお互いの pid を送り合い、1本の接続を双方向に使う。受け付けた側は pid を返す前に相手を送信先に加えるので、
+      start() から戻った時点で既存の全ワーカーがこのワーカーへ送る（次の discovery を待つあいだに欠けない）
+    - publish() は他のワーカーごとのキューにフレームを積むだけで await しない。
+      ワーカーごとの送信タスクが順に書き込み、drain() で相手の読み込みを待つ（遅い相手が他のワーカーへの送信を止めない）
+    - キューが max_buffer バイトを超えた・接続が切れた場合は、フレームを捨ててイベント ID だけを控え、
+      送れるようになったら共有リング（SharedEventRing）からその ID のイベントを読み直して順に送る。
+      リングから上書きされていたイベントは lost に数える（共有リングが無ければフレームのまま積み続ける）
+    - 受け取った側は送信元ごとに最後のイベント ID を覚え、それ以下の ID（送り直しで重なったもの）は配信しない。
+      したがって配信はちょうど1回（リングから消えるほど遅れた場合だけ欠ける）
+    - 受け取ったイベントは deliver() でそのプロセスの購読者にだけ配信し、他のワーカーへの再送はしない
+    - 受け取った JSON はそのまま配信用のバイト列として使い、再エンコードしない。
+      送信元で採番したイベント ID も一緒に送る（共有リングの履歴ではその ID のまま配信する）
+    """
+
+    name = BUS_UNIX
+
+    def __init__(self, bus_dir: Path, discovery_interval: float = 1.0, max_buffer: int = 8 * 1024 * 1024,
+                 pid: Optional[int] = None):
+        self.bus_dir = Path(bus_dir)
+        self.discovery_interval = discovery_interval
+        self.max_buffer = max_buffer
+        self.pid = pid or os.getpid()
+        self.socket_path = self.bus_dir / f"{self.pid}.sock"
+        self._deliver: Optional[Callable[[EncodedEvent], None]] = None
+        self._ring = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Dict[int, _Peer] = {}
+        self._last_received: Dict[int, int] = {}
+        self._readers = set()
+        self._discovery_task: Optional[asyncio.Task] = None
+        self._lock_fd: Optional[int] = None
+
+        # 統計情報
+        self.published = 0
+        self.received = 0
+        self.resynced = 0    # 共有リングから読み直して送ったイベント
+        self.lost = 0        # 読み直そうとしたときにはリングから消えていたイベント
+        self.duplicates = 0  # 送り直しで重なって配信しなかったイベント
+
+    # --- Lifecycle ---
+    async def start(self, deliver: Callable[[EncodedEvent], None], history=None):
+        """history が共有リングなら、送れなかったイベントをそこから読み直す"""
+        self._deliver = deliver
+        self._ring = history if getattr(history, "shared", False) else None
+        self.bus_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=str(self.socket_path))
+        await self._discover()
+        self._discovery_task = asyncio.create_task(self._discovery_loop())
+
+    async def stop(self):
+        if self._discovery_task:
+            self._discovery_task.cancel()
+            try:
+                await self._discovery_task
+            except asyncio.CancelledError:
+                pass
+        if self._server:
+            self._server.close()
+        for task in list(self._readers):
+            task.cancel()
+        for peer in self._peers.values():
+            if peer.task is not None:
+                peer.task.cancel()
+            if peer.writer is not None:
+                peer.writer.close()
+        self._peers.clear()
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    # --- Sending ---
+    def publish(self, event: EncodedEvent):
+        """自プロセスで取り込んだイベントを他のすべてのワーカーのキューに積む（await しない）"""
+        if not self._peers:
+            return
+        event_id = event.id or 0
+        frame = None
+        for peer in self._peers.values():
+            if peer.resync_ids and event_id:
+                # 控えた ID より先に送らないよう、読み直しが終わるまでは ID だけを控える
+                peer.resync_ids.append(event_id)
+            else:
+                if frame is None:
+                    body = event.json_bytes
+                    frame = _FRAME_HEADER.pack(len(body), event_id) + body
+                peer.frames.append((event_id, frame))
+                peer.queued_bytes += len(frame)
+                if peer.queued_bytes > self.max_buffer:
+                    self._spill(peer)
+            peer.wakeup.set()
+        self.published += 1
+
+    def _spill(self, peer: _Peer):
+        """キューのフレームを捨ててイベント ID だけを控える（共有リングから読み直せる場合だけ）"""
+        if self._ring is None or any(event_id == 0 for event_id, _ in peer.frames):
+            return
+        peer.resync_ids.extend(event_id for event_id, _ in peer.frames)
+        peer.frames.clear()
+        peer.queued_bytes = 0
+
+    def _attach(self, pid: int, writer: asyncio.StreamWriter) -> bool:
+        """接続を pid への送信に使う。すでに送信中の接続があれば、この接続は受信だけに使う"""
+        peer = self._peers.get(pid)
+        if peer is None:
+            peer = self._peers[pid] = _Peer(pid)
+        elif peer.connected or peer.sending:
+            return False
+        peer.writer = writer
+        peer.task = asyncio.create_task(self._send_loop(peer, writer))
+        return True
+
+    async def _send_loop(self, peer: _Peer, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                if writer.is_closing():
+                    break
+                if peer.frames:
+                    peer.inflight_frames, peer.frames = peer.frames, deque()
+                    peer.inflight_ids = array("Q", (event_id for event_id, _ in peer.inflight_frames))
+                    peer.queued_bytes = 0
+                    writer.writelines(frame for _, frame in peer.inflight_frames)
+                    await writer.drain()
+                elif peer.resync_ids:
+                    await self._resync(peer, writer)
+                else:
+                    peer.wakeup.clear()
+                    await peer.wakeup.wait()
+                    continue
+                peer.inflight_ids = array("Q")
+                peer.inflight_frames = deque()
+        except (ConnectionError, OSError) as e:
+            print(f"UnixSocketBus: connection to worker {peer.pid} lost: {e}")
+        finally:
+            self._detach(peer, writer)
+
+    async def _resync(self, peer: _Peer, writer: asyncio.StreamWriter):
+        """控えた ID のイベントを共有リングから読み直して順に送る（リングから消えていたものは lost に数える）"""
+        ids = peer.inflight_ids = peer.resync_ids
+        peer.resync_ids = array("Q")
+        index = 0
+        for event in self._ring.replay(after_id=ids[0] - 1, end_id=ids[-1]):
+            while index < len(ids) and ids[index] < event.id:
+                self.lost += 1
+                index += 1
+            if index == len(ids):
+                break
+            if ids[index] != event.id:
+                continue
+            body = event.json_bytes
+            writer.write(_FRAME_HEADER.pack(len(body), event.id))
+            writer.write(body)
+            self.resynced += 1
+            index += 1
+            await writer.drain()
+        self.lost += len(ids) - index
+
+    def _detach(self, peer: _Peer, writer: asyncio.StreamWriter):
+        """
+        接続が切れた。書き込み中だったものは届いたか分からないので送り直す
+        （重なった分は受け取った側が ID で捨てる）。次に接続したときに続きから送る。
+        """
+        writer.close()
+        if peer.writer is writer:
+            peer.writer = None
+        if self._ring is not None and peer.inflight_ids and all(peer.inflight_ids):
+            ids = peer.inflight_ids + peer.resync_ids
+            ids.extend(event_id for event_id, _ in peer.frames)
+            peer.resync_ids = ids
+            peer.frames.clear()
+            peer.queued_bytes = 0
+        else:
+            peer.frames.extendleft(reversed(peer.inflight_frames))
+            peer.queued_bytes += sum(len(frame) for _, frame in peer.inflight_frames)
+        peer.inflight_ids = array("Q")
+        peer.inflight_frames = deque()
+
+    # --- Receiving ---
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """他のワーカーからの接続。pid を受け取って送信先に加えてから自分の pid を返し、届いたフレームを読む"""
+        try:
+            pid, = _HELLO.unpack(await asyncio.wait_for(reader.readexactly(_HELLO.size), HELLO_TIMEOUT))
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        # 返事より前にフレームを書かないよう、返事を書いてから送信タスクを作る
+        writer.write(_HELLO.pack(self.pid))
+        self._attach(pid, writer)
+        await self._read_frames(pid, reader, writer)
+
+    async def _read_frames(self, pid: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """届いたフレームを順にこのプロセスの購読者へ配信する（送り直しで重なった ID は捨てる）"""
+        task = asyncio.current_task()
+        self._readers.add(task)
+        try:
+            while True:
+                header = await reader.readexactly(_FRAME_HEADER.size)
+                length, event_id = _FRAME_HEADER.unpack(header)
+                body = await reader.readexactly(length)
+                if event_id:
+                    if event_id <= self._last_received.get(pid, 0):
+                        self.duplicates += 1
+                        continue
+                    self._last_received[pid] = event_id
+                try:
+                    event = decode_event(body)
+                except ValueError as e:
+                    print(f"UnixSocketBus: invalid frame from peer: {e}")
+                    continue
+                if event_id:
+                    event.set_id(event_id)
+                self.received += 1
+                try:
+                    self._deliver(event)
+                except Exception as e:
+                    print(f"UnixSocketBus: delivery failed: {e}")
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._readers.discard(task)
+            writer.close()
+            # この接続で送っていたなら、送信タスクに切れたことを知らせる
+            peer = self._peers.get(pid)
+            if peer is not None and peer.writer is writer:
+                peer.wakeup.set()
+
+    # --- Discovery ---
+    async def _discovery_loop(self):
+        while True:
+            await asyncio.sleep(self.discovery_interval)
+            try:
+                await self._discover()
+            except Exception as e:
+                print(f"UnixSocketBus: discovery failed: {e}")
+
+    async def _discover(self):
+        """bus_dir のソケットを見て、接続していないワーカーへ接続する。ソケットが無くなったワーカーは忘れる"""
+        alive = set()
+        for path in self.bus_dir.glob("*.sock"):
+            try:
+                pid = int(path.stem)
+            except ValueError:
+                continue
+            if pid == self.pid:
+                continue
+            alive.add(pid)
+            peer = self._peers.get(pid)
+            if peer is not None and (peer.connected or peer.sending):
+                continue
+            try:
+                await self._connect(pid, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 待ち受けているプロセスがいない（終了したワーカーの残骸）
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                alive.discard(pid)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                print(f"UnixSocketBus: cannot connect to {path}: {e}")
+        for pid in [pid for pid, peer in self._peers.items() if pid not in alive and not peer.connected]:
+            del self._peers[pid]
+            self._last_received.pop(pid, None)
+
+    async def _connect(self, pid: int, path: Path):
+        """pid を送り、相手が送信先に加えた（pid を返した）ことを確かめてから、この接続を送受信に使う"""
+        reader, writer = await asyncio.open_unix_connection(str(path))
+        try:
+            writer.write(_HELLO.pack(self.pid))
+            await writer.drain()
+            await asyncio.wait_for(reader.readexactly(_HELLO.size), HELLO_TIMEOUT)
+        except BaseException:
+            writer.close()
+            raise
+        self._attach(pid, writer)
+        asyncio.create_task(self._read_frames(pid, reader, writer))
+
+    # --- Leadership ---
+    def try_lead(self) -> bool:
+        """
+        ワーカーのうち1つだけが true を返す（bus_dir/leader.lock の排他ロック）。
+        リーダーのプロセスが終了するとロックが外れ、次に呼んだワーカーがリーダーになる。
+        """
+        if self._lock_fd is not None:
+            return True
+        if fcntl is None:
+            return True
+        self.bus_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.bus_dir / "leader.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "pid": self.pid,
+            "socket": str(self.socket_path),
+            "leader": self._lock_fd is not None,
+            "peers": sorted(pid for pid, peer in self._peers.items() if peer.connected),
+            "pending": {pid: peer.pending for pid, peer in self._peers.items() if peer.pending},
+            "published": self.published,
+            "received": self.received,
+            "resynced": self.resynced,
+            "lost": self.lost,
+            "duplicates": self.duplicates,
+        }
+
+
+def create_bus(backend: str, log_dir: Path, bus_dir: Optional[Path] = None):
+    """設定名 (local / unix) からブロードキャストバスを作る"""
+    if backend == BUS_LOCAL:
+        return InProcessBus()
+    if backend == BUS_UNIX:
+        return UnixSocketBus(bus_dir or default_bus_dir(log_dir))
+    raise ValueError(f"Unknown broadcast bus: {backend} (expected one of {', '.join(BUS_BACKENDS)})")
@@ -0,0 +1,274 @@
+import json
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from cold_storage import is_compressed, open_log, stat_log
+from log_reader import READ_CHUNK_SIZE, find_tail_offset
+
+
+def _read_timestamp(raw_line: bytes) -> Optional[str]:
+    try:
+        timestamp = json.loads(raw_line).get("timestamp")
+    except (ValueError, AttributeError):
+        return None
+    return timestamp if isinstance(timestamp, str) else None
+
+
+def _first_line(path: Path) -> bytes:
+    with open_log(path) as f:
+        return f.readline(READ_CHUNK_SIZE).rstrip(b"\n")
+
+
+def _last_line(path: Path) -> bytes:
+    start = find_tail_offset(path, 1)
+    with open_log(path) as f:
+        f.seek(start)
+        return f.read().rstrip(b"\n")
+
+
+class FileInfo:
+    """カタログに載せるログファイル1つ分のメタデータ（size は圧縮済みファイルでも展開後のサイズ）"""
+
+    __slots__ = ("name", "size", "mtime", "compressed_size", "entries", "first_timestamp", "last_timestamp")
+
+    def __init__(self, name: str, size: int = 0, mtime: float = 0.0, compressed_size: Optional[int] = None):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.compressed_size = compressed_size  # 圧縮済みファイルのディスク上のサイズ
+        self.entries: Optional[int] = None  # 未集計の場合は None
+        self.first_timestamp: Optional[str] = None
+        self.last_timestamp: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "mtime": self.mtime,
+            "compressed_size": self.compressed_size,
+            "entries": self.entries,
+            "first_timestamp": self.first_timestamp,
+            "last_timestamp": self.last_timestamp,
+        }
+
+
+class ProjectCatalog:
+    """
+    LOG_DIR 配下のプロジェクトとログファイルのメモリ上のカタログ。
+    起動時に1回だけディレクトリを走査し、以後は LogWriter からの通知（書き込み・ローテーション）と
+    定期的な再走査（他プロセスによる変更の取り込み）で差分更新する。
+    version は ETag として使う。ファイルの追加・削除・名前の変更ではすぐに増えるが、
+    書き込みのたびに変わるサイズ・エントリ数などの統計は stats_interval 秒に1回だけ version に反映する
+    （取り込み中でも If-None-Match がその間は一致し続ける）。
+    """
+
+    def __init__(self, log_dir: Path, file_pattern: str = "*.log*", stats_interval: float = 10.0):
+        self.log_dir = log_dir
+        self.file_pattern = file_pattern
+        self.stats_interval = stats_interval
+        self.projects: Dict[str, Dict[str, FileInfo]] = {}
+        self.version = 0
+        self._instance = uuid.uuid4().hex[:8]
+        self._lock = threading.RLock()
+        self._stats_changed = False
+        self._touched_at = 0.0
+
+    @property
+    def etag(self) -> str:
+        with self._lock:
+            if self._stats_changed and time.monotonic() - self._touched_at >= self.stats_interval:
+                self._touch()
+            return f'"{self._instance}-{self.version}"'
+
+    def _touch(self):
+        """ファイル一覧が変わった（次の etag からすぐに反映する）"""
+        self.version += 1
+        self._stats_changed = False
+        self._touched_at = time.monotonic()
+
+    def _touch_stats(self):
+        """既存のファイルの統計だけが変わった（前回の反映から stats_interval 秒経つまで etag は変えない）"""
+        self._stats_changed = True
+
+    # --- Building ---
+    def _list_files(self) -> Dict[str, Dict[str, FileInfo]]:
+        projects: Dict[str, Dict[str, FileInfo]] = {}
+        if not self.log_dir.exists():
+            return projects
+        for project_dir in self.log_dir.iterdir():
+            if not project_dir.is_dir() or project_dir.name.startswith("."):
+                continue
+            files = {}
+            for path in project_dir.glob(self.file_pattern):
+                try:
+                    st = path.stat()
+                    if is_compressed(path):
+                        files[path.name] = FileInfo(path.name, stat_log(path)[1], st.st_mtime, st.st_size)
+                    else:
+                        files[path.name] = FileInfo(path.name, st.st_size, st.st_mtime)
+                except FileNotFoundError:
+                    continue
+                except Exception as e:
+                    print(f"Catalog: skipping unreadable file {path}: {e}")
+            projects[project_dir.name] = files
+        return projects
+
+    def rescan(self):
+        """
+        ディレクトリを走査してカタログと突き合わせる（ブロッキング）。
+        サイズが変わらないファイルは集計済みの情報をそのまま使う。
+        """
+        listed = self._list_files()
+        with self._lock:
+            changed = set(listed) != set(self.projects)
+            stats_changed = False
+            for project, files in listed.items():
+                known = self.projects.get(project, {})
+                if set(files) != set(known):
+                    changed = True
+                for name, info in files.items():
+                    old = known.get(name)
+                    if old is not None and old.size == info.size:
+                        # 自プロセスの書き込みは on_write で反映済みなので、サイズが同じなら集計を使い回す
+                        old.mtime = info.mtime
+                        files[name] = old
+                    else:
+                        stats_changed = True
+            self.projects = listed
+            if changed:
+                self._touch()
+            elif stats_changed:
+                self._touch_stats()
+
+    def fill_details(self):
+        """エントリ数・最初/最後のタイムスタンプが未集計のファイルを集計する（ブロッキング）"""
+        with self._lock:
+            pending = [
+                (project, info.name, info.size)
+                for project, files in self.projects.items()
+                for info in files.values()
+                if info.entries is None
+            ]
+        for project, name, size in pending:
+            details = self._scan_details(self.log_dir / project / name, size)
+            if details is None:
+                continue
+            with self._lock:
+                info = self.projects.get(project, {}).get(name)
+                if info is None or info.entries is not None:
+                    continue
+                info.entries, info.first_timestamp, info.last_timestamp = details
+                self._touch_stats()
+
+    @staticmethod
+    def _scan_details(path: Path, size: int) -> Optional[Tuple[int, Optional[str], Optional[str]]]:
+        try:
+            entries = 0
+            with open_log(path) as f:
+                remaining = size
+                while remaining > 0:
+                    block = f.read(min(READ_CHUNK_SIZE, remaining))
+                    if not block:
+                        break
+                    entries += block.count(b"\n")
+                    remaining -= len(block)
+            if entries == 0:
+                return 0, None, None
+            return entries, _read_timestamp(_first_line(path)), _read_timestamp(_last_line(path))
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+    # --- Hooks from LogWriter (writer thread) ---
+    def on_write(self, path: Path, offset: int, data: bytes):
+        project, name = path.parent.name, path.name
+        with self._lock:
+            files = self.projects.setdefault(project, {})
+            info = files.get(name)
+            added = info is None
+            if added:
+                info = files[name] = FileInfo(name)
+                if offset == 0:
+                    info.entries = 0
+            info.size = offset + len(data)
+            info.mtime = time.time()
+            lines = data.count(b"\n")
+            if info.entries is not None:
+                info.entries += lines
+            if lines:
+                first_nl = data.find(b"\n")
+                if info.first_timestamp is None and offset == 0:
+                    info.first_timestamp = _read_timestamp(data[:first_nl])
+                last_start = data.rfind(b"\n", 0, len(data) - 1) + 1
+                info.last_timestamp = _read_timestamp(data[last_start:].rstrip(b"\n")) or info.last_timestamp
+            if added:
+                self._touch()
+            else:
+                self._touch_stats()
+
+    def on_rotate(self, old_path: Path, new_path: Path):
+        with self._lock:
+            files = self.projects.setdefault(old_path.parent.name, {})
+            info = files.pop(old_path.name, None)
+            if info is None:
+                info = FileInfo(new_path.name)
+            info.name = new_path.name
+            files[new_path.name] = info
+            self._touch()
+
+    def on_compact(self, old_path: Path, new_path: Path):
+        """Compactor からの通知。集計済みの情報はそのままにファイル名と圧縮後のサイズを差し替える"""
+        try:
+            compressed_size = new_path.stat().st_size
+        except FileNotFoundError:
+            return
+        with self._lock:
+            files = self.projects.setdefault(old_path.parent.name, {})
+            info = files.pop(old_path.name, None)
+            if info is None:
+                info = FileInfo(new_path.name, stat_log(new_path)[1], time.time())
+            info.name = new_path.name
+            info.compressed_size = compressed_size
+            files[new_path.name] = info
+            self._touch()
+
+    def on_remove(self, paths: List[Path]):
+        """RetentionManager からの通知。削除されるファイルをまとめて外す（バージョンは1回だけ上がる）"""
+        with self._lock:
+            removed = False
+            for path in paths:
+                files = self.projects.get(path.parent.name)
+                if files and files.pop(path.name, None) is not None:
+                    removed = True
+                    if not files:
+                        self.projects.pop(path.parent.name, None)
+            if removed:
+                self._touch()
+
+    def remove_file(self, project: str, name: str) -> Optional[FileInfo]:
+        with self._lock:
+            files = self.projects.get(project)
+            if not files or name not in files:
+                return None
+            info = files.pop(name)
+            if not files:
+                self.projects.pop(project, None)
+            self._touch()
+            return info
+
+    # --- Reading ---
+    def snapshot(self) -> Tuple[str, List[Tuple[str, List[Dict]]]]:
+        """(ETag, [(プロジェクト名, [ファイル情報...]), ...]) をプロジェクト名順で返す"""
+        with self._lock:
+            projects = [
+                (project, [info.to_dict() for info in sorted(files.values(), key=lambda i: i.name)])
+                for project, files in sorted(self.projects.items())
+                if files
+            ]
+            return self.etag, projects
+
+    def file_info(self, project: str, name: str) -> Optional[FileInfo]:
+        with self._lock:
+            return self.projects.get(project, {}).get(name)
@@ -0,0 +1,97 @@
+from typing import Dict, List, Optional, Tuple
+
+from encoding import EncodedEvent, encode_event, log_project
+
+# 1フレームにまとめるイベント数の既定値と上限
+DEFAULT_BATCH_MAX = 500
+MAX_BATCH_MAX = 10000
+# まとめる間隔の上限（ミリ秒）
+MAX_BATCH_MS = 10000
+
+
+class CoalesceOptions:
+    """
+    購読者ごとの配信のまとめ方。interval 秒ごと、または max_events 件たまったら（早い方で）1フレームにまとめて送る。
+    dedupe=True なら、同じ (プロジェクト, レベル, オペレーション, メッセージ) のログを1件にまとめ、
+    repeat（回数）と first_timestamp / last_timestamp を付ける。
+    """
+
+    __slots__ = ("interval", "max_events", "dedupe")
+
+    def __init__(self, interval: float, max_events: int = DEFAULT_BATCH_MAX, dedupe: bool = False):
+        self.interval = interval
+        self.max_events = max_events
+        self.dedupe = dedupe
+
+    @classmethod
+    def from_params(cls, batch_ms: Optional[int], batch_max: Optional[int] = None,
+                    dedupe: bool = False) -> Optional["CoalesceOptions"]:
+        """クエリパラメータ・制御メッセージの値から作る。batch_ms も dedupe も無ければ None（まとめない）。不正な値は ValueError"""
+        if not batch_ms and not dedupe:
+            return None
+        batch_ms = int(batch_ms or 0)
+        if batch_ms < 0 or batch_ms > MAX_BATCH_MS:
+            raise ValueError(f"batch_ms must be between 0 and {MAX_BATCH_MS}")
+        batch_max = DEFAULT_BATCH_MAX if batch_max is None else int(batch_max)
+        if batch_max <= 0 or batch_max > MAX_BATCH_MAX:
+            raise ValueError(f"batch_max must be between 1 and {MAX_BATCH_MAX}")
+        return cls(batch_ms / 1000, batch_max, bool(dedupe))
+
+    def to_dict(self) -> Dict:
+        return {"batch_ms": round(self.interval * 1000), "batch_max": self.max_events, "dedupe": self.dedupe}
+
+
+def _dedupe_key(log: Dict) -> Tuple:
+    return log_project(log), log.get("level"), log.get("operation"), log.get("message")
+
+
+def collapse_duplicates(logs: List[Dict]) -> Tuple[List[Dict], int]:
+    """
+    同じ (プロジェクト, レベル, オペレーション, メッセージ) のログを最初の1件にまとめ、(ログ, まとめた件数) を返す。
+    まとめたログには repeat / first_timestamp / last_timestamp を付ける（1件だけのログはそのまま）。
+    """
+    collapsed: Dict[Tuple, Dict] = {}
+    counts: Dict[Tuple, int] = {}
+    for log in logs:
+        key = _dedupe_key(log)
+        first = collapsed.get(key)
+        if first is None:
+            collapsed[key] = log
+            counts[key] = 1
+            continue
+        if counts[key] == 1:
+            first = collapsed[key] = dict(first)
+            first["first_timestamp"] = first.get("timestamp")
+        counts[key] += 1
+        first["repeat"] = counts[key]
+        first["last_timestamp"] = log.get("timestamp")
+    return list(collapsed.values()), len(logs) - len(collapsed)
+
+
+def _is_message(event: EncodedEvent) -> bool:
+    """ログではなく制御メッセージ・集計（{"type": ...} の辞書）か"""
+    return isinstance(event.payload, dict) and "type" in event.payload
+
+
+def coalesce(events: List[EncodedEvent], dedupe: bool = False) -> Tuple[List[EncodedEvent], int]:
+    """
+    購読者に送るイベントの並びをフレームにまとめ、(フレーム, 重複としてまとめた件数) を返す。
+    ログは JSON 配列1つにまとめ（SSE の id は最後のイベントのもの）、ログ以外のイベント（制御メッセージ・集計）はそのまま先に送る。
+    """
+    frames = [event for event in events if _is_message(event)]
+    log_events = [event for event in events if not _is_message(event)]
+    if not log_events:
+        return frames, 0
+    if len(log_events) == 1 and not dedupe:
+        return frames + log_events, 0
+
+    logs = [log for event in log_events for log in event.logs]
+    collapsed = 0
+    if dedupe:
+        logs, collapsed = collapse_duplicates(logs)
+    frame = encode_event(logs)
+    last_id = log_events[-1].id
+    if last_id is not None:
+        frame.set_id(last_id)
+    frames.append(frame)
+    return frames, collapsed
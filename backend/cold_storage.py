@@ -0,0 +1,464 @@
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+from log_writer import file_lock, is_current
+
+# 圧縮済みファイルの拡張子（中身は複数メンバーの gzip なので zcat などでもそのまま読める）
+COMPRESSED_SUFFIX = ".gz"
+# 1ブロック（= 1つの gzip メンバー）に入れる非圧縮データの目安。ブロックは必ず行の区切りで切る
+BLOCK_SIZE = 256 * 1024
+COMPRESS_LEVEL = 6
+# ブロックインデックスは転置インデックスと同じく LOG_DIR/.index/<project>/<file>.blocks に置く
+BLOCK_INDEX_DIR_NAME = ".index"
+BLOCK_INDEX_VERSION = 1
+# 圧縮中の一時ファイルは検索・カタログ・保持ポリシーなどの走査対象にならないよう LOG_DIR/.tmp/<project>/ に書く
+TMP_DIR_NAME = ".tmp"
+_READ_SIZE = 256 * 1024
+
+
+def is_compressed(path: Path) -> bool:
+    return Path(path).name.endswith(COMPRESSED_SUFFIX)
+
+
+def block_index_path(path: Path) -> Path:
+    path = Path(path)
+    return path.parent.parent / BLOCK_INDEX_DIR_NAME / path.parent.name / f"{path.name}.blocks"
+
+
+def compress_block(data: bytes, level: int = COMPRESS_LEVEL) -> bytes:
+    """data を独立した1つの gzip メンバーに圧縮する"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class BlockIndex:
+    """
+    ブロック圧縮ファイルの索引。ブロックごとに (圧縮後のオフセット, 非圧縮でのオフセット, 先頭の行番号) を持ち、
+    任意の位置・行から読むときに1ブロックだけを展開すれば済むようにする。
+    """
+
+    def __init__(self, file_id: Tuple[int, int], stored_size: int, size: int, lines: int,
+                 blocks: List[Tuple[int, int, int]]):
+        self.file_id = file_id
+        self.stored_size = stored_size  # ディスク上（圧縮後）のサイズ
+        self.size = size                # 展開後のサイズ
+        self.lines = lines
+        self.compressed_offsets = [block[0] for block in blocks]
+        self.offsets = [block[1] for block in blocks]
+        self.line_starts = [block[2] for block in blocks]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def block_for_offset(self, offset: int) -> int:
+        return max(0, bisect_right(self.offsets, offset) - 1)
+
+    def block_span(self, block_no: int) -> Tuple[int, int]:
+        """ブロックの圧縮データの [start, end)"""
+        start = self.compressed_offsets[block_no]
+        end = self.compressed_offsets[block_no + 1] if block_no + 1 < len(self) else self.stored_size
+        return start, end
+
+    def locate_line(self, line: int) -> Tuple[int, int]:
+        """line 行目以前で最も近いブロック先頭の (非圧縮でのオフセット, 行番号) を返す"""
+        if not self.offsets:
+            return 0, 0
+        block_no = max(0, bisect_right(self.line_starts, line) - 1)
+        return self.offsets[block_no], self.line_starts[block_no]
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({
+            "version": BLOCK_INDEX_VERSION,
+            "file_id": list(self.file_id),
+            "stored_size": self.stored_size,
+            "size": self.size,
+            "lines": self.lines,
+            "blocks": list(zip(self.compressed_offsets, self.offsets, self.line_starts)),
+        }, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "BlockIndex":
+        data = json.loads(raw)
+        if data.get("version") != BLOCK_INDEX_VERSION:
+            raise ValueError("Unsupported block index version")
+        return cls(tuple(data["file_id"]), data["stored_size"], data["size"], data["lines"],
+                   [tuple(block) for block in data["blocks"]])
+
+    @classmethod
+    def scan(cls, path: Path) -> "BlockIndex":
+        """ブロックインデックスが無い（失われた）場合に、gzip メンバーの境界を走査して作り直す"""
+        st = os.stat(path)
+        blocks = []
+        size = lines = 0
+        with open(path, "rb") as f:
+            pos = 0
+            data = b""
+            decompressor = None
+            while True:
+                if not data:
+                    data = f.read(_READ_SIZE)
+                    if not data:
+                        break
+                if decompressor is None:
+                    blocks.append((pos, size, lines))
+                    decompressor = zlib.decompressobj(31)
+                out = decompressor.decompress(data)
+                size += len(out)
+                lines += out.count(b"\n")
+                if decompressor.eof:
+                    rest = decompressor.unused_data
+                    pos += len(data) - len(rest)
+                    data = rest
+                    decompressor = None
+                else:
+                    pos += len(data)
+                    data = b""
+        if decompressor is not None:
+            raise ValueError(f"Truncated compressed log file: {path}")
+        return cls((st.st_dev, st.st_ino), st.st_size, size, lines, blocks)
+
+
+class BlockIndexCache:
+    """圧縮ファイルごとの BlockIndex を LRU で保持する。ファイルが置き換えられていれば読み直す"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Path, BlockIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> BlockIndex:
+        path = Path(path)
+        st = os.stat(path)
+        file_id = (st.st_dev, st.st_ino)
+        with self._lock:
+            index = self._entries.get(path)
+            if index is not None and index.file_id == file_id and index.stored_size == st.st_size:
+                self._entries.move_to_end(path)
+                return index
+        index = self._load(path, file_id, st.st_size)
+        with self._lock:
+            self._entries[path] = index
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def _load(self, path: Path, file_id: Tuple[int, int], stored_size: int) -> BlockIndex:
+        sidecar = block_index_path(path)
+        try:
+            index = BlockIndex.from_bytes(sidecar.read_bytes())
+            if index.file_id == file_id and index.stored_size == stored_size:
+                return index
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"ColdStorage: discarding broken block index {sidecar}: {e}")
+        index = BlockIndex.scan(path)
+        save_block_index(path, index)
+        return index
+
+    def put(self, path: Path, index: BlockIndex):
+        with self._lock:
+            self._entries[Path(path)] = index
+
+    def invalidate(self, path: Path):
+        with self._lock:
+            self._entries.pop(Path(path), None)
+
+    def on_remove(self, paths: List[Path]):
+        """RetentionManager からの通知。削除される圧縮済みファイルのブロックインデックスを消す"""
+        for path in paths:
+            if not is_compressed(path):
+                continue
+            self.invalidate(path)
+            block_index_path(path).unlink(missing_ok=True)
+
+
+block_index_cache = BlockIndexCache()
+
+
+def save_block_index(path: Path, index: BlockIndex):
+    sidecar = block_index_path(path)
+    try:
+        sidecar.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = sidecar.with_suffix(".blocks.tmp")
+        tmp_path.write_bytes(index.to_bytes())
+        os.replace(tmp_path, sidecar)
+    except OSError as e:
+        print(f"ColdStorage: failed to save block index {sidecar}: {e}")
+
+
+class CompressedLogReader(io.RawIOBase):
+    """
+    ブロック圧縮ファイルを展開後のバイト列として読むファイルオブジェクト（seek / read / readline 対応）。
+    seek しても展開するのは該当する1ブロックだけで、ファイル全体は展開しない。
+    """
+
+    def __init__(self, path: Path):
+        super().__init__()
+        self.path = Path(path)
+        self.index = block_index_cache.get(self.path)
+        self._file = open(self.path, "rb")
+        self._pos = 0
+        self._block_no = -1
+        self._block = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.index.size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._pos = offset
+        return offset
+
+    def _current_block(self) -> Tuple[bytes, int]:
+        """現在位置を含むブロックの展開済みデータと、ブロック内での位置を返す"""
+        block_no = self.index.block_for_offset(self._pos)
+        if block_no != self._block_no:
+            start, end = self.index.block_span(block_no)
+            self._file.seek(start)
+            self._block = zlib.decompress(self._file.read(end - start), 31)
+            self._block_no = block_no
+        return self._block, self._pos - self.index.offsets[block_no]
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = max(0, self.index.size - self._pos)
+        parts = []
+        while size > 0 and self._pos < self.index.size:
+            block, start = self._current_block()
+            chunk = block[start:start + size]
+            if not chunk:
+                break
+            parts.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        return b"".join(parts)
+
+    def readall(self) -> bytes:
+        return self.read(-1)
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readline(self, size: int = -1) -> bytes:
+        parts = []
+        remaining = size if size is not None and size >= 0 else None
+        while self._pos < self.index.size and (remaining is None or remaining > 0):
+            block, start = self._current_block()
+            end = len(block) if remaining is None else min(len(block), start + remaining)
+            nl = block.find(b"\n", start, end)
+            stop = end if nl < 0 else nl + 1
+            parts.append(block[start:stop])
+            self._pos += stop - start
+            if remaining is not None:
+                remaining -= stop - start
+            if nl >= 0 or stop == start:
+                break
+        return b"".join(parts)
+
+    def pread(self, size: int, offset: int) -> bytes:
+        self.seek(offset)
+        return self.read(size)
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+# --- Transparent access (plain or compressed) ---
+def open_log(path: Path) -> BinaryIO:
+    """ログファイルを開く。圧縮済みなら展開しながら読むリーダーを返す"""
+    if is_compressed(path):
+        return CompressedLogReader(path)
+    return open(path, "rb")
+
+
+def stat_log(path: Path) -> Tuple[Tuple[int, int], int]:
+    """ログファイルの (ファイル ID, 展開後のサイズ) を返す"""
+    st = os.stat(path)
+    if is_compressed(path):
+        return (st.st_dev, st.st_ino), block_index_cache.get(path).size
+    return (st.st_dev, st.st_ino), st.st_size
+
+
+def read_at(f: BinaryIO, size: int, offset: int) -> bytes:
+    """open_log() で開いたファイルの offset から size バイトを読む（平文なら pread）"""
+    if isinstance(f, CompressedLogReader):
+        return f.pread(size, offset)
+    return os.pread(f.fileno(), size, offset)
+
+
+def locate_line(path: Path, line: int) -> Tuple[int, int]:
+    """圧縮済みファイルで line 行目以前の最も近いブロック先頭の (オフセット, 行番号) を返す"""
+    return block_index_cache.get(path).locate_line(line)
+
+
+def iter_blocks(f: BinaryIO, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """ファイルを行の区切りで block_size 程度のブロックに分けて返す"""
+    pending = b""
+    while True:
+        chunk = f.read(block_size)
+        if not chunk:
+            break
+        pending += chunk
+        if len(pending) < block_size:
+            continue
+        cut = pending.rfind(b"\n") + 1
+        if cut == 0:
+            # 1行がブロックより長い場合は行の途中で切らずに持ち越す
+            continue
+        yield pending[:cut]
+        pending = pending[cut:]
+    if pending:
+        yield pending
+
+
+# --- Compaction ---
+class Compactor:
+    """
+    書き込みが終わったログファイル（ローテーション済み・以前の起動のファイル）を
+    ブロック圧縮ファイル（<file>.gz）に置き換えるバックグラウンドジョブ。
+    置き換えたら add_listener() で登録したオブジェクトの on_compact(old_path, new_path) を呼ぶ。
+    """
+
+    def __init__(self, log_dir: Path, min_age: float = 300, block_size: int = BLOCK_SIZE,
+                 level: int = COMPRESS_LEVEL, file_pattern: str = "*.log*"):
+        self.log_dir = log_dir
+        self.min_age = min_age
+        self.block_size = block_size
+        self.level = level
+        self.file_pattern = file_pattern
+        self._listeners: List = []
+
+        # 統計情報
+        self.compacted_files = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, *args):
+        for listener in self._listeners:
+            try:
+                listener.on_compact(*args)
+            except Exception as e:
+                print(f"Compactor listener error ({type(listener).__name__}.on_compact): {e}")
+
+    def candidates(self, active: Iterable[Path] = ()) -> List[Path]:
+        """圧縮対象のファイル（未圧縮・書き込み中でない・min_age 秒以上更新されていない）"""
+        active_files = {Path(path).resolve() for path in active}
+        now = time.time()
+        files = []
+        if not self.log_dir.exists():
+            return files
+        for project_dir in self.log_dir.iterdir():
+            if not project_dir.is_dir() or project_dir.name.startswith("."):
+                continue
+            for path in project_dir.glob(self.file_pattern):
+                if is_compressed(path) or path.resolve() in active_files:
+                    continue
+                try:
+                    if now - path.stat().st_mtime < self.min_age:
+                        continue
+                except FileNotFoundError:
+                    continue
+                files.append(path)
+        return sorted(files)
+
+    def compact_file(self, path: Path) -> Optional[Path]:
+        """1ファイルを圧縮して置き換える（ブロッキング）。圧縮中に変更された場合は何もしない"""
+        target = path.with_name(path.name + COMPRESSED_SUFFIX)
+        # セグメントに遅れて書き込まれた分が再び圧縮される場合など、既存の圧縮済みファイルは上書きしない
+        suffix = 1
+        while target.exists():
+            target = path.with_name(f"{path.name}.{suffix}{COMPRESSED_SUFFIX}")
+            suffix += 1
+        tmp_path = path.parent.parent / TMP_DIR_NAME / path.parent.name / f"{target.name}.tmp"
+        try:
+            tmp_path.parent.mkdir(parents=True, exist_ok=True)
+            before = os.stat(path)
+            blocks = []
+            size = lines = 0
+            with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+                for block in iter_blocks(src, self.block_size):
+                    blocks.append((dst.tell(), size, lines))
+                    dst.write(compress_block(block, self.level))
+                    size += len(block)
+                    lines += block.count(b"\n")
+                if not blocks:
+                    # 空のファイルも有効な gzip にしておく
+                    blocks.append((0, 0, 0))
+                    dst.write(compress_block(b"", self.level))
+                dst.flush()
+                os.fsync(dst.fileno())
+            # 最後の確認から元のファイルを消すまでは、追記するライター（他のワーカーを含む）とファイルロックで排他する。
+            # ロックを待っていたライターはファイルが消えたことに気づき、同じパスに新しいファイルを作って書く
+            with open(path, "rb") as src, file_lock(src.fileno()):
+                after = os.fstat(src.fileno())
+                if (not is_current(path, src.fileno()) or size != before.st_size
+                        or (after.st_ino, after.st_size, after.st_mtime_ns) != (before.st_ino, before.st_size, before.st_mtime_ns)):
+                    tmp_path.unlink()
+                    return None
+
+                st = os.stat(tmp_path)
+                index = BlockIndex((st.st_dev, st.st_ino), st.st_size, size, lines, blocks)
+                save_block_index(target, index)
+                os.replace(tmp_path, target)
+                block_index_cache.put(target, index)
+
+                # 参照先を付け替えてから元のファイルを消す
+                self._notify(path, target)
+                path.unlink(missing_ok=True)
+        except FileNotFoundError:
+            try:
+                tmp_path.unlink()
+            except FileNotFoundError:
+                pass
+            return None
+
+        self.compacted_files += 1
+        self.bytes_before += size
+        self.bytes_after += index.stored_size
+        return target
+
+    def run_once(self, active: Iterable[Path] = ()) -> int:
+        """圧縮対象をすべて圧縮し、圧縮したファイル数を返す（ブロッキング）"""
+        count = 0
+        for path in self.candidates(active):
+            try:
+                if self.compact_file(path) is not None:
+                    count += 1
+            except Exception as e:
+                print(f"Compactor: failed to compact {path}: {e}")
+        return count
+
+    def stats(self) -> dict:
+        return {
+            "compacted_files": self.compacted_files,
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_after,
+        }
@@ -0,0 +1,469 @@
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from cold_storage import COMPRESSED_SUFFIX, open_log, stat_log
+from encoding import dumps, loads
+
+# pyarrow がインストールされていれば、書き込みが終わったログを Parquet に変換して列指向で検索・集計できる（任意）
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+    _pyarrow_installed = True
+except ImportError:
+    _pyarrow_installed = False
+
+COLUMNAR_AVAILABLE = _pyarrow_installed
+
+COLUMNAR_DIR_NAME = ".columnar"
+PARQUET_SUFFIX = ".parquet"
+# 変換元のログの展開後のサイズ（変わっていたら変換し直す）
+_SOURCE_SIZE_KEY = b"vibelogger.source_size"
+
+# 1行1列になるトップレベルのフィールド（project はディレクトリ名）
+TOP_LEVEL_COLUMNS = ("timestamp", "level", "operation", "project", "message", "correlation_id", "source")
+# context のキーは "context.<キー>"（入れ子は "." でつなぐ）の列になる
+CONTEXT_PREFIX = "context"
+CONTEXT_SEPARATOR = "."
+
+# /api/export の出力形式
+EXPORT_PARQUET = "parquet"
+EXPORT_ARROW = "arrow"
+EXPORT_FORMATS = (EXPORT_PARQUET, EXPORT_ARROW)
+# aggregate() の時間バケットの幅
+BUCKET_UNITS = ("minute", "hour", "day")
+
+_READ_SIZE = 1024 * 1024
+
+
+def _require_pyarrow():
+    if not _pyarrow_installed:
+        raise RuntimeError("pyarrow is not installed (uv pip install pyarrow)")
+
+
+def flatten_context(context: Dict[str, Any], prefix: str = CONTEXT_PREFIX,
+                    separator: str = CONTEXT_SEPARATOR) -> Dict[str, Any]:
+    """context の入れ子の辞書を "context.a.b" のキーに平坦化する（utils/helpers.flatten_dict と同じ規則）"""
+    result = {}
+    for key, value in context.items():
+        name = f"{prefix}{separator}{key}"
+        if isinstance(value, dict):
+            result.update(flatten_context(value, name, separator))
+        else:
+            result[name] = value
+    return result
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """ログの timestamp（ISO8601）を UTC の datetime にする。読めなければ None"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def _context_array(values: List[Any]):
+    """context の列の型を値から決める（bool / 数値は float64 / それ以外は文字列）"""
+    kinds = {type(value) for value in values if value is not None}
+    if kinds == {bool}:
+        return pa.array(values, type=pa.bool_())
+    if kinds and kinds <= {int, float}:
+        return pa.array([None if value is None else float(value) for value in values], type=pa.float64())
+    return pa.array(
+        [None if value is None else value if isinstance(value, str) else dumps(value) for value in values],
+        type=pa.string(),
+    )
+
+
+def _common_type(types: Set[Any]):
+    """複数のファイルで型が違う列の型（数値同士なら float64、それ以外は文字列）"""
+    if len(types) == 1:
+        return next(iter(types))
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return pa.string()
+
+
+class _ChunkSink:
+    """Arrow / Parquet の書き込み先。書かれたバイト列を take() で取り出して、そのままレスポンスに流す"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ColumnarStore:
+    """
+    書き込みが終わったログファイル（圧縮済み・ローテーション済み）を Parquet に変換して LOG_DIR/.columnar/<project>/ に置き、
+    列の射影（必要な列だけ読む）と述語のプッシュダウン（行グループの統計で読み飛ばす）で検索・集計する。
+
+    - 列はトップレベルのフィールド（timestamp / level / operation / project / message / correlation_id / source）と
+      平坦化した context のキー（context.latency_ms など）
+    - 変換元は <file>.log と、それを圧縮した <file>.log.gz を同じものとして扱う（圧縮で変換し直さない）
+    - 変換元が保持ポリシーで消えたら、対応する Parquet も run_once() で消す
+    - ファイルごとに列の型が違う場合は、読むときに共通の型（数値なら float64、それ以外は文字列）に揃える
+    """
+
+    def __init__(self, log_dir: Path, min_age: float = 300, compression: str = "zstd",
+                 file_pattern: str = "*.log*"):
+        self.log_dir = log_dir
+        self.columnar_dir = log_dir / COLUMNAR_DIR_NAME
+        self.min_age = min_age
+        self.compression = compression
+        self.file_pattern = file_pattern
+
+        # 統計情報
+        self.converted_files = 0
+        self.converted_rows = 0
+        self.removed_files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    # --- Conversion ---
+    def _target(self, path: Path) -> Path:
+        name = path.name[:-len(COMPRESSED_SUFFIX)] if path.name.endswith(COMPRESSED_SUFFIX) else path.name
+        return self.columnar_dir / path.parent.name / (name + PARQUET_SUFFIX)
+
+    def candidates(self, active: Iterable[Path] = ()) -> List[Path]:
+        """変換対象のファイル（書き込み中でない・min_age 秒以上更新されていない・未変換または変換後に変わったもの）"""
+        active_files = {Path(path).resolve() for path in active}
+        now = time.time()
+        files = []
+        if not self.log_dir.exists():
+            return files
+        for project_dir in sorted(self.log_dir.iterdir()):
+            if not project_dir.is_dir() or project_dir.name.startswith("."):
+                continue
+            for path in sorted(project_dir.glob(self.file_pattern)):
+                if path.name.startswith(".") or path.resolve() in active_files:
+                    continue
+                try:
+                    if now - path.stat().st_mtime < self.min_age:
+                        continue
+                    if self._is_current(path):
+                        continue
+                except FileNotFoundError:
+                    continue
+                files.append(path)
+        return files
+
+    def _is_current(self, path: Path) -> bool:
+        target = self._target(path)
+        if not target.exists():
+            return False
+        metadata = pq.read_schema(target).metadata or {}
+        return metadata.get(_SOURCE_SIZE_KEY) == str(stat_log(path)[1]).encode()
+
+    def _read_rows(self, path: Path) -> Iterator[Dict]:
+        with open_log(path) as f:
+            rest = b""
+            while True:
+                chunk = f.read(_READ_SIZE)
+                if not chunk:
+                    break
+                data = rest + chunk
+                cut = data.rfind(b"\n") + 1
+                rest = data[cut:]
+                for line in data[:cut].splitlines():
+                    try:
+                        log = loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(log, dict):
+                        yield log
+            if rest.strip():
+                try:
+                    log = loads(rest)
+                except ValueError:
+                    return
+                if isinstance(log, dict):
+                    yield log
+
+    def _build_table(self, path: Path):
+        project = path.parent.name
+        columns: Dict[str, List[Any]] = {name: [] for name in TOP_LEVEL_COLUMNS}
+        context_columns: Dict[str, List[Any]] = {}
+        rows = 0
+        for log in self._read_rows(path):
+            columns["timestamp"].append(parse_timestamp(log.get("timestamp")))
+            for name in TOP_LEVEL_COLUMNS[1:]:
+                value = project if name == "project" else log.get(name)
+                columns[name].append(value if value is None or isinstance(value, str) else str(value))
+            context = log.get("context")
+            flat = flatten_context(context) if isinstance(context, dict) else {}
+            for name, value in flat.items():
+                values = context_columns.get(name)
+                if values is None:
+                    values = context_columns[name] = []
+                # この列が無かった行のぶんを null で埋めてから足す
+                values.extend([None] * (rows - len(values)))
+                values.append(value)
+            rows += 1
+        for values in context_columns.values():
+            values.extend([None] * (rows - len(values)))
+
+        arrays = [pa.array(columns["timestamp"], type=pa.timestamp("us", tz="UTC"))]
+        arrays += [pa.array(columns[name], type=pa.string()) for name in TOP_LEVEL_COLUMNS[1:]]
+        names = list(TOP_LEVEL_COLUMNS)
+        for name in sorted(context_columns):
+            arrays.append(_context_array(context_columns[name]))
+            names.append(name)
+        return pa.Table.from_arrays(arrays, names=names), rows
+
+    def convert_file(self, path: Path) -> Optional[Path]:
+        """1ファイルを Parquet に変換する（ブロッキング）。変換中に変更された場合は何もしない"""
+        _require_pyarrow()
+        target = self._target(path)
+        tmp_path = target.with_name(f".{target.name}.tmp")
+        try:
+            before = stat_log(path)
+            table, rows = self._build_table(path)
+            if stat_log(path) != before:
+                return None
+            table = table.replace_schema_metadata({_SOURCE_SIZE_KEY: str(before[1]).encode()})
+            target.parent.mkdir(parents=True, exist_ok=True)
+            pq.write_table(table, tmp_path, compression=self.compression)
+            os.replace(tmp_path, target)
+        except FileNotFoundError:
+            tmp_path.unlink(missing_ok=True)
+            return None
+
+        self.converted_files += 1
+        self.converted_rows += rows
+        self.bytes_in += before[1]
+        self.bytes_out += target.stat().st_size
+        return target
+
+    def remove_orphans(self) -> int:
+        """変換元（<file>.log / <file>.log.gz）が無くなった Parquet を消し、消したファイル数を返す"""
+        removed = 0
+        if not self.columnar_dir.exists():
+            return removed
+        for target in self.columnar_dir.glob(f"*/*{PARQUET_SUFFIX}"):
+            source = self.log_dir / target.parent.name / target.name[:-len(PARQUET_SUFFIX)]
+            if source.exists() or source.with_name(source.name + COMPRESSED_SUFFIX).exists():
+                continue
+            target.unlink(missing_ok=True)
+            removed += 1
+        self.removed_files += removed
+        return removed
+
+    def run_once(self, active: Iterable[Path] = ()) -> int:
+        """変換対象をすべて変換し、変換したファイル数を返す（ブロッキング）"""
+        _require_pyarrow()
+        count = 0
+        for path in self.candidates(active):
+            try:
+                if self.convert_file(path) is not None:
+                    count += 1
+            except Exception as e:
+                print(f"ColumnarStore: failed to convert {path}: {e}")
+        self.remove_orphans()
+        return count
+
+    # --- Query ---
+    def files(self, projects: Optional[Iterable[str]] = None) -> List[Path]:
+        """Parquet ファイルの一覧（プロジェクトはディレクトリ単位で絞り込む）"""
+        if not self.columnar_dir.exists():
+            return []
+        projects = set(projects) if projects else None
+        files = []
+        for project_dir in sorted(self.columnar_dir.iterdir()):
+            if not project_dir.is_dir() or (projects is not None and project_dir.name not in projects):
+                continue
+            files.extend(sorted(project_dir.glob(f"*{PARQUET_SUFFIX}")))
+        return files
+
+    def schema(self, files: List[Path], columns: Optional[Iterable[str]] = None):
+        """files の列を合わせたスキーマ（Parquet のフッターだけを読む）。columns を指定するとその列だけ"""
+        _require_pyarrow()
+        wanted = list(columns) if columns else None
+        types: Dict[str, Set[Any]] = {}
+        order: List[str] = []
+        for path in files:
+            for field in pq.read_schema(path):
+                if wanted is not None and field.name not in wanted:
+                    continue
+                if field.name not in types:
+                    types[field.name] = set()
+                    order.append(field.name)
+                types[field.name].add(field.type)
+        if wanted is not None:
+            # 指定された列の順に並べ、どのファイルにも無い列は空の文字列の列にする
+            order = wanted
+        return pa.schema([(name, _common_type(types.get(name) or {pa.string()})) for name in order])
+
+    @staticmethod
+    def _filters(since: Optional[str], until: Optional[str], levels: Optional[Iterable[str]],
+                 operations: Optional[Iterable[str]]) -> Optional[List[Tuple]]:
+        filters = []
+        if levels:
+            filters.append(("level", "in", sorted(level.upper() for level in levels)))
+        if operations:
+            filters.append(("operation", "in", sorted(operations)))
+        if since:
+            filters.append(("timestamp", ">=", parse_timestamp(since)))
+        if until:
+            filters.append(("timestamp", "<=", parse_timestamp(until)))
+        return filters or None
+
+    @staticmethod
+    def _conform(table, schema):
+        """table を schema の列・型に揃える（無い列は null、型の違う列はキャスト）"""
+        arrays = []
+        for field in schema:
+            if field.name in table.column_names:
+                column = table[field.name]
+                arrays.append(column if column.type == field.type else column.cast(field.type))
+            else:
+                arrays.append(pa.nulls(table.num_rows, field.type))
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    def iter_tables(self, projects: Optional[Iterable[str]] = None, since: Optional[str] = None,
+                    until: Optional[str] = None, levels: Optional[Iterable[str]] = None,
+                    operations: Optional[Iterable[str]] = None,
+                    columns: Optional[Iterable[str]] = None) -> Tuple[Any, Iterator[Any]]:
+        """
+        (スキーマ, ファイルごとの Arrow テーブルのイテレータ) を返す。
+        各ファイルからは必要な列だけを読み、level / operation / 時刻範囲は Parquet の読み込みに渡して行グループごとに読み飛ばす。
+        """
+        _require_pyarrow()
+        files = self.files(projects)
+        schema = self.schema(files, columns)
+        filters = self._filters(since, until, levels, operations)
+
+        def tables():
+            for path in files:
+                names = set(pq.read_schema(path).names)
+                table = pq.read_table(path, columns=[name for name in schema.names if name in names],
+                                      filters=filters)
+                if table.num_rows:
+                    yield self._conform(table, schema)
+
+        return schema, tables()
+
+    def scan(self, **kwargs):
+        """iter_tables() の結果を1つの Arrow テーブルにまとめる"""
+        schema, tables = self.iter_tables(**kwargs)
+        return pa.concat_tables([schema.empty_table(), *tables])
+
+    def aggregate(self, group_by: Iterable[str] = ("project", "operation"), fields: Iterable[str] = (),
+                  interval: Optional[str] = None, **filters) -> List[Dict]:
+        """
+        条件に合うログを group_by の列ごとに集計する（Arrow の group_by でまとめて計算する）。
+        各行には件数（count）と、fields の数値列ごとの min / max / mean / sum / p50 / p90 / p99 が入る。
+        interval（minute / hour / day）を指定すると、時刻を切り捨てた "bucket" 列でもまとめられる。
+        """
+        _require_pyarrow()
+        group_by = list(group_by)
+        fields = list(fields)
+        if interval is not None and interval not in BUCKET_UNITS:
+            raise ValueError(f"interval must be one of {', '.join(BUCKET_UNITS)}")
+        if "bucket" in group_by and interval is None:
+            raise ValueError("group_by=bucket requires interval")
+        columns = ["timestamp"] + [name for name in group_by + fields if name not in ("timestamp", "bucket")]
+        table = self.scan(columns=list(dict.fromkeys(columns)), **filters)
+        for name in fields:
+            if not (pa.types.is_integer(table[name].type) or pa.types.is_floating(table[name].type)):
+                raise ValueError(f"{name} is not a numeric column")
+        if interval is not None:
+            table = table.append_column("bucket", pc.floor_temporal(table["timestamp"], 1, interval))
+            if "bucket" not in group_by:
+                group_by.insert(0, "bucket")
+
+        aggregations = [("timestamp", "count", pc.CountOptions(mode="all"))]
+        for name in fields:
+            aggregations += [(name, "min"), (name, "max"), (name, "mean"), (name, "sum"),
+                             (name, "tdigest", pc.TDigestOptions(q=[0.5, 0.9, 0.99]))]
+        if not group_by:
+            # 全体を1行にまとめる
+            table = table.append_column("_all", pa.array([0] * table.num_rows, type=pa.int8()))
+        result = table.group_by(group_by or ["_all"]).aggregate(aggregations)
+
+        rows = []
+        for row in result.to_pylist():
+            item = {name: row[name] for name in group_by}
+            if isinstance(item.get("bucket"), datetime):
+                item["bucket"] = item["bucket"].isoformat()
+            item["count"] = row["timestamp_count"]
+            for name in fields:
+                quantiles = row[f"{name}_tdigest"] or [None, None, None]
+                item[name] = {
+                    "min": row[f"{name}_min"],
+                    "max": row[f"{name}_max"],
+                    "mean": row[f"{name}_mean"],
+                    "sum": row[f"{name}_sum"],
+                    "p50": quantiles[0],
+                    "p90": quantiles[1],
+                    "p99": quantiles[2],
+                }
+            rows.append(item)
+        rows.sort(key=lambda item: tuple(str(item[name]) for name in group_by))
+        return rows
+
+    def export(self, format: str = EXPORT_PARQUET, **kwargs) -> Iterator[bytes]:
+        """
+        条件に合うログを Parquet または Arrow IPC ストリームのバイト列として少しずつ返す（ブロッキング）。
+        条件の検査とスキーマの決定はその場で行い（不正なら ValueError）、以後はファイル1つぶん読むごとに書き出した分を返す。
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+        schema, tables = self.iter_tables(**kwargs)
+        return self._write(format, schema, tables)
+
+    def _write(self, format: str, schema, tables: Iterator[Any]) -> Iterator[bytes]:
+        sink = _ChunkSink()
+        if format == EXPORT_ARROW:
+            writer = ipc.new_stream(sink, schema)
+        else:
+            writer = pq.ParquetWriter(sink, schema, compression=self.compression)
+        try:
+            for table in tables:
+                writer.write_table(table)
+                data = sink.take()
+                if data:
+                    yield data
+        finally:
+            writer.close()
+        yield sink.take()
+
+    def stats(self) -> Dict:
+        return {
+            "available": _pyarrow_installed,
+            "files": len(self.files()) if _pyarrow_installed else 0,
+            "converted_files": self.converted_files,
+            "converted_rows": self.converted_rows,
+            "removed_files": self.removed_files,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
@@ -0,0 +1,102 @@
+import json
+from typing import Any, List
+
+# orjson がインストールされていれば高速な JSON エンコーダとして使う
+try:
+    import orjson
+    _orjson_installed = True
+except ImportError:
+    _orjson_installed = False
+
+JSON_BACKEND = "orjson" if _orjson_installed else "json"
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """obj を UTF-8 の JSON バイト列に変換する（シリアライズできない値は str() で変換）"""
+    if _orjson_installed:
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson が扱えない値（巨大な整数など）は標準ライブラリに任せる
+            pass
+    return json.dumps(obj, default=str, ensure_ascii=False).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """obj を JSON 文字列に変換する"""
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    """UTF-8 の JSON バイト列（memoryview でもよい）を値に戻す（不正な JSON は ValueError）"""
+    if _orjson_installed:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = str(data, "utf-8")
+    return json.loads(data)
+
+
+def log_project(log: dict) -> str:
+    """ログ辞書の所属プロジェクト（project フィールド、無ければ context.project、どちらも無ければ default）"""
+    project = log.get("project")
+    if project is None and isinstance(log.get("context"), dict):
+        project = log["context"].get("project")
+    return str(project or "default")
+
+
+class EncodedEvent:
+    """
+    配信用にエンコード済みのイベント。
+    JSON への変換はイベントごとに1回だけ行い、WebSocket 用のテキストと
+    SSE 用の `id: ...\ndata: ...\n\n` フレームを全購読者で共有する。
+    """
+
+    __slots__ = ("payload", "json", "json_bytes", "sse", "id", "projects", "keys", "timestamp", "_data_frame")
+
+    def __init__(self, payload: Any, json_bytes: bytes):
+        self.payload = payload
+        self._data_frame = b"data: " + json_bytes + b"\n\n"
+        if not isinstance(json_bytes, bytes):
+            # 共有リングの memoryview などは、いずれ上書きされるのでフレームにコピーした部分を参照する
+            json_bytes = memoryview(self._data_frame)[6:-2]
+        self.json_bytes = json_bytes
+        self.json = str(json_bytes, "utf-8")
+        self.sse = self._data_frame
+        self.id = None
+
+        # 履歴・購読フィルタ用に、含まれる (プロジェクト, レベル) と（最新の）タイムスタンプを控えておく
+        keys = set()
+        timestamp = ""
+        for log in self.logs:
+            keys.add((log_project(log), str(log.get("level") or "").upper()))
+            timestamp = max(timestamp, str(log.get("timestamp") or ""))
+        self.keys = tuple(keys)
+        self.projects = tuple({project for project, _ in keys})
+        self.timestamp = timestamp
+
+    @property
+    def logs(self) -> List[dict]:
+        """イベントに含まれるログ辞書のリスト（バッチでなければ1件）"""
+        logs = self.payload if isinstance(self.payload, list) else [self.payload]
+        return [log for log in logs if isinstance(log, dict)]
+
+    def set_id(self, event_id: int):
+        """SSE の再開 (Last-Event-ID) 用のイベント ID を付与する"""
+        self.id = event_id
+        self.sse = b"id: %d\n" % event_id + self._data_frame
+
+    def __repr__(self):
+        return f"EncodedEvent({self.json[:80]!r})"
+
+
+def encode_event(payload: Any) -> EncodedEvent:
+    """ログ辞書（またはバッチのリスト）を配信用にエンコードする"""
+    return EncodedEvent(payload, dumps_bytes(payload))
+
+
+def decode_event(json_bytes: bytes) -> EncodedEvent:
+    """
+    他のプロセスから届いた JSON バイト列を、再エンコードせずにそのまま配信用のイベントにする。
+    memoryview（共有リングのレコード）も受け付け、コピーは配信用のフレームを作る1回だけにする
+    """
+    return EncodedEvent(loads(json_bytes), json_bytes)
@@ -0,0 +1,203 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+# 応答時間・書き込み時間などのバケット（秒）
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# 1イベントのファンアウトのバケット（秒）
+FANOUT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+# Prometheus のテキスト形式
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ラベルの組 -> 値。ラベルの無いメトリクスは {(): 値}
+Samples = Dict[Tuple[Tuple[str, str], ...], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    items = ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels)
+    return "{" + items + "}" if items else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Histogram:
+    """
+    固定バケットのヒストグラム。observe() はバケットを二分探索して数えるだけ（ロックは取らない）。
+    1つのヒストグラムは1つのスレッド（イベントループかライタースレッド）からだけ更新する。
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count", "max")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+
+class HistogramFamily:
+    """ラベル（1つ）の値ごとの Histogram"""
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                 label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._children: Dict[str, Histogram] = {}
+
+    def labels(self, value: str = "") -> Histogram:
+        child = self._children.get(value)
+        if child is None:
+            child = self._children[value] = Histogram(self.buckets)
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, child in sorted(self._children.items()):
+            base = ((self.label, value),) if self.label else ()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                labels = _format_labels(base + (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(base)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    スクレイプのたびに callback() で値を読む gauge / counter。
+    記録側のコストが無いので、既存の統計（キューの長さ・書き込んだバイト数など）はこれで公開する。
+    callback は数値か、{(("label", "value"), ...): 数値} を返す。
+    """
+
+    def __init__(self, name: str, help: str, kind: str, callback: Callable[[], Union[float, Samples]]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            samples = self.callback()
+        except Exception as e:
+            return [f"# {self.name} failed: {e}"]
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        for labels, value in samples.items():
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """メトリクスを登録順に Prometheus のテキスト形式で書き出す"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Union[HistogramFamily, CallbackMetric]] = {}
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                  label: Optional[str] = None) -> HistogramFamily:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = HistogramFamily(name, help, buckets, label)
+        return metric
+
+    def gauge(self, name: str, help: str, callback: Callable[[], Union[float, Samples]]):
+        self._metrics[name] = CallbackMetric(name, help, "gauge", callback)
+
+    def counter(self, name: str, help: str, callback: Callable[[], Union[float, Samples]]):
+        self._metrics[name] = CallbackMetric(name, help, "counter", callback)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# プロセス全体で共有するレジストリと、ホットパスで記録するヒストグラム（ラベルの無いものは Histogram を直接持つ）
+registry = Registry()
+event_loop_lag = registry.histogram(
+    "vibelogger_event_loop_lag_seconds", "Delay of event loop wake-ups beyond the requested sleep").labels()
+broadcast_fanout = registry.histogram(
+    "vibelogger_broadcast_fanout_seconds", "Time to fan out one event to listeners and subscriber buffers",
+    FANOUT_BUCKETS).labels()
+file_write = registry.histogram(
+    "vibelogger_file_write_seconds", "Time to append one flushed batch to a log file (writer thread)").labels()
+http_request = registry.histogram(
+    "vibelogger_http_request_duration_seconds", "Time from request start to the last response byte",
+    label="endpoint")
+
+
+class EndpointLatencyMiddleware:
+    """
+    指定したエンドポイントだけ、リクエストの開始からレスポンスの最後のボディまでの時間を記録する ASGI ミドルウェア。
+    ストリーミングのレスポンス（/api/logs など）は送り終えるまでを測る。それ以外のパスは素通しする。
+    endpoints は {パス: ラベル}、prefixes は [(パスの接頭辞, ラベル)]。
+    """
+
+    def __init__(self, app, endpoints: Dict[str, str], prefixes: Iterable[Tuple[str, str]] = ()):
+        self.app = app
+        self.endpoints = dict(endpoints)
+        self.prefixes = tuple(prefixes)
+        self.status_counts: Dict[Tuple[str, int], int] = {}
+        self._histograms = {label: http_request.labels(label)
+                            for label in list(self.endpoints.values()) + [label for _, label in self.prefixes]}
+        registry.counter("vibelogger_http_requests_total", "Requests to instrumented endpoints by status code",
+                         self._status_samples)
+
+    def _label(self, path: str) -> Optional[str]:
+        label = self.endpoints.get(path)
+        if label is None:
+            for prefix, prefix_label in self.prefixes:
+                if path.startswith(prefix):
+                    return prefix_label
+        return label
+
+    async def __call__(self, scope, receive, send):
+        label = self._label(scope["path"]) if scope["type"] == "http" else None
+        if label is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status
+            await send(message)
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                self._histograms[label].observe(time.perf_counter() - start)
+                key = (label, status)
+                self.status_counts[key] = self.status_counts.get(key, 0) + 1
+
+        await self.app(scope, receive, timed_send)
+
+    def _status_samples(self) -> Samples:
+        return {(("endpoint", label), ("code", str(code))): count
+                for (label, code), count in sorted(self.status_counts.items())}
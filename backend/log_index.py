@@ -0,0 +1,379 @@
+import json
+import os
+import re
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from cold_storage import open_log, stat_log
+from log_reader import READ_CHUNK_SIZE
+
+INDEX_VERSION = 1
+# インデックスファイルは LOG_DIR/.index/<project>/<file>.idx に保存する
+INDEX_DIR_NAME = ".index"
+# 転置インデックスに載せる context のキー
+INDEXED_CONTEXT_KEYS = ("user", "log_id", "error_code")
+# タイムスタンプの疎インデックスのバケット幅（isoformat の先頭何文字か。16 = 分単位）
+TIME_BUCKET_CHARS = 16
+# 1行あたりに索引するメッセージ単語数の上限
+MAX_TERMS_PER_LINE = 64
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """メッセージを検索用の単語（小文字）に分割する"""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) <= 64]
+
+
+def level_term(level: str) -> str:
+    return f"level:{str(level).upper()}"
+
+
+def operation_term(operation: str) -> str:
+    return f"op:{operation}"
+
+
+def word_term(word: str) -> str:
+    return f"w:{word}"
+
+
+def context_term(key: str, value) -> str:
+    return f"ctx:{key}={value}"
+
+
+def extract_terms(log: Dict) -> Set[str]:
+    """1件のログから転置インデックスに載せる語を取り出す"""
+    terms = {level_term(log.get("level", "")), operation_term(log.get("operation", ""))}
+    message = log.get("message")
+    if message:
+        for token in tokenize(str(message))[:MAX_TERMS_PER_LINE]:
+            terms.add(word_term(token))
+    context = log.get("context")
+    if isinstance(context, dict):
+        for key in INDEXED_CONTEXT_KEYS:
+            if key in context:
+                terms.add(context_term(key, context[key]))
+    return terms
+
+
+class FileIndex:
+    """
+    1つのログファイルの転置インデックス。
+    - lines: 各行の (バイトオフセット, 長さ)
+    - postings: 語 -> 行番号の配列
+    - buckets: 分単位の時刻バケット -> [最初の行番号, 最後の行番号]
+    ファイルの inode とインデックス済みバイト数を持ち、ファイルが伸びていれば続きだけを索引する。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.dirty = False
+        self._reset()
+
+    def _reset(self):
+        self.file_id: Optional[Tuple[int, int]] = None
+        self.indexed_bytes = 0
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.postings: Dict[str, array] = {}
+        self.buckets: Dict[str, List[int]] = {}
+
+    # --- Building ---
+    def _add_line(self, offset: int, raw_line: bytes):
+        line_no = len(self.offsets)
+        self.offsets.append(offset)
+        self.lengths.append(len(raw_line))
+        try:
+            log = json.loads(raw_line)
+        except ValueError:
+            return
+        if not isinstance(log, dict):
+            return
+        for term in extract_terms(log):
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = array("I")
+            postings.append(line_no)
+        timestamp = log.get("timestamp")
+        if isinstance(timestamp, str) and timestamp:
+            bucket = self.buckets.get(timestamp[:TIME_BUCKET_CHARS])
+            if bucket is None:
+                self.buckets[timestamp[:TIME_BUCKET_CHARS]] = [line_no, line_no]
+            else:
+                bucket[1] = line_no
+
+    def add_data(self, offset: int, data: bytes) -> bool:
+        """
+        offset から書き込まれたデータ（完結した行の並び）を索引する。
+        インデックス済みの末尾と連続していない場合は False を返す（refresh() が必要）。
+        """
+        with self.lock:
+            if self.file_id is None or offset != self.indexed_bytes:
+                return False
+            pos = 0
+            while True:
+                nl = data.find(b"\n", pos)
+                if nl < 0:
+                    break
+                if nl > pos:
+                    self._add_line(offset + pos, data[pos:nl])
+                pos = nl + 1
+            self.indexed_bytes = offset + pos
+            self.dirty = True
+            return True
+
+    def refresh(self) -> bool:
+        """
+        ファイルの現状に合わせてインデックスを更新する。
+        置き換え・切り詰めを検知したら作り直し、伸びていれば続きを索引する。ファイルが無ければ False。
+        """
+        with self.lock:
+            try:
+                file_id, size = stat_log(self.path)
+            except FileNotFoundError:
+                return False
+            if file_id != self.file_id or size < self.indexed_bytes:
+                self._reset()
+                self.file_id = file_id
+                self.dirty = True
+            if size > self.indexed_bytes:
+                self._scan(size)
+            return True
+
+    def _scan(self, size: int):
+        with open_log(self.path) as f:
+            f.seek(self.indexed_bytes)
+            pending = b""
+            base = self.indexed_bytes
+            while base + len(pending) < size:
+                block = f.read(min(READ_CHUNK_SIZE, size - base - len(pending)))
+                if not block:
+                    break
+                pending += block
+                last_nl = pending.rfind(b"\n")
+                if last_nl < 0:
+                    continue
+                complete = pending[:last_nl + 1]
+                self.add_data(base, complete)
+                base += len(complete)
+                pending = pending[last_nl + 1:]
+
+    # --- Query ---
+    def candidates(self, any_of: Iterable[Set[str]], all_of: Set[str],
+                   since: Optional[str] = None, until: Optional[str] = None) -> List[int]:
+        """
+        条件を満たし得る行番号を昇順で返す。
+        any_of の各集合は OR（例: level の複数指定）、all_of は AND、時刻はバケット単位で絞り込む。
+        """
+        with self.lock:
+            result: Optional[Set[int]] = None
+
+            def intersect(lines: Set[int]):
+                nonlocal result
+                result = lines if result is None else result & lines
+
+            for terms in any_of:
+                union: Set[int] = set()
+                for term in terms:
+                    union.update(self.postings.get(term, ()))
+                intersect(union)
+                if not result:
+                    return []
+            for term in all_of:
+                intersect(set(self.postings.get(term, ())))
+                if not result:
+                    return []
+            if since or until:
+                low = since[:TIME_BUCKET_CHARS] if since else None
+                high = until[:TIME_BUCKET_CHARS] if until else None
+                in_range: Set[int] = set()
+                for bucket, (first, last) in self.buckets.items():
+                    if (low and bucket < low) or (high and bucket > high):
+                        continue
+                    in_range.update(range(first, last + 1))
+                intersect(in_range)
+            if result is None:
+                return list(range(len(self.offsets)))
+            return sorted(result)
+
+    def line_range(self, line_no: int) -> Tuple[int, int]:
+        return self.offsets[line_no], self.lengths[line_no]
+
+    # --- Persistence ---
+    def to_bytes(self) -> bytes:
+        with self.lock:
+            header = {
+                "version": INDEX_VERSION,
+                "file_id": list(self.file_id) if self.file_id else None,
+                "indexed_bytes": self.indexed_bytes,
+                "buckets": self.buckets,
+                "terms": list(self.postings),
+            }
+            parts = [self.offsets.tobytes(), self.lengths.tobytes()]
+            parts.extend(postings.tobytes() for postings in self.postings.values())
+            header["sizes"] = [len(part) for part in parts]
+            header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+            body = len(header_bytes).to_bytes(4, "little") + header_bytes + b"".join(parts)
+            return zlib.compress(body, 1)
+
+    def load_bytes(self, raw: bytes):
+        body = zlib.decompress(raw)
+        header_len = int.from_bytes(body[:4], "little")
+        header = json.loads(body[4:4 + header_len])
+        if header.get("version") != INDEX_VERSION:
+            raise ValueError("Unsupported index version")
+        pos = 4 + header_len
+        parts = []
+        for size in header["sizes"]:
+            parts.append(body[pos:pos + size])
+            pos += size
+        with self.lock:
+            self._reset()
+            self.file_id = tuple(header["file_id"]) if header["file_id"] else None
+            self.indexed_bytes = header["indexed_bytes"]
+            self.buckets = header["buckets"]
+            self.offsets.frombytes(parts[0])
+            self.lengths.frombytes(parts[1])
+            for term, part in zip(header["terms"], parts[2:]):
+                postings = array("I")
+                postings.frombytes(part)
+                self.postings[term] = postings
+            self.dirty = False
+
+
+class LogIndex:
+    """
+    LOG_DIR 全体の転置インデックスを管理する。
+    ファイルごとの FileIndex を LRU で保持し、ディスク（LOG_DIR/.index）との間で読み書きする。
+    インデックスが無い・古い場合はログファイルから自動で作り直す。
+    """
+
+    def __init__(self, log_dir: Path, max_loaded: int = 64):
+        self.log_dir = log_dir
+        self.index_dir = log_dir / INDEX_DIR_NAME
+        self.max_loaded = max_loaded
+        self._files: "OrderedDict[Path, FileIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index_path(self, path: Path) -> Path:
+        return self.index_dir / path.parent.name / f"{path.name}.idx"
+
+    def get(self, path: Path) -> FileIndex:
+        """ファイルのインデックスを返す（必要ならディスクから読み込む）。内容の鮮度は refresh() で保証する"""
+        path = Path(path)
+        evicted = []
+        with self._lock:
+            file_index = self._files.get(path)
+            if file_index is not None:
+                self._files.move_to_end(path)
+                return file_index
+            file_index = FileIndex(path)
+            self._files[path] = file_index
+            while len(self._files) > self.max_loaded:
+                evicted.append(self._files.popitem(last=False)[1])
+        for old in evicted:
+            self._save(old)
+        self._load(file_index)
+        return file_index
+
+    def _load(self, file_index: FileIndex):
+        index_path = self._index_path(file_index.path)
+        try:
+            file_index.load_bytes(index_path.read_bytes())
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"LogIndex: discarding broken index {index_path}: {e}")
+
+    def _save(self, file_index: FileIndex):
+        if not file_index.dirty:
+            return
+        if not file_index.path.exists():
+            # 圧縮・削除で消えたファイルのインデックスは残さない
+            return
+        index_path = self._index_path(file_index.path)
+        try:
+            index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = index_path.with_suffix(".idx.tmp")
+            tmp_path.write_bytes(file_index.to_bytes())
+            os.replace(tmp_path, index_path)
+            file_index.dirty = False
+        except Exception as e:
+            print(f"LogIndex: failed to save {index_path}: {e}")
+
+    def save_all(self):
+        with self._lock:
+            file_indexes = list(self._files.values())
+        for file_index in file_indexes:
+            self._save(file_index)
+
+    def refreshed(self, path: Path) -> Optional[FileIndex]:
+        """最新の状態に更新したインデックスを返す。ファイルが無ければ None"""
+        file_index = self.get(path)
+        return file_index if file_index.refresh() else None
+
+    def rebuild_all(self):
+        """LOG_DIR 配下のすべてのログファイルのインデックスを読み込み・更新して保存する（起動時のウォームアップ用）"""
+        if not self.log_dir.exists():
+            return
+        for project_dir in self.log_dir.iterdir():
+            if not project_dir.is_dir() or project_dir.name.startswith("."):
+                continue
+            for path in project_dir.glob("*.log*"):
+                if path.is_file():
+                    self.refreshed(path)
+                    self._save(self.get(path))
+
+    # --- Hooks from LogWriter (writer thread) ---
+    def on_write(self, path: Path, offset: int, data: bytes):
+        file_index = self.get(path)
+        if not file_index.add_data(offset, data):
+            file_index.refresh()
+
+    def on_rotate(self, old_path: Path, new_path: Path):
+        """ローテーションでリネームされたファイルのインデックスを付け替える"""
+        with self._lock:
+            file_index = self._files.pop(Path(old_path), None)
+        old_index_path = self._index_path(Path(old_path))
+        new_index_path = self._index_path(Path(new_path))
+        if file_index is not None:
+            with file_index.lock:
+                file_index.path = Path(new_path)
+            with self._lock:
+                self._files[Path(new_path)] = file_index
+            file_index.dirty = True
+            self._save(file_index)
+        elif old_index_path.exists():
+            os.replace(old_index_path, new_index_path)
+        try:
+            old_index_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def on_remove(self, paths: List[Path]):
+        """RetentionManager からの通知。削除されるファイルのインデックスを捨てる"""
+        for path in paths:
+            with self._lock:
+                self._files.pop(Path(path), None)
+            try:
+                self._index_path(Path(path)).unlink()
+            except FileNotFoundError:
+                pass
+
+    def on_compact(self, old_path: Path, new_path: Path):
+        """
+        Compactor からの通知。圧縮後も展開した内容とオフセットは同じなので、
+        インデックスを付け替えてファイル ID だけを更新する（作り直さない）。
+        """
+        self.on_rotate(old_path, new_path)
+        file_index = self.get(Path(new_path))
+        with file_index.lock:
+            if file_index.file_id is not None:
+                file_index.file_id = stat_log(new_path)[0]
+                file_index.dirty = True
+        self._save(file_index)
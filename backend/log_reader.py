@@ -0,0 +1,278 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from cold_storage import is_compressed, locate_line, open_log, stat_log
+from scan_executor import count_newlines, find_checkpoints, scan_executor
+
+# ストリーミング時に1回で読み込むバイト数
+READ_CHUNK_SIZE = 256 * 1024
+# 疎インデックスで何行ごとにバイトオフセットを記録するか
+INDEX_INTERVAL = 1000
+# 未索引の部分がこれより大きければ、scan_executor のワーカープロセスで分担して索引する
+PARALLEL_INDEX_MIN_BYTES = 64 * 1024 * 1024
+
+
+class LineIndex:
+    """
+    ファイルの疎な行オフセットインデックス。
+    checkpoints[i] は (i * INDEX_INTERVAL) 行目の先頭のバイトオフセット。
+    ファイルが追記された場合は前回の末尾から続きだけを走査する。
+    圧縮済みファイルは展開後の内容で索引する（通常は cold_storage のブロックインデックスを使うので不要）。
+    """
+
+    def __init__(self, path: Path, interval: int = INDEX_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.checkpoints: List[int] = [0]
+        self.indexed_bytes = 0   # 走査済みのバイト数（常に行の先頭）
+        self.indexed_lines = 0   # 走査済みの行数
+        self.file_id: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def _reset(self):
+        self.checkpoints = [0]
+        self.indexed_bytes = 0
+        self.indexed_lines = 0
+
+    def refresh(self) -> int:
+        """ファイルの現在のサイズまでインデックスを伸ばし、完結している行数を返す"""
+        with self._lock:
+            file_id, size = stat_log(self.path)
+            if file_id != self.file_id or size < self.indexed_bytes:
+                # 置き換え・切り詰められたファイルは最初から作り直す
+                self.file_id = file_id
+                self._reset()
+            if size - self.indexed_bytes >= PARALLEL_INDEX_MIN_BYTES and scan_executor.parallel:
+                self._scan_parallel(size)
+            if size > self.indexed_bytes:
+                self._scan(size)
+            return self.indexed_lines
+
+    def _scan_parallel(self, size: int):
+        """
+        未索引の部分をバイト範囲に分け、1回目で範囲ごとの改行数を、2回目でチェックポイントの位置をワーカーで求める。
+        最後の改行より後（書き込み途中の行）は _scan() に任せる。
+        """
+        step = scan_executor.range_size
+        bounds = [(start, min(start + step, size)) for start in range(self.indexed_bytes, size, step)]
+        counts = list(scan_executor.imap(count_newlines, [(self.path, start, end) for start, end in bounds]))
+
+        tasks = []
+        lines = self.indexed_lines
+        for (start, end), (count, _) in zip(bounds, counts):
+            tasks.append((self.path, start, end, lines, self.interval))
+            lines += count
+        last = max(position for _, position in counts)
+        if last < 0:
+            return
+        for checkpoints in scan_executor.imap(find_checkpoints, tasks):
+            self.checkpoints.extend(checkpoints)
+        self.indexed_bytes = last
+        self.indexed_lines = lines
+
+    def _scan(self, size: int):
+        interval = self.interval
+        lines = self.indexed_lines
+        pos = self.indexed_bytes
+        next_checkpoint = len(self.checkpoints) * interval
+        with open_log(self.path) as f:
+            f.seek(pos)
+            read_pos = pos
+            while read_pos < size:
+                block = f.read(min(READ_CHUNK_SIZE, size - read_pos))
+                if not block:
+                    break
+                base = read_pos
+                read_pos += len(block)
+                remaining = block.count(b"\n")
+                if not remaining:
+                    continue
+                # このブロック内にあるチェックポイントの位置だけを探す
+                start = 0
+                while lines + remaining >= next_checkpoint:
+                    need = next_checkpoint - lines
+                    for _ in range(need):
+                        start = block.index(b"\n", start) + 1
+                    lines += need
+                    remaining -= need
+                    self.checkpoints.append(base + start)
+                    next_checkpoint += interval
+                lines += remaining
+                # 改行で終わっていない（書き込み途中の）末尾は次回に持ち越す
+                pos = base + block.rfind(b"\n") + 1
+        self.indexed_bytes = pos
+        self.indexed_lines = lines
+
+    def locate(self, line: int) -> Tuple[int, int]:
+        """line 行目以前で最も近いチェックポイントの (バイトオフセット, 行番号) を返す"""
+        slot = min(line // self.interval, len(self.checkpoints) - 1)
+        return self.checkpoints[slot], slot * self.interval
+
+
+class LineIndexCache:
+    """ファイルパスごとの LineIndex を LRU で保持する"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Path, LineIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> LineIndex:
+        with self._lock:
+            index = self._entries.get(path)
+            if index is None:
+                index = LineIndex(path)
+                self._entries[path] = index
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(path)
+            return index
+
+    def invalidate(self, path: Path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def on_compact(self, old_path: Path, new_path: Path):
+        """Compactor からの通知。圧縮で消えるファイルのインデックスを捨てる"""
+        self.invalidate(Path(old_path))
+
+    def on_remove(self, paths: List[Path]):
+        """RetentionManager からの通知。削除されるファイルのインデックスを捨てる"""
+        for path in paths:
+            self.invalidate(Path(path))
+
+
+line_index_cache = LineIndexCache()
+
+
+def iter_byte_range(path: Path, start: int = 0, end: Optional[int] = None,
+                    chunk_size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+    """[start, end) のバイト範囲をチャンク単位で読み出す（end=None はファイル末尾まで）"""
+    with open_log(path) as f:
+        f.seek(start)
+        remaining = None if end is None else max(0, end - start)
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def iter_lines_range(path: Path, offset: int = 0, limit: Optional[int] = None,
+                     chunk_size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    offset 行目から limit 行をチャンク単位で読み出す。
+    疎インデックス（圧縮済みファイルはブロックインデックス）で offset 付近までシークするので、
+    巨大なファイルでも先頭から読み直さない。
+    """
+    if is_compressed(path):
+        start, line = locate_line(path, offset)
+    else:
+        index = line_index_cache.get(path)
+        index.refresh()
+        start, line = index.locate(offset)
+
+    with open_log(path) as f:
+        f.seek(start)
+        # チェックポイントから offset 行目まで読み飛ばす
+        buffer = b""
+        while line < offset:
+            block = f.read(chunk_size)
+            if not block:
+                return
+            buffer += block
+            pos = 0
+            while line < offset:
+                nl = buffer.find(b"\n", pos)
+                if nl < 0:
+                    break
+                pos = nl + 1
+                line += 1
+            buffer = buffer[pos:]
+
+        remaining = limit
+        while True:
+            if remaining is None:
+                if buffer:
+                    yield buffer
+            else:
+                # 残り行数ぶんの改行が見つかったところで打ち切る
+                pos = 0
+                while remaining > 0:
+                    nl = buffer.find(b"\n", pos)
+                    if nl < 0:
+                        break
+                    pos = nl + 1
+                    remaining -= 1
+                if pos:
+                    yield buffer[:pos]
+                if remaining == 0:
+                    return
+                buffer = buffer[pos:]
+            block = f.read(chunk_size)
+            if not block:
+                # 改行で終わっていない最終行もそのまま返す
+                if remaining is not None and buffer:
+                    yield buffer
+                return
+            buffer = block if remaining is None else buffer + block
+
+
+def find_tail_offset(path: Path, lines: int, chunk_size: int = 64 * 1024) -> int:
+    """ファイル末尾から lines 行ぶんの先頭バイトオフセットを、末尾側だけを読んで求める"""
+    size = stat_log(path)[1]
+    if lines <= 0 or size == 0:
+        return size
+    with open_log(path) as f:
+        pos = size
+        # 最終行が改行で終わっている場合、その改行は数えない
+        f.seek(size - 1)
+        needed = lines + 1 if f.read(1) == b"\n" else lines
+        while pos > 0:
+            read_size = min(chunk_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            block = f.read(read_size)
+            end = len(block)
+            while True:
+                nl = block.rfind(b"\n", 0, end)
+                if nl < 0:
+                    break
+                needed -= 1
+                if needed == 0:
+                    return pos + nl + 1
+                end = nl
+    return 0
+
+
+def parse_range_header(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    `Range: bytes=...` ヘッダーを解釈して [start, end) を返す。
+    単一レンジのみ対応し、複数レンジなど対応しない形式は None（ファイル全体を返す）、
+    満たせないレンジは ValueError を送出する。
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if first == "":
+        # bytes=-N（末尾 N バイト）
+        if not last.isdigit():
+            raise ValueError("Invalid range")
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - suffix), size
+    if not first.isdigit() or (last and not last.isdigit()):
+        raise ValueError("Invalid range")
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size or start >= end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
@@ -0,0 +1,309 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from instrumentation import file_write
+
+# 複数プロセスで同じファイルに追記する場合の排他には fcntl.flock を使う（POSIX のみ）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+@contextmanager
+def file_lock(fd: int) -> Iterator[None]:
+    """
+    LogWriter が追記のあいだ取るファイルロック（flock）を取る。fcntl が無い環境では何もしない。
+    ログファイルを置き換える・消す側（Compactor / RetentionManager）はこのロックを持ったまま行う
+    """
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def is_current(path: Path, fd: int) -> bool:
+    """path がまだ fd と同じファイルを指しているか（リネーム・削除されていないか）"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    fst = os.fstat(fd)
+    return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+
+class _CloseFile:
+    """キューに入れる「このファイルを閉じる」指示"""
+
+    __slots__ = ("path",)
+
+    def __init__(self, path: Path):
+        self.path = path
+
+
+class LogWriter:
+    """
+    ログファイルへの追記をイベントループから切り離して専用スレッドで行うライター。
+
+    - 有界キューで受け取り、キューが満杯なら submit_nowait() は False を返す（バックプレッシャー）
+    - ファイルハンドルはファイルごとに開いたまま保持する
+    - 溜まったエントリはファイル単位でまとめ、サイズまたは時間のしきい値で書き出す
+    - vibelogger と同じ規則（サイズ超過で `<file>.<timestamp>` にリネーム）でローテーションする
+    - add_listener() で登録したオブジェクトに、書き込み (on_write) とローテーション (on_rotate) を
+      ライタースレッド上で通知する（インデックスやカタログの差分更新用）
+    - 追記は常にファイルロック（file_lock）下で行い、パスが別のファイルを指していたら（圧縮・保持ポリシーで
+      置き換えられた・消されたら）開き直すので、消されたファイルに書き込んで失うことはない
+    - lock_files=True の場合はローテーションもファイルロック下で行い、
+      複数のプロセスが同じファイルに追記しても行が混ざったり、ローテーション済みのファイルに書き続けたりしない
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = 10000,
+        flush_bytes: int = 256 * 1024,
+        flush_interval: float = 0.2,
+        max_file_size_mb: float = 5,
+        lock_files: bool = False,
+    ):
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_file_size = int(max_file_size_mb * 1024 * 1024)
+        self.lock_files = lock_files and fcntl is not None
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._handles: Dict[Path, BinaryIO] = {}
+        self._pending: Dict[Path, List[str]] = {}
+        self._pending_bytes = 0
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List = []
+
+        # 統計情報
+        self.bytes_written = 0
+        self.flush_count = 0
+        self.rejected_count = 0
+
+    def add_listener(self, listener):
+        """on_write(path, offset, data) / on_rotate(old_path, new_path) を持つオブジェクトを登録する"""
+        self._listeners.append(listener)
+
+    # --- Producer side (event loop) ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """残っているエントリを書き出し、ファイルハンドルを閉じてスレッドを終了する"""
+        if not self._thread:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def can_accept(self, count: int = 1) -> bool:
+        """count 件を submit_nowait() できる空きがあるかを返す（生産者がイベントループのみの前提）"""
+        maxsize = self._queue.maxsize
+        return maxsize <= 0 or self._queue.qsize() + count <= maxsize
+
+    def submit_nowait(self, path, data: str) -> bool:
+        """書き込みをキューに入れる。キューが満杯の場合は False を返す"""
+        try:
+            self._queue.put_nowait((Path(path), data))
+            return True
+        except queue.Full:
+            self.rejected_count += 1
+            return False
+
+    async def submit(self, path, data: str, poll_interval: float = 0.005):
+        """キューに空きができるまで await してから書き込みをキューに入れる"""
+        while not self.submit_nowait(path, data):
+            await asyncio.sleep(poll_interval)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """キュー投入済みのエントリがすべてファイルに書き出されるまで待つ（ブロッキング）"""
+        if not self._thread:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def release(self, path) -> bool:
+        """
+        path の未書き込み分を書き出してからファイルハンドルを閉じるよう依頼する（次に書き込むときに開き直す）。
+        キューが満杯の場合は False を返す（ハンドルは開いたまま）。
+        """
+        try:
+            self._queue.put_nowait(_CloseFile(Path(path)))
+            return True
+        except queue.Full:
+            return False
+
+    @property
+    def open_files(self) -> int:
+        return len(self._handles)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # --- Writer thread ---
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        running = True
+        while running:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            # キューに溜まっている分はまとめて取り出す
+            waiters = []
+            closing = []
+            while item is not False:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                elif isinstance(item, _CloseFile):
+                    closing.append(item.path)
+                else:
+                    self._add_pending(*item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = False
+
+            now = time.monotonic()
+            if waiters or closing or not running or self._pending_bytes >= self.flush_bytes or now >= deadline:
+                self._flush_pending()
+                deadline = now + self.flush_interval
+            for path in closing:
+                self._close_handle(path)
+            for waiter in waiters:
+                waiter.set()
+
+        self._close_all()
+
+    def _add_pending(self, path: Path, data: str):
+        self._pending.setdefault(path, []).append(data)
+        self._pending_bytes += len(data)
+
+    def _flush_pending(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._pending_bytes = 0
+        for path, chunks in pending.items():
+            data = "".join(chunks).encode("utf-8")
+            try:
+                start = time.perf_counter()
+                if self.lock_files:
+                    offset = self._write_locked(path, data)
+                else:
+                    offset = self._write(path, data)
+                file_write.observe(time.perf_counter() - start)
+                self.bytes_written += len(data)
+            except Exception as e:
+                print(f"LogWriter: failed to write {path}: {e}")
+                self._close_handle(path)
+                continue
+            self._notify("on_write", path, offset, data)
+        self.flush_count += 1
+
+    def _notify(self, method: str, *args):
+        for listener in self._listeners:
+            try:
+                getattr(listener, method)(*args)
+            except Exception as e:
+                print(f"LogWriter: listener {type(listener).__name__}.{method} failed: {e}")
+
+    def _write(self, path: Path, data: bytes) -> int:
+        """
+        ファイルに追記し、書き込んだ位置を返す。
+        ロックを取ったときにパスが別のファイルを指していたら（圧縮・保持ポリシーで置き換えられていたら）開き直す。
+        """
+        while True:
+            handle = self._get_handle(path)
+            if self.max_file_size > 0 and handle.tell() > self.max_file_size:
+                self._rotate(path)
+                continue
+            fd = handle.fileno()
+            with file_lock(fd):
+                if is_current(path, fd):
+                    offset = handle.tell()
+                    handle.write(data)
+                    handle.flush()
+                    return offset
+            self._close_handle(path)
+
+    def _write_locked(self, path: Path, data: bytes) -> int:
+        """
+        ファイルロックを取って追記し、書き込んだ位置を返す。
+        他のプロセスがローテーションしていたら（パスが別のファイルを指していたら）開き直す。
+        """
+        while True:
+            handle = self._get_handle(path)
+            fd = handle.fileno()
+            with file_lock(fd):
+                if is_current(path, fd):
+                    offset = os.fstat(fd).st_size
+                    if self.max_file_size <= 0 or offset <= self.max_file_size:
+                        handle.write(data)
+                        handle.flush()
+                        return offset
+                    # ロックを持ったままリネームするので、他のプロセスが古いファイルに書き込むことはない
+                    self._move_aside(path)
+            self._close_handle(path)
+
+    def _get_handle(self, path: Path) -> BinaryIO:
+        handle = self._handles.get(path)
+        if handle is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handle = open(path, "ab")
+            self._handles[path] = handle
+        return handle
+
+    def _rotate(self, path: Path):
+        self._close_handle(path)
+        self._move_aside(path)
+
+    def _move_aside(self, path: Path):
+        """path を `<file>.<timestamp>` にリネームしてリスナーに通知する"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        rotated = Path(f"{path}.{timestamp}")
+        # 同じ秒に2回ローテーションしても上書きしないよう連番を付ける
+        suffix = 1
+        while rotated.exists():
+            rotated = Path(f"{path}.{timestamp}_{suffix}")
+            suffix += 1
+        try:
+            os.replace(path, rotated)
+        except FileNotFoundError:
+            return
+        self._notify("on_rotate", path, rotated)
+
+    def _close_handle(self, path: Path):
+        handle = self._handles.pop(path, None)
+        if handle is not None:
+            try:
+                handle.close()
+            except Exception:
+                pass
+
+    def _close_all(self):
+        self._flush_pending()
+        for path in list(self._handles):
+            self._close_handle(path)
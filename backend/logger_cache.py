@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class LoggerCache:
+    """
+    (プロジェクト, オペレーション) ごとのロガーを保持する有界の LRU キャッシュ。
+    max_size を超えたら最も長く使われていないものから、idle_timeout 秒使われていないものは
+    evict_idle() で追い出す。追い出したロガーは on_evict(key, logger) に渡す（ファイルハンドルを閉じる用）。
+    イベントループからだけ使う前提なのでロックは持たない。
+    """
+
+    def __init__(self, max_size: int = 256, idle_timeout: float = 600,
+                 on_evict: Optional[Callable[[str, Any], None]] = None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+
+        # 統計情報
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.idle_evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = (entry[0], time.monotonic())
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, logger: Any):
+        self._entries[key] = (logger, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            old_key, (old_logger, _) = self._entries.popitem(last=False)
+            self.evictions += 1
+            self._evicted(old_key, old_logger)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """idle_timeout 秒以上使われていないロガーを追い出し、その数を返す"""
+        now = time.monotonic() if now is None else now
+        evicted = 0
+        # 古い順に並んでいるので、期限内のものが出てきたらそこで終わり
+        while self._entries:
+            key, (logger, last_used) = next(iter(self._entries.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            del self._entries[key]
+            evicted += 1
+            self._evicted(key, logger)
+        self.idle_evictions += evicted
+        return evicted
+
+    def _evicted(self, key: str, logger: Any):
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(key, logger)
+        except Exception as e:
+            print(f"LoggerCache: on_evict failed for '{key}': {e}")
+
+    def clear(self):
+        """すべてのロガーを追い出す（シャットダウン用。統計には数えない）"""
+        while self._entries:
+            key, (logger, _) = self._entries.popitem(last=False)
+            self._evicted(key, logger)
+
+    def values(self) -> List[Any]:
+        return [logger for logger, _ in self._entries.values()]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "idle_timeout": self.idle_timeout,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "idle_evictions": self.idle_evictions,
+        }
@@ -1,23 +1,50 @@
 import asyncio
 import json
+import os
 import random
+import re
+import time
 from contextlib import asynccontextmanager
+from datetime import datetime
 from pathlib import Path
-from typing import List, Set
+from typing import Optional, Set
 
 from fastapi import FastAPI, WebSocket, Request, WebSocketDisconnect, HTTPException, status
-from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 
 from starlette.responses import StreamingResponse
 
+from broadcast import ConnectionManager, EventHistory, DROP_OLDEST, METRICS_MODES, SLOW_CONSUMER_POLICIES
+from bus import BUS_LOCAL, BUS_UNIX, create_bus
+from catalog import ProjectCatalog
+from coalesce import CoalesceOptions
+from columnar import BUCKET_UNITS, COLUMNAR_AVAILABLE, EXPORT_ARROW, EXPORT_FORMATS, EXPORT_PARQUET, ColumnarStore
+from cold_storage import Compactor, block_index_cache, stat_log
+from encoding import JSON_BACKEND, dumps_bytes, encode_event
+from instrumentation import CONTENT_TYPE as METRICS_CONTENT_TYPE, EndpointLatencyMiddleware, event_loop_lag, registry
+from log_index import LogIndex
+from log_reader import find_tail_offset, iter_byte_range, iter_lines_range, line_index_cache, parse_range_header
+from log_writer import LogWriter
+from logger_cache import LoggerCache
+from metrics import MetricsAggregator
+from retention import RetentionManager, RetentionPolicy
+from rollups import RESOLUTIONS, RollupStore
+from scan_executor import scan_executor
+from search import SearchQuery, normalize_timestamp, search_logs
+from shared_ring import SharedEventRing
+from segments import LAYOUT_DAILY, LOG_FILE_LAYOUTS, is_segmented, segment_file_name, segment_suffix
+from subscription import SubscriptionFilter
+from wire import negotiate as negotiate_wire_protocol
+
 # VibeCoding Logger (assuming it's installed or in the path)
 # If vibelogger is not a real package, we'll simulate it.
 try:
-    from vibelogger import create_file_logger, create_logger, VibeLoggerConfig
+    from vibelogger import create_file_logger, create_logger, VibeLoggerConfig, LogLevel
     _vibelogger_installed = True
 except ImportError:
     _vibelogger_installed = False
+    LogLevel = None
     # Simple mock for VibeCoding Logger if not available
     class MockLogger:
         def __init__(self, name, log_dir=None):
@@ -29,9 +56,9 @@ except ImportError:
                 self.log_file = None
                 print(f"MockLogger initialized for '{name}' (console only)")
             
-        def _log(self, level, operation=None, message=None, context=None, **kwargs):
+        def _create_log_entry(self, level, operation=None, message=None, context=None, **kwargs):
             import datetime
-            log_entry = {
+            return {
                 "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
                 "level": level,
                 "operation": operation,
@@ -39,6 +66,9 @@ except ImportError:
                 "context": context or {},
                 **kwargs
             }
+
+        def _log(self, level, operation=None, message=None, context=None, **kwargs):
+            log_entry = self._create_log_entry(level, operation=operation, message=message, context=context, **kwargs)
             
             # ログファイルに追記（ファイルパスが設定されている場合のみ）
             if self.log_file:
@@ -77,8 +107,92 @@ FRONTEND_DIR = BASE_DIR / "frontend"
 LOG_DIR = BASE_DIR / "logs"
 LOG_DIR.mkdir(exist_ok=True)
 
-# ダミーログ生成の制御フラグ
-ENABLE_DUMMY_LOGS = True
+# ダミーログ生成の制御フラグ（--workers で起動したワーカープロセスには環境変数で引き継ぐ）
+ENABLE_DUMMY_LOGS = not os.environ.get("VIBELOGGER_NO_DUMMY")
+
+# ワーカープロセス間でイベントを中継するブロードキャストバス
+#   "local": 1プロセス内だけで配信する（既定）
+#   "unix" : 同じホストの全ワーカーへ Unix ドメインソケットで中継する（uvicorn --workers 用。--workers 2 以上で自動的に選ばれる）
+BROADCAST_BUS = os.environ.get("VIBELOGGER_BROADCAST_BUS", BUS_LOCAL)
+broadcast_bus = create_bus(BROADCAST_BUS, LOG_DIR)
+
+# ログファイルのローテーションサイズ (MB)
+LOG_MAX_FILE_SIZE_MB = 5
+
+# ログファイルの配置方法
+#   "daily" / "hourly": プロジェクト・オペレーションごとに時刻で区切ったファイル（{operation}_{YYYYmmdd[_HH]}.log）に追記する。
+#                       再起動後や複数のワーカープロセスからも同じファイルに追記する（ファイルロックで排他）
+#   "per_logger"      : 従来どおり、ロガーを作るたびに新しいファイル（{operation}_{YYYYmmdd_HHMM}_{乱数}.log）を作る
+LOG_FILE_LAYOUT = LAYOUT_DAILY
+if LOG_FILE_LAYOUT not in LOG_FILE_LAYOUTS:
+    raise ValueError(f"LOG_FILE_LAYOUT must be one of {', '.join(LOG_FILE_LAYOUTS)}")
+
+# ログファイルへの書き込みはイベントループを塞がないよう専用スレッドで行う
+log_writer = LogWriter(
+    max_queue_size=10000,
+    max_file_size_mb=LOG_MAX_FILE_SIZE_MB,
+    lock_files=is_segmented(LOG_FILE_LAYOUT),
+)
+
+# 検索用の転置インデックス（LOG_DIR/.index に永続化）。ライタースレッドが書き込みごとに差分更新する
+ENABLE_LOG_INDEX = True
+LOG_INDEX_SAVE_INTERVAL = 30  # 秒
+log_index = LogIndex(LOG_DIR)
+if ENABLE_LOG_INDEX:
+    log_writer.add_listener(log_index)
+
+# 分・時間単位の時系列ロールアップ（LOG_DIR/.rollups）。ライタースレッドが書き込みごとに差分を積み、定期的にファイルへ足し込む
+ENABLE_ROLLUPS = True
+ROLLUP_SAVE_INTERVAL = 30  # 秒
+ROLLUP_FIELDS = ("latency_ms", "duration_ms")  # 件数・合計・最小・最大・分位点を持つ context の数値フィールド
+rollups = RollupStore(LOG_DIR, fields=ROLLUP_FIELDS)
+if ENABLE_ROLLUPS:
+    log_writer.add_listener(rollups)
+
+# /api/projects 用のプロジェクト・ファイル一覧のカタログ。書き込み・ローテーションの通知で差分更新し、
+# 他プロセスによる変更は CATALOG_RESCAN_INTERVAL 秒ごとの再走査で取り込む
+# サイズ・エントリ数などの統計の変化は CATALOG_STATS_INTERVAL 秒に1回だけ ETag に反映する（ファイルの増減はすぐに反映する）
+CATALOG_RESCAN_INTERVAL = 60  # 秒
+CATALOG_STATS_INTERVAL = 10  # 秒
+catalog = ProjectCatalog(LOG_DIR, stats_interval=CATALOG_STATS_INTERVAL)
+log_writer.add_listener(catalog)
+
+# 書き込みが終わったログファイル（ローテーション済み・以前の起動のもの）をブロック圧縮（<file>.gz）に置き換える。
+# 圧縮済みファイルも /api/logs・/api/search・/api/projects から透過的に読める
+ENABLE_COLD_STORAGE = True
+COLD_STORAGE_MIN_AGE = 300  # 秒。これより最近に更新されたファイルは圧縮しない
+COLD_STORAGE_INTERVAL = 60  # 秒
+compactor = Compactor(LOG_DIR, min_age=COLD_STORAGE_MIN_AGE)
+compactor.add_listener(catalog)
+compactor.add_listener(line_index_cache)
+if ENABLE_LOG_INDEX:
+    compactor.add_listener(log_index)
+
+# 書き込みが終わったログファイルを列指向の Parquet（LOG_DIR/.columnar）に変換し、/api/export・/api/aggregate で使う。
+# pyarrow がインストールされている場合だけ有効（uv pip install pyarrow）
+ENABLE_COLUMNAR = COLUMNAR_AVAILABLE
+COLUMNAR_INTERVAL = 300  # 秒
+columnar = ColumnarStore(LOG_DIR, min_age=COLD_STORAGE_MIN_AGE)
+
+# 全件走査（インデックスで絞り込めない /api/search、大きなファイルの行インデックス作成、ロールアップの作り直し）を
+# 分担するワーカープロセスの数。1 以下ならこのプロセスで順に走査する（--scan-workers で指定したワーカーには環境変数で引き継ぐ）
+# --workers 2 以上で起動した場合はサーバー全体の合計で、各ワーカーにはワーカー数で割った数を渡す
+SCAN_WORKERS = int(os.environ.get("VIBELOGGER_SCAN_WORKERS", min(4, os.cpu_count() or 1)))
+
+# LOG_DIR の保持ポリシー。上限を超えたぶんを古いファイルから削除する（RETENTION_ARCHIVE_DIR を指定すると移動する）
+ENABLE_RETENTION = True
+RETENTION_INTERVAL = 300  # 秒
+RETENTION_DEFAULT_POLICY = RetentionPolicy(max_age_days=30, max_bytes=1024 * 1024 * 1024, max_files=1000)
+RETENTION_PROJECT_POLICIES = {}  # 例: {"monitoring_alerts": RetentionPolicy(max_age_days=7)}
+RETENTION_ARCHIVE_DIR = None     # 例: BASE_DIR / "archive"
+retention = RetentionManager(
+    LOG_DIR,
+    default_policy=RETENTION_DEFAULT_POLICY,
+    project_policies=RETENTION_PROJECT_POLICIES,
+    archive_dir=RETENTION_ARCHIVE_DIR,
+)
+for listener in (catalog, line_index_cache, block_index_cache, log_index):
+    retention.add_listener(listener)
 
 # --- Helper Functions ---
 def serialize_log_entry(log_entry):
@@ -109,41 +223,107 @@ def serialize_log_entry(log_entry):
         return {"raw_log": str(log_entry), "error": f"Serialization failed: {e}"}
 
 # --- Logger Setup ---
-from datetime import datetime
-import random
+# ロガーインスタンスを管理する有界キャッシュ。クライアントが任意の project / operation を送っても
+# 増え続けないよう、LOGGER_CACHE_SIZE を超えたら LRU で、LOGGER_IDLE_TIMEOUT 秒使われなければ追い出す
+LOGGER_CACHE_SIZE = 256
+LOGGER_IDLE_TIMEOUT = 600  # 秒
+
+def release_logger(logger_key: str, vibe_logger):
+    """追い出したロガーの書き込み先を、未書き込み分を書き出してから閉じる"""
+    log_file = getattr(vibe_logger, "log_file", None)
+    if log_file:
+        log_writer.release(log_file)
 
-# ロガーインスタンスを管理する辞書
-loggers = {}
+loggers = LoggerCache(max_size=LOGGER_CACHE_SIZE, idle_timeout=LOGGER_IDLE_TIMEOUT, on_evict=release_logger)
 
 def get_operation_logger(project_name: str, operation_name: str):
-    """プロジェクト名とオペレーション名に基づいてロガーを取得または作成する"""
+    """
+    プロジェクト名とオペレーション名に基づいてロガーを取得または作成する。
+    キャッシュから追い出された後に再び呼ばれた場合、セグメント配置なら同じファイルに追記を再開する。
+    """
     logger_key = f"{project_name}_{operation_name}"
-    if logger_key not in loggers:
-        project_log_dir = LOG_DIR / project_name
-        project_log_dir.mkdir(exist_ok=True)
-        
+    project_log_dir = LOG_DIR / project_name
+    existing = loggers.get(logger_key)
+    if existing is not None:
+        if is_segmented(LOG_FILE_LAYOUT) and getattr(existing, "log_file", None):
+            # セグメントのファイル名は時刻で決まるので、区切りをまたいだら書き込み先を切り替える
+            log_filename = segment_file_name(operation_name, LOG_FILE_LAYOUT)
+            if Path(existing.log_file).name != log_filename:
+                log_writer.release(existing.log_file)
+                existing.log_file = project_log_dir / log_filename
+        return existing
+
+    if is_segmented(LOG_FILE_LAYOUT):
+        # 既存のセグメントがあれば（再起動後・別プロセスでも）そのまま追記する
+        log_filename = segment_file_name(operation_name, LOG_FILE_LAYOUT)
+    else:
         # タイムスタンプをファイル名に入れることで、起動ごとに新しいログファイルが作られる
         timestamp = datetime.now().strftime("%Y%m%d_%H%M")
         log_filename = f"{operation_name}_{timestamp}_{random.randint(100,999)}.log"
-        
-        # VibeLoggerConfig が見つからない場合はモックを使用する
-        try:
-            from vibelogger import VibeLoggerConfig, create_logger
-        except ImportError:
-            # モックの場合、VibeLoggerConfig は存在しない可能性があるため、ここでは何もしない
-            pass
 
-        config = VibeLoggerConfig(
-            log_file=project_log_dir / log_filename,
-            max_file_size_mb=5, # デモ用に小さく設定
-            auto_save=True,
-            keep_logs_in_memory=False, # サーバーサイドではメモリに保持する必要は基本的にない
-            max_memory_logs=1
-        )
-        loggers[logger_key] = create_logger(config=config)
-        print(f"***** Logger created for '{logger_key}' at '{project_log_dir / log_filename}' *****")
+    project_log_dir.mkdir(exist_ok=True)
+
+    # VibeLoggerConfig が見つからない場合はモックを使用する
+    try:
+        from vibelogger import VibeLoggerConfig, create_logger
+    except ImportError:
+        # モックの場合、VibeLoggerConfig は存在しない可能性があるため、ここでは何もしない
+        pass
 
-    return loggers[logger_key]
+    config = VibeLoggerConfig(
+        log_file=project_log_dir / log_filename,
+        max_file_size_mb=LOG_MAX_FILE_SIZE_MB, # デモ用に小さく設定
+        auto_save=False, # ファイルへの追記とローテーションは log_writer が行う
+        keep_logs_in_memory=False, # サーバーサイドではメモリに保持する必要は基本的にない
+        max_memory_logs=1
+    )
+    vibe_logger = create_logger(config=config)
+    loggers.put(logger_key, vibe_logger)
+    print(f"***** Logger created for '{logger_key}' at '{project_log_dir / log_filename}' *****")
+    return vibe_logger
+
+def build_log_entry(vibe_logger, level: str, operation: str, message: str, context=None, human_note=None):
+    """ファイルへ書き込まずにログエントリだけを生成する（バッチ書き込み用）"""
+    if LogLevel is None:
+        # モックロガーはレベル名の文字列をそのまま扱う
+        return vibe_logger._create_log_entry(level.upper(), operation=operation, message=message,
+                                             context=context, human_note=human_note)
+
+    # ingest_log と同様、未知のレベル（SUCCESS など）は INFO として扱う
+    log_level = LogLevel.__members__.get(level.upper(), LogLevel.INFO)
+    return vibe_logger._create_log_entry(
+        level=log_level,
+        operation=operation,
+        message=message,
+        context=context,
+        human_note=human_note,
+        include_stack=log_level in (LogLevel.ERROR, LogLevel.CRITICAL),
+    )
+
+def entry_to_json(log_entry) -> str:
+    """ログエントリを1行分のJSON文字列に変換する"""
+    if hasattr(log_entry, "to_json"):
+        return log_entry.to_json()
+    return json.dumps(serialize_log_entry(log_entry), default=str, ensure_ascii=False)
+
+def enqueue_log_entries(vibe_logger, entries: list) -> bool:
+    """
+    複数のログエントリを1つの書き込みとして log_writer のキューへ入れる。
+    キューが満杯の場合は False を返す（呼び出し側で 429 を返す）。
+    """
+    log_file = getattr(vibe_logger, "log_file", None)
+    if not log_file or not entries:
+        return True
+    data = "".join(entry_to_json(entry) + "\n" for entry in entries)
+    return log_writer.submit_nowait(log_file, data)
+
+async def write_log_entries(vibe_logger, entries: list):
+    """キューに空きができるまで待ってから log_writer へ書き込みを依頼する"""
+    log_file = getattr(vibe_logger, "log_file", None)
+    if not log_file or not entries:
+        return
+    data = "".join(entry_to_json(entry) + "\n" for entry in entries)
+    await log_writer.submit(log_file, data)
 
 # -------------------------------------------------------------------
 # テスト用のログ生成関数（Colabで動作していた機能）
@@ -214,43 +394,88 @@ async def test_logger():
     print(f"All generated logs are saved in: {LOG_DIR}")
 
 # --- Connection Management ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_websockets: Set[WebSocket] = set()
-        self.active_sse_queues: Set[asyncio.Queue] = set()
-
-    async def connect_ws(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_websockets.add(websocket)
-
-    def disconnect_ws(self, websocket: WebSocket):
-        self.active_websockets.remove(websocket)
-
-    async def connect_sse(self) -> asyncio.Queue:
-        queue = asyncio.Queue()
-        self.active_sse_queues.add(queue)
-        return queue
-    
-    def disconnect_sse(self, queue: asyncio.Queue):
-        self.active_sse_queues.remove(queue)
+# クライアントごとの送信バッファの上限と、溢れた場合の方針 (drop_oldest / drop_newest / disconnect)
+SUBSCRIBER_QUEUE_SIZE = 1000
+SLOW_CONSUMER_POLICY = DROP_OLDEST
 
-    async def broadcast(self, message: str):
-        # Broadcast to WebSockets
-        for websocket in self.active_websockets:
-            try:
-                await websocket.send_text(message)
-            except WebSocketDisconnect:
-                # This will be handled by the endpoint's finally block
-                pass
-            except Exception:
-                # Handle other potential errors
-                pass
+# 接続時のリプレイ用の履歴
+#   "memory": プロセスごとに、プロジェクトごとのリングバッファで直近のイベントを保持する（既定）
+#   "shared": 全ワーカーで共有するメモリマップトファイルのリングバッファ（--workers 2 以上で自動的に選ばれる）
+HISTORY_BACKEND = os.environ.get("VIBELOGGER_HISTORY", "memory")
+# memory: 保持する直近のイベント数（プロジェクトごとに上書き可能）
+HISTORY_SIZE = 1000
+HISTORY_PROJECT_SIZES = {}  # 例: {"monitoring_alerts": 5000}
+# shared: リングバッファのファイルと容量（/dev/shm/vibelogger-events.ring なども指定できる）
+HISTORY_RING_PATH = LOG_DIR / ".ring" / "events.ring"
+HISTORY_RING_BYTES = 64 * 1024 * 1024
+
+if HISTORY_BACKEND == "shared":
+    history = SharedEventRing(HISTORY_RING_PATH, capacity=HISTORY_RING_BYTES)
+elif HISTORY_BACKEND == "memory":
+    history = EventHistory(default_size=HISTORY_SIZE, project_sizes=HISTORY_PROJECT_SIZES)
+else:
+    raise ValueError("VIBELOGGER_HISTORY must be one of memory, shared")
+
+manager = ConnectionManager(
+    queue_size=SUBSCRIBER_QUEUE_SIZE,
+    policy=SLOW_CONSUMER_POLICY,
+    history=history,
+    bus=broadcast_bus,
+)
 
-        # Broadcast to SSE queues
-        for queue in self.active_sse_queues:
-            await queue.put(message)
+# 配信するイベントをその場で集計する（/api/metrics と、購読者への定期配信用）
+#   METRICS_WINDOW 秒ぶんを METRICS_RESOLUTION 秒ごとのスライスで保持し、context の METRICS_FIELDS の分位点を求める
+METRICS_WINDOW = 300       # 秒
+METRICS_RESOLUTION = 10    # 秒
+METRICS_FIELDS = ("latency_ms", "duration_ms")
+METRICS_PUSH_INTERVAL = 5  # 秒
+metrics = MetricsAggregator(window=METRICS_WINDOW, resolution=METRICS_RESOLUTION, fields=METRICS_FIELDS)
+manager.add_listener(metrics)
 
-manager = ConnectionManager()
+# サーバー自身の計測値（/api/internal/metrics で Prometheus のテキスト形式で返す）
+#   ホットパス（ファンアウト・ファイル書き込み・INSTRUMENTED_ENDPOINTS の応答時間）はヒストグラムに数えるだけで、
+#   キューの長さ・ロガーキャッシュの大きさなどはスクレイプのときに読む
+EVENT_LOOP_LAG_INTERVAL = 0.1  # 秒
+INSTRUMENTED_ENDPOINTS = {"/api/ingest": "/api/ingest", "/api/ingest/batch": "/api/ingest/batch",
+                          "/api/projects": "/api/projects"}
+INSTRUMENTED_PREFIXES = [("/api/logs/", "/api/logs/{project}/{file}")]
+
+
+def subscriber_samples(field: str) -> dict:
+    return {(("id", str(subscriber.id)), ("kind", subscriber.kind)): getattr(subscriber, field)
+            for subscriber in list(manager.subscribers.values())}
+
+
+def subscriber_counts() -> dict:
+    counts = {"ws": 0, "sse": 0}
+    for subscriber in list(manager.subscribers.values()):
+        counts[subscriber.kind] = counts.get(subscriber.kind, 0) + 1
+    return {(("kind", kind),): count for kind, count in counts.items()}
+
+
+registry.gauge("vibelogger_event_loop_lag_max_seconds", "Largest event loop lag observed since startup",
+               lambda: event_loop_lag.max)
+registry.gauge("vibelogger_subscribers", "Connected subscribers", subscriber_counts)
+registry.gauge("vibelogger_subscriber_queue_depth", "Events buffered for each subscriber",
+               lambda: subscriber_samples("lag"))
+registry.gauge("vibelogger_subscriber_queue_depth_max", "Largest buffer depth seen by each subscriber",
+               lambda: subscriber_samples("max_lag"))
+registry.counter("vibelogger_subscriber_dropped_total", "Events dropped for each slow subscriber",
+                 lambda: subscriber_samples("dropped"))
+registry.gauge("vibelogger_log_writer_queue_depth", "Write requests waiting for the writer thread",
+               lambda: log_writer.queue_depth)
+registry.counter("vibelogger_log_writer_bytes_written_total", "Bytes appended to log files",
+                 lambda: log_writer.bytes_written)
+registry.counter("vibelogger_log_writer_flushes_total", "Batched flushes by the writer thread",
+                 lambda: log_writer.flush_count)
+registry.gauge("vibelogger_log_writer_open_files", "Log files held open by the writer thread",
+               lambda: log_writer.open_files)
+registry.counter("vibelogger_bus_lost_total", "Events not relayed to another worker (overwritten in the shared ring before a resync)",
+                 lambda: broadcast_bus.stats().get("lost", 0))
+registry.gauge("vibelogger_logger_cache_size", "Cached operation loggers", lambda: len(loggers))
+registry.gauge("vibelogger_logger_cache_max_size", "Logger cache capacity", lambda: loggers.max_size)
+registry.counter("vibelogger_logger_cache_evictions_total", "Loggers evicted from the cache (LRU and idle)",
+                 lambda: loggers.evictions + loggers.idle_evictions)
 
 # --- Background Log Generation ---
 async def generate_logs():
@@ -286,7 +511,6 @@ async def generate_logs():
             
             log_entry = {}
             base_context = {"user": user, "project": project_name, "log_id": log_id}
-            message = f"{operation} status"
 
             if log_level == "INFO":
                 log_entry = vibe_logger.info(
@@ -325,16 +549,21 @@ async def generate_logs():
                 )
             
             print(f"ログエントリが生成されました: {type(log_entry)}")
+
+            # ファイルへの追記はライタースレッドに任せる（キュー満杯時は空くまで待つ）
+            if log_entry:
+                await write_log_entries(vibe_logger, [log_entry])
             
             # log_entryをJSON化してブロードキャスト
             try:
                 if log_entry:
                     # LogEntryオブジェクトを辞書に変換
                     log_dict = serialize_log_entry(log_entry)
+                    log_dict.setdefault("project", project_name)
                         
-                    message_json = json.dumps(log_dict, default=str, ensure_ascii=False)
-                    print(f"ブロードキャスト中: {message_json[:100]}...")
-                    await manager.broadcast(message_json)
+                    event = encode_event(log_dict)
+                    print(f"ブロードキャスト中: {event.json[:100]}...")
+                    await manager.broadcast(event)
                     print("***** ブロードキャスト完了 *****")
                 else:
                     print("警告: log_entryが空です")
@@ -348,7 +577,7 @@ async def generate_logs():
                     "user": user,
                     "timestamp": datetime.now().isoformat()
                 }
-                await manager.broadcast(json.dumps(fallback_message))
+                await manager.broadcast(encode_event(fallback_message))
                 
         except Exception as e:
             print(f"generate_logs()でエラーが発生しました: {e}")
@@ -356,6 +585,124 @@ async def generate_logs():
             # エラーが発生してもwhileを継続
             await asyncio.sleep(1)  # エラー後は短い間隔で再試行
 
+async def maintain_log_index():
+    """起動時に既存ログのインデックスを読み込み（無い・古いものは再構築し）、以後は定期的に保存する"""
+    try:
+        await asyncio.to_thread(log_index.rebuild_all)
+    except Exception as e:
+        print(f"Log index rebuild failed: {e}")
+    while True:
+        await asyncio.sleep(LOG_INDEX_SAVE_INTERVAL)
+        await asyncio.to_thread(log_index.save_all)
+
+async def maintain_rollups():
+    """書き込みで積んだロールアップの差分を定期的にファイルへ足し込む"""
+    while True:
+        await asyncio.sleep(ROLLUP_SAVE_INTERVAL)
+        try:
+            await asyncio.to_thread(rollups.save_all)
+        except Exception as e:
+            print(f"Rollup save failed: {e}")
+
+async def maintain_catalog():
+    """カタログの詳細（エントリ数・タイムスタンプ）を集計し、以後は定期的に再走査する"""
+    while True:
+        try:
+            await asyncio.to_thread(catalog.fill_details)
+        except Exception as e:
+            print(f"Catalog update failed: {e}")
+        await asyncio.sleep(CATALOG_RESCAN_INTERVAL)
+        await asyncio.to_thread(catalog.rescan)
+
+def active_log_files() -> Set[Path]:
+    """
+    書き込み中のファイル（圧縮・Parquet 変換・保持ポリシーの対象外）。このプロセスのロガーの書き込み先に加え、
+    セグメント配置ではファイル名が時刻だけで決まるので、他のワーカーが書き込み中の現在のセグメントもすべて含める。
+    per_logger 配置で他のワーカーが開いているファイルは含まれないが、圧縮と削除はライターと同じファイルロックの下で行い、
+    ライターは置き換えられた（消された）ファイルに気づいて開き直すので、書き込みは失われない
+    """
+    files = {Path(logger.log_file) for logger in loggers.values() if getattr(logger, "log_file", None)}
+    if is_segmented(LOG_FILE_LAYOUT):
+        files.update(LOG_DIR.glob(f"*/*{segment_suffix(LOG_FILE_LAYOUT)}"))
+    return files
+
+async def maintain_cold_storage():
+    """書き込みが終わったログファイルを定期的に圧縮する（複数ワーカーの場合はリーダーだけが行う）"""
+    while True:
+        if not broadcast_bus.try_lead():
+            await asyncio.sleep(COLD_STORAGE_INTERVAL)
+            continue
+        try:
+            compacted = await asyncio.to_thread(compactor.run_once, active_log_files())
+            if compacted:
+                print(f"Cold storage: compacted {compacted} file(s) "
+                      f"({compactor.bytes_before} -> {compactor.bytes_after} bytes in total)")
+        except Exception as e:
+            print(f"Cold storage compaction failed: {e}")
+        await asyncio.sleep(COLD_STORAGE_INTERVAL)
+
+async def maintain_columnar():
+    """書き込みが終わったログファイルを定期的に Parquet に変換する（複数ワーカーの場合はリーダーだけが行う）"""
+    while True:
+        if not broadcast_bus.try_lead():
+            await asyncio.sleep(COLUMNAR_INTERVAL)
+            continue
+        try:
+            converted = await asyncio.to_thread(columnar.run_once, active_log_files())
+            if converted:
+                print(f"Columnar: converted {converted} file(s) ({columnar.converted_rows} rows in total)")
+        except Exception as e:
+            print(f"Columnar conversion failed: {e}")
+        await asyncio.sleep(COLUMNAR_INTERVAL)
+
+async def enforce_retention():
+    """保持ポリシーを定期的に適用し、回収したバイト数を報告する（複数ワーカーの場合はリーダーだけが行う）"""
+    while True:
+        if not broadcast_bus.try_lead():
+            await asyncio.sleep(RETENTION_INTERVAL)
+            continue
+        try:
+            report = await asyncio.to_thread(retention.run_once, active_log_files())
+            if report["files"]:
+                print(f"Retention: removed {report['files']} file(s), reclaimed {report['bytes']} bytes "
+                      f"({retention.reclaimed_bytes} bytes since startup)")
+        except Exception as e:
+            print(f"Retention enforcement failed: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+async def push_metrics():
+    """集計を受け取る購読者へ、METRICS_PUSH_INTERVAL 秒ごとに購読フィルタの範囲の集計を送る"""
+    while True:
+        await asyncio.sleep(METRICS_PUSH_INTERVAL)
+        try:
+            # 同じプロジェクト・オペレーションの条件の購読者には同じエンコード結果を送る
+            encoded = {}
+            for subscriber in manager.metrics_subscribers():
+                subscription = subscriber.filter
+                key = (subscription.projects, subscription.operations) if subscription else (None, None)
+                event = encoded.get(key)
+                if event is None:
+                    snapshot = metrics.snapshot(projects=key[0], operations=key[1])
+                    event = encoded[key] = encode_event({"type": "metrics", **snapshot})
+                subscriber.push(event)
+        except Exception as e:
+            print(f"Metrics push failed: {e}")
+
+async def maintain_logger_cache():
+    """使われなくなったロガーを定期的に追い出し、ファイルハンドルを閉じる"""
+    while True:
+        await asyncio.sleep(max(1.0, LOGGER_IDLE_TIMEOUT / 4))
+        evicted = loggers.evict_idle()
+        if evicted:
+            print(f"Logger cache: evicted {evicted} idle logger(s), {len(loggers)} remaining")
+
+async def monitor_event_loop():
+    """EVENT_LOOP_LAG_INTERVAL 秒ごとに眠り、起こされるのが遅れた時間をイベントループの遅れとして記録する"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        event_loop_lag.observe(max(0.0, time.perf_counter() - start - EVENT_LOOP_LAG_INTERVAL))
+
 # --- FastAPI App Lifecycle ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -364,6 +711,46 @@ async def lifespan(app: FastAPI):
         print("********* 実際の 'vibelogger' パッケージが見つかりました。使用します。")
     else:
         print("'********* vibelogger' パッケージが見つかりませんでした。モックロガーを使用します。")
+    print(f"********* JSON backend for broadcasts: {JSON_BACKEND}")
+
+    # 走査用のワーカープロセス（forkserver から作るので、このプロセスのソケットやイベントループは引き継がない）
+    scan_executor.start(SCAN_WORKERS)
+    print(f"********* Scan workers: {scan_executor.stats()['workers']}")
+
+    # Start the log writer thread
+    log_writer.start()
+
+    # 他のワーカープロセスから届いたイベントはこのプロセスの購読者へ配信する
+    await broadcast_bus.start(manager.receive, history)
+    print(f"********* Broadcast bus: {broadcast_bus.name}")
+
+    # プロジェクトカタログを構築（ファイル一覧は起動時に、エントリ数などはバックグラウンドで集計）
+    await asyncio.to_thread(catalog.rescan)
+    catalog_task = asyncio.create_task(maintain_catalog())
+
+    # 転置インデックスの読み込み・再構築と定期保存
+    index_task = asyncio.create_task(maintain_log_index()) if ENABLE_LOG_INDEX else None
+
+    # 時系列ロールアップの定期保存
+    rollup_task = asyncio.create_task(maintain_rollups()) if ENABLE_ROLLUPS else None
+
+    # 書き込みが終わったログファイルの圧縮
+    cold_storage_task = asyncio.create_task(maintain_cold_storage()) if ENABLE_COLD_STORAGE else None
+
+    # 列指向ファイルへの変換
+    columnar_task = asyncio.create_task(maintain_columnar()) if ENABLE_COLUMNAR else None
+
+    # 保持ポリシーの適用
+    retention_task = asyncio.create_task(enforce_retention()) if ENABLE_RETENTION else None
+
+    # 使われなくなったロガーの追い出し
+    logger_cache_task = asyncio.create_task(maintain_logger_cache())
+
+    # 集計の定期配信
+    metrics_task = asyncio.create_task(push_metrics())
+
+    # イベントループの遅れの計測
+    loop_monitor_task = asyncio.create_task(monitor_event_loop())
 
     # Start the background task
     log_task = None
@@ -380,7 +767,41 @@ async def lifespan(app: FastAPI):
         except asyncio.CancelledError:
             print("Log generation task cancelled.")
 
+    await broadcast_bus.stop()
+
+    # 未書き込みのログを書き出してからファイルを閉じる
+    await asyncio.to_thread(log_writer.stop)
+
+    catalog_task.cancel()
+    try:
+        await catalog_task
+    except asyncio.CancelledError:
+        pass
+
+    for task in (cold_storage_task, retention_task, logger_cache_task, metrics_task, rollup_task, columnar_task,
+                 loop_monitor_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    if index_task:
+        index_task.cancel()
+        try:
+            await index_task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.to_thread(log_index.save_all)
+
+    if ENABLE_ROLLUPS:
+        await asyncio.to_thread(rollups.save_all)
+
+    scan_executor.shutdown()
+
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(EndpointLatencyMiddleware, endpoints=INSTRUMENTED_ENDPOINTS, prefixes=INSTRUMENTED_PREFIXES)
 
 # --- API Endpoints ---
 PROJECT_DESCRIPTIONS = {
@@ -392,43 +813,201 @@ PROJECT_DESCRIPTIONS = {
     "default": "General application logs"
 }
 
+# カタログのバージョンごとにレスポンスを1回だけ組み立てる
+_projects_response_cache = {"etag": None, "body": b"[]"}
+
 @app.get("/api/projects")
-async def get_projects():
-    projects_data = []
-    if not LOG_DIR.exists():
-        return []
-        
-    for project_dir in LOG_DIR.iterdir():
-        if project_dir.is_dir():
-            files = [f.name for f in project_dir.glob("*.log")]
-            if files: # ファイルがあるプロジェクトのみ追加
-                projects_data.append({
-                    "name": project_dir.name,
-                    "description": PROJECT_DESCRIPTIONS.get(project_dir.name, PROJECT_DESCRIPTIONS["default"]),
-                    "files": files
-                })
-    return sorted(projects_data, key=lambda x: x['name'])
+async def get_projects(request: Request):
+    """
+    プロジェクト一覧とログファイル（ファイル名・サイズ・更新時刻・エントリ数・最初/最後のタイムスタンプ）を返す。
+    メモリ上のカタログから返すのでディレクトリは走査しない。If-None-Match が一致すれば 304 を返す。
+    """
+    etag = catalog.etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    if _projects_response_cache["etag"] != etag:
+        etag, projects = catalog.snapshot()
+        projects_data = [
+            {
+                "name": name,
+                "description": PROJECT_DESCRIPTIONS.get(name, PROJECT_DESCRIPTIONS["default"]),
+                "files": [file_info["name"] for file_info in files],
+                "file_details": files,
+            }
+            for name, files in projects
+        ]
+        _projects_response_cache["etag"] = etag
+        _projects_response_cache["body"] = dumps_bytes(projects_data)
+
+    return Response(
+        content=_projects_response_cache["body"],
+        media_type="application/json",
+        headers={"ETag": _projects_response_cache["etag"]},
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
 async def get_root():
     return await asyncio.to_thread(Path(FRONTEND_DIR / "index.html").read_text, encoding="utf-8")
 
+def validate_policy(policy: Optional[str]) -> Optional[str]:
+    """クエリパラメータで指定された遅延クライアント方針を検証する"""
+    if policy is not None and policy not in SLOW_CONSUMER_POLICIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"policy must be one of {', '.join(SLOW_CONSUMER_POLICIES)}."
+        )
+    return policy
+
+def parse_replay_request(since: Optional[str], last: Optional[int], last_event_id: Optional[str]) -> Optional[dict]:
+    """接続時のリプレイ指定（?since= / ?last= / Last-Event-ID）を EventHistory.replay() の引数に変換する"""
+    replay = {}
+    if last_event_id:
+        replay["after_id"] = int(last_event_id)
+    if since:
+        replay["since"] = normalize_timestamp(since)
+    if last is not None:
+        if last < 0:
+            raise ValueError("last must be non-negative.")
+        replay["last"] = last
+    return replay or None
+
+def parse_subscription_filter(project: Optional[str], min_level: Optional[str], operation: Optional[str],
+                              context: Optional[str]) -> Optional[SubscriptionFilter]:
+    """接続時のクエリパラメータから購読フィルタを作る。不正な値は ValueError"""
+    subscription = SubscriptionFilter(
+        projects=split_param(project),
+        min_level=min_level,
+        operations=split_param(operation),
+        context=parse_context_filter(context),
+    )
+    return None if subscription.is_empty else subscription
+
+def validate_metrics_mode(mode: Optional[str]) -> Optional[str]:
+    """?metrics=（on / only / off）を検証する。不正な値は ValueError"""
+    if mode is None or mode == "off":
+        return None
+    if mode not in METRICS_MODES:
+        raise ValueError(f"metrics must be one of {', '.join(METRICS_MODES)}, off")
+    return mode
+
+def handle_ws_control(subscriber, text: str):
+    """
+    WebSocket でクライアントから届いた制御メッセージを処理する。
+    {"type": "subscribe", "filter": {"projects": [...], "min_level": "ERROR", "operations": [...], "context": {...}}}
+    でフィルタを差し替え、{"type": "metrics", "mode": "on" | "only" | "off"} で集計の定期配信を、
+    {"type": "delivery", "batch_ms": 250, "batch_max": 500, "dedupe": true} で配信のまとめ方を切り替える。
+    結果（または error）は配信と同じ経路でクライアントへ返す。
+    """
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return  # ping などの制御メッセージ以外は無視する
+    if not isinstance(message, dict):
+        return
+    if message.get("type") == "delivery":
+        try:
+            options = CoalesceOptions.from_params(message.get("batch_ms"), message.get("batch_max"),
+                                                  bool(message.get("dedupe")))
+        except (TypeError, ValueError) as e:
+            subscriber.push(encode_event({"type": "error", "detail": str(e)}))
+            return
+        subscriber.coalesce = options
+        subscriber.push(encode_event({"type": "delivery", "options": options.to_dict() if options else None}))
+        return
+    if message.get("type") == "metrics":
+        try:
+            mode = validate_metrics_mode(message.get("mode") or METRICS_MODES[0])
+        except ValueError as e:
+            subscriber.push(encode_event({"type": "error", "detail": str(e)}))
+            return
+        manager.set_metrics(subscriber, mode)
+        subscriber.push(encode_event({"type": "metrics_mode", "mode": mode or "off"}))
+        return
+    if message.get("type") != "subscribe":
+        return
+    try:
+        subscription = SubscriptionFilter.from_dict(message.get("filter") or {})
+    except ValueError as e:
+        subscriber.push(encode_event({"type": "error", "detail": str(e)}))
+        return
+    manager.set_filter(subscriber, subscription)
+    subscriber.push(encode_event({"type": "subscribed", "filter": subscription.to_dict()}))
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect_ws(websocket)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    policy: Optional[str] = None,
+    since: Optional[str] = None,
+    last: Optional[int] = None,
+    last_event_id: Optional[str] = None,
+    project: Optional[str] = None,
+    min_level: Optional[str] = None,
+    operation: Optional[str] = None,
+    context: Optional[str] = None,
+    metrics: Optional[str] = None,
+    batch_ms: Optional[int] = None,
+    batch_max: Optional[int] = None,
+    dedupe: bool = False,
+):
+    if policy is not None and policy not in SLOW_CONSUMER_POLICIES:
+        await websocket.close(code=1008)  # Policy Violation
+        return
+    try:
+        replay = parse_replay_request(since, last, last_event_id)
+        subscription = parse_subscription_filter(project, min_level, operation, context)
+        metrics_mode = validate_metrics_mode(metrics)
+        coalesce = CoalesceOptions.from_params(batch_ms, batch_max, dedupe)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    # Sec-WebSocket-Protocol で vibelogger.v1.deflate を申し出たクライアントにはバイナリのフレームで送る
+    subprotocol = negotiate_wire_protocol(websocket.scope.get("subprotocols", []))
+    subscriber = await manager.connect_ws(websocket, policy=policy, replay=replay, filter=subscription,
+                                          metrics=metrics_mode, coalesce=coalesce, subprotocol=subprotocol)
     try:
         while True:
-            # Keep the connection alive
-            await websocket.receive_text()
+            # 購読フィルタの変更などの制御メッセージを受け付ける
+            handle_ws_control(subscriber, await websocket.receive_text())
     except WebSocketDisconnect:
         print("WebSocket client disconnected")
+    except RuntimeError:
+        # disconnect ポリシーでサーバー側から切断した場合
+        pass
     finally:
-        manager.disconnect_ws(websocket)
+        manager.disconnect_ws(subscriber)
 
 @app.get("/sse")
-async def sse_endpoint(request: Request):
-    queue = await manager.connect_sse()
+async def sse_endpoint(
+    request: Request,
+    policy: Optional[str] = None,
+    since: Optional[str] = None,
+    last: Optional[int] = None,
+    project: Optional[str] = None,
+    min_level: Optional[str] = None,
+    operation: Optional[str] = None,
+    context: Optional[str] = None,
+    metrics: Optional[str] = None,
+    batch_ms: Optional[int] = None,
+    batch_max: Optional[int] = None,
+    dedupe: bool = False,
+):
+    """
+    Server-Sent Events で配信する。各イベントには単調増加する `id:` が付くので、
+    再接続時にブラウザが送る Last-Event-ID ヘッダーの続きから履歴を再送する。
+    購読フィルタ（project / min_level / operation / context）・集計の定期配信（metrics）・
+    配信のまとめ方（batch_ms / batch_max / dedupe）は接続時のクエリパラメータで指定する。
+    """
+    try:
+        replay = parse_replay_request(since, last, request.headers.get("last-event-id"))
+        subscription = parse_subscription_filter(project, min_level, operation, context)
+        metrics_mode = validate_metrics_mode(metrics)
+        coalesce = CoalesceOptions.from_params(batch_ms, batch_max, dedupe)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    subscriber = await manager.connect_sse(policy=validate_policy(policy), replay=replay, filter=subscription,
+                                           metrics=metrics_mode, coalesce=coalesce)
     print("\033[92mINFO:\033[0m     SSE connection open")  # WebSocket接続を受け付けた際は自動的にログが出力されるようなので SSE の方にだけ print する
 
     async def event_generator():
@@ -437,17 +1016,73 @@ async def sse_endpoint(request: Request):
                 # Check if client is still connected
                 if await request.is_disconnected():
                     break
-                message = await queue.get()
-                yield f"data: {message}\n\n"
+                messages = await subscriber.next_frames()
+                if not messages:
+                    # disconnect ポリシーで切り離された
+                    break
+                # SSE フレームはイベントごとにエンコード済みなので連結するだけ
+                yield b"".join(message.sse for message in messages)
         except asyncio.CancelledError:
             print("SSE client disconnected")
         finally:
-            manager.disconnect_sse(queue)
+            manager.disconnect_sse(subscriber)
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+@app.get("/api/connections")
+async def get_connections():
+    """接続中クライアントごとの未送信数 (lag)・破棄数などの統計を返す"""
+    return {
+        "queue_size": manager.queue_size,
+        "policy": manager.policy,
+        "bus": broadcast_bus.stats(),
+        "history": history.stats(),
+        "subscribers": manager.stats(),
+    }
+
+@app.get("/api/metrics")
+async def get_metrics(
+    window: Optional[float] = None,
+    project: Optional[str] = None,
+    operation: Optional[str] = None,
+):
+    """
+    直近 window 秒（既定・上限は METRICS_WINDOW）の集計を (プロジェクト, オペレーション) ごとに返す。
+    件数・レベル別件数・毎秒の件数・エラー率と、context の数値フィールド（latency_ms など）の分位点 (p50/p90/p99)。
+    """
+    if window is not None and window <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="window must be positive.")
+    return metrics.snapshot(window=window, projects=split_param(project), operations=split_param(operation))
+
+@app.get("/api/loggers")
+async def get_loggers():
+    """ロガーキャッシュのヒット・ミス・追い出し回数と、開いているログファイル数を返す"""
+    return {
+        **loggers.stats(),
+        "open_files": log_writer.open_files,
+    }
+
+@app.get("/api/retention")
+async def get_retention():
+    """保持ポリシーと、これまでに削除したファイル数・回収したバイト数を返す"""
+    return {
+        "enabled": ENABLE_RETENTION,
+        "default_policy": vars(retention.default_policy),
+        "project_policies": {name: vars(policy) for name, policy in retention.project_policies.items()},
+        **retention.stats(),
+    }
+
+@app.get("/api/internal/metrics")
+async def get_internal_metrics():
+    """
+    サーバー自身の計測値を Prometheus のテキスト形式で返す（scrape_configs の metrics_path に指定する）。
+    イベントループの遅れ・エンドポイントごとの応答時間・ファンアウト時間・購読者ごとのキューの長さ・
+    ファイル書き込みの時間とバイト数・ロガーキャッシュの大きさ。値はこのワーカープロセスのもの。
+    """
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 # --- External Log Ingestion Endpoint ---
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 
 class IncomingLog(BaseModel):
@@ -459,6 +1094,10 @@ class IncomingLog(BaseModel):
     project: str = "external_project"
 
 
+# 1回の書き込みで使うキューの枠の見積もり（書き込み1つ + ロガーの取得で入りうる「ファイルを閉じる」指示1つ）
+QUEUE_ITEMS_PER_LOGGER = 2
+
+
 @app.post("/api/ingest")
 async def ingest_log(log: IncomingLog):
     """外部サービスから送信されたログを保存し、リアルタイム配信する"""
@@ -466,7 +1105,12 @@ async def ingest_log(log: IncomingLog):
 
     timestamp = log.timestamp or datetime.now(timezone.utc).isoformat()
 
+    # 拒否するリクエストではロガー（ディレクトリ・キャッシュのエントリ）を作らないよう、空きを先に確かめる。
+    # ロガーの取得はキャッシュからの追い出しなどでキューに「ファイルを閉じる」指示を1つ入れることがあるので、その分も見込む
+    if not log_writer.can_accept(QUEUE_ITEMS_PER_LOGGER):
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Log write queue is full.")
     vibe_logger = get_operation_logger(log.project, log.operation or "external")
+
     level_method = getattr(vibe_logger, log.level.lower(), vibe_logger.info)
     log_entry = level_method(
         operation=log.operation or "external",
@@ -474,20 +1118,119 @@ async def ingest_log(log: IncomingLog):
         context=log.context,
         human_note="Received via /api/ingest",
     )
+    if not enqueue_log_entries(vibe_logger, [log_entry]):
+        await write_log_entries(vibe_logger, [log_entry])
 
     log_dict = serialize_log_entry(log_entry) or {}
     log_dict.setdefault("timestamp", timestamp)
     log_dict.setdefault("project", log.project)
 
-    await manager.broadcast(json.dumps(log_dict, ensure_ascii=False))
+    await manager.broadcast(encode_event(log_dict))
 
     return {"status": "ok"}
 
 
-@app.get("/api/logs/{project_name}/{file_name}", response_class=PlainTextResponse)
-async def get_log_file(project_name: str, file_name: str):
+# 1リクエストで受け付ける最大エントリ数
+MAX_INGEST_BATCH_SIZE = 10000
+
+
+def parse_ingest_batch(body: bytes):
+    """JSON配列 / NDJSON のリクエストボディを検証し、(index, IncomingLog) と拒否リストに分ける"""
+    accepted = []
+    rejected = []
+
+    text = body.strip()
+    if text.startswith(b"["):
+        try:
+            items = json.loads(text)
+        except ValueError as e:
+            # JSONDecodeError に加え、UTF-8 として読めないボディ（UnicodeDecodeError）も 400 にする
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON array: {e}")
+        if len(items) > MAX_INGEST_BATCH_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                detail=f"Batch exceeds {MAX_INGEST_BATCH_SIZE} entries."
+            )
+        for index, item in enumerate(items):
+            try:
+                accepted.append((index, IncomingLog.model_validate(item)))
+            except ValidationError as e:
+                rejected.append({"index": index, "error": str(e)})
+    else:
+        # NDJSON: 空行は読み飛ばし、行番号（0始まり）を index として返す
+        lines = text.splitlines()
+        if len(lines) > MAX_INGEST_BATCH_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                detail=f"Batch exceeds {MAX_INGEST_BATCH_SIZE} entries."
+            )
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                accepted.append((index, IncomingLog.model_validate_json(line)))
+            except ValidationError as e:
+                rejected.append({"index": index, "error": str(e)})
+
+    return accepted, rejected
+
+
+@app.post("/api/ingest/batch")
+async def ingest_log_batch(request: Request):
+    """
+    JSON配列または NDJSON で送られた複数のログをまとめて保存し、1メッセージで配信する。
+    (project, operation) ごとにグループ化し、各グループは1回のファイル書き込みで追記する。
     """
-    指定されたログファイルの中身を読み込んで返す。
+    accepted, rejected = parse_ingest_batch(await request.body())
+
+    groups = {}
+    for _, log in accepted:
+        groups.setdefault((log.project, log.operation or "external"), []).append(log)
+
+    # グループ単位で書き込むため、全グループ分の空き（ロガーの取得で入る「ファイルを閉じる」指示を含む）がなければ
+    # ロガーを作る前にバッチ全体を拒否する
+    if not log_writer.can_accept(QUEUE_ITEMS_PER_LOGGER * len(groups)):
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Log write queue is full.")
+    group_loggers = {key: get_operation_logger(*key) for key in groups}
+
+    log_dicts = []
+    for (project, operation), logs in groups.items():
+        vibe_logger = group_loggers[(project, operation)]
+        entries = [
+            build_log_entry(
+                vibe_logger,
+                log.level,
+                operation=operation,
+                message=log.message,
+                context=log.context,
+                human_note="Received via /api/ingest/batch",
+            )
+            for log in logs
+        ]
+        if not enqueue_log_entries(vibe_logger, entries):
+            # 空きは確かめてあるが、受理と配信の前に必ずキューに入れる
+            await write_log_entries(vibe_logger, entries)
+
+        for entry in entries:
+            log_dict = serialize_log_entry(entry) or {}
+            log_dict.setdefault("project", project)
+            log_dicts.append(log_dict)
+
+    if log_dicts:
+        # バッチ全体を JSON 配列1つとして配信する
+        await manager.broadcast(encode_event(log_dicts))
+
+    return {
+        "status": "ok",
+        "accepted": len(accepted),
+        "rejected": len(rejected),
+        "errors": rejected,
+    }
+
+
+def resolve_log_path(project_name: str, file_name: str) -> Path:
+    """
+    プロジェクト名とファイル名から LOG_DIR 配下のログファイルのパスを求める。
     セキュリティのため、ディレクトリトラバーサル攻撃を防ぐチェックを行う。
     """
     # セキュリティ: 不正な文字が含まれていないかチェック
@@ -512,9 +1255,76 @@ async def get_log_file(project_name: str, file_name: str):
     if not resolved_path.is_file():
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Log file not found.")
 
+    return resolved_path
+
+
+@app.get("/api/logs/{project_name}/{file_name}", response_class=PlainTextResponse)
+async def get_log_file(
+    request: Request,
+    project_name: str,
+    file_name: str,
+    offset: Optional[int] = None,
+    limit: Optional[int] = None,
+    tail: Optional[int] = None,
+):
+    """
+    指定されたログファイルの中身をディスクからチャンク単位でストリーミングして返す。
+    - `offset` / `limit`: 行単位の範囲（0始まり）。疎な行インデックスで offset 付近までシークする
+    - `tail=N`: 末尾 N 行（ファイル末尾側だけを読む）
+    - `Range: bytes=...` ヘッダー: バイト範囲（206 Partial Content）
+    圧縮済み（.gz）のファイルは展開後の内容を返す。オフセットはすべて展開後の位置で、必要なブロックだけを展開する。
+    """
+    resolved_path = resolve_log_path(project_name, file_name)
+
+    if (offset is not None and offset < 0) or (limit is not None and limit < 0) or (tail is not None and tail < 0):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="offset, limit and tail must be non-negative.")
+    if tail is not None and (offset is not None or limit is not None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="tail cannot be combined with offset or limit.")
+
+    media_type = "text/plain; charset=utf-8"
     try:
-        content = await asyncio.to_thread(resolved_path.read_text, encoding="utf-8")
-        return PlainTextResponse(content=content)
+        size = await asyncio.to_thread(lambda: stat_log(resolved_path)[1])
+
+        if tail is not None:
+            start = await asyncio.to_thread(find_tail_offset, resolved_path, tail)
+            return StreamingResponse(iter_byte_range(resolved_path, start, size), media_type=media_type)
+
+        if offset is not None or limit is not None:
+            return StreamingResponse(
+                iter_lines_range(resolved_path, offset or 0, limit),
+                media_type=media_type,
+            )
+
+        range_header = request.headers.get("range")
+        if range_header:
+            try:
+                byte_range = parse_range_header(range_header, size)
+            except ValueError:
+                raise HTTPException(
+                    status_code=416,  # Range Not Satisfiable
+                    detail="Requested range not satisfiable.",
+                    headers={"Content-Range": f"bytes */{size}"},
+                )
+            if byte_range:
+                start, end = byte_range
+                return StreamingResponse(
+                    iter_byte_range(resolved_path, start, end),
+                    status_code=status.HTTP_206_PARTIAL_CONTENT,
+                    media_type=media_type,
+                    headers={
+                        "Content-Range": f"bytes {start}-{end - 1}/{size}",
+                        "Content-Length": str(end - start),
+                        "Accept-Ranges": "bytes",
+                    },
+                )
+
+        return StreamingResponse(
+            iter_byte_range(resolved_path, 0, size),
+            media_type=media_type,
+            headers={"Content-Length": str(size), "Accept-Ranges": "bytes"},
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -522,6 +1332,212 @@ async def get_log_file(project_name: str, file_name: str):
         )
 
 
+def split_param(value: Optional[str]) -> Optional[Set[str]]:
+    """カンマ区切りのクエリパラメータを集合に変換する"""
+    if not value:
+        return None
+    items = {item.strip() for item in value.split(",") if item.strip()}
+    return items or None
+
+
+def parse_context_filter(value: Optional[str]) -> Optional[dict]:
+    """`key=value,key2=value2` 形式の context フィルタを辞書に変換する"""
+    if not value:
+        return None
+    filters = {}
+    for item in value.split(","):
+        key, sep, item_value = item.partition("=")
+        if not sep or not key.strip():
+            raise ValueError(f"Invalid context filter: {item!r} (expected key=value)")
+        filters[key.strip()] = item_value.strip()
+    return filters
+
+
+# /api/search の1ページあたりの最大件数
+MAX_SEARCH_LIMIT = 1000
+
+
+@app.get("/api/search")
+async def search(
+    project: Optional[str] = None,
+    level: Optional[str] = None,
+    operation: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    q: Optional[str] = None,
+    regex: bool = False,
+    terms: Optional[str] = None,
+    context: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+):
+    """
+    保存済みのログファイルをサーバー側で検索し、一致した行を NDJSON でストリーミングする。
+    - `project` / `level` / `operation`: カンマ区切りで複数指定可
+    - `since` / `until`: ISO8601 の時刻範囲
+    - `q`: message と context に対する部分一致（大文字小文字を区別しない）。`regex=true` で正規表現
+    - `terms`: message に含まれる単語（スペース区切り、すべて含むものに一致）
+    - `context`: context の完全一致（`user=Alice,error_code=503` の形式）
+    level / operation / terms / context / 時刻範囲は転置インデックスで候補行を絞り込んでから読む
+    - 続きがある場合はレスポンスヘッダー `X-Next-Cursor` の値を `cursor` に渡す
+    """
+    if limit <= 0 or limit > MAX_SEARCH_LIMIT:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"limit must be between 1 and {MAX_SEARCH_LIMIT}.")
+    try:
+        query = SearchQuery(
+            projects=split_param(project),
+            levels=split_param(level),
+            operations=split_param(operation),
+            since=normalize_timestamp(since) if since else None,
+            until=normalize_timestamp(until) if until else None,
+            text=q,
+            regex=regex,
+            terms=terms.split() if terms else None,
+            context=parse_context_filter(context),
+        )
+        results, next_cursor = await search_logs(
+            LOG_DIR, query, limit, cursor, log_index if ENABLE_LOG_INDEX else None, scan_executor
+        )
+    except (ValueError, re.error) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
+    def ndjson_lines():
+        for log_dict in results:
+            yield dumps_bytes(log_dict) + b"\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson", headers=headers)
+
+
+@app.get("/api/timeseries")
+async def get_timeseries(
+    resolution: str = "minute",
+    project: Optional[str] = None,
+    operation: Optional[str] = None,
+    level: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """
+    分・時間単位のロールアップから時系列を返す（生のログは読まないので、バケット数に比例する時間で返る）。
+    - `resolution`: minute / hour
+    - `project` / `operation` / `level`: カンマ区切りで複数指定可（条件に合うものを足し合わせる）
+    - `since` / `until`: ISO8601 の時刻範囲（既定は minute なら直近 1 日、hour なら直近 7 日）
+    各バケットには件数・レベル別件数と、context の数値フィールドの count / min / max / mean / p50 / p90 / p99 が入る。
+    """
+    if not ENABLE_ROLLUPS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Rollups are disabled.")
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"resolution must be one of {', '.join(RESOLUTIONS)}.")
+    try:
+        result = await asyncio.to_thread(
+            rollups.query,
+            resolution,
+            normalize_timestamp(since) if since else None,
+            normalize_timestamp(until) if until else None,
+            split_param(project),
+            split_param(operation),
+            split_param(level),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return Response(content=dumps_bytes(result), media_type="application/json")
+
+
+def require_columnar():
+    if not ENABLE_COLUMNAR:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail="Columnar export requires pyarrow (uv pip install pyarrow).")
+
+
+EXPORT_MEDIA_TYPES = {
+    EXPORT_PARQUET: ("application/vnd.apache.parquet", "logs.parquet"),
+    EXPORT_ARROW: ("application/vnd.apache.arrow.stream", "logs.arrows"),
+}
+
+
+@app.get("/api/export")
+async def export_logs(
+    format: str = EXPORT_PARQUET,
+    project: Optional[str] = None,
+    level: Optional[str] = None,
+    operation: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    columns: Optional[str] = None,
+):
+    """
+    書き込みが終わったログ（Parquet に変換済みのもの）を列指向の形式でストリーミングする。
+    - `format`: parquet / arrow（Arrow IPC ストリーム）
+    - `project` / `level` / `operation`: カンマ区切りで複数指定可
+    - `since` / `until`: ISO8601 の時刻範囲
+    - `columns`: 出力する列（カンマ区切り。例: `timestamp,operation,context.latency_ms`）。既定はすべての列
+    必要な列だけを読み、level / operation / 時刻範囲に合わない行グループは読み飛ばす。
+    """
+    require_columnar()
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"format must be one of {', '.join(EXPORT_FORMATS)}.")
+    try:
+        chunks = await asyncio.to_thread(
+            columnar.export,
+            format,
+            projects=split_param(project),
+            levels=split_param(level),
+            operations=split_param(operation),
+            since=normalize_timestamp(since) if since else None,
+            until=normalize_timestamp(until) if until else None,
+            columns=[name.strip() for name in columns.split(",") if name.strip()] if columns else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    media_type, filename = EXPORT_MEDIA_TYPES[format]
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.get("/api/aggregate")
+async def aggregate_logs(
+    group_by: str = "project,operation",
+    fields: Optional[str] = None,
+    interval: Optional[str] = None,
+    project: Optional[str] = None,
+    level: Optional[str] = None,
+    operation: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """
+    Parquet に変換済みのログを列単位でまとめて集計する（数週間ぶんでも行ごとに JSON を読まない）。
+    - `group_by`: まとめる列（カンマ区切り。例: `project,operation,level`）。`interval` を指定すると時刻のバケット `bucket` も使える
+    - `fields`: 集計する数値列（例: `context.latency_ms`）。min / max / mean / sum / p50 / p90 / p99 を返す
+    - `interval`: minute / hour / day
+    - `project` / `level` / `operation` / `since` / `until`: /api/export と同じ絞り込み
+    """
+    require_columnar()
+    if interval is not None and interval not in BUCKET_UNITS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"interval must be one of {', '.join(BUCKET_UNITS)}.")
+    try:
+        result = await asyncio.to_thread(
+            columnar.aggregate,
+            group_by=[name.strip() for name in group_by.split(",") if name.strip()],
+            fields=[name.strip() for name in fields.split(",") if name.strip()] if fields else (),
+            interval=interval,
+            projects=split_param(project),
+            levels=split_param(level),
+            operations=split_param(operation),
+            since=normalize_timestamp(since) if since else None,
+            until=normalize_timestamp(until) if until else None,
+        )
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return Response(content=dumps_bytes({"rows": result, "columnar": columnar.stats()}),
+                    media_type="application/json")
+
+
 # --- Static Files (registered after all API routes) ---
 app.mount("/", StaticFiles(directory=FRONTEND_DIR), name="static")
 
@@ -531,19 +1547,44 @@ if __name__ == "__main__":
     
     # コマンドライン引数の解析
     parser = argparse.ArgumentParser(description="VibeCoding Logger Server")
-    parser.add_argument("mode", nargs="?", default="server", choices=["test", "server"], 
-                       help="Run mode: 'test' for log generation test, 'server' for FastAPI server")
+    parser.add_argument("mode", nargs="?", default="server", choices=["test", "server", "backfill-rollups", "convert-columnar"],
+                       help="Run mode: 'test' for log generation test, 'server' for FastAPI server, "
+                            "'backfill-rollups' to rebuild time-series rollups from existing log files, "
+                            "'convert-columnar' to convert finished log files to Parquet now")
     parser.add_argument("--no-dummy", action="store_true", 
                        help="Disable dummy log generation in server mode")
     parser.add_argument("--port", type=int, default=6702, help="Port to run the server on")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Number of worker processes (events are relayed between workers over a Unix socket bus)")
+    parser.add_argument("--scan-workers", type=int, default=None,
+                       help=f"Number of processes for full log scans (search, line index, backfill-rollups; "
+                            f"total across --workers; default {SCAN_WORKERS})")
     args = parser.parse_args()
     
     # ダミーログ生成フラグの設定
     if args.no_dummy:
         ENABLE_DUMMY_LOGS = False
         print("Dummy log generation is disabled.")
+
+    if args.scan_workers is not None:
+        SCAN_WORKERS = args.scan_workers
+        os.environ["VIBELOGGER_SCAN_WORKERS"] = str(args.scan_workers)
     
-    if args.mode == "test":
+    if args.mode == "backfill-rollups":
+        # 既存のログファイルから時系列ロールアップを作り直す（サーバーを止めてから実行する）
+        print(f"Rebuilding rollups from {LOG_DIR} with {SCAN_WORKERS} scan worker(s) ...")
+        scan_executor.start(SCAN_WORKERS)
+        lines = rollups.backfill(executor=scan_executor)
+        scan_executor.shutdown()
+        print(f"Rollups rebuilt from {lines} log lines into {rollups.rollup_dir}")
+    elif args.mode == "convert-columnar":
+        # 書き込みが終わったログファイルをすぐに Parquet へ変換する（min_age を待たない）
+        if not COLUMNAR_AVAILABLE:
+            sys.exit("convert-columnar requires pyarrow (uv pip install pyarrow)")
+        columnar.min_age = 0
+        converted = columnar.run_once()
+        print(f"Converted {converted} file(s) ({columnar.converted_rows} rows) into {columnar.columnar_dir}")
+    elif args.mode == "test":
         # テストモード：Colabのようにログを生成してテスト
         print("Running in test mode...")
         asyncio.run(test_logger())
@@ -556,7 +1597,22 @@ if __name__ == "__main__":
         # reload=True の場合はインポート文字列を渡し、
         # reload=False の場合は app オブジェクトを直接渡すことで、
         # --no-dummy フラグの状態を維持する
-        if ENABLE_DUMMY_LOGS:
+        if args.workers > 1:
+            # ワーカープロセスはモジュールを読み込み直すので、設定は環境変数で引き継ぐ
+            if not ENABLE_DUMMY_LOGS:
+                os.environ["VIBELOGGER_NO_DUMMY"] = "1"
+            os.environ.setdefault("VIBELOGGER_BROADCAST_BUS", BUS_UNIX)
+            os.environ.setdefault("VIBELOGGER_HISTORY", "shared")
+            # 走査用のワーカープロセスはワーカーごとに作るので、合計が SCAN_WORKERS を超えないよう分ける
+            os.environ["VIBELOGGER_SCAN_WORKERS"] = str(max(1, SCAN_WORKERS // args.workers))
+            print(f"Starting {args.workers} workers (broadcast bus: {os.environ['VIBELOGGER_BROADCAST_BUS']}).")
+            uvicorn.run(
+                "main:app",  # For workers, must use string
+                host="127.0.0.1",
+                port=args.port,
+                workers=args.workers,
+            )
+        elif ENABLE_DUMMY_LOGS:
             print("Dummy log generation is enabled. Starting with auto-reload.")
             uvicorn.run(
                 "main:app",  # For reload, must use string
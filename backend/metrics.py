@@ -0,0 +1,258 @@
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from encoding import EncodedEvent, log_project
+
+# エラー率に数えるレベル
+ERROR_LEVELS = ("ERROR", "CRITICAL")
+# 集計結果で返すパーセンタイル
+QUANTILES = (0.5, 0.9, 0.99)
+# 上限を超えた (プロジェクト, オペレーション) をまとめる名前
+OTHER_OPERATION = "_other"
+
+
+class DDSketch:
+    """
+    相対誤差 relative_accuracy 以内で分位点を返す DDSketch（正の値用。0 以下の値は zero_count に数える）。
+    値を対数のバケットに数えるだけなので、同じ精度のスケッチ同士は merge() でバケットを足し合わせられる。
+    """
+
+    __slots__ = ("relative_accuracy", "_gamma_log", "bins", "zero_count", "count", "sum", "min", "max")
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma_log = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._gamma_log)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other: "DDSketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return min(0.0, self.max)
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # バケット (gamma^(i-1), gamma^i] の代表値
+                value = 2 * math.exp(index * self._gamma_log) / (1 + math.exp(self._gamma_log))
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict:
+        if self.count == 0:
+            return {"count": 0}
+        result = {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count,
+        }
+        for q in QUANTILES:
+            result[f"p{round(q * 100)}"] = self.quantile(q)
+        return result
+
+    def to_dict(self) -> Dict:
+        """永続化用の状態（from_dict で復元して merge できる）"""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": {str(index): count for index, count in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DDSketch":
+        sketch = cls(data.get("relative_accuracy", 0.01))
+        sketch.bins = {int(index): count for index, count in data.get("bins", {}).items()}
+        sketch.zero_count = data.get("zero_count", 0)
+        sketch.count = data.get("count", 0)
+        sketch.sum = data.get("sum", 0.0)
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
+
+
+class _Slice:
+    """resolution 秒ぶんの集計（(プロジェクト, オペレーション, レベル) の件数と、数値フィールドのスケッチ）"""
+
+    __slots__ = ("start", "counts", "sketches")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.counts: Dict[Tuple[str, str, str], int] = {}
+        self.sketches: Dict[Tuple[str, str, str], DDSketch] = {}
+
+
+def numeric_fields(log: Dict, fields: Iterable[str]) -> List[Tuple[str, float]]:
+    """context から集計対象の数値フィールドを (名前, 値) で取り出す（bool は数値として扱わない）"""
+    context = log.get("context")
+    if not isinstance(context, dict):
+        return []
+    values = []
+    for field in fields:
+        value = context.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            values.append((field, float(value)))
+    return values
+
+
+class MetricsAggregator:
+    """
+    配信されるイベントをその場で集計するスライディングウィンドウ。
+    resolution 秒ごとのスライスを window 秒ぶん保持し、問い合わせ時に指定された幅のスライスだけを足し合わせる。
+
+    - (プロジェクト, オペレーション, レベル) ごとの件数
+    - (プロジェクト, オペレーション, フィールド) ごとの DDSketch（context の latency_ms / duration_ms などの数値）
+
+    ConnectionManager のリスナーとして登録すると、他のワーカーから届いたイベントも含めて1回ずつ on_event() が呼ばれる。
+    (プロジェクト, オペレーション) の組が max_keys を超えたら、以降の新しい組はオペレーション "_other" にまとめる。
+    """
+
+    def __init__(self, window: float = 300, resolution: float = 10,
+                 fields: Iterable[str] = ("latency_ms", "duration_ms"),
+                 relative_accuracy: float = 0.01, max_keys: int = 10000):
+        self.window = window
+        self.resolution = resolution
+        self.fields = tuple(fields)
+        self.relative_accuracy = relative_accuracy
+        self.max_keys = max_keys
+        self._slices: Deque[_Slice] = deque()
+        self._known_keys = set()
+
+        # 統計情報
+        self.events = 0
+
+    def _current_slice(self, now: float) -> _Slice:
+        start = now - now % self.resolution
+        slices = self._slices
+        if not slices or slices[-1].start < start:
+            slices.append(_Slice(start))
+            while slices and slices[0].start <= start - self.window:
+                slices.popleft()
+        return slices[-1]
+
+    def _operation_key(self, project: str, operation: str) -> str:
+        key = (project, operation)
+        if key not in self._known_keys:
+            if len(self._known_keys) >= self.max_keys:
+                return OTHER_OPERATION
+            self._known_keys.add(key)
+        return operation
+
+    def record(self, log: Dict, now: Optional[float] = None):
+        """ログ1件を集計する"""
+        current = self._current_slice(time.time() if now is None else now)
+        project = log_project(log)
+        operation = self._operation_key(project, str(log.get("operation") or ""))
+        level = str(log.get("level") or "").upper()
+        key = (project, operation, level)
+        current.counts[key] = current.counts.get(key, 0) + 1
+        for field, value in numeric_fields(log, self.fields):
+            sketch_key = (project, operation, field)
+            sketch = current.sketches.get(sketch_key)
+            if sketch is None:
+                sketch = current.sketches[sketch_key] = DDSketch(self.relative_accuracy)
+            sketch.add(value)
+        self.events += 1
+
+    def on_event(self, event: EncodedEvent):
+        """ConnectionManager からの通知（バッチは1件ずつ集計する）"""
+        if not event.keys:
+            return  # ログ以外のイベント
+        now = time.time()
+        for log in event.logs:
+            self.record(log, now)
+
+    def snapshot(self, window: Optional[float] = None, projects: Optional[Iterable[str]] = None,
+                 operations: Optional[Iterable[str]] = None, now: Optional[float] = None) -> Dict:
+        """
+        直近 window 秒（既定は保持している全期間）の集計を (プロジェクト, オペレーション) ごとに返す。
+        各行にはレベル別の件数・合計・毎秒の件数・エラー率と、数値フィールドごとの分位点が入る。
+        """
+        now = time.time() if now is None else now
+        window = min(window or self.window, self.window)
+        projects = set(projects) if projects else None
+        operations = set(operations) if operations else None
+        cutoff = now - window
+
+        counts: Dict[Tuple[str, str], Dict[str, int]] = {}
+        sketches: Dict[Tuple[str, str], Dict[str, DDSketch]] = {}
+        for current in self._slices:
+            if current.start + self.resolution <= cutoff:
+                continue
+            for (project, operation, level), count in current.counts.items():
+                if (projects is not None and project not in projects) or \
+                        (operations is not None and operation not in operations):
+                    continue
+                levels = counts.setdefault((project, operation), {})
+                levels[level] = levels.get(level, 0) + count
+            for (project, operation, field), sketch in current.sketches.items():
+                if (projects is not None and project not in projects) or \
+                        (operations is not None and operation not in operations):
+                    continue
+                merged = sketches.setdefault((project, operation), {}).get(field)
+                if merged is None:
+                    merged = sketches[(project, operation)][field] = DDSketch(self.relative_accuracy)
+                merged.merge(sketch)
+
+        series = []
+        for (project, operation), levels in sorted(counts.items()):
+            total = sum(levels.values())
+            errors = sum(levels.get(level, 0) for level in ERROR_LEVELS)
+            series.append({
+                "project": project,
+                "operation": operation,
+                "total": total,
+                "rate": total / window,
+                "error_rate": errors / total if total else 0.0,
+                "levels": levels,
+                "fields": {
+                    field: sketch.summary()
+                    for field, sketch in sorted(sketches.get((project, operation), {}).items())
+                },
+            })
+        return {"window": window, "resolution": self.resolution, "generated_at": now, "series": series}
+
+    def stats(self) -> Dict:
+        return {
+            "events": self.events,
+            "slices": len(self._slices),
+            "keys": len(self._known_keys),
+            "max_keys": self.max_keys,
+        }
@@ -0,0 +1,153 @@
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from log_writer import file_lock
+
+
+@dataclass
+class RetentionPolicy:
+    """プロジェクトごとの保持ポリシー（None の項目は無制限）"""
+    max_age_days: Optional[float] = None   # 最終更新からの日数
+    max_bytes: Optional[int] = None        # プロジェクト内のファイルの合計サイズ（ディスク上）
+    max_files: Optional[int] = None        # プロジェクト内のファイル数
+
+
+class RetentionManager:
+    """
+    LOG_DIR 配下のログファイルに保持ポリシーを適用し、古いファイルから削除（または archive_dir へ移動）する。
+    書き込み中のファイル（active）は対象外。削除（移動）できたファイルについて、add_listener() で登録したオブジェクトの
+    on_remove(paths) を1回の実行につき1度だけ呼ぶので、カタログなどはまとめて一度に更新できる。
+    削除に失敗したファイルは通知しないので、カタログや検索インデックスからも消えない。
+    """
+
+    def __init__(self, log_dir: Path, default_policy: Optional[RetentionPolicy] = None,
+                 project_policies: Optional[Dict[str, RetentionPolicy]] = None,
+                 archive_dir: Optional[Path] = None, file_pattern: str = "*.log*"):
+        self.log_dir = log_dir
+        self.default_policy = default_policy or RetentionPolicy()
+        self.project_policies = project_policies or {}
+        self.archive_dir = archive_dir
+        self.file_pattern = file_pattern
+        self._listeners: List = []
+
+        # 統計情報
+        self.removed_files = 0
+        self.reclaimed_bytes = 0
+        self.last_report: Optional[Dict] = None
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, paths: List[Path]):
+        for listener in self._listeners:
+            try:
+                listener.on_remove(paths)
+            except Exception as e:
+                print(f"RetentionManager listener error ({type(listener).__name__}.on_remove): {e}")
+
+    def policy_for(self, project: str) -> RetentionPolicy:
+        return self.project_policies.get(project, self.default_policy)
+
+    def _list_project_files(self, project_dir: Path) -> List[Tuple[Path, int, float]]:
+        files = []
+        for path in project_dir.glob(self.file_pattern):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((path, st.st_size, st.st_mtime))
+        # 古い順
+        files.sort(key=lambda item: (item[2], item[0].name))
+        return files
+
+    def select_expired(self, project: str, files: List[Tuple[Path, int, float]],
+                       active: Iterable[Path] = (), now: Optional[float] = None) -> List[Tuple[Path, int]]:
+        """ポリシーを超えているぶんのファイルを古い順に選ぶ（書き込み中のファイルは数えるが選ばない）"""
+        policy = self.policy_for(project)
+        active_files = set(active)
+        now = time.time() if now is None else now
+        total_bytes = sum(size for _, size, _ in files)
+        total_files = len(files)
+        selected = []
+        for path, size, mtime in files:
+            if path.resolve() in active_files:
+                continue
+            expired = policy.max_age_days is not None and now - mtime > policy.max_age_days * 86400
+            over_bytes = policy.max_bytes is not None and total_bytes > policy.max_bytes
+            over_count = policy.max_files is not None and total_files > policy.max_files
+            if not (expired or over_bytes or over_count):
+                # 古い順に見ているので、これ以降のファイルも上限を超えない
+                break
+            selected.append((path, size))
+            total_bytes -= size
+            total_files -= 1
+        return selected
+
+    def _dispose(self, path: Path):
+        """
+        ファイルを削除（移動）する。active に無い他のワーカーのライターが書き込み中でもよいよう、ライターと同じ
+        ファイルロックの下で行う（ロックを待っていたライターは同じパスに新しいファイルを作って書く）
+        """
+        with open(path, "rb") as f, file_lock(f.fileno()):
+            if self.archive_dir is None:
+                path.unlink(missing_ok=True)
+                return
+            target_dir = self.archive_dir / path.parent.name
+            target_dir.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(path), str(target_dir / path.name))
+
+    def run_once(self, active: Iterable[Path] = ()) -> Dict:
+        """
+        すべてのプロジェクトにポリシーを適用する（ブロッキング）。
+        戻り値は {"files": 削除数, "bytes": 回収したバイト数, "projects": {プロジェクト: {...}}}。
+        """
+        active_files = {Path(path).resolve() for path in active}
+        now = time.time()
+        victims: List[Tuple[str, Path, int]] = []
+        if self.log_dir.exists():
+            for project_dir in sorted(self.log_dir.iterdir()):
+                if not project_dir.is_dir() or project_dir.name.startswith("."):
+                    continue
+                files = self._list_project_files(project_dir)
+                for path, size in self.select_expired(project_dir.name, files, active_files, now):
+                    victims.append((project_dir.name, path, size))
+
+        report = {"files": 0, "bytes": 0, "projects": {}}
+        removed: List[Path] = []
+        for project, path, size in victims:
+            try:
+                self._dispose(path)
+            except FileNotFoundError:
+                # 他のワーカーが先に消した。参照は外しておく
+                removed.append(path)
+                continue
+            except OSError as e:
+                print(f"RetentionManager: failed to remove {path}: {e}")
+                continue
+            removed.append(path)
+            project_report = report["projects"].setdefault(project, {"files": 0, "bytes": 0})
+            project_report["files"] += 1
+            project_report["bytes"] += size
+            report["files"] += 1
+            report["bytes"] += size
+        if removed:
+            # 実際に消えたファイルの参照だけをまとめて外す
+            self._notify(removed)
+
+        self.removed_files += report["files"]
+        self.reclaimed_bytes += report["bytes"]
+        report["finished_at"] = now
+        self.last_report = report
+        return report
+
+    def stats(self) -> Dict:
+        return {
+            "removed_files": self.removed_files,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "archive_dir": str(self.archive_dir) if self.archive_dir else None,
+            "last_report": self.last_report,
+        }
+
@@ -0,0 +1,347 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import DDSketch, numeric_fields
+from scan_executor import RangeReader, ScanExecutor, ScanRange, split_ranges
+
+# 複数プロセスが同じロールアップファイルへ書き足す場合の排他には fcntl.flock を使う（POSIX のみ）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+ROLLUP_VERSION = 1
+# ロールアップは LOG_DIR/.rollups/<project>/<resolution>/<YYYY-mm-dd>.json に1日ぶんずつ保存する
+ROLLUP_DIR_NAME = ".rollups"
+# バケットの粒度 -> ISO8601 のタイムスタンプの先頭何文字か
+RESOLUTIONS = {
+    "minute": 16,  # 2025-07-11T08:44
+    "hour": 13,    # 2025-07-11T08
+}
+
+
+class RollupBucket:
+    """1つのバケット・(オペレーション, レベル) の件数と、数値フィールドごとのスケッチ（sum / min / max を含む）"""
+
+    __slots__ = ("count", "fields")
+
+    def __init__(self):
+        self.count = 0
+        self.fields: Dict[str, DDSketch] = {}
+
+    def add(self, values: List[Tuple[str, float]], relative_accuracy: float):
+        self.count += 1
+        for field, value in values:
+            sketch = self.fields.get(field)
+            if sketch is None:
+                sketch = self.fields[field] = DDSketch(relative_accuracy)
+            sketch.add(value)
+
+    def merge(self, other: "RollupBucket"):
+        self.count += other.count
+        for field, sketch in other.fields.items():
+            mine = self.fields.get(field)
+            if mine is None:
+                mine = self.fields[field] = DDSketch(sketch.relative_accuracy)
+            mine.merge(sketch)
+
+    def to_dict(self) -> Dict:
+        return {"count": self.count, "fields": {field: sketch.to_dict() for field, sketch in self.fields.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RollupBucket":
+        bucket = cls()
+        bucket.count = data.get("count", 0)
+        bucket.fields = {field: DDSketch.from_dict(sketch) for field, sketch in data.get("fields", {}).items()}
+        return bucket
+
+
+# バケット -> オペレーション -> レベル -> RollupBucket
+DayRollup = Dict[str, Dict[str, Dict[str, RollupBucket]]]
+
+
+def _merge_day(target: DayRollup, source: DayRollup):
+    for bucket, operations in source.items():
+        target_operations = target.setdefault(bucket, {})
+        for operation, levels in operations.items():
+            target_levels = target_operations.setdefault(operation, {})
+            for level, rollup in levels.items():
+                mine = target_levels.get(level)
+                if mine is None:
+                    mine = target_levels[level] = RollupBucket()
+                mine.merge(rollup)
+
+
+def _day_to_dict(day: DayRollup) -> Dict:
+    return {
+        "version": ROLLUP_VERSION,
+        "buckets": {
+            bucket: {
+                operation: {level: rollup.to_dict() for level, rollup in levels.items()}
+                for operation, levels in operations.items()
+            }
+            for bucket, operations in day.items()
+        },
+    }
+
+
+def _day_from_dict(data: Dict) -> DayRollup:
+    if data.get("version") != ROLLUP_VERSION:
+        raise ValueError(f"unsupported rollup version: {data.get('version')}")
+    return {
+        bucket: {
+            operation: {level: RollupBucket.from_dict(rollup) for level, rollup in levels.items()}
+            for operation, levels in operations.items()
+        }
+        for bucket, operations in data.get("buckets", {}).items()
+    }
+
+
+def _backfill_range(fields: Tuple[str, ...], relative_accuracy: float,
+                    scan_range: ScanRange) -> Tuple[Dict[Tuple[str, str, str], DayRollup], int]:
+    """ScanExecutor のワーカーで1つの ScanRange を集計し、(差分, 集計した行数) を返す"""
+    store = RollupStore(scan_range.path.parent.parent, fields=fields, relative_accuracy=relative_accuracy)
+    pending: Dict[Tuple[str, str, str], DayRollup] = {}
+    count = 0
+    reader = RangeReader(scan_range)
+    try:
+        for _, block in reader:
+            count += store._add_lines(pending, scan_range.project, block)
+        count += store._add_lines(pending, scan_range.project, reader.tail)
+    except Exception as e:
+        print(f"RollupStore: failed to read {scan_range.path}: {e}")
+    return pending, count
+
+
+class RollupStore:
+    """
+    ログを分・時間単位のバケットにまとめた時系列のロールアップ。
+    (プロジェクト, オペレーション, レベル) ごとに件数と、context の数値フィールドのスケッチ（件数・合計・最小・最大・分位点）を持つ。
+
+    - LogWriter のリスナーとして書き込みのたびにライタースレッドで差分を積み、save_all() でファイルへ足し込む
+      （ファイルロックの下で「読み込み・加算・書き戻し」するので、複数のワーカープロセスが同じ日のファイルに書いても数が合う）
+    - query() は日ごとのファイルと未保存の差分を足し合わせて、範囲内のバケットだけを返す（生のログは読まない）
+    - backfill() は既存のログファイル（圧縮済みを含む）からロールアップを作り直す
+    """
+
+    def __init__(self, log_dir: Path, fields: Iterable[str] = ("latency_ms", "duration_ms"),
+                 relative_accuracy: float = 0.01):
+        self.log_dir = Path(log_dir)
+        self.rollup_dir = self.log_dir / ROLLUP_DIR_NAME
+        self.fields = tuple(fields)
+        self.relative_accuracy = relative_accuracy
+        self._pending: Dict[Tuple[str, str, str], DayRollup] = {}
+        self._lock = threading.Lock()
+        self._cache: Dict[Path, Tuple[float, DayRollup]] = {}
+
+        # 統計情報
+        self.lines = 0
+        self.saved_files = 0
+
+    def _path(self, project: str, resolution: str, day: str) -> Path:
+        return self.rollup_dir / project / resolution / f"{day}.json"
+
+    # --- Building ---
+    def _add_log(self, pending: Dict[Tuple[str, str, str], DayRollup], project: str, log: Dict):
+        timestamp = log.get("timestamp")
+        if not isinstance(timestamp, str) or len(timestamp) < RESOLUTIONS["minute"]:
+            return
+        operation = str(log.get("operation") or "")
+        level = str(log.get("level") or "").upper()
+        values = numeric_fields(log, self.fields)
+        day = timestamp[:10]
+        for resolution, chars in RESOLUTIONS.items():
+            buckets = pending.setdefault((project, resolution, day), {})
+            levels = buckets.setdefault(timestamp[:chars], {}).setdefault(operation, {})
+            rollup = levels.get(level)
+            if rollup is None:
+                rollup = levels[level] = RollupBucket()
+            rollup.add(values, self.relative_accuracy)
+
+    def _add_lines(self, pending: Dict[Tuple[str, str, str], DayRollup], project: str, data: bytes) -> int:
+        count = 0
+        for raw_line in data.splitlines():
+            try:
+                log = json.loads(raw_line)
+            except ValueError:
+                continue
+            if isinstance(log, dict):
+                self._add_log(pending, project, log)
+                count += 1
+        return count
+
+    def on_write(self, path: Path, offset: int, data: bytes):
+        """LogWriter からの通知（ライタースレッド）。書き込まれた行を差分に積む"""
+        pending: Dict[Tuple[str, str, str], DayRollup] = {}
+        count = self._add_lines(pending, Path(path).parent.name, data)
+        with self._lock:
+            for key, day in pending.items():
+                _merge_day(self._pending.setdefault(key, {}), day)
+            self.lines += count
+
+    # --- Persistence ---
+    def _read(self, path: Path) -> DayRollup:
+        """日ごとのファイルを読む（更新時刻が変わっていなければキャッシュを返す）"""
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return {}
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            day = _day_from_dict(json.loads(path.read_bytes()))
+        except (ValueError, KeyError) as e:
+            print(f"RollupStore: ignoring broken rollup {path}: {e}")
+            day = {}
+        self._cache[path] = (mtime, day)
+        return day
+
+    def _add_to_file(self, path: Path, delta: DayRollup):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.with_name(path.name + ".lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                self._cache.pop(path, None)
+                day: DayRollup = {}
+                _merge_day(day, self._read(path))
+                _merge_day(day, delta)
+                tmp_path = path.with_name(path.name + ".tmp")
+                tmp_path.write_text(json.dumps(_day_to_dict(day), separators=(",", ":")), encoding="utf-8")
+                os.replace(tmp_path, path)
+                self._cache.pop(path, None)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def save_all(self):
+        """未保存の差分をファイルへ足し込む"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for (project, resolution, day), delta in pending.items():
+            path = self._path(project, resolution, day)
+            try:
+                self._add_to_file(path, delta)
+                self.saved_files += 1
+            except Exception as e:
+                print(f"RollupStore: failed to save {path}: {e}")
+                # 次の保存で再試行する
+                with self._lock:
+                    _merge_day(self._pending.setdefault((project, resolution, day), {}), delta)
+
+    def backfill(self, projects: Optional[Iterable[str]] = None, executor: Optional[ScanExecutor] = None) -> int:
+        """
+        LOG_DIR のログファイル（ローテーション済み・圧縮済みを含む）からロールアップを作り直し、集計した行数を返す。
+        既存のロールアップは置き換えるので、サーバーを止めてから実行する。
+        executor を渡すと、ファイルを ScanRange に分けてワーカープロセスで部分集計し、結果を足し合わせる。
+        """
+        projects = set(projects) if projects else None
+        project_names = []
+        files = []
+        for project_dir in sorted(self.log_dir.iterdir()):
+            if not project_dir.is_dir() or project_dir.name.startswith("."):
+                continue
+            if projects is not None and project_dir.name not in projects:
+                continue
+            project_names.append(project_dir.name)
+            files.extend((project_dir.name, path) for path in sorted(project_dir.glob("*.log*")) if path.is_file())
+
+        executor = executor or ScanExecutor()
+        tasks = [(self.fields, self.relative_accuracy, scan_range)
+                 for scan_range in split_ranges(files, executor.range_size)]
+        total = 0
+        pending: Dict[Tuple[str, str, str], DayRollup] = {}
+        for partial, count in executor.imap(_backfill_range, tasks):
+            for key, day in partial.items():
+                _merge_day(pending.setdefault(key, {}), day)
+            total += count
+
+        for project in project_names:
+            for old in (self.rollup_dir / project).glob("*/*.json"):
+                old.unlink()
+        for (project, resolution, day), rollup in pending.items():
+            self._add_to_file(self._path(project, resolution, day), rollup)
+        return total
+
+    # --- Query ---
+    def projects(self) -> List[str]:
+        """ロールアップのあるプロジェクト（未保存の差分だけのものを含む）"""
+        with self._lock:
+            names = {project for project, _, _ in self._pending}
+        if self.rollup_dir.exists():
+            names.update(path.name for path in self.rollup_dir.iterdir() if path.is_dir())
+        return sorted(names)
+
+    def _days(self, since: str, until: str) -> Iterator[str]:
+        day = datetime.fromisoformat(since[:10])
+        last = datetime.fromisoformat(until[:10])
+        while day <= last:
+            yield day.strftime("%Y-%m-%d")
+            day += timedelta(days=1)
+
+    def query(self, resolution: str = "minute", since: Optional[str] = None, until: Optional[str] = None,
+              projects: Optional[Iterable[str]] = None, operations: Optional[Iterable[str]] = None,
+              levels: Optional[Iterable[str]] = None) -> Dict:
+        """
+        [since, until] の範囲のバケットを古い順に返す（since / until は UTC の isoformat）。
+        条件に合う (プロジェクト, オペレーション, レベル) を足し合わせ、バケットごとに件数・レベル別件数と
+        数値フィールドの count / min / max / mean / p50 / p90 / p99 を返す。
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+        chars = RESOLUTIONS[resolution]
+        now = datetime.now(timezone.utc)
+        until = until or now.isoformat()
+        since = since or (now - (timedelta(days=1) if resolution == "minute" else timedelta(days=7))).isoformat()
+        operations = set(operations) if operations else None
+        levels = {level.upper() for level in levels} if levels else None
+        first, last = since[:chars], until[:chars]
+
+        merged: Dict[str, RollupBucket] = {}
+        level_counts: Dict[str, Dict[str, int]] = {}
+        for project in sorted(set(projects) if projects else self.projects()):
+            for day in self._days(since, until):
+                sources = [self._read(self._path(project, resolution, day))]
+                with self._lock:
+                    pending = self._pending.get((project, resolution, day))
+                    if pending:
+                        copy: DayRollup = {}
+                        _merge_day(copy, pending)
+                        sources.append(copy)
+                for source in sources:
+                    for bucket, bucket_operations in source.items():
+                        if bucket < first or bucket > last:
+                            continue
+                        for operation, bucket_levels in bucket_operations.items():
+                            if operations is not None and operation not in operations:
+                                continue
+                            for level, rollup in bucket_levels.items():
+                                if levels is not None and level not in levels:
+                                    continue
+                                target = merged.get(bucket)
+                                if target is None:
+                                    target = merged[bucket] = RollupBucket()
+                                target.merge(rollup)
+                                counts = level_counts.setdefault(bucket, {})
+                                counts[level] = counts.get(level, 0) + rollup.count
+
+        points = [
+            {
+                "bucket": bucket,
+                "count": merged[bucket].count,
+                "levels": level_counts[bucket],
+                "fields": {field: sketch.summary() for field, sketch in sorted(merged[bucket].fields.items())},
+            }
+            for bucket in sorted(merged)
+        ]
+        return {"resolution": resolution, "since": since, "until": until, "points": points}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {"lines": self.lines, "pending_files": pending, "saved_files": self.saved_files}
@@ -0,0 +1,252 @@
+import itertools
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from cold_storage import open_log, stat_log
+
+# 1つの範囲として1つのワーカーに渡すバイト数（ファイルはこの大きさごとに分け、境界は改行に揃える）
+RANGE_SIZE = 32 * 1024 * 1024
+# 範囲を読むときに1回で読み込むバイト数
+SCAN_CHUNK_SIZE = 1024 * 1024
+# ワーカーを作る forkserver に読み込んでおくモジュール（ワーカーで実行する関数の定義元）
+FORKSERVER_PRELOAD = ["scan_executor", "log_reader", "search", "rollups"]
+
+
+class ScanRange(NamedTuple):
+    """1ファイルのバイト範囲 [start, end)（展開後のオフセット）。範囲内で始まる行をその範囲のものとして扱う"""
+    project: str
+    path: Path
+    start: int
+    end: int
+
+
+def split_ranges(files: Iterable[Tuple[str, Path]], range_size: int = RANGE_SIZE,
+                 starts: Optional[dict] = None) -> List[ScanRange]:
+    """
+    (プロジェクト, パス) の並びを range_size ごとの ScanRange に分ける（ファイル順・オフセット順）。
+    starts に {パス: 開始オフセット} を渡すと、そのファイルは途中から分ける。
+    """
+    ranges = []
+    for project, path in files:
+        try:
+            size = stat_log(path)[1]
+        except FileNotFoundError:
+            continue
+        start = (starts or {}).get(path, 0)
+        while start < size:
+            end = min(start + range_size, size)
+            ranges.append(ScanRange(project, path, start, end))
+            start = end
+    return ranges
+
+
+class RangeReader:
+    """
+    ScanRange の中で始まる行を、改行で終わるブロックごとに (ブロック先頭のオフセット, バイト列) で返す。
+    範囲の先頭が行の途中なら次の行から読み、範囲の末尾をまたぐ行は最後まで読む（隣の範囲とは重複も欠落もしない）。
+    改行で終わっていない（書き込み途中の）ファイル末尾の行は返さず、tail に残す。
+    読み終えた後の position は、次に読むべき行の先頭（範囲の末尾を改行に揃えた位置）。
+    """
+
+    def __init__(self, scan_range: ScanRange, chunk_size: int = SCAN_CHUNK_SIZE):
+        self.range = scan_range
+        self.chunk_size = chunk_size
+        self.position = scan_range.start
+        self.finished = False  # ファイル末尾まで読んだか
+        self.tail = b""        # ファイル末尾の改行で終わっていない行
+
+    def __iter__(self) -> Iterator[Tuple[int, bytes]]:
+        start, end = self.range.start, self.range.end
+        try:
+            with open_log(self.range.path) as f:
+                buffer = b""
+                if start > 0:
+                    # start - 1 バイト目を含む行は前の範囲のもの
+                    f.seek(start - 1)
+                    skipped = 0
+                    while True:
+                        chunk = f.read(self.chunk_size)
+                        if not chunk:
+                            self.position = start - 1 + skipped
+                            self.finished = True
+                            return
+                        newline = chunk.find(b"\n")
+                        if newline >= 0:
+                            self.position = start - 1 + skipped + newline + 1
+                            buffer = chunk[newline + 1:]
+                            break
+                        skipped += len(chunk)
+
+                while self.position < end:
+                    chunk = f.read(self.chunk_size)
+                    buffer += chunk
+                    limit = end - self.position
+                    if len(buffer) >= limit:
+                        # 範囲の末尾をまたぐ行の改行まで
+                        cut = buffer.find(b"\n", limit - 1) + 1
+                        if cut:
+                            yield self.position, buffer[:cut]
+                            self.position += cut
+                            # 範囲の末尾がちょうどファイル末尾（最後のファイルの最後の範囲）なら、末尾まで読んだことになる
+                            self.finished = cut == len(buffer) and not f.read(1)
+                            return
+                    if not chunk:
+                        # ファイル末尾。改行で終わる行までを返し、残りは tail に置く
+                        cut = buffer.rfind(b"\n") + 1
+                        if cut:
+                            yield self.position, buffer[:cut]
+                            self.position += cut
+                        self.finished = True
+                        self.tail = buffer[cut:]
+                        return
+                    if len(buffer) < limit:
+                        cut = buffer.rfind(b"\n") + 1
+                        if cut:
+                            yield self.position, buffer[:cut]
+                            self.position += cut
+                            buffer = buffer[cut:]
+                # 範囲内で始まる行が無かった（前の範囲の行が範囲の末尾までまたいでいた）
+                self.finished = not buffer and not f.read(1)
+        except FileNotFoundError:
+            self.finished = True
+
+
+def _run(function: Callable, args: Tuple) -> Any:
+    return function(*args)
+
+
+class ScanExecutor:
+    """
+    ログファイルの走査（JSON のデコードと条件判定・部分集計）を複数のプロセスで並行に行う実行器。
+    ファイルを ScanRange に分けて ProcessPoolExecutor の各ワーカーに渡し、結果は範囲の順に返す。
+
+    - imap() は先頭から window 個ずつだけ投入し、呼び出し側が途中でやめる（件数の上限に達した）と残りを取り消す
+    - ワーカーは forkserver（無ければ spawn）で作る。サーバーのプロセスを fork しないので、待ち受けソケットや
+      イベントループ・スレッドの状態を引き継がず、lifespan の中からでも start() できる
+    - workers が 1 以下なら同じ処理をこのプロセスで順に実行する
+    """
+
+    def __init__(self, workers: int = 0, range_size: int = RANGE_SIZE):
+        self.workers = workers
+        self.range_size = range_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+        # 統計情報
+        self.tasks = 0
+        self.cancelled = 0
+
+    @property
+    def parallel(self) -> bool:
+        return self._pool is not None
+
+    def start(self, workers: Optional[int] = None):
+        """ワーカープロセスを作り、起動にかかる時間を最初の検索で払わないよう全ワーカーの起動を待つ"""
+        if workers is not None:
+            self.workers = workers
+        if self._pool is not None or self.workers <= 1:
+            return
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            # 既定ではメインモジュール（main.py）まで読み込むので、ワーカーで使うモジュールだけにする
+            context.set_forkserver_preload(FORKSERVER_PRELOAD)
+        else:
+            context = multiprocessing.get_context("spawn")
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        for future in [self._pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def imap(self, function: Callable, args_list: Iterable[Tuple], window: Optional[int] = None) -> Iterator[Any]:
+        """function(*args) の結果を args_list の順に返す。同時に投入するのは window 個（既定はワーカー数の2倍）まで"""
+        if self._pool is None:
+            for args in args_list:
+                self.tasks += 1
+                yield function(*args)
+            return
+
+        window = window or self.workers * 2
+        args_iter = iter(args_list)
+        pending: Deque[Future] = deque(
+            self._pool.submit(_run, function, args) for args in itertools.islice(args_iter, window)
+        )
+        try:
+            while pending:
+                result = pending.popleft().result()
+                self.tasks += 1
+                for args in itertools.islice(args_iter, 1):
+                    pending.append(self._pool.submit(_run, function, args))
+                yield result
+        finally:
+            for future in pending:
+                if future.cancel():
+                    self.cancelled += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers if self.parallel else 1,
+            "parallel": self.parallel,
+            "range_size": self.range_size,
+            "tasks": self.tasks,
+            "cancelled": self.cancelled,
+        }
+
+
+# サーバー全体で共有する実行器（main.py が起動時に start() する）
+scan_executor = ScanExecutor()
+
+
+# --- Line counting (LineIndex) ---
+def count_newlines(path: Path, start: int, end: int) -> Tuple[int, int]:
+    """[start, end) の改行の数と、最後の改行の直後のオフセット（改行が無ければ -1）を返す"""
+    count = 0
+    last = -1
+    with open_log(path) as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            chunk = f.read(min(SCAN_CHUNK_SIZE, end - position))
+            if not chunk:
+                break
+            newlines = chunk.count(b"\n")
+            if newlines:
+                count += newlines
+                last = position + chunk.rfind(b"\n") + 1
+            position += len(chunk)
+    return count, last
+
+
+def find_checkpoints(path: Path, start: int, end: int, lines_before: int, interval: int) -> List[int]:
+    """
+    [start, end) の中で、ファイル先頭から数えて interval の倍数番目の行が始まるオフセットを返す。
+    lines_before は start より前にある改行の数。
+    """
+    checkpoints = []
+    next_checkpoint = (lines_before // interval + 1) * interval
+    lines = lines_before
+    with open_log(path) as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            chunk = f.read(min(SCAN_CHUNK_SIZE, end - position))
+            if not chunk:
+                break
+            remaining = chunk.count(b"\n")
+            index = 0
+            while lines + remaining >= next_checkpoint:
+                for _ in range(next_checkpoint - lines):
+                    index = chunk.index(b"\n", index) + 1
+                remaining -= next_checkpoint - lines
+                lines = next_checkpoint
+                checkpoints.append(position + index)
+                next_checkpoint += interval
+            lines += remaining
+            position += len(chunk)
+    return checkpoints
@@ -0,0 +1,360 @@
+import asyncio
+import base64
+import json
+import re
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from log_index import (INDEXED_CONTEXT_KEYS, LogIndex, FileIndex, context_term, level_term,
+                       operation_term, tokenize, word_term)
+from cold_storage import COMPRESSED_SUFFIX, open_log, read_at
+from log_reader import READ_CHUNK_SIZE
+from scan_executor import RangeReader, ScanExecutor, ScanRange, split_ranges
+
+# 1回の検索で並行して走査するファイル数
+SEARCH_WORKERS = 4
+# 1ページを作るために走査する最大バイト数（超えた場合は途中までの結果とカーソルを返す）
+MAX_SCAN_BYTES = 64 * 1024 * 1024
+
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="log-search")
+
+
+def normalize_timestamp(value: str) -> str:
+    """
+    クエリで指定された時刻を、ログと同じ UTC の isoformat 文字列に揃える。
+    ログの timestamp は UTC の isoformat なので、文字列比較で範囲判定できる。
+    """
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+
+@dataclass
+class SearchQuery:
+    projects: Optional[Set[str]] = None
+    levels: Optional[Set[str]] = None
+    operations: Optional[Set[str]] = None
+    since: Optional[str] = None
+    until: Optional[str] = None
+    text: Optional[str] = None
+    regex: bool = False
+    terms: Optional[List[str]] = None           # message の単語（すべて含む行に一致）
+    context: Optional[Dict[str, str]] = None    # context の key=value 完全一致
+    _pattern: Optional[re.Pattern] = field(default=None, repr=False)
+    _raw_needle: Optional[bytes] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.levels:
+            self.levels = {level.upper() for level in self.levels}
+        if self.terms:
+            self.terms = [token for term in self.terms for token in tokenize(term)]
+        if self.text:
+            if self.regex:
+                self._pattern = re.compile(self.text, re.IGNORECASE)
+            else:
+                self.text = self.text.lower()
+                # JSON エスケープされない文字だけなら、デコード前に生の行で絞り込める
+                if self.text.isascii() and not re.search(r'["\\\x00-\x1f]', self.text):
+                    self._raw_needle = self.text.encode("utf-8")
+
+    def prefilter(self, raw_line: bytes) -> bool:
+        """JSON デコード前に、明らかに一致しない行を安く除外する"""
+        return self._raw_needle is None or self._raw_needle in raw_line.lower()
+
+    def matches(self, log: Dict) -> bool:
+        if self.levels and str(log.get("level", "")).upper() not in self.levels:
+            return False
+        if self.operations and log.get("operation") not in self.operations:
+            return False
+        timestamp = log.get("timestamp") or ""
+        if self.since and timestamp < self.since:
+            return False
+        if self.until and timestamp > self.until:
+            return False
+        if self.terms:
+            words = set(tokenize(str(log.get("message") or "")))
+            if not all(term in words for term in self.terms):
+                return False
+        if self.context:
+            context = log.get("context")
+            if not isinstance(context, dict):
+                return False
+            for key, value in self.context.items():
+                if key not in context or str(context[key]) != value:
+                    return False
+        if self.text:
+            message = str(log.get("message") or "")
+            context = json.dumps(log.get("context") or {}, default=str, ensure_ascii=False)
+            if self._pattern is not None:
+                return bool(self._pattern.search(message) or self._pattern.search(context))
+            return self.text in message.lower() or self.text in context.lower()
+        return True
+
+    def index_plan(self) -> Optional[Tuple[List[Set[str]], Set[str]]]:
+        """
+        転置インデックスで絞り込める条件を (OR 条件の集合のリスト, AND 条件の集合) で返す。
+        インデックスで絞り込めない検索（条件が q だけなど）の場合は None。
+        """
+        any_of: List[Set[str]] = []
+        all_of: Set[str] = set()
+        if self.levels:
+            any_of.append({level_term(level) for level in self.levels})
+        if self.operations:
+            any_of.append({operation_term(operation) for operation in self.operations})
+        if self.terms:
+            all_of.update(word_term(term) for term in self.terms)
+        if self.context:
+            all_of.update(
+                context_term(key, value) for key, value in self.context.items() if key in INDEXED_CONTEXT_KEYS
+            )
+        if not any_of and not all_of and not self.since and not self.until:
+            return None
+        return any_of, all_of
+
+
+# --- Cursor ---
+def encode_cursor(file_key: str, offset: int) -> str:
+    raw = json.dumps({"f": file_key, "o": offset}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """カーソルを (ファイルキー, バイトオフセット) に戻す。不正な場合は ValueError"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(data["f"]), int(data["o"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+# --- Scanning ---
+def list_search_files(log_dir: Path, projects: Optional[Set[str]] = None) -> List[Tuple[str, Path]]:
+    """検索対象のログファイル（ローテーション済みを含む）を (ファイルキー, パス) の順序付きリストで返す"""
+    files = []
+    if not log_dir.exists():
+        return files
+    for project_dir in sorted(log_dir.iterdir()):
+        if not project_dir.is_dir() or project_dir.name.startswith("."):
+            continue
+        if projects and project_dir.name not in projects:
+            continue
+        for path in sorted(project_dir.glob("*.log*")):
+            if path.is_file():
+                files.append((f"{project_dir.name}/{path.name}", path))
+    return files
+
+
+def scan_file(path: Path, project: str, query: SearchQuery, start: int, limit: int,
+              max_bytes: int, log_index: Optional[LogIndex] = None) -> Tuple[List[Tuple[int, Dict]], int, bool]:
+    """
+    1ファイルを start から走査し、一致した (行末オフセット, ログ辞書) を最大 limit 件返す。
+    戻り値は (一致リスト, 走査を終えたオフセット, ファイル末尾まで走査したか)。
+    転置インデックスで絞り込める検索では、候補行のバイト範囲だけを読む。
+    """
+    if log_index is not None:
+        plan = query.index_plan()
+        if plan is not None:
+            file_index = log_index.refreshed(path)
+            if file_index is None:
+                return [], start, True
+            return scan_indexed(path, project, query, plan, file_index, start, limit, max_bytes)
+
+    matches = []
+    pos = start
+    try:
+        with open_log(path) as f:
+            f.seek(start)
+            remainder = b""
+            while len(matches) < limit and pos - start < max_bytes:
+                block = f.read(READ_CHUNK_SIZE)
+                if not block:
+                    return matches, pos, True
+                lines = (remainder + block).split(b"\n")
+                remainder = lines.pop()
+                for raw_line in lines:
+                    pos += len(raw_line) + 1
+                    if not raw_line.strip() or not query.prefilter(raw_line):
+                        continue
+                    try:
+                        log = json.loads(raw_line)
+                    except ValueError:
+                        continue
+                    if not isinstance(log, dict) or not query.matches(log):
+                        continue
+                    log.setdefault("project", project)
+                    matches.append((pos, log))
+                    if len(matches) >= limit:
+                        return matches, pos, False
+    except FileNotFoundError:
+        return matches, pos, True
+    return matches, pos, False
+
+
+def scan_indexed(path: Path, project: str, query: SearchQuery, plan, file_index: FileIndex,
+                 start: int, limit: int, max_bytes: int) -> Tuple[List[Tuple[int, Dict]], int, bool]:
+    """転置インデックスの候補行だけを pread（圧縮済みファイルは該当ブロックの展開）で読み、条件を検証する"""
+    any_of, all_of = plan
+    lines = file_index.candidates(any_of, all_of, query.since, query.until)
+    offsets = file_index.offsets
+    first = bisect_left(lines, start, key=lambda line_no: offsets[line_no])
+
+    matches = []
+    scanned = 0
+    try:
+        with open_log(path) as f:
+            for line_no in lines[first:]:
+                offset, length = file_index.line_range(line_no)
+                if scanned >= max_bytes:
+                    return matches, offset, False
+                raw_line = read_at(f, length, offset)
+                scanned += length
+                end = offset + length + 1
+                if not query.prefilter(raw_line):
+                    continue
+                try:
+                    log = json.loads(raw_line)
+                except ValueError:
+                    continue
+                if not isinstance(log, dict) or not query.matches(log):
+                    continue
+                log.setdefault("project", project)
+                matches.append((end, log))
+                if len(matches) >= limit:
+                    return matches, end, False
+    except FileNotFoundError:
+        pass
+    return matches, max(start, file_index.indexed_bytes), True
+
+
+def scan_file_range(query: SearchQuery, scan_range: ScanRange, limit: int) -> Tuple[List[Tuple[int, Dict]], int, bool]:
+    """
+    ScanExecutor のワーカーで1つの ScanRange を走査し、一致した (行末オフセット, ログ辞書) を最大 limit 件返す。
+    戻り値は (一致リスト, 走査を終えたオフセット, ファイル末尾まで走査したか)。
+    """
+    matches = []
+    reader = RangeReader(scan_range)
+    for base, block in reader:
+        pos = base
+        lines = block.split(b"\n")
+        lines.pop()
+        for raw_line in lines:
+            pos += len(raw_line) + 1
+            if not raw_line.strip() or not query.prefilter(raw_line):
+                continue
+            try:
+                log = json.loads(raw_line)
+            except ValueError:
+                continue
+            if not isinstance(log, dict) or not query.matches(log):
+                continue
+            log.setdefault("project", scan_range.project)
+            matches.append((pos, log))
+            if len(matches) >= limit:
+                return matches, pos, False
+    return matches, reader.position, reader.finished
+
+
+def run_parallel_search(files: List[Tuple[str, Path]], start_offset: int, query: SearchQuery, limit: int,
+                        max_scan_bytes: int, executor: ScanExecutor) -> Tuple[List[Dict], Optional[str]]:
+    """
+    files を ScanRange に分けて ScanExecutor のワーカープロセスで並行に走査し、範囲の順に結果を結合する。
+    limit 件に達するか走査バイト数の上限に達したところで、残りの範囲は取り消す。
+    """
+    keys = {path: file_key for file_key, path in files}
+    starts = {files[0][1]: start_offset} if files and start_offset else None
+    ranges = split_ranges(((file_key.split("/", 1)[0], path) for file_key, path in files),
+                          executor.range_size, starts)
+
+    results: List[Dict] = []
+    budget = max_scan_bytes
+    tasks = ((query, scan_range, limit) for scan_range in ranges)
+    with closing(executor.imap(scan_file_range, tasks)) as outcomes:
+        for scan_range, (matches, end, finished) in zip(ranges, outcomes):
+            file_key = keys[scan_range.path]
+            budget -= end - scan_range.start
+            for match_end, log in matches:
+                results.append(log)
+                if len(results) >= limit:
+                    return results, encode_cursor(file_key, match_end)
+            if budget <= 0 and not (finished and scan_range is ranges[-1]):
+                return results, encode_cursor(file_key, end)
+    return results, None
+
+
+def run_search(log_dir: Path, query: SearchQuery, limit: int, cursor: Optional[str] = None,
+               max_scan_bytes: int = MAX_SCAN_BYTES, log_index: Optional[LogIndex] = None,
+               executor: Optional[ScanExecutor] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    検索を実行して1ページぶんの結果と次ページのカーソルを返す（ブロッキング）。
+    先頭から SEARCH_WORKERS 個のファイルをスレッドプールで並行に走査し、ファイル順に結果を結合する。
+    転置インデックスで絞り込めない全件走査は、executor（並行実行が有効な ScanExecutor）があればワーカープロセスで行う。
+    このとき走査バイト数の上限はワーカー数倍にする（1ページにかかる時間がおおよそ同じになる）。
+    """
+    files = list_search_files(log_dir, query.projects)
+    start_index, start_offset = 0, 0
+    if cursor:
+        file_key, start_offset = decode_cursor(cursor)
+        keys = [key for key, _ in files]
+        if file_key in keys:
+            start_index = keys.index(file_key)
+        elif file_key + COMPRESSED_SUFFIX in keys:
+            # 圧縮されたファイルは展開後のオフセットが変わらないので、そのまま続きから読む
+            start_index = keys.index(file_key + COMPRESSED_SUFFIX)
+        else:
+            # カーソルのファイルが消えていたら、順序上その次のファイルから再開する
+            start_index = next((i for i, key in enumerate(keys) if key > file_key), len(files))
+            start_offset = 0
+
+    indexed = log_index is not None and query.index_plan() is not None
+    if executor is not None and executor.parallel and not indexed:
+        return run_parallel_search(files[start_index:], start_offset, query, limit,
+                                   max_scan_bytes * executor.workers, executor)
+
+    results: List[Dict] = []
+    budget = max_scan_bytes
+    index = start_index
+    while index < len(files) and len(results) < limit and budget > 0:
+        batch = files[index:index + SEARCH_WORKERS]
+        per_file_budget = max(budget // len(batch), 1)
+        futures = []
+        for i, (file_key, path) in enumerate(batch):
+            offset = start_offset if index + i == start_index else 0
+            project = file_key.split("/", 1)[0]
+            futures.append(search_executor.submit(
+                scan_file, path, project, query, offset, limit - len(results), per_file_budget, log_index
+            ))
+
+        for i, future in enumerate(futures):
+            file_key = batch[i][0]
+            offset = start_offset if index + i == start_index else 0
+            matches, end, finished = future.result()
+            budget -= end - offset
+            for match_end, log in matches:
+                results.append(log)
+                if len(results) >= limit:
+                    # 残りのファイルの結果は捨て、最後に返した行の直後から再開する
+                    for rest in futures[i + 1:]:
+                        rest.cancel()
+                    return results, encode_cursor(file_key, match_end)
+            if not finished:
+                # 走査バイト数の上限に達したので、ここまでの結果を返す
+                for rest in futures[i + 1:]:
+                    rest.cancel()
+                return results, encode_cursor(file_key, end)
+        index += len(batch)
+
+    if index < len(files):
+        return results, encode_cursor(files[index][0], 0)
+    return results, None
+
+
+async def search_logs(log_dir: Path, query: SearchQuery, limit: int, cursor: Optional[str] = None,
+                      log_index: Optional[LogIndex] = None, executor: Optional[ScanExecutor] = None):
+    """イベントループを塞がないよう、検索全体をスレッドで実行する"""
+    return await asyncio.to_thread(run_search, log_dir, query, limit, cursor, MAX_SCAN_BYTES, log_index, executor)
@@ -0,0 +1,33 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+# ログファイルの配置方法
+LAYOUT_PER_LOGGER = "per_logger"  # ロガーを作るたびに新しいファイル（{operation}_{YYYYmmdd_HHMM}_{乱数}.log）
+LAYOUT_HOURLY = "hourly"          # 1時間ごとのセグメント（{operation}_{YYYYmmdd_HH}.log）
+LAYOUT_DAILY = "daily"            # 1日ごとのセグメント（{operation}_{YYYYmmdd}.log）
+LOG_FILE_LAYOUTS = (LAYOUT_PER_LOGGER, LAYOUT_HOURLY, LAYOUT_DAILY)
+
+_SEGMENT_FORMATS = {
+    LAYOUT_HOURLY: "%Y%m%d_%H",
+    LAYOUT_DAILY: "%Y%m%d",
+}
+
+
+def is_segmented(layout: str) -> bool:
+    return layout in _SEGMENT_FORMATS
+
+
+def segment_suffix(layout: str, now: Optional[datetime] = None) -> str:
+    """now を含むセグメントのファイル名の末尾（_{時刻}.log）。オペレーションによらず、どのプロセスでも同じになる"""
+    if layout not in _SEGMENT_FORMATS:
+        raise ValueError(f"Unknown segmented layout: {layout} (expected one of {', '.join(_SEGMENT_FORMATS)})")
+    now = now or datetime.now(timezone.utc)
+    return f"_{now.astimezone(timezone.utc).strftime(_SEGMENT_FORMATS[layout])}.log"
+
+
+def segment_file_name(operation: str, layout: str, now: Optional[datetime] = None) -> str:
+    """
+    時刻で区切ったセグメントのファイル名を返す。
+    名前は (operation, UTC の時刻) だけで決まるので、再起動後や別プロセスからも同じファイルに追記される。
+    """
+    return operation + segment_suffix(layout, now)
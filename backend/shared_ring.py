@@ -0,0 +1,265 @@
+import mmap
+import os
+import struct
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+from encoding import EncodedEvent, decode_event
+
+# 書き込みの排他には fcntl.flock を使う（POSIX のみ。無い環境では1プロセスからの利用に限る）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_MAGIC = b"VLRING01"
+# ヘッダー: magic, データ領域の容量, 書き込み位置, 最も古いレコードの位置, 最後に採番したシーケンス番号
+# 位置はすべて通算のバイト数（データ領域内の位置は position % capacity）
+_HEADER = struct.Struct("<8sQQQQ")
+HEADER_SIZE = 64
+# レコード: 全長（パディング込み）, ペイロード長, シーケンス番号, タイムスタンプ（ASCII、右側を NUL で埋める）
+_RECORD = struct.Struct("<IIQ40s")
+# データ領域の末尾に入りきらない場合に残りを埋めるレコードのペイロード長
+_PADDING = 0xFFFFFFFF
+
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+class SharedEventRing:
+    """
+    同じホストの全ワーカープロセスで共有する「最近のイベント」のリングバッファ。
+    EventHistory と同じ record() / replay() / last_id を持ち、接続時のリプレイをどのワーカーからでも返せる。
+
+    - 固定長のメモリマップトファイル（LOG_DIR/.ring/ や /dev/shm）に、長さ付きのレコードとして JSON を追記する
+    - シーケンス番号はファイルのヘッダーで採番するので、全ワーカーで単調増加し SSE の Last-Event-ID にそのまま使える
+    - 追記はファイルロック下で行う。古いレコードは上書きする前にヘッダーの「最も古い位置」を進めるので、
+      読み手はロックを取らずに読み、読み終えた後にその位置がまだ有効かを確かめて上書き中のデータを捨てる
+    - リプレイの位置合わせはレコードのヘッダー（シーケンス番号・タイムスタンプ）だけを読み、
+      送信するレコードのペイロードは mmap の memoryview のまま配信用のフレームに組み立てる（途中のバイト列を作らない）
+    - ファイルが残っていれば再起動後もそのまま使う。容量が違う・壊れている場合は、縮めずに新しいファイルを作って置き換える
+      （古いファイルを mmap しているワーカーは SIGBUS にならず、再起動するまで古い方を使い続ける）
+    """
+
+    shared = True
+
+    def __init__(self, path: Path, capacity: int = 64 * 1024 * 1024):
+        self.path = Path(path)
+        self.capacity = _align(max(capacity, _RECORD.size * 16))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        size = HEADER_SIZE + self.capacity
+        while True:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._lock()
+            try:
+                if self._is_current():
+                    header = os.pread(self._fd, _HEADER.size, 0)
+                    if len(header) == _HEADER.size and header[:8] == _MAGIC and \
+                            _HEADER.unpack(header)[1] == self.capacity and os.fstat(self._fd).st_size == size:
+                        self._mm = mmap.mmap(self._fd, size)
+                        break
+                    # 他のワーカーが古いファイルを mmap していても SIGBUS にならないよう、縮めずに新しいファイルと置き換える
+                    self._create(size)
+            finally:
+                self._unlock()
+            os.close(self._fd)
+        self._view = memoryview(self._mm)
+
+        # 統計情報
+        self.appended = 0
+        self.oversized = 0
+        self.torn_reads = 0
+
+    def _is_current(self) -> bool:
+        """開いたファイルが、ロックを待つあいだに別のワーカーに置き換えられていないか"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        fst = os.fstat(self._fd)
+        return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+    def _create(self, size: int):
+        """空のリングを一時ファイルに作ってから path に置き換える"""
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            # プロセスを再起動しても ID が単調増加するよう、作成時刻（マイクロ秒）から採番する
+            os.pwrite(fd, _HEADER.pack(_MAGIC, self.capacity, 0, 0, time.time_ns() // 1000), 0)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self._view.release()
+        self._mm.close()
+        os.close(self._fd)
+
+    # --- Header ---
+    def _lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _header(self):
+        """(書き込み位置, 最も古い位置, 最後のシーケンス番号)"""
+        _, _, write_pos, tail_pos, last_seq = _HEADER.unpack_from(self._mm, 0)
+        return write_pos, tail_pos, last_seq
+
+    def _set_header(self, write_pos: int, tail_pos: int, last_seq: int):
+        _HEADER.pack_into(self._mm, 0, _MAGIC, self.capacity, write_pos, tail_pos, last_seq)
+
+    @property
+    def last_id(self) -> int:
+        return self._header()[2]
+
+    # --- Records ---
+    def _offset(self, position: int) -> int:
+        return HEADER_SIZE + position % self.capacity
+
+    def _record_at(self, position: int):
+        """
+        position のレコードの (次のレコードの位置, シーケンス番号, タイムスタンプ, ペイロード長) を返す。
+        データ領域の末尾を埋めるレコードなら シーケンス番号は None。
+        """
+        remaining = self.capacity - position % self.capacity
+        if remaining < _RECORD.size:
+            return position + remaining, None, None, 0
+        total, length, seq, timestamp = _RECORD.unpack_from(self._mm, self._offset(position))
+        if length == _PADDING or total == 0:
+            return position + (total or remaining), None, None, 0
+        return position + total, seq, timestamp, length
+
+    def append(self, payload: bytes, timestamp: str = "") -> int:
+        """レコードを追記し、採番したシーケンス番号を返す（容量に収まらないイベントは番号だけ採る）"""
+        total = _align(_RECORD.size + len(payload))
+        self._lock()
+        try:
+            write_pos, tail_pos, last_seq = self._header()
+            seq = last_seq + 1
+            if total > self.capacity:
+                self.oversized += 1
+                self._set_header(write_pos, tail_pos, seq)
+                return seq
+
+            # データ領域の末尾に入りきらなければ、残りを埋めて先頭から書く
+            remaining = self.capacity - write_pos % self.capacity
+            start = write_pos if remaining >= total else write_pos + remaining
+            end = start + total
+
+            # 上書きされるレコードを読み手から見えなくしてから書き込む
+            while tail_pos < write_pos and tail_pos < end - self.capacity:
+                tail_pos = self._record_at(tail_pos)[0]
+            if tail_pos >= write_pos:
+                tail_pos = start
+            self._set_header(write_pos, tail_pos, last_seq)
+
+            if start != write_pos and remaining >= _RECORD.size:
+                _RECORD.pack_into(self._mm, self._offset(write_pos), remaining, _PADDING, 0, b"")
+            offset = self._offset(start)
+            _RECORD.pack_into(self._mm, offset, total, len(payload), seq, timestamp.encode("ascii", "replace")[:40])
+            self._mm[offset + _RECORD.size:offset + _RECORD.size + len(payload)] = payload
+            self._set_header(end, tail_pos, seq)
+            self.appended += 1
+            return seq
+        finally:
+            self._unlock()
+
+    def _payload(self, position: int, length: int) -> memoryview:
+        """ペイロードの memoryview（コピーしない）。使い終えたら release() し、上書きされていないかを確かめる"""
+        offset = self._offset(position) + _RECORD.size
+        return self._view[offset:offset + length]
+
+    # --- EventHistory interface ---
+    def record(self, event: EncodedEvent):
+        event.set_id(self.append(event.json_bytes, event.timestamp))
+
+    def _positions(self, after_id: Optional[int], since: Optional[str], end_id: int) -> array:
+        """条件に合うレコードの位置を古い順に集める（レコードのヘッダーだけを読む）"""
+        write_pos, position, _ = self._header()
+        since_bytes = since.encode("ascii", "replace")[:40] if since is not None else None
+        positions = array("Q")
+        while position < write_pos:
+            next_position, seq, timestamp, _ = self._record_at(position)
+            if seq is not None:
+                if seq > end_id:
+                    break
+                if (after_id is None or seq > after_id) and \
+                        (since_bytes is None or timestamp.rstrip(b"\0") >= since_bytes):
+                    positions.append(position)
+            if next_position <= position:
+                break
+            position = next_position
+        return positions
+
+    def _load(self, position: int) -> Optional[EncodedEvent]:
+        if position < self._header()[1]:
+            return None  # すでに上書きされた
+        _, seq, _, length = self._record_at(position)
+        if seq is None:
+            return None
+        payload = self._payload(position, length)
+        try:
+            event = decode_event(payload)
+        except ValueError:
+            event = None
+        finally:
+            payload.release()
+        if self._header()[1] > position:
+            # 読んでいる間に上書きされた
+            self.torn_reads += 1
+            return None
+        if event is not None:
+            event.set_id(seq)
+        return event
+
+    def _iter_events(self, positions: Iterable[int], projects: Optional[frozenset]) -> Iterator[EncodedEvent]:
+        for position in positions:
+            event = self._load(position)
+            if event is None:
+                continue
+            if projects is not None and not projects.intersection(event.projects):
+                continue
+            yield event
+
+    def replay(self, after_id: Optional[int] = None, since: Optional[str] = None,
+               last: Optional[int] = None, projects: Optional[Iterable[str]] = None,
+               end_id: Optional[int] = None) -> Iterator[EncodedEvent]:
+        """EventHistory.replay() と同じ条件で、共有リングからイベントをシーケンス番号順に返すイテレータを作る"""
+        end_id = self.last_id if end_id is None else end_id
+        projects = frozenset(projects) if projects is not None else None
+        positions = self._positions(after_id, since, end_id)
+        if last is not None:
+            if projects is None:
+                positions = positions[max(0, len(positions) - last):]
+            else:
+                # 新しい方から指定プロジェクトのイベントを last 件数えて、その位置から読む
+                newest = []
+                for position in reversed(positions):
+                    if len(newest) >= last:
+                        break
+                    event = self._load(position)
+                    if event is not None and projects.intersection(event.projects):
+                        newest.append(position)
+                positions = array("Q", reversed(newest))
+        return self._iter_events(positions, projects)
+
+    def stats(self) -> Dict:
+        write_pos, tail_pos, last_seq = self._header()
+        return {
+            "backend": "shared",
+            "path": str(self.path),
+            "capacity": self.capacity,
+            "used_bytes": write_pos - tail_pos,
+            "last_id": last_seq,
+            "appended": self.appended,
+            "oversized": self.oversized,
+            "torn_reads": self.torn_reads,
+        }
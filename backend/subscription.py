@@ -0,0 +1,134 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from encoding import EncodedEvent, encode_event, log_project
+
+# 最低レベル指定のためのログレベルの順位
+LEVEL_RANKS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+
+def _as_set(value: Any) -> Optional[Set[str]]:
+    """リストまたはカンマ区切り文字列を集合に変換する（空なら None）"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple, set)):
+        raise ValueError(f"Expected a list or comma separated string, got {value!r}")
+    items = {str(item).strip() for item in value if str(item).strip()}
+    return items or None
+
+
+class SubscriptionFilter:
+    """
+    WebSocket / SSE 購読者ごとの配信フィルタ。
+    プロジェクトの集合・最低レベル・operation の集合・context の key=value 一致を組み合わせる（すべて AND）。
+    プロジェクトとレベルの条件は ConnectionManager の配信テーブルの構築に使い、
+    operation と context の条件だけをイベントごとに検証する。
+    """
+
+    __slots__ = ("projects", "min_level", "operations", "context", "_min_rank")
+
+    def __init__(self, projects: Optional[Iterable[str]] = None, min_level: Optional[str] = None,
+                 operations: Optional[Iterable[str]] = None, context: Optional[Dict[str, str]] = None):
+        self.projects = frozenset(projects) if projects else None
+        self.operations = frozenset(operations) if operations else None
+        self.context = {str(key): str(value) for key, value in context.items()} if context else None
+        self.min_level = min_level.upper() if min_level else None
+        if self.min_level is not None and self.min_level not in LEVEL_RANKS:
+            raise ValueError(f"Unknown level: {min_level} (expected one of {', '.join(LEVEL_RANKS)})")
+        self._min_rank = LEVEL_RANKS[self.min_level] if self.min_level else None
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SubscriptionFilter":
+        """WebSocket の制御メッセージ（{"projects": [...], "min_level": ..., ...}）からフィルタを作る"""
+        if not isinstance(data, dict):
+            raise ValueError("Filter must be a JSON object")
+        context = data.get("context")
+        if context is not None and not isinstance(context, dict):
+            raise ValueError("context must be a JSON object")
+        return cls(
+            projects=_as_set(data.get("projects", data.get("project"))),
+            min_level=data.get("min_level"),
+            operations=_as_set(data.get("operations", data.get("operation"))),
+            context=context,
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "projects": sorted(self.projects) if self.projects else None,
+            "min_level": self.min_level,
+            "operations": sorted(self.operations) if self.operations else None,
+            "context": self.context,
+        }
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.projects or self.min_level or self.operations or self.context)
+
+    @property
+    def cache_key(self) -> Tuple:
+        """同じ条件のフィルタ同士で絞り込み結果を共有するためのキー"""
+        context = tuple(sorted(self.context.items())) if self.context else None
+        return self.projects, self.min_level, self.operations, context
+
+    def accepts_key(self, project: str, level: str) -> bool:
+        """(プロジェクト, レベル) だけで判定できる条件を満たすか"""
+        if self.projects is not None and project not in self.projects:
+            return False
+        if self._min_rank is not None and LEVEL_RANKS.get(level, 0) < self._min_rank:
+            return False
+        return True
+
+    @property
+    def needs_log_check(self) -> bool:
+        """(プロジェクト, レベル) 以外にログ本体を見る条件があるか"""
+        return bool(self.operations or self.context)
+
+    def matches(self, log: Dict) -> bool:
+        if not self.accepts_key(log_project(log), str(log.get("level") or "").upper()):
+            return False
+        if self.operations is not None and log.get("operation") not in self.operations:
+            return False
+        if self.context:
+            context = log.get("context")
+            if not isinstance(context, dict):
+                return False
+            for key, value in self.context.items():
+                if key not in context or str(context[key]) != value:
+                    return False
+        return True
+
+    def select(self, event: EncodedEvent, cache: Optional[Dict] = None) -> Optional[EncodedEvent]:
+        """
+        イベントのうちフィルタに一致する部分を返す。すべて一致すればそのまま、1件も一致しなければ None。
+        バッチの一部だけが一致する場合は一致したログだけを再エンコードする（cache で同じ条件の購読者と共有）。
+        """
+        if not event.keys:
+            # ログ以外のイベントはフィルタの対象外
+            return event
+        if not self.needs_log_check and all(self.accepts_key(*key) for key in event.keys):
+            return event
+        if cache is not None:
+            key = self.cache_key
+            if key in cache:
+                return cache[key]
+        logs = event.logs
+        selected: List[Dict] = [log for log in logs if self.matches(log)]
+        if len(selected) == len(logs):
+            result = event
+        elif not selected:
+            result = None
+        else:
+            result = encode_event(selected)
+            if event.id is not None:
+                result.set_id(event.id)
+        if cache is not None:
+            cache[self.cache_key] = result
+        return result
+
+    def filter_events(self, events: Iterator[EncodedEvent]) -> Iterator[EncodedEvent]:
+        """リプレイのイテレータにフィルタを掛ける"""
+        for event in events:
+            selected = self.select(event)
+            if selected is not None:
+                yield selected
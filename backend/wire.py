@@ -0,0 +1,150 @@
+import struct
+import zlib
+from typing import Any, Dict, List, Optional, Sequence
+
+from encoding import EncodedEvent, dumps_bytes, loads
+
+# WebSocket のサブプロトコル名。クライアントが Sec-WebSocket-Protocol で申し出たときだけバイナリで送る
+WIRE_SUBPROTOCOL = "vibelogger.v1.deflate"
+
+# 接続ごとの文字列辞書に入れるフィールド（値の種類が少なく、毎回同じ文字列が繰り返されるもの）
+DICTIONARY_FIELDS = ("project_name", "project", "level", "operation")
+# 行の先頭に置く、辞書に入れないフィールド
+INLINE_FIELDS = ("timestamp", "message")
+# 辞書の上限。超えたら辞書を作り直す（フレームに r: 1 を付けて受け手にも捨てさせる）
+MAX_DICTIONARY_SIZE = 4096
+
+# フレームは「4バイトのビッグエンディアンの展開後の長さ + raw deflate のデータ」
+_FRAME_HEADER = struct.Struct(">I")
+
+
+def negotiate(offered: Sequence[str]) -> Optional[str]:
+    """クライアントが申し出たサブプロトコルから、使うものを選ぶ（無ければ None = JSON テキスト）"""
+    return WIRE_SUBPROTOCOL if WIRE_SUBPROTOCOL in offered else None
+
+
+class WireEncoder:
+    """
+    WebSocket 1接続ぶんのバイナリ形式のエンコーダー。next_frames() で取り出したイベントをまとめて1つのバイナリフレームにする。
+
+    - ログは固定のキーを繰り返さず、[timestamp, message, project_name, project, level, operation, 残りのフィールド] の行にする
+    - project / level / operation などは接続ごとの文字列辞書の番号で送る。新しい文字列はそのフレームの "s" で送り、
+      受け手は届いた順に辞書へ足す（辞書の状態は送り手と受け手で常に同じ）
+    - フレーム全体を接続ごとの deflate ストリームで圧縮し、Z_SYNC_FLUSH で区切る。
+      前のフレームの内容も圧縮の参照に使えるので、小さなフレームでも繰り返しのキーや値がよく縮む
+    - 制御メッセージ・集計（{"type": ...}）はそのままの値で送る
+
+    フレームの中身（展開後の JSON）は {"r": 1?, "s": [新しい文字列], "e": [項目]}。
+    項目は {"l": 行}（ログ1件）・{"b": [行]}（バッチ）・{"m": 値}（ログ以外）のいずれか。
+    """
+
+    def __init__(self, level: int = 6, max_dictionary: int = MAX_DICTIONARY_SIZE):
+        self.max_dictionary = max_dictionary
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._strings: Dict[str, int] = {}
+
+        # 統計情報
+        self.frames = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.resets = 0
+
+    def _ref(self, value: str, new_strings: List[str]) -> int:
+        index = self._strings.get(value)
+        if index is None:
+            index = self._strings[value] = len(self._strings)
+            new_strings.append(value)
+        return index
+
+    def _row(self, log: Dict, new_strings: List[str]) -> List:
+        row: List[Any] = []
+        for field in INLINE_FIELDS:
+            value = log.get(field)
+            row.append(value if isinstance(value, str) else None)
+        for field in DICTIONARY_FIELDS:
+            value = log.get(field)
+            row.append(self._ref(value, new_strings) if isinstance(value, str) else None)
+        # 行に入らなかったフィールド（文字列でない timestamp なども含む）はそのまま送る
+        extra = {
+            key: value for key, value in log.items()
+            if not (key in INLINE_FIELDS or key in DICTIONARY_FIELDS) or not isinstance(value, str)
+        }
+        row.append(extra or None)
+        return row
+
+    def _item(self, payload: Any, new_strings: List[str]) -> Dict:
+        if isinstance(payload, dict):
+            if "type" in payload:
+                return {"m": payload}
+            return {"l": self._row(payload, new_strings)}
+        if isinstance(payload, list) and all(isinstance(log, dict) for log in payload):
+            return {"b": [self._row(log, new_strings) for log in payload]}
+        return {"m": payload}
+
+    def encode(self, events: List[EncodedEvent]) -> bytes:
+        """イベントの並びを1つのバイナリフレームにする"""
+        frame: Dict[str, Any] = {}
+        if len(self._strings) >= self.max_dictionary:
+            self._strings.clear()
+            self.resets += 1
+            frame["r"] = 1
+        new_strings: List[str] = []
+        frame["e"] = [self._item(event.payload, new_strings) for event in events]
+        if new_strings:
+            frame["s"] = new_strings
+        raw = dumps_bytes(frame)
+        data = _FRAME_HEADER.pack(len(raw)) + \
+            self._compressor.compress(raw) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.frames += 1
+        self.raw_bytes += len(raw)
+        self.wire_bytes += len(data)
+        return data
+
+    def stats(self) -> Dict:
+        return {
+            "protocol": WIRE_SUBPROTOCOL,
+            "frames": self.frames,
+            "raw_bytes": self.raw_bytes,
+            "wire_bytes": self.wire_bytes,
+            "dictionary": len(self._strings),
+            "resets": self.resets,
+        }
+
+
+class WireDecoder:
+    """WireEncoder のフレームを元の値（ログ辞書・バッチのリスト・制御メッセージ）に戻す。フロントエンドの実装と同じ手順"""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(-15)
+        self._strings: List[str] = []
+
+    def _log(self, row: List) -> Dict:
+        log: Dict[str, Any] = {}
+        for field, value in zip(INLINE_FIELDS, row):
+            if value is not None:
+                log[field] = value
+        for field, index in zip(DICTIONARY_FIELDS, row[len(INLINE_FIELDS):]):
+            if index is not None:
+                log[field] = self._strings[index]
+        if row[-1]:
+            log.update(row[-1])
+        return log
+
+    def decode(self, data: bytes) -> List[Any]:
+        (length,) = _FRAME_HEADER.unpack_from(data)
+        raw = self._decompressor.decompress(data[_FRAME_HEADER.size:])
+        if len(raw) != length:
+            raise ValueError(f"Truncated wire frame ({len(raw)} of {length} bytes)")
+        frame = loads(raw)
+        if frame.get("r"):
+            self._strings.clear()
+        self._strings.extend(frame.get("s", ()))
+        payloads = []
+        for item in frame["e"]:
+            if "l" in item:
+                payloads.append(self._log(item["l"]))
+            elif "b" in item:
+                payloads.append([self._log(row) for row in item["b"]])
+            else:
+                payloads.append(item["m"])
+        return payloads
@@ -16,6 +16,7 @@ document.addEventListener("DOMContentLoaded", () => {
     const exportBtn = document.getElementById("export-btn");
     const logCountDisplayEl = document.getElementById("log-count-display");
     const connectionTypeSelect = document.getElementById("connection-type");
+    const batchDeliveryToggle = document.getElementById("batch-delivery");
     const bufferIndicator = document.getElementById("buffer-indicator");
     const bufferCountEl = document.getElementById("buffer-count");
     const scrollToTopBtn = document.getElementById("scroll-to-top-btn");
@@ -24,6 +25,14 @@ document.addEventListener("DOMContentLoaded", () => {
     let connection = null;
     let projects = {}; // To store logs grouped by project, populated from API
     let allLogs = []; // Store all received logs
+    const REPLAY_ON_CONNECT = 200; // Number of recent events to replay on first connect
+    const BATCHED_DELIVERY_QUERY = "batch_ms=250&dedupe=true"; // Opt-in: let the server batch bursts and collapse repeats
+    // Compact binary WebSocket frames (backend/wire.py). Offered only when the browser can inflate them.
+    const WIRE_PROTOCOL = "vibelogger.v1.deflate";
+    const WIRE_SUPPORTED = typeof DecompressionStream !== "undefined";
+    const WIRE_INLINE_FIELDS = ["timestamp", "message"];
+    const WIRE_DICTIONARY_FIELDS = ["project_name", "project", "level", "operation"];
+    let wireDecoder = null;
     let totalLogs = 0;
     let errorLogs = 0;
     let warningLogs = 0;
@@ -213,6 +222,7 @@ document.addEventListener("DOMContentLoaded", () => {
         operationFilterEl.addEventListener('input', debounce(applyFilters, 300));
         searchFilterEl.addEventListener('input', debounce(applyFilters, 300));
         connectionTypeSelect.addEventListener('change', connect);
+        batchDeliveryToggle.addEventListener('change', connect);
 
         autoScrollBtn.addEventListener('click', () => {
             isAutoScrollActive = !isAutoScrollActive;
@@ -248,15 +258,25 @@ document.addEventListener("DOMContentLoaded", () => {
         const type = connectionTypeSelect.value;
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
         const host = window.location.host;
+        // On a fresh page, ask the server to replay recent history before live events.
+        // Batching and dedupe are off unless the user turns them on, so each event arrives as it happens.
+        const params = [];
+        if (allLogs.length === 0) params.push(`last=${REPLAY_ON_CONNECT}`);
+        if (batchDeliveryToggle.checked) params.push(BATCHED_DELIVERY_QUERY);
+        const query = params.length ? `?${params.join("&")}` : "";
 
         if (type === "ws") {
-            connection = new WebSocket(`${protocol}//${host}/ws`);
+            connection = new WebSocket(`${protocol}//${host}/ws${query}`, WIRE_SUPPORTED ? [WIRE_PROTOCOL] : []);
+            connection.binaryType = "arraybuffer";
+            // The decoder keeps per-connection state (deflate stream and string dictionary).
+            wireDecoder = WIRE_SUPPORTED ? createWireDecoder() : null;
             connection.onopen = handleOpen;
             connection.onmessage = handleMessage;
             connection.onclose = handleClose;
             connection.onerror = handleError;
         } else if (type === "sse") {
-            connection = new EventSource("/sse");
+            // EventSource resends Last-Event-ID on automatic reconnects, so gaps are backfilled.
+            connection = new EventSource(`/sse${query}`);
             // Use the standard 'open' event instead of an optimistic call for reliability.
             connection.onopen = handleOpen;
             connection.onmessage = handleMessage;
@@ -302,23 +322,107 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     function handleMessage(event) {
+        if (typeof event.data !== "string") {
+            // Binary frame: one frame carries several payloads
+            wireDecoder.decode(event.data)
+                .then(handlePayloads)
+                .catch(e => console.error("Failed to decode wire frame:", e));
+            return;
+        }
         try {
-            const logData = JSON.parse(event.data);
+            handlePayloads([JSON.parse(event.data)]);
+        } catch (e) {
+            console.error("Failed to parse log data:", e);
+        }
+    }
+
+    function handlePayloads(payloads) {
+        const logs = [];
+        payloads.forEach(payload => {
+            // Replies to subscription control messages are not log entries
+            if (!Array.isArray(payload) && payload.type) {
+                console.log("Subscription message:", payload);
+                return;
+            }
+            // Batch ingestion is broadcast as a single JSON array
+            logs.push(...(Array.isArray(payload) ? payload : [payload]));
+        });
+        if (logs.length === 0) return;
+
+        logs.forEach(logData => {
             allLogs.push(logData);
             updateStats(logData);
-            
-            // Check if user is scrolled down and auto-scroll is disabled
-            if (isUserScrolledDown && !isAutoScrollActive) {
-                // Add to buffer instead of immediately displaying
-                bufferedLogs.push(logData);
-                updateBufferIndicator();
-            } else {
-                // Normal rendering
-                renderFilteredLogs();
+        });
+
+        // Check if user is scrolled down and auto-scroll is disabled
+        if (isUserScrolledDown && !isAutoScrollActive) {
+            // Add to buffer instead of immediately displaying
+            bufferedLogs.push(...logs);
+            updateBufferIndicator();
+        } else {
+            // Normal rendering (once per frame, not once per log)
+            renderFilteredLogs();
+        }
+    }
+
+    // Decoder for one binary WebSocket connection. Frames are a 4-byte big-endian length of the
+    // inflated JSON followed by a chunk of a raw deflate stream that spans the whole connection.
+    function createWireDecoder() {
+        const stream = new DecompressionStream("deflate-raw");
+        const writer = stream.writable.getWriter();
+        const reader = stream.readable.getReader();
+        const textDecoder = new TextDecoder();
+        let strings = [];
+        let pending = new Uint8Array(0);
+        let queue = Promise.resolve();
+
+        async function readExactly(length) {
+            while (pending.length < length) {
+                const { value, done } = await reader.read();
+                if (done) throw new Error("Wire stream closed");
+                const merged = new Uint8Array(pending.length + value.length);
+                merged.set(pending);
+                merged.set(value, pending.length);
+                pending = merged;
             }
-        } catch (e) {
-            console.error("Failed to parse log data:", e);
+            const data = pending.subarray(0, length);
+            pending = pending.slice(length);
+            return data;
         }
+
+        function decodeLog(row) {
+            const log = {};
+            WIRE_INLINE_FIELDS.forEach((field, i) => {
+                if (row[i] !== null) log[field] = row[i];
+            });
+            WIRE_DICTIONARY_FIELDS.forEach((field, i) => {
+                const index = row[WIRE_INLINE_FIELDS.length + i];
+                if (index !== null) log[field] = strings[index];
+            });
+            return row[row.length - 1] ? Object.assign(log, row[row.length - 1]) : log;
+        }
+
+        async function decodeFrame(buffer) {
+            const length = new DataView(buffer).getUint32(0);
+            // Not awaited: the write only settles once the output has been read below.
+            writer.write(new Uint8Array(buffer, 4)).catch(() => {});
+            const frame = JSON.parse(textDecoder.decode(await readExactly(length)));
+            if (frame.r) strings = [];
+            if (frame.s) strings = strings.concat(frame.s);
+            return frame.e.map(item => {
+                if ("l" in item) return decodeLog(item.l);
+                if ("b" in item) return item.b.map(decodeLog);
+                return item.m;
+            });
+        }
+
+        return {
+            // Frames must be inflated in arrival order, so decoding is chained.
+            decode(buffer) {
+                queue = queue.then(() => decodeFrame(buffer));
+                return queue;
+            },
+        };
     }
 
     // --- UI Update Functions ---
@@ -372,6 +476,7 @@ document.addEventListener("DOMContentLoaded", () => {
                 <span class="log-timestamp">${date} ${timestamp}</span>
                 <span class="log-level">${log.level || 'INFO'}</span>
                 <span class="log-operation">${log.operation || ''}</span>
+                ${log.repeat > 1 ? `<span class="log-repeat" title="${log.first_timestamp} – ${log.last_timestamp}">×${log.repeat}</span>` : ''}
                 <span class="log-id">${log.correlation_id ? log.correlation_id.split('-')[0] : ''}</span>
             </div>
             <div class="log-card-body">
@@ -385,9 +490,11 @@ document.addEventListener("DOMContentLoaded", () => {
     
     // --- Feature Implementations ---
     function updateStats(log) {
-        totalLogs++;
-        if (log.level === 'ERROR') errorLogs++;
-        if (log.level === 'WARNING') warningLogs++;
+        // Collapsed duplicates carry the number of original events in `repeat`.
+        const count = log.repeat || 1;
+        totalLogs += count;
+        if (log.level === 'ERROR') errorLogs += count;
+        if (log.level === 'WARNING') warningLogs += count;
 
         totalLogsEl.textContent = totalLogs;
         errorLogsEl.textContent = errorLogs;
@@ -0,0 +1,85 @@
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import encoding  # noqa: E402
+
+# -----------------------------------------------------------------------------
+# USAGE:
+#   python tests/bench_encoding.py            # -> 2,000 events per case
+#   python tests/bench_encoding.py 10000
+#
+# ブロードキャスト1イベントあたりの CPU 時間を、購読者数 1 / 100 / 1000 で比較する。
+#   legacy : json.dumps をイベントごとに行い、SSE フレームを購読者ごとに f-string + encode
+#   encoded: encode_event で1回だけエンコードし、全購読者で同じバイト列を共有
+#   frame MB: encoded で購読者へ渡した SSE フレームの合計（ループが省かれていないことの確認も兼ねる）
+# -----------------------------------------------------------------------------
+
+SUBSCRIBER_COUNTS = [1, 100, 1000]
+
+
+def sample_log(i):
+    return {
+        "timestamp": "2025-07-11T08:44:08.918671+00:00",
+        "level": "WARNING",
+        "correlation_id": "bf92f353-69a8-43a8-bbff-1a81029057b2",
+        "operation": "db_query",
+        "message": f"High latency detected in db_query #{i}",
+        "context": {"user": "Alice", "project": "api_backend", "log_id": f"{i:08x}", "latency_ms": 512},
+        "environment": {
+            "python_version": "3.11.13 (main, Jun  4 2025, 08:57:29) [GCC 11.4.0]",
+            "os": "Linux",
+            "platform": "Linux-6.1.123+-x86_64-with-glibc2.35",
+            "architecture": "x86_64",
+        },
+        "source": "main.py:298 in generate_logs()",
+        "stack_trace": None,
+        "human_note": "AI: Investigate performance bottlenecks in db_query",
+        "ai_todo": None,
+        "project": "api_backend",
+    }
+
+
+def bench_legacy(logs, subscribers):
+    """(1イベントあたりの CPU 秒, 購読者へ渡したフレームの合計バイト数)"""
+    sent = 0
+    start = time.process_time()
+    for log in logs:
+        message = json.dumps(log, default=str, ensure_ascii=False)
+        for _ in range(subscribers):
+            # sse_endpoint の f-string と、StreamingResponse による str -> bytes 変換
+            frame = f"data: {message}\n\n".encode("utf-8")
+            sent += len(frame)
+    return (time.process_time() - start) / len(logs), sent
+
+
+def bench_encoded(logs, subscribers):
+    """(1イベントあたりの CPU 秒, 購読者へ渡したフレームの合計バイト数)"""
+    sent = 0
+    start = time.process_time()
+    for log in logs:
+        event = encoding.encode_event(log)
+        for _ in range(subscribers):
+            frame = event.sse
+            sent += len(frame)
+    return (time.process_time() - start) / len(logs), sent
+
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    logs = [sample_log(i) for i in range(num_events)]
+
+    print(f"JSON backend: {encoding.JSON_BACKEND}, events per case: {num_events}")
+    print(f"{'subscribers':>11} | {'legacy us/event':>15} | {'encoded us/event':>16} | {'speedup':>7} | {'frame MB':>8}")
+    for subscribers in SUBSCRIBER_COUNTS:
+        legacy, _ = bench_legacy(logs, subscribers)
+        encoded, sent = bench_encoded(logs, subscribers)
+        print(f"{subscribers:>11} | {legacy * 1e6:>15.1f} | {encoded * 1e6:>16.1f} | {legacy / encoded:>6.1f}x | "
+              f"{sent / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
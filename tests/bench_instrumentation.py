@@ -0,0 +1,99 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from instrumentation import (FANOUT_BUCKETS, EndpointLatencyMiddleware, Histogram,  # noqa: E402
+                             registry)
+
+# -----------------------------------------------------------------------------
+# USAGE:
+#   python tests/bench_instrumentation.py            # -> 1,000,000 回ずつ
+#   python tests/bench_instrumentation.py 5000000
+#
+# ホットパスに入れた計測の 1 回あたりのコスト（ns）を測る。
+#   clock          : perf_counter() 2 回だけ（timed との差が計測そのもののコスト）
+#   observe        : Histogram.observe() だけ
+#   timed          : perf_counter() 2 回 + observe()（ファンアウト・ファイル書き込みで1回ごとに払うコスト）
+#   middleware pass: 計測対象でないパスが EndpointLatencyMiddleware を素通りするコスト（1 リクエストあたり）
+#   middleware hit : 計測対象のパス（/api/ingest）で応答時間を記録するコスト（1 リクエストあたり）
+#   render         : /api/internal/metrics の 1 回の書き出し（参考）
+# -----------------------------------------------------------------------------
+
+
+def bench_observe(n):
+    histogram = Histogram(FANOUT_BUCKETS)
+    values = [i % 1000 * 1e-6 for i in range(1000)]
+    start = time.perf_counter()
+    for i in range(n // 1000):
+        for value in values:
+            histogram.observe(value)
+    return (time.perf_counter() - start) / n
+
+
+def bench_clock(n):
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    for _ in range(n):
+        t0 = perf_counter()
+        perf_counter() - t0
+    return (perf_counter() - start) / n
+
+
+def bench_timed(n):
+    histogram = Histogram(FANOUT_BUCKETS)
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    for _ in range(n):
+        t0 = perf_counter()
+        histogram.observe(perf_counter() - t0)
+    return (perf_counter() - start) / n
+
+
+def bench_middleware(n, path):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def send(message):
+        pass
+
+    async def run(handler):
+        scope = {"type": "http", "path": path}
+        start = time.perf_counter()
+        for _ in range(n):
+            await handler(scope, None, send)
+        return time.perf_counter() - start
+
+    middleware = EndpointLatencyMiddleware(app, {"/api/ingest": "/api/ingest"}, [("/api/logs/", "/api/logs")])
+    baseline = asyncio.run(run(app))
+    return (asyncio.run(run(middleware)) - baseline) / n
+
+
+def bench_render(n):
+    start = time.perf_counter()
+    for _ in range(n):
+        registry.render()
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print(f"iterations: {n}")
+    print(f"{'case':>15} | {'ns/op':>10}")
+    cases = [
+        ("clock", lambda: bench_clock(n)),
+        ("observe", lambda: bench_observe(n)),
+        ("timed", lambda: bench_timed(n)),
+        ("middleware pass", lambda: bench_middleware(n // 10, "/api/search")),
+        ("middleware hit", lambda: bench_middleware(n // 10, "/api/ingest")),
+        ("render", lambda: bench_render(max(n // 10000, 1))),
+    ]
+    for name, bench in cases:
+        print(f"{name:>15} | {bench() * 1e9:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
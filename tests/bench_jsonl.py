@@ -0,0 +1,96 @@
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tests.bench_encoding import sample_log  # noqa: E402
+from utils.jsonl_reader import JSON_PARSER, JSONLReader  # noqa: E402
+
+# -----------------------------------------------------------------------------
+# USAGE:
+#   python tests/bench_jsonl.py            # -> 200,000 lines
+#   python tests/bench_jsonl.py 1000000
+#
+# 保存済みの JSONL を全件読むときの 1 行あたりの時間を比較する。
+#   naive   : for line in f: json.loads(line)
+#   orjson  : for line in f: orjson.loads(line)（orjson がインストールされている場合）
+#   reader  : utils.jsonl_reader.JSONLReader（mmap でブロックごとに読み、ブロックを1回でデコード）
+#   fields  : JSONLReader(fields=...)（timestamp / level / operation / context.latency_ms だけを残す）
+# ファイルの末尾には書きかけの行を1つ付けておく（naive は例外を握りつぶして読み飛ばす）。
+# -----------------------------------------------------------------------------
+
+FIELDS = ("timestamp", "level", "operation", "context.latency_ms")
+
+
+def write_sample(path, num_lines):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(num_lines):
+            f.write(json.dumps(sample_log(i), ensure_ascii=False) + "\n")
+        f.write('{"timestamp": "2025-07-11T08:44:08')
+
+
+def bench_naive(path):
+    start = time.perf_counter()
+    records = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                json.loads(line)
+            except ValueError:
+                continue
+            records += 1
+    return records, time.perf_counter() - start
+
+
+def bench_naive_orjson(path):
+    import orjson
+
+    start = time.perf_counter()
+    records = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                orjson.loads(line)
+            except ValueError:
+                continue
+            records += 1
+    return records, time.perf_counter() - start
+
+
+def bench_reader(path, fields=None):
+    start = time.perf_counter()
+    records = 0
+    for batch in JSONLReader(path, fields=fields):
+        records += len(batch)
+    return records, time.perf_counter() - start
+
+
+def main():
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.log"
+        write_sample(path, num_lines)
+        size_mb = path.stat().st_size / 1024 / 1024
+
+        print(f"parser: {JSON_PARSER}, lines: {num_lines}, file: {size_mb:.1f} MB")
+        print(f"{'path':>6} | {'records':>8} | {'seconds':>7} | {'us/line':>7} | {'MB/s':>6} | {'speedup':>7}")
+        baseline = None
+        cases = [("naive", lambda: bench_naive(path))]
+        if JSON_PARSER == "orjson":
+            cases.append(("orjson", lambda: bench_naive_orjson(path)))
+        cases += [
+            ("reader", lambda: bench_reader(path)),
+            ("fields", lambda: bench_reader(path, FIELDS)),
+        ]
+        for name, bench in cases:
+            records, elapsed = bench()
+            baseline = baseline or elapsed
+            print(f"{name:>6} | {records:>8} | {elapsed:>7.2f} | {elapsed / num_lines * 1e6:>7.2f} | "
+                  f"{size_mb / elapsed:>6.1f} | {baseline / elapsed:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
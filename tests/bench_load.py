@@ -0,0 +1,575 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from itertools import count
+from pathlib import Path
+from urllib.parse import urlsplit
+
+# /ws の購読には uvicorn[standard] に含まれる websockets を使う（無い場合は WS の購読者を付けない）
+try:
+    import websockets
+
+    _websockets_installed = True
+except ImportError:
+    _websockets_installed = False
+
+# -----------------------------------------------------------------------------
+# USAGE:
+#   python tests/bench_load.py                                  # -> 500 events/s を 10 秒、WS 10 / SSE 10 購読者
+#   python tests/bench_load.py --rate 0 --concurrency 32        # 上限なし（32 並列で送れるだけ送る）
+#   python tests/bench_load.py --rate 5000 --batch 100 --ws 200 --sse 50 --duration 30
+#   python tests/bench_load.py --output results/v1.2.json       # 結果の JSON をファイルに保存（既定は標準出力）
+#   python tests/bench_load.py --server http://127.0.0.1:6702   # 起動済みのサーバーに対して測る
+#
+# backend/main.py を --no-dummy でローカルに起動し（--server を指定しない場合）、
+#   - /api/ingest（--batch N なら /api/ingest/batch に N 件ずつ）へ --rate events/s・--concurrency 並列で送る
+#   - /ws と /sse の購読者を --ws / --sse 個つなぎ、受け取ったイベントを数える
+# 結果として次を 1 つの JSON にまとめて出力する（人が読む要約は標準エラーへ）。
+#   ingest  : 送信数・受理数・429 の数・スループット・リクエストの応答時間の分位点
+#   delivery: 購読者ごとの受信数の合計・欠落率・送信→受信（ingest→配信）の遅延の分位点（WS / SSE 別）
+#   server  : サーバープロセス（子プロセスを含む）の RSS、イベントループの遅れとファンアウト時間
+#             （/api/internal/metrics のヒストグラムの差分。無いサーバーでは GET /api/loggers の応答時間で近似）
+# 各イベントは context.bench_sent に送信時刻（このプロセスの perf_counter）を入れて送り、受信側で差を取る。
+# ログは logs/bench_load/ に書かれる。
+# -----------------------------------------------------------------------------
+
+RESULT_VERSION = 1
+BENCH_PROJECT = "bench_load"
+BASE_DIR = Path(__file__).resolve().parent.parent
+PROBE_PATH = "/api/loggers"
+INTERNAL_METRICS_PATH = "/api/internal/metrics"
+
+
+def percentiles(samples):
+    """ミリ秒の分位点（サンプルが無ければ None）"""
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def at(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+
+    return {
+        "count": len(samples),
+        "p50": at(0.50),
+        "p90": at(0.90),
+        "p99": at(0.99),
+        "p999": at(0.999),
+        "max": round(samples[-1] * 1000, 3),
+        "mean": round(sum(samples) / len(samples) * 1000, 3),
+    }
+
+
+# --- HTTP/1.1 (keep-alive) ---
+class HTTPConnection:
+    """1本の keep-alive 接続でリクエストを順に送る最小限の HTTP/1.1 クライアント"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=b"", content_type="application/json"):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode("ascii") + body)
+        try:
+            status, headers = await read_response_head(self.reader)
+            if headers.get("transfer-encoding") == "chunked":
+                payload = b""
+                async for chunk in iter_chunked(self.reader):
+                    payload += chunk
+            else:
+                payload = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close()
+            raise
+        if headers.get("connection") == "close":
+            self.close()
+        return status, payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def read_response_head(reader):
+    status_line = await reader.readuntil(b"\r\n")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            return status, headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip().lower()
+
+
+async def iter_chunked(reader):
+    while True:
+        size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+        if size == 0:
+            await reader.readuntil(b"\r\n")
+            return
+        chunk = await reader.readexactly(size)
+        await reader.readexactly(2)
+        yield chunk
+
+
+async def iter_stream(reader):
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            return
+        yield data
+
+
+# --- Subscribers ---
+class DeliveryStats:
+    """購読方式（ws / sse）ごとの受信数と ingest→配信の遅延"""
+
+    def __init__(self, transport, subscribers):
+        self.transport = transport
+        self.subscribers = subscribers
+        self.connected = 0
+        self.received = 0
+        self.latencies = []
+        self.errors = 0
+
+    def on_payload(self, payload):
+        now = time.perf_counter()
+        for log in payload if isinstance(payload, list) else [payload]:
+            if not isinstance(log, dict) or "type" in log:
+                continue  # 制御メッセージ・集計の定期配信
+            context = log.get("context")
+            if not isinstance(context, dict) or "bench_sent" not in context:
+                continue
+            self.received += 1
+            self.latencies.append(now - context["bench_sent"])
+
+    def to_dict(self, expected_per_subscriber):
+        expected = expected_per_subscriber * self.subscribers
+        return {
+            "subscribers": self.subscribers,
+            "connected": self.connected,
+            "errors": self.errors,
+            "expected": expected,
+            "received": self.received,
+            "loss_ratio": round(1 - self.received / expected, 6) if expected else None,
+            "latency_ms": percentiles(self.latencies),
+        }
+
+
+async def ws_subscriber(url, stats):
+    """取り消される（run の終わり）まで受信し続ける"""
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            stats.connected += 1
+            async for message in ws:
+                stats.on_payload(json.loads(message))
+    except Exception:
+        stats.errors += 1
+
+
+async def sse_subscriber(host, port, path, stats):
+    """取り消される（run の終わり）まで受信し続ける"""
+    writer = None
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nAccept: text/event-stream\r\n\r\n".encode("ascii"))
+        status, headers = await read_response_head(reader)
+        if status != 200:
+            raise RuntimeError(f"SSE status {status}")
+        stats.connected += 1
+        chunks = iter_chunked(reader) if headers.get("transfer-encoding") == "chunked" else iter_stream(reader)
+        buffer = b""
+        async for data in chunks:
+            buffer += data
+            *frames, buffer = buffer.split(b"\n\n")
+            for frame in frames:
+                for line in frame.split(b"\n"):
+                    if line.startswith(b"data:"):
+                        stats.on_payload(json.loads(line[5:]))
+    except Exception:
+        stats.errors += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# --- Load ---
+class IngestStats:
+    def __init__(self):
+        self.requests = 0
+        self.sent = 0       # 送ったイベント数
+        self.accepted = 0   # 2xx で受理されたイベント数
+        self.rejected = 0   # 429 で拒否されたイベント数
+        self.errors = 0     # それ以外の失敗（接続エラー・5xx など）のリクエスト数
+        self.latencies = []
+
+
+def make_event(seq):
+    return {
+        "level": "INFO" if seq % 10 else "WARNING",
+        "operation": "bench",
+        "message": f"bench event #{seq}",
+        "context": {"bench_seq": seq, "bench_sent": time.perf_counter()},
+        "project": BENCH_PROJECT,
+    }
+
+
+async def ingest_worker(host, port, args, stats, sequence, started, deadline):
+    connection = HTTPConnection(host, port)
+    batch = args.batch
+    while True:
+        n = next(sequence)
+        if args.rate > 0:
+            # 開ループ: n 番目のリクエストは started + n * batch / rate に送る
+            delay = started + n * max(batch, 1) / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if time.perf_counter() >= deadline:
+            break
+        if batch:
+            events = [make_event(n * batch + i) for i in range(batch)]
+            path = "/api/ingest/batch"
+            body = b"\n".join(json.dumps(event).encode("utf-8") for event in events)
+            content_type = "application/x-ndjson"
+        else:
+            events = [make_event(n)]
+            path = "/api/ingest"
+            body = json.dumps(events[0]).encode("utf-8")
+            content_type = "application/json"
+        sent_at = time.perf_counter()
+        stats.requests += 1
+        stats.sent += len(events)
+        try:
+            status, _ = await connection.request("POST", path, body, content_type)
+        except (OSError, asyncio.IncompleteReadError):
+            stats.errors += 1
+            continue
+        stats.latencies.append(time.perf_counter() - sent_at)
+        if 200 <= status < 300:
+            stats.accepted += len(events)
+        elif status == 429:
+            stats.rejected += len(events)
+        else:
+            stats.errors += 1
+    connection.close()
+
+
+# --- Server ---
+def process_tree_rss(pid):
+    """pid とその子孫プロセスの RSS の合計（バイト）。/proc が無い環境では None"""
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                try:
+                    with open(f"/proc/{current}/task/{task}/children") as f:
+                        pending.extend(int(child) for child in f.read().split())
+                except OSError:
+                    pass
+    except OSError:
+        return None if total == 0 else total
+    return total
+
+
+async def sample_server(host, port, pid, stop, rss_samples, probe_latencies, interval):
+    """interval 秒ごとに RSS を読み、軽いエンドポイントの応答時間でイベントループの遅れを近似する"""
+    connection = HTTPConnection(host, port)
+    while not stop.is_set():
+        if pid is not None:
+            rss = process_tree_rss(pid)
+            if rss is not None:
+                rss_samples.append(rss)
+        started = time.perf_counter()
+        try:
+            await connection.request("GET", PROBE_PATH)
+            probe_latencies.append(time.perf_counter() - started)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+    connection.close()
+
+
+async def scrape_histograms(host, port, names):
+    """
+    /api/internal/metrics からラベルの無いヒストグラムの {名前: [(上限, 累積件数), ...]} を読む。
+    エンドポイントが無い（古いサーバー）場合は None。
+    """
+    connection = HTTPConnection(host, port)
+    try:
+        status, body = await connection.request("GET", INTERNAL_METRICS_PATH)
+    except (OSError, asyncio.IncompleteReadError):
+        return None
+    finally:
+        connection.close()
+    if status != 200:
+        return None
+    histograms = {name: [] for name in names}
+    for line in body.decode("utf-8").splitlines():
+        for name in names:
+            prefix = f'{name}_bucket{{le="'
+            if line.startswith(prefix):
+                bound, _, value = line[len(prefix):].partition('"} ')
+                histograms[name].append((float(bound), float(value)))
+    return histograms if all(histograms.values()) else None
+
+
+def histogram_delta(before, after):
+    """2回のスクレイプの差から、その間の件数と分位点（バケットの上限で近似、ミリ秒）を求める"""
+    counts = [(bound, count - dict(before).get(bound, 0)) for bound, count in after]
+    total = counts[-1][1] if counts else 0
+    if not total:
+        return {"count": 0}
+
+    def at(q):
+        for bound, cumulative in counts:
+            if cumulative >= q * total:
+                return bound * 1000
+        return None
+
+    return {"count": int(total), "p50_le": at(0.50), "p90_le": at(0.90), "p99_le": at(0.99), "p999_le": at(0.999)}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers):
+    command = [sys.executable, str(BASE_DIR / "backend" / "main.py"), "server", "--no-dummy", "--port", str(port)]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+    return subprocess.Popen(command, cwd=BASE_DIR / "backend", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(host, port, timeout, process=None):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode} "
+                               f"(run `python backend/main.py --no-dummy` to see the error)")
+        connection = HTTPConnection(host, port)
+        try:
+            status, _ = await connection.request("GET", PROBE_PATH)
+            if status == 200:
+                return
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            connection.close()
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"server did not become ready on {host}:{port} within {timeout}s")
+
+
+def stop_server(process):
+    # SIGINT で lifespan の終了処理（未書き込みログの書き出し）を走らせる
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+async def run(args, host, port, pid):
+    query = args.subscribe_query
+    ws_stats = DeliveryStats("ws", args.ws if _websockets_installed else 0)
+    sse_stats = DeliveryStats("sse", args.sse)
+    subscribers = [
+        asyncio.create_task(ws_subscriber(f"ws://{host}:{port}/ws{query}", ws_stats))
+        for _ in range(ws_stats.subscribers)
+    ] + [
+        asyncio.create_task(sse_subscriber(host, port, f"/sse{query}", sse_stats))
+        for _ in range(sse_stats.subscribers)
+    ]
+
+    rss_samples, probe_latencies = [], []
+    sampler_stop = asyncio.Event()
+    sampler = asyncio.create_task(
+        sample_server(host, port, pid, sampler_stop, rss_samples, probe_latencies, args.sample_interval)
+    )
+    # 購読者がつながるのを待ってから送り始める
+    await asyncio.sleep(args.warmup)
+    rss_start = process_tree_rss(pid) if pid is not None else None
+    histogram_names = ("vibelogger_event_loop_lag_seconds", "vibelogger_broadcast_fanout_seconds")
+    histograms_start = await scrape_histograms(host, port, histogram_names)
+
+    ingest = IngestStats()
+    sequence = count()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(
+        ingest_worker(host, port, args, ingest, sequence, started, deadline) for _ in range(args.concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+
+    # 配信の遅れぶんを受け取ってから閉じる
+    await asyncio.sleep(args.drain)
+    sampler_stop.set()
+    for subscriber in subscribers:
+        subscriber.cancel()
+    await asyncio.gather(*subscribers, sampler, return_exceptions=True)
+    rss_end = process_tree_rss(pid) if pid is not None else None
+    histograms_end = await scrape_histograms(host, port, histogram_names)
+
+    # サーバーが計測していればその値（送信開始から受信終了までの差分）を、無ければ応答時間での近似を使う
+    probe = {"path": PROBE_PATH, **(percentiles(probe_latencies) or {})}
+    if histograms_start is not None and histograms_end is not None:
+        loop_lag = {"source": "server", **histogram_delta(histograms_start[histogram_names[0]],
+                                                          histograms_end[histogram_names[0]])}
+        fanout = histogram_delta(histograms_start[histogram_names[1]], histograms_end[histogram_names[1]])
+    else:
+        loop_lag = {"source": "probe", **probe}
+        fanout = None
+
+    def mb(value):
+        return None if value is None else round(value / 1024 / 1024, 1)
+
+    return {
+        "version": RESULT_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "config": {
+            "rate": args.rate,
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "batch": args.batch,
+            "ws": ws_stats.subscribers,
+            "sse": sse_stats.subscribers,
+            "subscribe_query": query,
+            "workers": args.workers,
+            "server": args.server or "local",
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+        },
+        "ingest": {
+            "requests": ingest.requests,
+            "sent": ingest.sent,
+            "accepted": ingest.accepted,
+            "rejected": ingest.rejected,
+            "errors": ingest.errors,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_eps": round(ingest.accepted / elapsed, 1) if elapsed else None,
+            "latency_ms": percentiles(ingest.latencies),
+        },
+        "delivery": {
+            "ws": ws_stats.to_dict(ingest.accepted),
+            "sse": sse_stats.to_dict(ingest.accepted),
+        },
+        "server": {
+            "rss_mb": {
+                "start": mb(rss_start),
+                "peak": mb(max(rss_samples)) if rss_samples else None,
+                "end": mb(rss_end),
+            },
+            "event_loop_lag_ms": loop_lag,
+            "broadcast_fanout_ms": fanout,
+            "probe_latency_ms": probe,
+        },
+    }
+
+
+def summarize(result):
+    ingest = result["ingest"]
+    lines = [
+        f"ingest  : {ingest['accepted']}/{ingest['sent']} accepted, {ingest['rejected']} rejected (429), "
+        f"{ingest['errors']} errors, {ingest['throughput_eps']} events/s",
+    ]
+    if ingest["latency_ms"]:
+        lines.append(f"          request p50 {ingest['latency_ms']['p50']} ms, p99 {ingest['latency_ms']['p99']} ms")
+    for transport, delivery in result["delivery"].items():
+        if not delivery["subscribers"]:
+            continue
+        latency = delivery["latency_ms"] or {}
+        lines.append(
+            f"{transport:<8}: {delivery['connected']}/{delivery['subscribers']} connected, "
+            f"received {delivery['received']}/{delivery['expected']} (loss {delivery['loss_ratio']}), "
+            f"p50 {latency.get('p50')} ms, p99 {latency.get('p99')} ms, max {latency.get('max')} ms"
+        )
+    server = result["server"]
+    lag = server["event_loop_lag_ms"]
+    lines.append(f"server  : RSS {server['rss_mb']}, loop lag ({lag['source']}) "
+                 f"p99 {lag.get('p99', lag.get('p99_le'))} ms, probe p99 {server['probe_latency_ms'].get('p99')} ms")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/ingest with /ws and /sse subscribers attached")
+    parser.add_argument("--rate", type=float, default=500, help="Target events per second (0 = as fast as possible)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to send for")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent ingest connections")
+    parser.add_argument("--batch", type=int, default=0, help="Events per request via /api/ingest/batch (0 = /api/ingest)")
+    parser.add_argument("--ws", type=int, default=10, help="Number of /ws subscribers")
+    parser.add_argument("--sse", type=int, default=10, help="Number of /sse subscribers")
+    parser.add_argument("--subscribe-query", default="", help="Query string for /ws and /sse, e.g. '?batch_ms=250'")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds to wait after subscribing before sending")
+    parser.add_argument("--drain", type=float, default=2.0, help="Seconds to keep receiving after sending stops")
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="Seconds between RSS / loop lag samples")
+    parser.add_argument("--server", help="Use a running server (e.g. http://127.0.0.1:6702) instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="--workers passed to the locally started server")
+    parser.add_argument("--startup-timeout", type=float, default=30, help="Seconds to wait for the local server")
+    parser.add_argument("--output", help="Write the JSON result to this file (default: stdout)")
+    args = parser.parse_args()
+    if args.subscribe_query and not args.subscribe_query.startswith("?"):
+        args.subscribe_query = "?" + args.subscribe_query
+    if args.ws and not _websockets_installed:
+        print("websockets is not installed; skipping /ws subscribers (uv pip install websockets)", file=sys.stderr)
+
+    process = None
+    if args.server:
+        url = urlsplit(args.server)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = "127.0.0.1", free_port()
+        process = start_server(port, args.workers)
+    try:
+        asyncio.run(wait_ready(host, port, args.startup_timeout, process))
+        result = asyncio.run(run(args, host, port, process.pid if process else None))
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    print(summarize(result), file=sys.stderr)
+    output = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
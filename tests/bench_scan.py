@@ -0,0 +1,137 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from bench_encoding import sample_log  # noqa: E402
+from log_reader import LineIndex  # noqa: E402
+from rollups import RollupStore  # noqa: E402
+from scan_executor import scan_executor  # noqa: E402
+from search import SearchQuery, run_search  # noqa: E402
+
+# -----------------------------------------------------------------------------
+# USAGE:
+#   python tests/bench_scan.py                 # -> 512 MB の LOG_DIR、ワーカー数 min(8, CPU 数)
+#   python tests/bench_scan.py 4096 8          # -> 4 GB の LOG_DIR、8 ワーカー
+#   python tests/bench_scan.py 4096 8 /tmp/bench_logs   # 生成した LOG_DIR を残して次回も使う
+#
+# 合成した LOG_DIR（3 プロジェクト、1 ファイル最大 256 MB）の全件走査を、
+# 1 プロセス（従来の逐次走査）と scan_executor のワーカープロセスで比較する。
+#   search  : インデックスで絞り込めない /api/search（q= の正規表現。生の行での絞り込みが効かず、ほぼ一致しないので全行をデコードする）
+#   backfill: RollupStore.backfill()（分・時間バケットの部分集計をワーカーで作って足し合わせる）
+#   index   : 最大のファイルの LineIndex を作る（/api/logs?offset= の初回）
+# どのケースも逐次と並行で結果が同じであることを確かめる。
+# -----------------------------------------------------------------------------
+
+PROJECTS = ["api_backend", "web_frontend", "worker"]
+LEVELS = ["INFO", "DEBUG", "WARNING", "ERROR"]
+OPERATIONS = ["db_query", "http_request", "cache_lookup", "auth_check", "render"]
+MAX_FILE_MB = 256
+LINES_PER_BLOCK = 1000
+
+
+def make_block():
+    """分（MINUTE）だけを後から差し替える 1000 行ぶんのテンプレート"""
+    lines = []
+    for i in range(LINES_PER_BLOCK):
+        log = sample_log(i)
+        log["timestamp"] = f"MINUTE:{i % 60:02d}.{i:06d}+00:00"
+        log["level"] = LEVELS[i % len(LEVELS)]
+        log["operation"] = OPERATIONS[i % len(OPERATIONS)]
+        log["context"]["latency_ms"] = (i * 37) % 2000
+        if i == 500:
+            log["message"] = "Upstream timeout while calling payment gateway"
+        lines.append(json.dumps(log, ensure_ascii=False))
+    return "\n".join(lines) + "\n"
+
+
+def generate(log_dir, size_mb):
+    """size_mb ぶんのログを生成する（既に同じ大きさ以上あれば使い回す）"""
+    existing = sum(path.stat().st_size for path in log_dir.glob("*/*.log"))
+    if existing >= size_mb * 1024 * 1024:
+        return
+    template = make_block()
+    target = size_mb * 1024 * 1024 // len(PROJECTS)
+    minute = 0
+    for project in PROJECTS:
+        project_dir = log_dir / project
+        project_dir.mkdir(parents=True, exist_ok=True)
+        written = 0
+        file_no = 0
+        while written < target:
+            path = project_dir / f"bench_{file_no:04d}.log"
+            file_size = 0
+            with open(path, "w", encoding="utf-8") as f:
+                while file_size < MAX_FILE_MB * 1024 * 1024 and written + file_size < target:
+                    stamp = f"2025-07-{11 + minute // 1440:02d}T{minute // 60 % 24:02d}:{minute % 60:02d}"
+                    block = template.replace("MINUTE", stamp)
+                    f.write(block)
+                    file_size += len(block.encode("utf-8"))
+                    minute += 1
+            written += file_size
+            file_no += 1
+
+
+def bench_search(log_dir, executor):
+    query = SearchQuery(text=r"upstream\s+timeout", regex=True)
+    start = time.perf_counter()
+    results, cursor = run_search(log_dir, query, limit=10 ** 9, max_scan_bytes=1 << 62, executor=executor)
+    return len(results), time.perf_counter() - start
+
+
+def bench_backfill(log_dir, executor):
+    store = RollupStore(log_dir)
+    start = time.perf_counter()
+    lines = store.backfill(executor=executor)
+    return lines, time.perf_counter() - start
+
+
+def bench_index(path):
+    index = LineIndex(path)
+    start = time.perf_counter()
+    index.refresh()
+    return (index.indexed_lines, index.checkpoints[-1]), time.perf_counter() - start
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else min(8, os.cpu_count() or 1)
+    keep_dir = sys.argv[3] if len(sys.argv) > 3 else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_dir = Path(keep_dir or tmp)
+        log_dir.mkdir(parents=True, exist_ok=True)
+        generate(log_dir, size_mb)
+        files = sorted(log_dir.glob("*/*.log"))
+        total_mb = sum(path.stat().st_size for path in files) / 1024 / 1024
+        largest = max(files, key=lambda path: path.stat().st_size)
+
+        cases = [
+            ("search", lambda: bench_search(log_dir, scan_executor)),
+            ("backfill", lambda: bench_backfill(log_dir, scan_executor)),
+            ("index", lambda: bench_index(largest)),
+        ]
+        sizes = {"search": total_mb, "backfill": total_mb, "index": largest.stat().st_size / 1024 / 1024}
+
+        # 逐次（scan_executor を start する前）
+        serial = {name: bench() for name, bench in cases}
+        # ワーカープロセスで並行
+        scan_executor.start(workers)
+        parallel = {name: bench() for name, bench in cases}
+        scan_executor.shutdown()
+
+        print(f"LOG_DIR: {total_mb:.0f} MB in {len(files)} files, workers: {workers}, CPUs: {os.cpu_count()}")
+        print(f"{'case':>8} | {'workers':>7} | {'seconds':>7} | {'MB/s':>7} | {'speedup':>7}")
+        for name, _ in cases:
+            assert serial[name][0] == parallel[name][0], f"{name}: {serial[name][0]} != {parallel[name][0]}"
+            for label, (_, elapsed) in (("1", serial[name]), (str(workers), parallel[name])):
+                print(f"{name:>8} | {label:>7} | {elapsed:>7.2f} | {sizes[name] / elapsed:>7.1f} | "
+                      f"{serial[name][1] / elapsed:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
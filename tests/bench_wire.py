@@ -0,0 +1,96 @@
+import sys
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import encoding  # noqa: E402
+from bench_encoding import sample_log  # noqa: E402
+from wire import WireDecoder, WireEncoder  # noqa: E402
+
+# -----------------------------------------------------------------------------
+# USAGE:
+#   python tests/bench_wire.py            # -> 5,000 events per case
+#   python tests/bench_wire.py 20000
+#
+# WebSocket 1接続あたりの「1イベントの送信バイト数」と「1イベントのエンコード CPU 時間」を、
+# 1フレームにまとめるイベント数 1 / 10 / 100 で比較する。
+#   json   : 現在の JSON テキスト（イベントごとに send_text。エンコードは全購読者で共有）
+#   json+pmd: JSON テキストに permessage-deflate（context takeover あり）をかけた場合の目安
+#   wire   : vibelogger.v1.deflate（接続ごとの文字列辞書 + 接続ごとの deflate ストリーム）
+# -----------------------------------------------------------------------------
+
+BATCH_SIZES = [1, 10, 100]
+
+PROJECTS = ["api_backend", "web_frontend", "worker"]
+OPERATIONS = ["db_query", "http_request", "cache_lookup", "auth_check", "render"]
+LEVELS = ["INFO", "DEBUG", "WARNING", "ERROR"]
+
+
+def make_logs(num_events):
+    logs = []
+    for i in range(num_events):
+        log = sample_log(i)
+        log["project"] = PROJECTS[i % len(PROJECTS)]
+        log["operation"] = OPERATIONS[i % len(OPERATIONS)]
+        log["level"] = LEVELS[i % len(LEVELS)]
+        logs.append(log)
+    return logs
+
+
+def batches(events, size):
+    return [events[i:i + size] for i in range(0, len(events), size)]
+
+
+def bench_json(events, size):
+    start = time.process_time()
+    sent = 0
+    for batch in batches(events, size):
+        for event in batch:
+            sent += len(event.json_bytes)
+    return sent, time.process_time() - start
+
+
+def bench_json_pmd(events, size):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    start = time.process_time()
+    sent = 0
+    for batch in batches(events, size):
+        for event in batch:
+            sent += len(compressor.compress(event.json_bytes) + compressor.flush(zlib.Z_SYNC_FLUSH))
+    return sent, time.process_time() - start
+
+
+def bench_wire(events, size):
+    encoder = WireEncoder()
+    frames = []
+    start = time.process_time()
+    for batch in batches(events, size):
+        frames.append(encoder.encode(batch))
+    elapsed = time.process_time() - start
+
+    # 送ったフレームが元のイベントに戻ることを確かめる（時間には含めない）
+    decoder = WireDecoder()
+    decoded = [payload for frame in frames for payload in decoder.decode(frame)]
+    assert decoded == [event.payload for event in events], "wire round trip mismatch"
+    return sum(len(frame) for frame in frames), elapsed
+
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    events = [encoding.encode_event(log) for log in make_logs(num_events)]
+
+    print(f"JSON backend: {encoding.JSON_BACKEND}, events per case: {num_events}")
+    print(f"{'batch':>5} | {'path':>8} | {'bytes/event':>11} | {'ratio':>6} | {'us/event':>8}")
+    for size in BATCH_SIZES:
+        baseline = None
+        for name, bench in (("json", bench_json), ("json+pmd", bench_json_pmd), ("wire", bench_wire)):
+            sent, elapsed = bench(events, size)
+            baseline = baseline or sent
+            print(f"{size:>5} | {name:>8} | {sent / num_events:>11.1f} | {sent / baseline:>6.3f} | "
+                  f"{elapsed / num_events * 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
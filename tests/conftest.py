@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# backend/ のモジュールはフラットに import される（backend/main.py と同じ）
+sys.path.insert(0, str(ROOT / "backend"))
+# utils パッケージはリポジトリ直下から import する（tests/bench_jsonl.py と同じ）
+sys.path.append(str(ROOT))
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from broadcast import DISCONNECT, DROP_NEWEST, DROP_OLDEST, Subscriber  # noqa: E402
+from encoding import encode_event  # noqa: E402
+
+
+def events(count):
+    return [encode_event({"message": str(i)}) for i in range(count)]
+
+
+def messages(batch):
+    return [event.payload["message"] for event in batch]
+
+
+def test_drop_oldest_keeps_latest():
+    subscriber = Subscriber("ws", maxsize=3, policy=DROP_OLDEST)
+    results = [subscriber.push(event) for event in events(5)]
+    assert results == [True] * 5
+    assert subscriber.dropped == 2
+    assert subscriber.max_lag == 3
+    assert messages(asyncio.run(subscriber.next_batch())) == ["2", "3", "4"]
+    assert subscriber.sent == 3
+
+
+def test_drop_newest_keeps_earliest():
+    subscriber = Subscriber("ws", maxsize=3, policy=DROP_NEWEST)
+    results = [subscriber.push(event) for event in events(5)]
+    assert results == [True, True, True, False, False]
+    assert subscriber.dropped == 2
+    assert not subscriber.closed
+    assert messages(asyncio.run(subscriber.next_batch())) == ["0", "1", "2"]
+
+
+def test_disconnect_closes_subscriber():
+    subscriber = Subscriber("sse", maxsize=3, policy=DISCONNECT)
+    results = [subscriber.push(event) for event in events(5)]
+    assert results == [True, True, True, False, False]
+    # 切断した後に届いたものは捨てたとは数えない
+    assert subscriber.dropped == 1
+    assert subscriber.closed
+
+
+def test_closed_subscriber_returns_empty_batch():
+    subscriber = Subscriber("ws", maxsize=3)
+    subscriber.close()
+    assert not subscriber.push(events(1)[0])
+    assert asyncio.run(subscriber.next_batch()) == []
+
+
+def test_skips_replayed_ids():
+    subscriber = Subscriber("sse", maxsize=10)
+    subscriber.replay_until = 2
+    batch = events(4)
+    for event_id, event in enumerate(batch, 1):
+        event.set_id(event_id)
+        assert subscriber.push(event)
+    assert messages(asyncio.run(subscriber.next_batch())) == ["2", "3"]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Subscriber("ws", policy="block")
@@ -0,0 +1,200 @@
+import asyncio
+
+import pytest
+
+from bus import UnixSocketBus
+from encoding import encode_event
+from shared_ring import SharedEventRing
+
+
+class Worker:
+    """1つのワーカー相当: 共有リングに記録してからバスで送り、届いたイベントを控える"""
+
+    def __init__(self, bus_dir, ring, pid, **kwargs):
+        self.ring = ring
+        self.bus = UnixSocketBus(bus_dir, pid=pid, **kwargs)
+        self.received = []
+
+    async def start(self):
+        await self.bus.start(self.received.append, self.ring)
+
+    async def stop(self):
+        await self.bus.stop()
+
+    def publish(self, message):
+        event = encode_event({"project": "p", "message": message})
+        self.ring.record(event)
+        self.bus.publish(event)
+        return event.id
+
+
+async def settle(predicate, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def messages(events):
+    return [event.payload["message"] for event in events]
+
+
+@pytest.fixture
+def ring(tmp_path):
+    rings = []
+
+    def open_ring(capacity=1024 * 1024):
+        r = SharedEventRing(tmp_path / "events.ring", capacity)
+        rings.append(r)
+        return r
+
+    yield open_ring
+    for r in rings:
+        r.close()
+
+
+def test_round_trip_without_duplicates(tmp_path, ring):
+    async def main():
+        a = Worker(tmp_path / "bus", ring(), 1001, discovery_interval=60)
+        b = Worker(tmp_path / "bus", ring(), 1002, discovery_interval=60)
+        await a.start()
+        await b.start()
+        try:
+            ids = [a.publish(f"a{i}") for i in range(50)]
+            b.publish("b0")
+            await settle(lambda: len(b.received) == 50 and len(a.received) == 1)
+            await asyncio.sleep(0.05)
+            assert messages(b.received) == [f"a{i}" for i in range(50)]
+            # 送信元で採番した ID のまま届く
+            assert [event.id for event in b.received] == ids
+            assert messages(a.received) == ["b0"]
+            assert b.bus.stats()["duplicates"] == 0
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(main())
+
+
+def test_new_worker_is_reachable_when_start_returns(tmp_path, ring):
+    async def main():
+        (tmp_path / "bus").mkdir()
+        # 待ち受けているプロセスのいないソケットは削除される
+        (tmp_path / "bus" / "999.sock").touch()
+        a = Worker(tmp_path / "bus", ring(), 1001, discovery_interval=60)
+        await a.start()
+        assert not (tmp_path / "bus" / "999.sock").exists()
+        b = Worker(tmp_path / "bus", ring(), 1002, discovery_interval=60)
+        await b.start()
+        try:
+            # a の discovery を待たずに、b の start() が終わった時点で a から b へ届く
+            assert a.bus.stats()["peers"] == [1002]
+            a.publish("first")
+            await settle(lambda: b.received)
+            assert messages(b.received) == ["first"]
+        finally:
+            await b.stop()
+        # 止まったワーカーは次の discovery で忘れる
+        await settle(lambda: not a.bus.stats()["peers"])
+        await a.bus._discover()
+        assert not a.bus._peers
+        await a.stop()
+
+    asyncio.run(main())
+
+
+def test_overflow_resyncs_from_ring(tmp_path, ring):
+    async def main():
+        a = Worker(tmp_path / "bus", ring(), 1001, discovery_interval=60, max_buffer=256)
+        b = Worker(tmp_path / "bus", ring(), 1002, discovery_interval=60)
+        await a.start()
+        await b.start()
+        try:
+            # await せずに積むので、キューが max_buffer を超えて ID だけが控えられる
+            for i in range(200):
+                a.publish(f"m{i}")
+            assert a.bus._peers[1002].resync_ids
+            await settle(lambda: len(b.received) == 200)
+            await asyncio.sleep(0.05)
+            assert messages(b.received) == [f"m{i}" for i in range(200)]
+            stats = a.bus.stats()
+            assert stats["resynced"] > 0
+            assert stats["lost"] == 0
+            assert stats["pending"] == {}
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(main())
+
+
+def test_overflow_counts_events_overwritten_in_ring(tmp_path, ring):
+    async def main():
+        shared = ring(capacity=4096)
+        a = Worker(tmp_path / "bus", shared, 1001, discovery_interval=60, max_buffer=64)
+        b = Worker(tmp_path / "bus", shared, 1002, discovery_interval=60)
+        await a.start()
+        await b.start()
+        try:
+            for i in range(300):
+                a.publish(f"m{i}")
+            await settle(lambda: a.bus.stats()["pending"] == {})
+            await asyncio.sleep(0.05)
+            stats = a.bus.stats()
+            assert stats["lost"] > 0
+            assert len(b.received) + stats["lost"] == 300
+            # 届いたものは順序どおりで重複しない（最新のものは必ず届く）
+            received = messages(b.received)
+            assert received == sorted(set(received), key=lambda m: int(m[1:]))
+            assert received[-1] == "m299"
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(main())
+
+
+def test_reconnect_resends_unsent_events_once(tmp_path, ring):
+    async def main():
+        a = Worker(tmp_path / "bus", ring(), 1001, discovery_interval=60)
+        b = Worker(tmp_path / "bus", ring(), 1002, discovery_interval=60)
+        await a.start()
+        await b.start()
+        try:
+            a.publish("before")
+            await settle(lambda: len(b.received) == 1)
+            # a から b への接続を切り、切れているあいだのイベントは次の接続で送る
+            peer = a.bus._peers[1002]
+            peer.writer.close()
+            await settle(lambda: not peer.sending)
+            for i in range(3):
+                a.publish(f"during{i}")
+            await a.bus._discover()
+            await settle(lambda: len(b.received) == 4)
+            await asyncio.sleep(0.05)
+            assert messages(b.received) == ["before", "during0", "during1", "during2"]
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(main())
+
+
+def test_receiver_drops_repeated_ids(tmp_path, ring):
+    async def main():
+        a = Worker(tmp_path / "bus", ring(), 1001, discovery_interval=60)
+        b = Worker(tmp_path / "bus", ring(), 1002, discovery_interval=60)
+        await a.start()
+        await b.start()
+        try:
+            event = encode_event({"project": "p", "message": "once"})
+            a.ring.record(event)
+            a.bus.publish(event)
+            a.bus.publish(event)
+            await settle(lambda: b.bus.stats()["duplicates"] == 1)
+            assert messages(b.received) == ["once"]
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+import catalog as catalog_module
+from catalog import ProjectCatalog
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(catalog_module, "time", clock)
+    return clock
+
+
+def line(i):
+    return (json.dumps({"timestamp": f"2024-01-01T00:00:{i:02d}", "message": str(i)}) + "\n").encode("utf-8")
+
+
+def write(catalog, path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    offset = path.stat().st_size if path.exists() else 0
+    with open(path, "ab") as f:
+        f.write(data)
+    catalog.on_write(path, offset, data)
+
+
+def test_new_file_changes_etag_immediately(tmp_path, clock):
+    catalog = ProjectCatalog(tmp_path, stats_interval=10)
+    before = catalog.etag
+    write(catalog, tmp_path / "p" / "a.log", line(0))
+    assert catalog.etag != before
+
+
+def test_stats_changes_are_batched(tmp_path, clock):
+    catalog = ProjectCatalog(tmp_path, stats_interval=10)
+    path = tmp_path / "p" / "a.log"
+    write(catalog, path, line(0))
+    etag = catalog.etag
+    for i in range(1, 5):
+        clock.now += 1
+        write(catalog, path, line(i))
+        # 書き込みのたびには変わらない
+        assert catalog.etag == etag
+    clock.now += 10
+    changed = catalog.etag
+    assert changed != etag
+    assert catalog.etag == changed
+
+    _, projects = catalog.snapshot()
+    (info,) = dict(projects)["p"]
+    assert info["entries"] == 5
+    assert info["first_timestamp"] == "2024-01-01T00:00:00"
+    assert info["last_timestamp"] == "2024-01-01T00:00:04"
+
+
+def test_no_change_keeps_etag(tmp_path, clock):
+    catalog = ProjectCatalog(tmp_path, stats_interval=0)
+    write(catalog, tmp_path / "p" / "a.log", line(0))
+    etag = catalog.etag
+    catalog.rescan()
+    catalog.fill_details()
+    assert catalog.etag == etag
+
+
+def test_rescan_picks_up_other_writers(tmp_path, clock):
+    catalog = ProjectCatalog(tmp_path, stats_interval=10)
+    (tmp_path / "p").mkdir()
+    (tmp_path / "p" / "a.log").write_bytes(line(0))
+    catalog.rescan()
+    catalog.fill_details()
+    etag = catalog.etag
+    # 他のプロセスによる追記（サイズの変化）は統計の変化として扱う
+    with open(tmp_path / "p" / "a.log", "ab") as f:
+        f.write(line(1))
+    catalog.rescan()
+    assert catalog.etag == etag
+    # ファイルの追加はすぐに反映する
+    (tmp_path / "p" / "b.log").write_bytes(line(2))
+    catalog.rescan()
+    assert catalog.etag != etag
+
+
+def test_rotate_and_remove(tmp_path, clock):
+    catalog = ProjectCatalog(tmp_path, stats_interval=10)
+    path = tmp_path / "p" / "a.log"
+    write(catalog, path, line(0))
+    etag = catalog.etag
+    rotated = tmp_path / "p" / "a.log.1"
+    path.rename(rotated)
+    catalog.on_rotate(path, rotated)
+    assert catalog.etag != etag
+    assert catalog.file_info("p", "a.log.1").entries == 1
+    etag = catalog.etag
+    catalog.on_remove([rotated])
+    assert catalog.etag != etag
+    assert catalog.snapshot()[1] == []
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from coalesce import CoalesceOptions, coalesce, collapse_duplicates
+from encoding import encode_event
+
+
+def log(message, level="INFO", project="p", operation="op", timestamp="t"):
+    return {"project": project, "level": level, "operation": operation, "message": message, "timestamp": timestamp}
+
+
+def test_from_params():
+    assert CoalesceOptions.from_params(None) is None
+    assert CoalesceOptions.from_params(0, 10) is None
+    options = CoalesceOptions.from_params(250, 50, dedupe=True)
+    assert options.to_dict() == {"batch_ms": 250, "batch_max": 50, "dedupe": True}
+    # dedupe だけならまとめる間隔は 0（溜まっている分だけをまとめる）
+    assert CoalesceOptions.from_params(None, dedupe=True).interval == 0
+
+
+@pytest.mark.parametrize("batch_ms, batch_max", [(-1, None), (10001, None), (100, 0), (100, 10001)])
+def test_from_params_invalid(batch_ms, batch_max):
+    with pytest.raises(ValueError):
+        CoalesceOptions.from_params(batch_ms, batch_max)
+
+
+def test_collapse_duplicates():
+    logs = [log("a", timestamp="1"), log("b", timestamp="2"), log("a", timestamp="3"),
+            log("a", level="ERROR", timestamp="4"), log("a", timestamp="5")]
+    collapsed, count = collapse_duplicates(logs)
+    assert count == 2
+    assert [(item["message"], item["level"], item.get("repeat")) for item in collapsed] == [
+        ("a", "INFO", 3), ("b", "INFO", None), ("a", "ERROR", None)]
+    assert collapsed[0]["first_timestamp"] == "1" and collapsed[0]["last_timestamp"] == "5"
+    # 元のログ辞書は書き換えない
+    assert "repeat" not in logs[0]
+
+
+def test_collapse_duplicates_uses_context_project():
+    logs = [{"message": "a", "context": {"project": "x"}}, {"message": "a", "context": {"project": "y"}},
+            {"message": "a", "project": "x"}]
+    collapsed, count = collapse_duplicates(logs)
+    assert count == 1
+    assert collapsed[0]["repeat"] == 2
+
+
+def test_coalesce_batches_logs_after_messages():
+    events = [encode_event(log("a")), encode_event({"type": "metrics"}), encode_event([log("b"), log("c")])]
+    for event_id, event in enumerate(events, 1):
+        event.set_id(event_id)
+    frames, collapsed = coalesce(events)
+    assert collapsed == 0
+    assert [frame.payload for frame in frames[:1]] == [{"type": "metrics"}]
+    assert [item["message"] for item in frames[1].payload] == ["a", "b", "c"]
+    # まとめたフレームの SSE の id は最後のイベントのもの
+    assert frames[1].id == 3
+
+
+def test_coalesce_single_event_is_sent_as_is():
+    event = encode_event(log("a"))
+    frames, collapsed = coalesce([event])
+    assert frames == [event] and collapsed == 0
+    frames, collapsed = coalesce([event], dedupe=True)
+    assert isinstance(frames[0].payload, list) and collapsed == 0
+
+
+def test_coalesce_dedupe():
+    events = [encode_event(log("same")) for _ in range(5)] + [encode_event(log("other"))]
+    frames, collapsed = coalesce(events, dedupe=True)
+    assert collapsed == 4
+    assert [(item["message"], item.get("repeat")) for item in frames[0].payload] == [("same", 5), ("other", None)]
+
+
+def test_subscriber_next_frames():
+    pytest.importorskip("fastapi")
+    from broadcast import Subscriber
+
+    async def run():
+        subscriber = Subscriber("ws", coalesce=CoalesceOptions(0.05, max_events=3, dedupe=True))
+        for i in range(5):
+            subscriber.push(encode_event(log("same" if i < 4 else "other")))
+        first = await subscriber.next_frames()
+        second = await subscriber.next_frames()
+        return subscriber, first, second
+
+    subscriber, first, second = asyncio.run(run())
+    # max_events 件でフレームを区切り、入りきらなかった分は次のフレームに回す
+    assert [(item["message"], item.get("repeat")) for item in first[0].payload] == [("same", 3)]
+    assert [item["message"] for item in second[0].payload] == ["same", "other"]
+    assert subscriber.collapsed == 2 and subscriber.lag == 0
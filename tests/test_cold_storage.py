@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+
+import pytest
+
+from cold_storage import TMP_DIR_NAME, Compactor, is_compressed, locate_line, open_log, stat_log
+from log_writer import LogWriter
+
+
+def write_lines(path, start, count):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(b"".join(b'{"n": %d}\n' % i for i in range(start, start + count)))
+
+
+def read_numbers(paths):
+    numbers = []
+    for path in paths:
+        with open_log(path) as f:
+            numbers.extend(json.loads(line)["n"] for line in f.read().splitlines())
+    return numbers
+
+
+@pytest.fixture
+def compactor(tmp_path):
+    return Compactor(tmp_path, min_age=0, block_size=64)
+
+
+def test_compact_round_trip(tmp_path, compactor):
+    path = tmp_path / "p" / "op.log"
+    write_lines(path, 0, 100)
+    original = path.read_bytes()
+
+    target = compactor.compact_file(path)
+    assert target == tmp_path / "p" / "op.log.gz"
+    assert is_compressed(target) and not path.exists()
+    assert stat_log(target)[1] == len(original)
+    with open_log(target) as f:
+        assert f.read() == original
+        f.seek(500)
+        assert f.read(30) == original[500:530]
+
+    offset, line = locate_line(target, 50)
+    assert line <= 50
+    assert original[:offset].count(b"\n") == line
+
+
+def test_tmp_files_are_outside_project_dirs(tmp_path, compactor, monkeypatch):
+    path = tmp_path / "p" / "op.log"
+    write_lines(path, 0, 10)
+    seen = []
+    listener = type("Listener", (), {"on_compact": lambda self, old, new: seen.append(
+        sorted(p.name for p in (tmp_path / "p").glob("*.log*")))})()
+    compactor.add_listener(listener)
+    compactor.compact_file(path)
+    # 圧縮中の一時ファイルは *.log* で列挙されるプロジェクトのディレクトリには置かない
+    assert seen == [["op.log", "op.log.gz"]]
+    assert (tmp_path / TMP_DIR_NAME / "p").is_dir()
+    assert list((tmp_path / TMP_DIR_NAME / "p").iterdir()) == []
+    assert TMP_DIR_NAME not in [p.name for p in compactor.candidates()]
+
+
+def test_existing_archive_is_not_overwritten(tmp_path, compactor):
+    path = tmp_path / "p" / "op.log"
+    write_lines(path, 0, 5)
+    first = compactor.compact_file(path)
+    write_lines(path, 5, 5)
+    second = compactor.compact_file(path)
+    assert second == tmp_path / "p" / "op.log.1.gz"
+    assert read_numbers([first, second]) == list(range(10))
+
+
+def test_candidates_skip_active_and_compressed(tmp_path, compactor):
+    for name in ("a.log", "b.log", "c.log.gz"):
+        write_lines(tmp_path / "p" / name, 0, 1)
+    assert compactor.candidates(active=[tmp_path / "p" / "b.log"]) == [tmp_path / "p" / "a.log"]
+
+
+@pytest.mark.parametrize("lock_files", [False, True])
+def test_compaction_does_not_lose_concurrent_writes(tmp_path, compactor, lock_files):
+    # 追記し続けているファイルを圧縮しても、書き込みは圧縮済みファイルか新しく作られたファイルのどちらかに残る
+    writer = LogWriter(flush_interval=0.001, max_file_size_mb=0, lock_files=lock_files)
+    writer.start()
+    path = tmp_path / "p" / "op.log"
+    write_lines(path, 0, 1)
+    stop = threading.Event()
+
+    def compact_loop():
+        while not stop.is_set():
+            if path.exists():
+                compactor.compact_file(path)
+
+    thread = threading.Thread(target=compact_loop)
+    thread.start()
+    count = 1
+    deadline = time.monotonic() + 10
+    try:
+        while count < 2000 or (compactor.compacted_files < 3 and time.monotonic() < deadline):
+            while not writer.submit_nowait(path, '{"n": %d}\n' % count):
+                time.sleep(0.001)
+            count += 1
+            if count % 20 == 0:
+                writer.flush()
+                # 圧縮が終わる隙間を作る
+                time.sleep(0.01 if count % 200 == 0 else 0.001)
+    finally:
+        writer.flush()
+        stop.set()
+        thread.join()
+        writer.stop()
+
+    assert compactor.compacted_files >= 1
+    files = sorted((tmp_path / "p").glob("*.log*"))
+    assert sorted(read_numbers(files)) == list(range(count))
@@ -0,0 +1,167 @@
+import io
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from cold_storage import Compactor
+from columnar import ColumnarStore, flatten_context, parse_timestamp
+
+
+def log(n, operation="db", level="INFO", hour=0, **context):
+    return {"timestamp": f"2024-01-01T{hour:02d}:00:{n % 60:02d}+00:00", "level": level, "operation": operation,
+            "message": f"m{n}", "context": context}
+
+
+def age(path, seconds=3600):
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def write(path, logs, seconds=3600):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("".join(json.dumps(item) + "\n" for item in logs), "utf-8")
+    return age(path, seconds)
+
+
+def test_flatten_context():
+    assert flatten_context({"a": 1, "b": {"c": 2, "d": {"e": 3}}}) == \
+        {"context.a": 1, "context.b.c": 2, "context.b.d.e": 3}
+
+
+def test_parse_timestamp():
+    utc = datetime(2024, 1, 1, 0, 0, tzinfo=timezone.utc)
+    assert parse_timestamp("2024-01-01T00:00:00Z") == utc
+    assert parse_timestamp("2024-01-01T09:00:00+09:00") == utc
+    assert parse_timestamp("2024-01-01T00:00:00") == utc
+    assert parse_timestamp("yesterday") is None
+    assert parse_timestamp(None) is None
+
+
+@pytest.fixture
+def pa():
+    return pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def store(pa, tmp_path):
+    return ColumnarStore(tmp_path, min_age=60, compression="snappy")
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    """api に圧縮済みのファイルと通常のファイル、web に型の違う context を持つファイル"""
+    write(tmp_path / "api" / "op.log.20240101_000000", [
+        log(0, "db", "INFO", latency_ms=10, user={"id": "u0"}),
+        log(1, "db", "ERROR", latency_ms=30, retry=True),
+    ])
+    age(Compactor(tmp_path, min_age=0, block_size=64).compact_file(tmp_path / "api" / "op.log.20240101_000000"))
+    write(tmp_path / "api" / "op.log", [
+        log(2, "db", "INFO", hour=1, latency_ms=20),
+        log(3, "http", "WARNING", hour=1, latency_ms=5),
+        {"broken": True},
+    ])
+    write(tmp_path / "web" / "render.log", [log(4, "render", "INFO", latency_ms="slow")])
+    return tmp_path
+
+
+def test_convert_file(pa, store, log_dir):
+    pq = pytest.importorskip("pyarrow.parquet")
+    target = store.convert_file(log_dir / "api" / "op.log.20240101_000000.gz")
+    # 圧縮済みのファイルは拡張子を除いた名前で変換する
+    assert target == log_dir / ".columnar" / "api" / "op.log.20240101_000000.parquet"
+    table = pq.read_table(target)
+    assert table.num_rows == 2
+    assert table["project"].to_pylist() == ["api", "api"]
+    assert table.schema.field("timestamp").type == pa.timestamp("us", tz="UTC")
+    assert table.schema.field("context.latency_ms").type == pa.float64()
+    assert table.schema.field("context.retry").type == pa.bool_()
+    assert table["context.user.id"].to_pylist() == ["u0", None]
+    assert table["context.retry"].to_pylist() == [None, True]
+
+    # timestamp などの無いオブジェクトも1行として変換する（列は null）
+    table = pq.read_table(store.convert_file(log_dir / "api" / "op.log"))
+    assert table.num_rows == 3
+    assert store.stats()["converted_files"] == 2
+    assert store.stats()["converted_rows"] == 5
+
+
+def test_candidates_skip_active_recent_and_current(store, log_dir):
+    active = log_dir / "api" / "op.log"
+    assert store.candidates(active=[active]) == [log_dir / "api" / "op.log.20240101_000000.gz",
+                                                 log_dir / "web" / "render.log"]
+    recent = write(log_dir / "web" / "new.log", [log(5)], seconds=0)
+    assert recent not in store.candidates()
+
+    assert store.run_once(active=[active]) == 2
+    assert store.candidates(active=[active]) == []
+    # 変換した後に伸びたファイルは変換し直す
+    with open(log_dir / "web" / "render.log", "a") as f:
+        f.write(json.dumps(log(6, "render")) + "\n")
+    age(log_dir / "web" / "render.log")
+    assert store.candidates(active=[active]) == [log_dir / "web" / "render.log"]
+
+
+def test_remove_orphans(store, log_dir):
+    store.run_once()
+    assert len(store.files()) == 3
+    assert store.remove_orphans() == 0
+    (log_dir / "api" / "op.log").unlink()
+    (log_dir / "web" / "render.log").unlink()
+    assert store.remove_orphans() == 2
+    # 圧縮済みの変換元が残っているものは消さない
+    assert store.files() == [log_dir / ".columnar" / "api" / "op.log.20240101_000000.parquet"]
+    assert store.stats()["removed_files"] == 2
+
+
+def test_aggregate(store, log_dir):
+    store.run_once()
+    rows = store.aggregate(group_by=["operation"], fields=["context.latency_ms"], projects=["api"])
+    by_operation = {row["operation"]: row for row in rows}
+    assert {operation: row["count"] for operation, row in by_operation.items()} == {"db": 3, "http": 1, None: 1}
+    db = by_operation["db"]["context.latency_ms"]
+    assert (db["min"], db["max"], db["sum"], db["mean"]) == (10, 30, 60, 20)
+    assert db["p50"] == pytest.approx(20, rel=0.1)
+
+    rows = store.aggregate(group_by=["project"], levels=["error", "warning"])
+    assert [(row["project"], row["count"]) for row in rows] == [("api", 2)]
+
+    rows = store.aggregate(group_by=["operation"], interval="hour", projects=["api"], operations=["db"])
+    assert [(row["bucket"], row["count"]) for row in rows] == [
+        ("2024-01-01T00:00:00+00:00", 2), ("2024-01-01T01:00:00+00:00", 1)]
+
+    # 時刻の無い行は時刻の条件に一致しない
+    rows = store.aggregate(group_by=[], since="2024-01-01T01:00:00+00:00")
+    assert [row["count"] for row in rows] == [2]
+
+    with pytest.raises(ValueError):
+        store.aggregate(group_by=["bucket"])
+    with pytest.raises(ValueError):
+        store.aggregate(interval="week")
+    with pytest.raises(ValueError):
+        # web の latency_ms は文字列なので、合わせた型は文字列になる
+        store.aggregate(fields=["context.latency_ms"])
+
+
+def test_export(pa, store, log_dir):
+    ipc = pytest.importorskip("pyarrow.ipc")
+    pq = pytest.importorskip("pyarrow.parquet")
+    store.run_once()
+    columns = ["timestamp", "project", "operation", "context.latency_ms", "context.missing"]
+
+    table = pq.read_table(io.BytesIO(b"".join(store.export("parquet", columns=columns))))
+    assert table.column_names == columns
+    assert table.num_rows == 6
+    # ファイルごとに型が違う列は共通の型に揃え、どのファイルにも無い列は null
+    assert table.schema.field("context.latency_ms").type == pa.string()
+    assert table["context.missing"].null_count == 6
+
+    chunks = list(store.export("arrow", projects=["api"], levels=["INFO"], columns=["project", "message"]))
+    table = ipc.open_stream(b"".join(chunks)).read_all()
+    assert sorted(table["message"].to_pylist()) == ["m0", "m2"]
+
+    with pytest.raises(ValueError):
+        store.export("csv")
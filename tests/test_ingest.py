@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi import HTTPException  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from log_writer import LogWriter  # noqa: E402
+from logger_cache import LoggerCache  # noqa: E402
+
+
+def log(message, project="p", operation="op", level="INFO"):
+    return {"project": project, "operation": operation, "level": level, "message": message}
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    """LOG_DIR を一時ディレクトリに、ライターを起動していない（キューに溜まるだけの）ものにしたアプリ"""
+    writer = LogWriter(max_queue_size=100)
+    monkeypatch.setattr(main, "LOG_DIR", tmp_path)
+    monkeypatch.setattr(main, "log_writer", writer)
+    monkeypatch.setattr(main, "loggers", LoggerCache(max_size=100, on_evict=main.release_logger))
+    client = TestClient(main.app)
+    client.writer = writer
+    return client
+
+
+def test_parse_json_array():
+    body = json.dumps([log("a"), {"project": "p", "message": 1}, log("c")]).encode("utf-8")
+    accepted, rejected = main.parse_ingest_batch(body)
+    assert [(index, item.message) for index, item in accepted] == [(0, "a"), (2, "c")]
+    assert [item["index"] for item in rejected] == [1]
+
+
+def test_parse_ndjson_keeps_line_numbers():
+    lines = [json.dumps(log("a")), "", "not json", json.dumps(log("d"))]
+    accepted, rejected = main.parse_ingest_batch("\n".join(lines).encode("utf-8"))
+    assert [(index, item.message) for index, item in accepted] == [(0, "a"), (3, "d")]
+    assert [item["index"] for item in rejected] == [2]
+
+
+@pytest.mark.parametrize("body", [b"[{", b'[{"message": "\xff"}]'])
+def test_parse_invalid_array(body):
+    with pytest.raises(HTTPException) as e:
+        main.parse_ingest_batch(body)
+    assert e.value.status_code == 400
+
+
+def test_batch_invalid_utf8(app):
+    response = app.post("/api/ingest/batch", content=b'[{"message": "\xff"}]')
+    assert response.status_code == 400
+    response = app.post("/api/ingest/batch", content=b'{"message": "\xff"}\n{"message": "ok"}')
+    assert response.status_code == 200
+    assert response.json()["rejected"] == 1
+
+
+@pytest.mark.parametrize("encode", [
+    lambda logs: json.dumps(logs),
+    lambda logs: "\n".join(json.dumps(item) for item in logs),
+])
+def test_batch_too_large(app, monkeypatch, encode):
+    monkeypatch.setattr(main, "MAX_INGEST_BATCH_SIZE", 2)
+    response = app.post("/api/ingest/batch", content=encode([log("a"), log("b"), log("c")]))
+    assert response.status_code == 413
+    assert app.writer.queue_depth == 0
+
+
+def test_batch_groups_writes(app):
+    logs = [log("a"), log("b", operation="other"), log("c")]
+    response = app.post("/api/ingest/batch", content=json.dumps(logs))
+    assert response.status_code == 200
+    assert response.json()["accepted"] == 3
+    # (project, operation) ごとに1回の書き込み
+    assert app.writer.queue_depth == 2
+
+
+def test_batch_rejected_when_queue_full(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "log_writer", LogWriter(max_queue_size=3))
+    logs = [log("a"), log("b", operation="other", project="new")]
+    response = app.post("/api/ingest/batch", content=json.dumps(logs))
+    assert response.status_code == 429
+    assert main.log_writer.queue_depth == 0
+    # 拒否したリクエストではロガーを作らない
+    assert len(main.loggers) == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_ingest_rejected_when_queue_full(app, monkeypatch, tmp_path):
+    writer = LogWriter(max_queue_size=2)
+    monkeypatch.setattr(main, "log_writer", writer)
+    assert app.post("/api/ingest", json=log("a")).status_code == 200
+    assert app.post("/api/ingest", json=log("b", project="new")).status_code == 429
+    assert writer.queue_depth == 1
+    assert len(main.loggers) == 1
+    assert [p.name for p in tmp_path.iterdir()] == ["p"]
+
+
+def test_ingest_leaves_room_for_evicted_logger(app, monkeypatch):
+    # ロガーの追い出しで入る「ファイルを閉じる」指示の分も空きを見込むので、キューがあふれて書き込みを待つことはない
+    writer = LogWriter(max_queue_size=3)
+    monkeypatch.setattr(main, "log_writer", writer)
+    monkeypatch.setattr(main, "loggers", LoggerCache(max_size=1, on_evict=main.release_logger))
+    assert app.post("/api/ingest", json=log("a", operation="first")).status_code == 200
+    assert app.post("/api/ingest", json=log("b", operation="second")).status_code == 200
+    assert writer.queue_depth == 3
+    assert app.post("/api/ingest", json=log("c", operation="third")).status_code == 429
+    assert writer.queue_depth == 3
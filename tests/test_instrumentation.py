@@ -0,0 +1,121 @@
+import pytest
+
+from instrumentation import CONTENT_TYPE, CallbackMetric, Registry
+
+
+def samples(text):
+    """コメント以外の行を {"名前{ラベル}": 値} にする"""
+    result = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            key, value = line.rsplit(" ", 1)
+            result[key] = value
+    return result
+
+
+def test_render_counter_gauge_and_histogram():
+    registry = Registry()
+    registry.counter("requests_total", "Requests", lambda: {(("code", "200"),): 3, (("code", "500"),): 1})
+    registry.gauge("queue_depth", "Queue depth", lambda: 2.5)
+    registry.gauge("unknown", "Skipped when None", lambda: None)
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0), label="endpoint")
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.labels("/a").observe(value)
+    # 同じ名前で登録し直しても同じヒストグラム
+    assert registry.histogram("latency_seconds", "Latency") is histogram
+
+    text = registry.render()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    assert lines[:4] == ["# HELP requests_total Requests", "# TYPE requests_total counter",
+                         'requests_total{code="200"} 3', 'requests_total{code="500"} 1']
+    assert "# TYPE queue_depth gauge" in lines
+    assert "# TYPE unknown gauge" in lines
+    assert "# TYPE latency_seconds histogram" in lines
+    assert samples(text) == {
+        'requests_total{code="200"}': "3",
+        'requests_total{code="500"}': "1",
+        "queue_depth": "2.5",
+        # バケットは累積で、le は境界以下を数える
+        'latency_seconds_bucket{endpoint="/a",le="0.1"}': "2",
+        'latency_seconds_bucket{endpoint="/a",le="1"}': "3",
+        'latency_seconds_bucket{endpoint="/a",le="+Inf"}': "4",
+        'latency_seconds_sum{endpoint="/a"}': "2.65",
+        'latency_seconds_count{endpoint="/a"}': "4",
+    }
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.gauge("odd", "Odd labels", lambda: {(("path", 'C:\\logs\\"a"\nb'),): 1})
+    histogram = registry.histogram("h", "Histogram", buckets=(1.0,), label="name").labels('say "hi"')
+    histogram.observe(0.5)
+    lines = registry.render().splitlines()
+    assert 'odd{path="C:\\\\logs\\\\\\"a\\"\\nb"} 1' in lines
+    assert 'h_count{name="say \\"hi\\""} 1' in lines
+    # 値に改行があっても1サンプルは1行
+    assert all(line.startswith(("#", "odd", "h_")) for line in lines)
+
+
+def test_failing_callback_does_not_break_render():
+    registry = Registry()
+    registry.gauge("broken", "Raises", lambda: 1 / 0)
+    registry.gauge("ok", "Works", lambda: 1)
+    text = registry.render()
+    assert "# broken failed: division by zero" in text.splitlines()
+    assert samples(text) == {"ok": "1"}
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    import main
+    from log_writer import LogWriter
+    from logger_cache import LoggerCache
+
+    monkeypatch.setattr(main, "LOG_DIR", tmp_path)
+    monkeypatch.setattr(main, "log_writer", LogWriter(max_queue_size=100))
+    monkeypatch.setattr(main, "loggers", LoggerCache(max_size=100, on_evict=main.release_logger))
+    client = TestClient(main.app)
+    client.main = main
+    return client
+
+
+def test_internal_metrics_endpoint(app, monkeypatch):
+    def scrape():
+        response = app.get("/api/internal/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == CONTENT_TYPE
+        return response.text
+
+    # 計測対象のエンドポイントを1回呼ぶと、ヒストグラムとステータスごとのカウンタが増える
+    app.get("/api/projects")
+    before = samples(scrape())
+    assert app.get("/api/projects").status_code == 200
+    text = scrape()
+    after = samples(text)
+    lines = text.splitlines()
+    for name, kind in [("vibelogger_http_request_duration_seconds", "histogram"),
+                       ("vibelogger_http_requests_total", "counter"),
+                       ("vibelogger_log_writer_queue_depth", "gauge"),
+                       ("vibelogger_logger_cache_max_size", "gauge")]:
+        assert f"# TYPE {name} {kind}" in lines
+
+    count = 'vibelogger_http_request_duration_seconds_count{endpoint="/api/projects"}'
+    inf = 'vibelogger_http_request_duration_seconds_bucket{endpoint="/api/projects",le="+Inf"}'
+    requests = 'vibelogger_http_requests_total{endpoint="/api/projects",code="200"}'
+    assert int(after[count]) == int(before[count]) + 1
+    assert after[inf] == after[count]
+    assert int(after[requests]) == int(before[requests]) + 1
+    assert after["vibelogger_logger_cache_max_size"] == "100"
+    assert after["vibelogger_log_writer_queue_depth"] == "0"
+    # 計測対象でないパス（/api/internal/metrics 自身）は数えない
+    assert not any("/api/internal/metrics" in key for key in after)
+
+    # レジストリに登録したメトリクスのラベルはエスケープして返す
+    monkeypatch.setitem(app.main.registry._metrics, "test_escaped", CallbackMetric(
+        "test_escaped", "Escaping", "gauge", lambda: {(("value", 'a"b\\c\nd'),): 1}))
+    assert 'test_escaped{value="a\\"b\\\\c\\nd"} 1' in scrape().splitlines()
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from utils.jsonl_reader import JSONLReader, iter_jsonl_batches, read_jsonl
+
+
+def record(n):
+    return {"n": n, "level": "INFO", "context": {"latency_ms": n * 10, "user": {"id": f"u{n}"}}}
+
+
+def write(path, lines, newline_at_end=True):
+    data = "\n".join(lines) + ("\n" if newline_at_end else "")
+    path.write_text(data, "utf-8")
+    return path
+
+
+def lines(count):
+    return [json.dumps(record(n)) for n in range(count)]
+
+
+def numbers(reader):
+    return [row["n"] for batch in reader for row in batch.rows()]
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 64, 1024 * 1024])
+def test_reads_all_records_at_any_block_size(tmp_path, block_size):
+    path = write(tmp_path / "a.jsonl", lines(50))
+    reader = JSONLReader(path, block_size=block_size)
+    batches = list(reader)
+    assert [row["n"] for batch in batches for row in batch.rows()] == list(range(50))
+    # ブロックは行の境界で区切られ、隙間なく続く
+    assert batches[0].start == 0
+    assert batches[-1].end == path.stat().st_size
+    assert all(a.end == b.start for a, b in zip(batches, batches[1:]))
+    if block_size < 64:
+        # ブロックより長い行も1行ずつ読む
+        assert len(batches) == 50
+    assert reader.stats()["lines"] == reader.stats()["records"] == 50
+    assert reader.errors == 0
+
+
+@pytest.mark.parametrize("block_size", [16, 1024 * 1024])
+def test_corrupt_middle_lines_are_skipped(tmp_path, block_size):
+    content = lines(6)
+    content[2] = content[2][:-5]       # 途中で切れた行
+    content.insert(4, "[1, 2]")        # オブジェクトでない行
+    content.insert(1, "")              # 空行は数えない
+    path = write(tmp_path / "a.jsonl", content)
+    reader = JSONLReader(path, block_size=block_size)
+    assert numbers(reader) == [0, 1, 3, 4, 5]
+    assert reader.errors == 2
+    assert reader.lines == 7
+    assert reader.records == 5
+
+
+def test_partial_trailing_line(tmp_path):
+    content = lines(3)
+    path = write(tmp_path / "a.jsonl", content[:2] + [content[2][:10]], newline_at_end=False)
+    reader = JSONLReader(path)
+    assert numbers(reader) == [0, 1]
+    assert reader.partial_tail_bytes == 10
+    assert reader.errors == 0
+
+    # 改行で終わっていなくても、完結している最後の行は読む
+    path = write(tmp_path / "b.jsonl", content, newline_at_end=False)
+    reader = JSONLReader(path, block_size=8)
+    batches = list(reader)
+    assert [row["n"] for batch in batches for row in batch.rows()] == [0, 1, 2]
+    assert batches[-1].end == path.stat().st_size
+    assert reader.partial_tail_bytes == 0
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.jsonl"
+    path.touch()
+    reader = JSONLReader(path)
+    assert list(reader) == []
+    assert reader.stats()["records"] == 0
+    assert list(read_jsonl(write(tmp_path / "blank.jsonl", ["", "  "]))) == []
+
+
+def test_dotted_field_selection(tmp_path):
+    content = lines(3) + [json.dumps({"n": 3, "context": "not a dict"}), json.dumps({"n": 4})]
+    path = write(tmp_path / "a.jsonl", content)
+    fields = ["n", "context.latency_ms", "context.user.id", "missing"]
+    batches = list(iter_jsonl_batches(path, fields=fields, block_size=64))
+    assert all(batch.records is None and batch.fields == tuple(fields) for batch in batches)
+    columns = {field: [value for batch in batches for value in batch.columns[field]] for field in fields}
+    assert columns == {
+        "n": [0, 1, 2, 3, 4],
+        "context.latency_ms": [0, 10, 20, None, None],
+        "context.user.id": ["u0", "u1", "u2", None, None],
+        "missing": [None] * 5,
+    }
+    assert list(read_jsonl(path, fields=["context.user.id"]))[:2] == [{"context.user.id": "u0"},
+                                                                     {"context.user.id": "u1"}]
+    assert sum(len(batch) for batch in batches) == 5
+
+
+def test_start_offset(tmp_path):
+    content = lines(5)
+    path = write(tmp_path / "a.jsonl", content)
+    start = sum(len(line) + 1 for line in content[:3])
+    assert numbers(JSONLReader(path, start=start)) == [3, 4]
+    assert numbers(JSONLReader(path, start=path.stat().st_size)) == []
+
+
+def test_invalid_block_size(tmp_path):
+    with pytest.raises(ValueError):
+        JSONLReader(tmp_path / "a.jsonl", block_size=0)
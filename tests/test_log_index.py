@@ -0,0 +1,199 @@
+import json
+
+import pytest
+
+from cold_storage import Compactor, open_log
+from log_index import LogIndex, context_term, extract_terms, level_term, operation_term, word_term
+
+
+def line(n, level="INFO", operation="op", message=None, minute=0, **context):
+    log = {"timestamp": f"2024-01-01T00:{minute:02d}:{n % 60:02d}+00:00", "level": level, "operation": operation,
+           "message": message or f"message {n}", "context": context}
+    return (json.dumps(log) + "\n").encode("utf-8")
+
+
+def append(path, data):
+    """ファイルに追記し、LogWriter と同じく書き込み前のオフセットを返す"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    offset = path.stat().st_size if path.exists() else 0
+    with open(path, "ab") as f:
+        f.write(data)
+    return offset
+
+
+def read_line(file_index, line_no):
+    offset, length = file_index.line_range(line_no)
+    with open_log(file_index.path) as f:
+        f.seek(offset)
+        return json.loads(f.read(length))
+
+
+@pytest.fixture
+def log_index(tmp_path):
+    return LogIndex(tmp_path)
+
+
+def test_extract_terms():
+    terms = extract_terms({"level": "error", "operation": "db", "message": "Disk full!", "context": {"user": "u1"}})
+    assert terms == {level_term("ERROR"), operation_term("db"), word_term("disk"), word_term("full"),
+                     context_term("user", "u1")}
+
+
+def test_on_write_indexes_incrementally(tmp_path, log_index):
+    path = tmp_path / "p" / "op.log"
+    assert log_index.refreshed(path) is None
+    path.parent.mkdir()
+    path.touch()
+    file_index = log_index.refreshed(path)
+    for n in range(5):
+        data = line(n, level="ERROR" if n % 2 else "INFO")
+        log_index.on_write(path, append(path, data), data)
+    assert len(file_index.offsets) == 5
+    assert file_index.indexed_bytes == path.stat().st_size
+    assert file_index.candidates([{level_term("ERROR")}], set()) == [1, 3]
+    assert read_line(file_index, 3)["message"] == "message 3"
+
+
+def test_on_write_with_gap_refreshes_from_file(tmp_path, log_index):
+    path = tmp_path / "p" / "op.log"
+    append(path, line(0))
+    file_index = log_index.refreshed(path)
+    # 通知されなかった書き込み（他のプロセスなど）の後の通知は、ファイルから続きを索引し直す
+    append(path, line(1))
+    data = line(2)
+    log_index.on_write(path, append(path, data), data)
+    assert len(file_index.offsets) == 3
+    assert [read_line(file_index, n)["message"] for n in range(3)] == ["message 0", "message 1", "message 2"]
+
+
+def test_partial_trailing_line_is_not_indexed(tmp_path, log_index):
+    path = tmp_path / "p" / "op.log"
+    append(path, line(0) + line(1)[:20])
+    file_index = log_index.refreshed(path)
+    assert len(file_index.offsets) == 1
+    append(path, line(1)[20:])
+    assert len(log_index.refreshed(path).offsets) == 2
+
+
+def test_search_by_term_and_level(tmp_path, log_index):
+    path = tmp_path / "p" / "op.log"
+    append(path, b"".join([
+        line(0, level="INFO", message="disk ok", user="alice"),
+        line(1, level="ERROR", message="disk full", user="bob"),
+        line(2, level="WARNING", message="disk almost full", operation="db", user="alice"),
+        line(3, level="ERROR", message="timeout", operation="db", minute=5),
+        b"not json\n",
+    ]))
+    file_index = log_index.refreshed(path)
+    errors_or_warnings = {level_term("ERROR"), level_term("WARNING")}
+    assert file_index.candidates([errors_or_warnings], {word_term("full")}) == [1, 2]
+    assert file_index.candidates([], {word_term("disk"), context_term("user", "alice")}) == [0, 2]
+    assert file_index.candidates([{operation_term("db")}], {word_term("missing")}) == []
+    # 時刻は分単位のバケットで絞る
+    assert file_index.candidates([], set(), since="2024-01-01T00:05:00+00:00") == [3]
+    assert file_index.candidates([], set(), until="2024-01-01T00:01:00+00:00") == [0, 1, 2]
+    # 条件が無ければ壊れた行を含むすべての行
+    assert file_index.candidates([], set()) == [0, 1, 2, 3, 4]
+
+
+def test_persist_and_reload(tmp_path):
+    path = tmp_path / "p" / "op.log"
+    append(path, b"".join(line(n, level="ERROR" if n % 3 == 0 else "INFO") for n in range(30)))
+    first = LogIndex(tmp_path)
+    original = first.refreshed(path)
+    first.save_all()
+    assert (tmp_path / ".index" / "p" / "op.log.idx").exists()
+    assert not original.dirty
+
+    reloaded = LogIndex(tmp_path).get(path)
+    assert reloaded.file_id == original.file_id
+    assert reloaded.indexed_bytes == original.indexed_bytes
+    assert list(reloaded.offsets) == list(original.offsets)
+    assert list(reloaded.lengths) == list(original.lengths)
+    assert reloaded.buckets == original.buckets
+    assert reloaded.candidates([{level_term("ERROR")}], set()) == list(range(0, 30, 3))
+
+
+def test_reload_continues_after_growth_and_rebuilds_after_replacement(tmp_path):
+    path = tmp_path / "p" / "op.log"
+    append(path, line(0) + line(1))
+    index = LogIndex(tmp_path)
+    index.refreshed(path)
+    index.save_all()
+
+    append(path, line(2))
+    assert len(LogIndex(tmp_path).refreshed(path).offsets) == 3
+
+    # 別の内容で置き換えられたファイルは作り直す
+    path.unlink()
+    append(path, line(9, level="ERROR"))
+    file_index = LogIndex(tmp_path).refreshed(path)
+    assert len(file_index.offsets) == 1
+    assert file_index.candidates([{level_term("ERROR")}], set()) == [0]
+
+
+def test_broken_index_file_is_discarded(tmp_path):
+    path = tmp_path / "p" / "op.log"
+    append(path, line(0))
+    index_path = tmp_path / ".index" / "p" / "op.log.idx"
+    index_path.parent.mkdir(parents=True)
+    index_path.write_bytes(b"garbage")
+    assert len(LogIndex(tmp_path).refreshed(path).offsets) == 1
+
+
+def test_on_compact_keeps_offsets(tmp_path, log_index):
+    path = tmp_path / "p" / "op.log"
+    append(path, b"".join(line(n, level="ERROR" if n % 2 else "INFO") for n in range(40)))
+    file_index = log_index.refreshed(path)
+    offsets = list(file_index.offsets)
+    log_index.save_all()
+
+    compactor = Compactor(tmp_path, min_age=0, block_size=256)
+    compactor.add_listener(log_index)
+    target = compactor.compact_file(path)
+
+    assert not (tmp_path / ".index" / "p" / "op.log.idx").exists()
+    assert (tmp_path / ".index" / "p" / f"{target.name}.idx").exists()
+    compacted = log_index.refreshed(target)
+    # 作り直さず、展開後のオフセットのまま使える
+    assert compacted is file_index
+    assert list(compacted.offsets) == offsets
+    assert compacted.candidates([{level_term("ERROR")}], set())[:3] == [1, 3, 5]
+    assert read_line(compacted, 39)["message"] == "message 39"
+
+    # 再起動後もディスクのインデックスをそのまま使う
+    reloaded = LogIndex(tmp_path).get(target)
+    assert reloaded.refresh()
+    assert list(reloaded.offsets) == offsets
+
+
+def test_on_rotate_moves_index(tmp_path, log_index):
+    path = tmp_path / "p" / "op.log"
+    append(path, line(0))
+    log_index.refreshed(path)
+    log_index.save_all()
+    rotated = path.with_name("op.log.20240101_000000")
+    path.rename(rotated)
+    log_index.on_rotate(path, rotated)
+    assert not (tmp_path / ".index" / "p" / "op.log.idx").exists()
+    assert log_index.get(rotated).indexed_bytes == rotated.stat().st_size
+
+
+def test_on_remove_discards_index(tmp_path, log_index):
+    path = tmp_path / "p" / "op.log"
+    append(path, line(0))
+    log_index.refreshed(path)
+    log_index.save_all()
+    path.unlink()
+    log_index.on_remove([path])
+    assert not (tmp_path / ".index" / "p" / "op.log.idx").exists()
+    assert log_index.refreshed(path) is None
+
+
+def test_rebuild_all_skips_hidden_dirs(tmp_path, log_index):
+    append(tmp_path / "p" / "op.log", line(0))
+    append(tmp_path / "q" / "op.log.20240101_000000", line(1))
+    append(tmp_path / ".rollups" / "x.log", line(2))
+    log_index.rebuild_all()
+    saved = sorted(path.relative_to(tmp_path / ".index").as_posix() for path in (tmp_path / ".index").rglob("*.idx"))
+    assert saved == ["p/op.log.idx", "q/op.log.20240101_000000.idx"]
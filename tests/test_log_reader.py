@@ -0,0 +1,101 @@
+import functools
+
+import pytest
+
+import log_reader
+from log_reader import LineIndex, find_tail_offset, iter_lines_range, parse_range_header
+
+
+def write_lines(path, count, terminated=True):
+    lines = [f'{{"n": {i}, "message": "{"z" * (i % 7)}"}}' for i in range(count)]
+    data = "\n".join(lines) + ("\n" if terminated else "")
+    path.write_bytes(data.encode("utf-8"))
+    return [line.encode("utf-8") for line in lines]
+
+
+def read_range(path, offset, limit=None, chunk_size=64):
+    return b"".join(iter_lines_range(path, offset, limit, chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 10)),
+    ("bytes=10-", (10, 100)),
+    ("bytes=90-200", (90, 100)),
+    ("bytes=-10", (90, 100)),
+    ("bytes=-500", (0, 100)),
+    ("BYTES = 5-5", (5, 6)),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=5-4", "bytes=-0", "bytes=a-b", "bytes=-x", "bytes=1-x"])
+def test_parse_range_header_invalid(header):
+    with pytest.raises(ValueError):
+        parse_range_header(header, 100)
+
+
+@pytest.mark.parametrize("terminated", [True, False])
+@pytest.mark.parametrize("chunk_size", [7, 64, 4096])
+def test_find_tail_offset(tmp_path, terminated, chunk_size):
+    path = tmp_path / "op.log"
+    lines = write_lines(path, 50, terminated)
+    data = path.read_bytes()
+    for count in (1, 3, 49):
+        offset = find_tail_offset(path, count, chunk_size=chunk_size)
+        assert data[offset:].splitlines() == lines[-count:]
+    assert find_tail_offset(path, 50, chunk_size=chunk_size) == 0
+    assert find_tail_offset(path, 500, chunk_size=chunk_size) == 0
+    assert find_tail_offset(path, 0, chunk_size=chunk_size) == len(data)
+
+
+def test_find_tail_offset_empty(tmp_path):
+    path = tmp_path / "op.log"
+    path.write_bytes(b"")
+    assert find_tail_offset(path, 10) == 0
+
+
+@pytest.fixture
+def small_index(monkeypatch):
+    # チェックポイントをまたぐ読み出しを小さなファイルで試す
+    monkeypatch.setattr(log_reader, "line_index_cache", log_reader.LineIndexCache())
+    monkeypatch.setattr(log_reader, "LineIndex", functools.partial(LineIndex, interval=7))
+
+
+def test_line_index_checkpoints(tmp_path):
+    path = tmp_path / "op.log"
+    write_lines(path, 30)
+    data = path.read_bytes()
+    index = LineIndex(path, interval=7)
+    assert index.refresh() == 30
+    assert index.checkpoints == [0] + [
+        sum(len(line) + 1 for line in data.splitlines()[:n]) for n in range(7, 30, 7)
+    ]
+    assert index.locate(20) == (index.checkpoints[2], 14)
+
+
+@pytest.mark.parametrize("offset, limit", [(0, None), (0, 5), (6, 3), (7, 7), (13, 100), (29, 1), (30, 5), (40, 1)])
+def test_iter_lines_range(tmp_path, small_index, offset, limit):
+    path = tmp_path / "op.log"
+    lines = write_lines(path, 30)
+    end = None if limit is None else offset + limit
+    expected = b"".join(line + b"\n" for line in lines[offset:end])
+    assert read_range(path, offset, limit) == expected
+
+
+def test_iter_lines_range_unterminated_tail(tmp_path, small_index):
+    path = tmp_path / "op.log"
+    lines = write_lines(path, 10, terminated=False)
+    assert read_range(path, 8, 5) == lines[8] + b"\n" + lines[9]
+    assert read_range(path, 9) == lines[9]
+
+
+def test_iter_lines_range_follows_appends(tmp_path, small_index):
+    path = tmp_path / "op.log"
+    lines = write_lines(path, 10)
+    assert read_range(path, 8) == lines[8] + b"\n" + lines[9] + b"\n"
+    with open(path, "ab") as f:
+        f.write(b"".join(b'{"n": %d}\n' % i for i in range(10, 20)))
+    assert read_range(path, 17, 2) == b'{"n": 17}\n{"n": 18}\n'
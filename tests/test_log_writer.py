@@ -0,0 +1,143 @@
+import os
+import threading
+
+import pytest
+
+from log_writer import LogWriter, fcntl
+
+
+class Recorder:
+    def __init__(self):
+        self.writes = []
+        self.rotations = []
+
+    def on_write(self, path, offset, data):
+        self.writes.append((path, offset, data))
+
+    def on_rotate(self, old_path, new_path):
+        self.rotations.append((old_path, new_path))
+
+
+def read_lines(directory):
+    lines = []
+    for path in sorted(directory.iterdir()):
+        lines.extend(path.read_text("utf-8").splitlines())
+    return lines
+
+
+@pytest.fixture
+def writer():
+    writers = []
+
+    def create(**kwargs):
+        kwargs.setdefault("flush_interval", 0.01)
+        w = LogWriter(**kwargs)
+        w.start()
+        writers.append(w)
+        return w
+
+    yield create
+    for w in writers:
+        w.stop()
+
+
+def test_queue_full_rejects():
+    w = LogWriter(max_queue_size=2)
+    assert w.can_accept(2)
+    assert w.submit_nowait("a.log", "1\n")
+    assert w.submit_nowait("a.log", "2\n")
+    assert not w.can_accept()
+    assert not w.submit_nowait("a.log", "3\n")
+    assert w.rejected_count == 1
+    assert not w.release("a.log")
+
+
+def test_appends_and_notifies(writer, tmp_path):
+    recorder = Recorder()
+    w = writer()
+    w.add_listener(recorder)
+    path = tmp_path / "p" / "op.log"
+    w.submit_nowait(path, "one\n")
+    assert w.flush()
+    w.submit_nowait(path, "two\n")
+    assert w.flush()
+    assert path.read_text("utf-8") == "one\ntwo\n"
+    assert [(offset, data) for _, offset, data in recorder.writes] == [(0, b"one\n"), (4, b"two\n")]
+
+
+@pytest.mark.parametrize("lock_files", [False, True])
+def test_rotation(writer, tmp_path, lock_files):
+    if lock_files and fcntl is None:
+        pytest.skip("fcntl is not available")
+    recorder = Recorder()
+    w = writer(max_file_size_mb=100 / (1024 * 1024), lock_files=lock_files)
+    w.add_listener(recorder)
+    path = tmp_path / "op.log"
+    lines = [f"line {i:04d} " + "x" * 40 for i in range(20)]
+    for line in lines:
+        w.submit_nowait(path, line + "\n")
+        assert w.flush()
+
+    rotated = sorted(p for p in tmp_path.iterdir() if p != path)
+    assert rotated
+    assert [new for _, new in recorder.rotations] == rotated
+    assert all(old == path for old, _ in recorder.rotations)
+    # どのファイルも上限を超えたら次の書き込みの前にローテーションされ、行は欠けない
+    for p in rotated:
+        assert p.stat().st_size <= 100 + 60
+    assert sorted(read_lines(tmp_path)) == lines
+
+
+def test_reopens_replaced_file(writer, tmp_path):
+    w = writer()
+    path = tmp_path / "op.log"
+    w.submit_nowait(path, "before\n")
+    assert w.flush()
+    # 圧縮・保持ポリシーで置き換えられた・消された場合は、開いたままのハンドルには書かない
+    os.replace(path, tmp_path / "moved.log")
+    w.submit_nowait(path, "after replace\n")
+    assert w.flush()
+    assert path.read_text("utf-8") == "after replace\n"
+    path.unlink()
+    w.submit_nowait(path, "after unlink\n")
+    assert w.flush()
+    assert path.read_text("utf-8") == "after unlink\n"
+    assert (tmp_path / "moved.log").read_text("utf-8") == "before\n"
+
+
+def test_release_closes_handle(writer, tmp_path):
+    w = writer()
+    path = tmp_path / "op.log"
+    w.submit_nowait(path, "a\n")
+    assert w.flush()
+    assert w.open_files == 1
+    assert w.release(path)
+    assert w.flush()
+    assert w.open_files == 0
+
+
+@pytest.mark.skipif(fcntl is None, reason="fcntl is not available")
+def test_locked_writers_share_file(writer, tmp_path):
+    # 2つのライター（別プロセスの代わり）が同じファイルに追記・ローテーションしても、行が混ざったり欠けたりしない
+    writers = [writer(max_file_size_mb=2048 / (1024 * 1024), lock_files=True) for _ in range(2)]
+    path = tmp_path / "op.log"
+    expected = []
+
+    def produce(index, w):
+        for i in range(300):
+            line = f"{index}-{i:04d} " + "y" * (i % 50) + "\n"
+            expected.append(line.rstrip("\n"))
+            while not w.submit_nowait(path, line):
+                pass
+            if i % 20 == 0:
+                w.flush()
+        w.flush()
+
+    threads = [threading.Thread(target=produce, args=(i, w)) for i, w in enumerate(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(list(tmp_path.iterdir())) > 1
+    assert sorted(read_lines(tmp_path)) == sorted(expected)
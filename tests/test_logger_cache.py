@@ -0,0 +1,150 @@
+from pathlib import Path
+
+import pytest
+
+import logger_cache
+from log_writer import LogWriter
+from logger_cache import LoggerCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(logger_cache.time, "monotonic", clock)
+    return clock
+
+
+def recording_cache(**kwargs):
+    evicted = []
+    cache = LoggerCache(on_evict=lambda key, logger: evicted.append((key, logger)), **kwargs)
+    return cache, evicted
+
+
+def test_lru_eviction_order():
+    cache, evicted = recording_cache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # a が最近使われたので b が最も古い
+    cache.put("c", 3)
+    assert evicted == [("b", 2)]
+    assert list(cache) == ["a", "c"]
+    cache.put("a", 10)  # 置き換えても数は増えない
+    cache.put("d", 4)
+    assert evicted == [("b", 2), ("c", 3)]
+    assert "a" in cache and "d" in cache and len(cache) == 2
+    assert cache.values() == [10, 4]
+
+
+def test_evict_idle(clock):
+    cache, evicted = recording_cache(max_size=10, idle_timeout=60)
+    cache.put("a", 1)
+    clock.now += 30
+    cache.put("b", 2)
+    clock.now += 29
+    assert cache.evict_idle() == 0
+    clock.now += 1
+    assert cache.evict_idle() == 1
+    assert evicted == [("a", 1)]
+    # 使われると期限が延びる
+    clock.now += 20
+    assert cache.get("b") == 2
+    clock.now += 59
+    assert cache.evict_idle() == 0
+    assert cache.evict_idle(now=clock.now + 1) == 1
+    assert len(cache) == 0
+
+
+def test_counters(clock):
+    cache, evicted = recording_cache(max_size=1, idle_timeout=10)
+    assert cache.stats()["hit_ratio"] is None
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("a")
+    cache.put("b", 2)
+    clock.now += 10
+    cache.evict_idle()
+    cache.put("c", 3)
+    cache.clear()  # シャットダウン時の追い出しは数えない
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["idle_evictions"]) == (2, 1, 1, 1)
+    assert stats["hit_ratio"] == pytest.approx(2 / 3)
+    assert stats["size"] == 0
+    assert [key for key, _ in evicted] == ["a", "b", "c"]
+
+
+def test_on_evict_errors_are_ignored():
+    def fail(key, logger):
+        raise RuntimeError("boom")
+
+    cache = LoggerCache(max_size=1, on_evict=fail)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert list(cache) == ["b"]
+    assert cache.evictions == 1
+
+
+@pytest.fixture
+def main(monkeypatch, tmp_path):
+    """LOG_DIR を一時ディレクトリに、ロガーキャッシュを1件だけにした main モジュール"""
+    pytest.importorskip("fastapi")
+    import main
+
+    writer = LogWriter(flush_interval=0.01)
+    writer.start()
+    monkeypatch.setattr(main, "LOG_DIR", tmp_path)
+    monkeypatch.setattr(main, "log_writer", writer)
+    monkeypatch.setattr(main, "loggers", LoggerCache(max_size=1, on_evict=main.release_logger))
+    yield main
+    writer.stop()
+
+
+def test_release_logger_flushes_and_closes(main, tmp_path):
+    writer = main.log_writer
+    path = tmp_path / "p" / "op.log"
+    writer.submit_nowait(path, "one\n")
+    assert writer.flush()
+    assert writer.open_files == 1
+    writer.submit_nowait(path, "two\n")
+
+    class Logger:
+        log_file = path
+
+    main.release_logger("p_op", Logger())
+    assert writer.flush()
+    assert writer.open_files == 0
+    assert path.read_text("utf-8") == "one\ntwo\n"
+    # 書き込み先の無いロガーは何もしない
+    main.release_logger("p_none", object())
+
+
+def test_logger_reopens_same_segment_after_eviction(main, tmp_path):
+    writer = main.log_writer
+    first = main.get_operation_logger("p", "a")
+    segment = Path(first.log_file)
+    assert segment.parent == tmp_path / "p"
+    writer.submit_nowait(segment, "before\n")
+    assert writer.flush() and writer.open_files == 1
+
+    # キャッシュは1件なので b を作ると a が追い出され、a のファイルは閉じられる
+    main.get_operation_logger("p", "b")
+    assert "p_a" not in main.loggers
+    assert writer.flush()
+    assert writer.open_files == 0
+
+    again = main.get_operation_logger("p", "a")
+    assert again is not first
+    assert Path(again.log_file) == segment
+    writer.submit_nowait(again.log_file, "after\n")
+    assert writer.flush()
+    assert segment.read_text("utf-8") == "before\nafter\n"
+    stats = main.loggers.stats()
+    assert (stats["misses"], stats["evictions"]) == (3, 2)
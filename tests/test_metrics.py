@@ -0,0 +1,65 @@
+import math
+import random
+
+import pytest
+
+from metrics import DDSketch
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[math.floor(q * (len(ordered) - 1))]
+
+
+@pytest.mark.parametrize("accuracy", [0.01, 0.05])
+@pytest.mark.parametrize("distribution", ["uniform", "lognormal", "pareto"])
+def test_quantile_relative_error(accuracy, distribution):
+    rng = random.Random(42)
+    draw = {
+        "uniform": lambda: rng.uniform(1, 1000),
+        "lognormal": lambda: rng.lognormvariate(3, 1.5),
+        "pareto": lambda: rng.paretovariate(1.2),
+    }[distribution]
+    values = [draw() for _ in range(20000)]
+    sketch = DDSketch(accuracy)
+    for value in values:
+        sketch.add(value)
+    for q in (0.0, 0.1, 0.5, 0.9, 0.99, 0.999, 1.0):
+        expected = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - expected) <= accuracy * expected * (1 + 1e-9)
+
+
+def test_merge_matches_single_sketch():
+    rng = random.Random(7)
+    values = [rng.expovariate(0.01) for _ in range(5000)]
+    whole, left, right = DDSketch(), DDSketch(), DDSketch()
+    for i, value in enumerate(values):
+        whole.add(value)
+        (left if i % 2 else right).add(value)
+    left.merge(right)
+    assert left.bins == whole.bins
+    assert left.summary() == pytest.approx(whole.summary())
+    with pytest.raises(ValueError):
+        left.merge(DDSketch(0.05))
+
+
+def test_zero_and_negative_values():
+    sketch = DDSketch()
+    for value in (0, -5, 0, 10, 20):
+        sketch.add(value)
+    assert sketch.zero_count == 3
+    assert sketch.quantile(0.0) == 0.0
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(20, rel=0.01)
+    assert sketch.min == -5
+
+
+def test_empty_and_round_trip():
+    assert DDSketch().quantile(0.5) is None
+    assert DDSketch().summary() == {"count": 0}
+    sketch = DDSketch()
+    for value in range(1, 101):
+        sketch.add(value)
+    restored = DDSketch.from_dict(sketch.to_dict())
+    assert restored.summary() == sketch.summary()
+    assert DDSketch.from_dict(DDSketch().to_dict()).count == 0
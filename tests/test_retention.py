@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+from retention import RetentionManager, RetentionPolicy
+
+DAY = 86400
+NOW = 1_700_000_000.0
+
+
+def files(tmp_path, *specs):
+    """(名前, サイズ, 何日前) の並びから _list_project_files と同じ形（古い順）のリストを作る"""
+    result = []
+    for name, size, age_days in specs:
+        result.append((tmp_path / name, size, NOW - age_days * DAY))
+    return sorted(result, key=lambda item: (item[2], item[0].name))
+
+
+def names(selected):
+    return [path.name for path, _ in selected]
+
+
+def test_no_policy_selects_nothing(tmp_path):
+    manager = RetentionManager(tmp_path)
+    listing = files(tmp_path, ("a.log", 100, 400), ("b.log", 100, 1))
+    assert manager.select_expired("p", listing, now=NOW) == []
+
+
+def test_max_age(tmp_path):
+    manager = RetentionManager(tmp_path, RetentionPolicy(max_age_days=7))
+    listing = files(tmp_path, ("a.log", 10, 30), ("b.log", 10, 8), ("c.log", 10, 6), ("d.log", 10, 0))
+    assert names(manager.select_expired("p", listing, now=NOW)) == ["a.log", "b.log"]
+
+
+def test_max_bytes_removes_oldest_until_under_limit(tmp_path):
+    manager = RetentionManager(tmp_path, RetentionPolicy(max_bytes=250))
+    listing = files(tmp_path, ("a.log", 100, 4), ("b.log", 100, 3), ("c.log", 100, 2), ("d.log", 50, 1))
+    assert names(manager.select_expired("p", listing, now=NOW)) == ["a.log"]
+    manager.default_policy.max_bytes = 249
+    assert names(manager.select_expired("p", listing, now=NOW)) == ["a.log", "b.log"]
+
+
+def test_max_files(tmp_path):
+    manager = RetentionManager(tmp_path, RetentionPolicy(max_files=2))
+    listing = files(tmp_path, ("a.log", 1, 4), ("b.log", 1, 3), ("c.log", 1, 2), ("d.log", 1, 1))
+    assert names(manager.select_expired("p", listing, now=NOW)) == ["a.log", "b.log"]
+
+
+def test_active_files_count_but_are_kept(tmp_path):
+    manager = RetentionManager(tmp_path, RetentionPolicy(max_files=2))
+    listing = files(tmp_path, ("a.log", 1, 4), ("b.log", 1, 3), ("c.log", 1, 2), ("d.log", 1, 1))
+    active = [(tmp_path / "a.log").resolve()]
+    # 書き込み中の a.log は残すので、上限まで減らすには次に古い b.log と c.log を選ぶ
+    assert names(manager.select_expired("p", listing, active, now=NOW)) == ["b.log", "c.log"]
+
+
+def test_project_policy_overrides_default(tmp_path):
+    manager = RetentionManager(tmp_path, RetentionPolicy(max_files=1),
+                               project_policies={"keep": RetentionPolicy()})
+    listing = files(tmp_path, ("a.log", 1, 2), ("b.log", 1, 1))
+    assert names(manager.select_expired("p", listing, now=NOW)) == ["a.log"]
+    assert manager.select_expired("keep", listing, now=NOW) == []
+
+
+class Recorder:
+    def __init__(self):
+        self.removed = []
+
+    def on_remove(self, paths):
+        self.removed.append(sorted(path.name for path in paths))
+
+
+@pytest.mark.parametrize("archive", [False, True])
+def test_run_once(tmp_path, archive):
+    log_dir = tmp_path / "logs"
+    archive_dir = tmp_path / "archive" if archive else None
+    for project in ("p", "q"):
+        (log_dir / project).mkdir(parents=True)
+        for i, name in enumerate(("a.log", "b.log.gz", "c.log")):
+            path = log_dir / project / name
+            path.write_bytes(b"x" * 10)
+            os.utime(path, (NOW + i, NOW + i))
+    (log_dir / ".index").mkdir()
+    (log_dir / ".index" / "a.log").write_bytes(b"")
+
+    recorder = Recorder()
+    manager = RetentionManager(log_dir, RetentionPolicy(max_files=1), archive_dir=archive_dir)
+    manager.add_listener(recorder)
+    report = manager.run_once(active=[log_dir / "q" / "a.log"])
+
+    assert report["files"] == 4 and report["bytes"] == 40
+    assert report["projects"] == {"p": {"files": 2, "bytes": 20}, "q": {"files": 2, "bytes": 20}}
+    # リスナーへの通知は1回の実行につき1度。書き込み中の q/a.log は最も古くても残す
+    assert recorder.removed == [["a.log", "b.log.gz", "b.log.gz", "c.log"]]
+    assert sorted(p.name for p in (log_dir / "p").iterdir()) == ["c.log"]
+    assert sorted(p.name for p in (log_dir / "q").iterdir()) == ["a.log"]
+    assert (log_dir / ".index" / "a.log").exists()
+    if archive:
+        assert sorted(p.name for p in (archive_dir / "p").iterdir()) == ["a.log", "b.log.gz"]
+        assert sorted(p.name for p in (archive_dir / "q").iterdir()) == ["b.log.gz", "c.log"]
+
+
+def test_failed_disposal_is_not_notified(tmp_path, monkeypatch):
+    log_dir = tmp_path / "logs"
+    (log_dir / "p").mkdir(parents=True)
+    for i, name in enumerate(("a.log", "b.log", "c.log")):
+        path = log_dir / "p" / name
+        path.write_bytes(b"x")
+        os.utime(path, (NOW + i, NOW + i))
+
+    recorder = Recorder()
+    manager = RetentionManager(log_dir, RetentionPolicy(max_files=1))
+    manager.add_listener(recorder)
+    dispose = manager._dispose
+
+    def failing_dispose(path):
+        if path.name == "a.log":
+            raise PermissionError("busy")
+        dispose(path)
+
+    monkeypatch.setattr(manager, "_dispose", failing_dispose)
+    report = manager.run_once()
+    # 消せなかった a.log はカタログ・インデックスに残す
+    assert report["files"] == 1
+    assert recorder.removed == [["b.log"]]
+    assert sorted(p.name for p in (log_dir / "p").iterdir()) == ["a.log", "c.log"]
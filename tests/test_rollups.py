@@ -0,0 +1,148 @@
+import json
+import threading
+
+import pytest
+
+from cold_storage import Compactor, open_log
+from rollups import RollupStore
+from scan_executor import ScanExecutor
+
+DAY = "2024-01-01"
+
+
+def log_line(minute, level="INFO", operation="op", hour=0, day=DAY, **context):
+    log = {"timestamp": f"{day}T{hour:02d}:{minute:02d}:30+00:00", "level": level, "operation": operation,
+           "message": "m", "context": context}
+    return (json.dumps(log) + "\n").encode("utf-8")
+
+
+def write(path, lines):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(b"".join(lines))
+
+
+def query(store, resolution="minute", **kwargs):
+    kwargs.setdefault("since", f"{DAY}T00:00:00+00:00")
+    kwargs.setdefault("until", "2024-01-02T23:59:59+00:00")
+    return {point["bucket"]: point for point in store.query(resolution, **kwargs)["points"]}
+
+
+def counts(points):
+    return {bucket: point["count"] for bucket, point in points.items()}
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    """2プロジェクト。api は圧縮済みファイルとローテーション済みファイルを含む"""
+    lines = [log_line(i % 7, "ERROR" if i % 5 == 0 else "INFO", "db" if i % 3 == 0 else "http",
+                      hour=i % 3, latency_ms=i) for i in range(300)]
+    write(tmp_path / "api" / "http.log.20240101_000000", lines[:100])
+    write(tmp_path / "api" / "http.log", lines[100:200])
+    write(tmp_path / "web" / "render.log", lines[200:])
+    Compactor(tmp_path, min_age=0, block_size=512).compact_file(tmp_path / "api" / "http.log.20240101_000000")
+    return tmp_path
+
+
+def test_on_write_save_all_and_query(tmp_path):
+    store = RollupStore(tmp_path)
+    path = tmp_path / "api" / "http.log"
+    store.on_write(path, 0, log_line(0, latency_ms=10) + log_line(0, "error", latency_ms=30) + log_line(1)
+                   + log_line(5, hour=1) + b"not json\n")
+
+    # 保存前は未保存の差分から返す
+    before = query(store)
+    assert counts(before) == {f"{DAY}T00:00": 2, f"{DAY}T00:01": 1, f"{DAY}T01:05": 1}
+    assert before[f"{DAY}T00:00"]["levels"] == {"INFO": 1, "ERROR": 1}
+    latency = before[f"{DAY}T00:00"]["fields"]["latency_ms"]
+    assert (latency["count"], latency["min"], latency["max"], latency["mean"]) == (2, 10, 30, 20)
+
+    store.save_all()
+    assert store.stats()["pending_files"] == 0
+    assert (tmp_path / ".rollups" / "api" / "minute" / f"{DAY}.json").exists()
+    assert counts(query(store)) == counts(before)
+    assert counts(query(store, "hour")) == {f"{DAY}T00": 3, f"{DAY}T01": 1}
+
+    # 保存済みのファイルと新しい差分を足し合わせる
+    store.on_write(path, 0, log_line(0))
+    assert counts(query(store))[f"{DAY}T00:00"] == 3
+    store.save_all()
+    assert counts(query(RollupStore(tmp_path)))[f"{DAY}T00:00"] == 3
+
+
+def test_query_range_and_filters(tmp_path):
+    store = RollupStore(tmp_path)
+    store.on_write(tmp_path / "api" / "a.log", 0, b"".join([
+        log_line(0, "INFO", "db"), log_line(0, "ERROR", "db"), log_line(1, "ERROR", "http"),
+        log_line(2, "WARNING", "http"), log_line(0, "INFO", "db", day="2024-01-02"),
+    ]))
+    store.on_write(tmp_path / "web" / "b.log", 0, log_line(0, "ERROR", "db"))
+    store.save_all()
+
+    assert store.projects() == ["api", "web"]
+    assert counts(query(store, operations=["db"])) == {f"{DAY}T00:00": 3, "2024-01-02T00:00": 1}
+    assert counts(query(store, levels=["error"])) == {f"{DAY}T00:00": 2, f"{DAY}T00:01": 1}
+    assert counts(query(store, projects=["api"], operations=["http"], levels=["ERROR", "WARNING"])) == \
+        {f"{DAY}T00:01": 1, f"{DAY}T00:02": 1}
+    # since / until はバケット単位で含む
+    assert counts(query(store, since=f"{DAY}T00:01:59+00:00", until=f"{DAY}T00:02:00+00:00")) == \
+        {f"{DAY}T00:01": 1, f"{DAY}T00:02": 1}
+    assert counts(query(store, "hour", since="2024-01-02T00:00:00+00:00")) == {"2024-01-02T00": 1}
+    with pytest.raises(ValueError):
+        store.query("second")
+
+
+def test_concurrent_stores_add_to_the_same_file(tmp_path):
+    stores = [RollupStore(tmp_path) for _ in range(4)]
+
+    def run(store):
+        for i in range(20):
+            store.on_write(tmp_path / "api" / "a.log", 0, log_line(0))
+            store.save_all()
+
+    threads = [threading.Thread(target=run, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counts(query(RollupStore(tmp_path))) == {f"{DAY}T00:00": 80}
+
+
+def direct_counts(log_dir, scratch, resolution):
+    """ログファイルを先頭から読んで on_write に渡した場合の件数（保存先は別のディレクトリ）"""
+    store = RollupStore(scratch)
+    for path in sorted(log_dir.glob("[!.]*/*.log*")):
+        with open_log(path) as f:
+            store.on_write(path, 0, f.read())
+    return counts(query(store, resolution))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_backfill_matches_direct_scan(log_dir, tmp_path_factory, workers):
+    executor = ScanExecutor(workers=workers, range_size=1024)
+    executor.start()
+    try:
+        store = RollupStore(log_dir)
+        assert store.backfill(executor=executor) == 300
+    finally:
+        executor.shutdown()
+    if workers > 1:
+        assert executor.stats()["tasks"] > 1
+    for resolution in ("minute", "hour"):
+        assert counts(query(store, resolution)) == direct_counts(log_dir, tmp_path_factory.mktemp("direct"), resolution)
+    points = query(store, "hour")
+    assert sum(point["fields"]["latency_ms"]["count"] for point in points.values()) == 300
+
+
+def test_backfill_replaces_existing_rollups(log_dir):
+    store = RollupStore(log_dir)
+    # 古いロールアップ（消えたログの日を含む）は作り直す前に消す
+    store.on_write(log_dir / "api" / "x.log", 0, log_line(0) + log_line(0, day="2023-12-31"))
+    store.save_all()
+    assert store.backfill(projects=["api"]) == 200
+    assert not (log_dir / ".rollups" / "api" / "minute" / "2023-12-31.json").exists()
+    assert sum(counts(query(store, projects=["api"])).values()) == 200
+    # 2回実行しても二重に数えない
+    store.backfill(projects=["api"])
+    assert sum(counts(query(store, projects=["api"])).values()) == 200
+    assert not (log_dir / ".rollups" / "web").exists()
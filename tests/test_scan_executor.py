@@ -0,0 +1,130 @@
+import os
+
+import pytest
+
+from cold_storage import Compactor
+from scan_executor import (RangeReader, ScanExecutor, ScanRange, count_newlines, find_checkpoints,
+                           split_ranges)
+
+
+def make_file(path, count=60, terminated=True):
+    lines = [b"%d:" % i + b"x" * (i * 7 % 23) for i in range(count)]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\n".join(lines) + (b"\n" if terminated else b""))
+    return lines
+
+
+def read_all(ranges, chunk_size):
+    blocks, readers = [], []
+    for scan_range in ranges:
+        reader = RangeReader(scan_range, chunk_size)
+        blocks.extend(reader)
+        readers.append(reader)
+    return blocks, readers
+
+
+def test_split_ranges(tmp_path):
+    make_file(tmp_path / "a.log")
+    make_file(tmp_path / "b.log", 5)
+    files = [("p", tmp_path / "a.log"), ("p", tmp_path / "missing.log"), ("q", tmp_path / "b.log")]
+    ranges = split_ranges(files, range_size=100)
+    by_file = {}
+    for scan_range in ranges:
+        by_file.setdefault(scan_range.path.name, []).append((scan_range.start, scan_range.end))
+    for name, spans in by_file.items():
+        size = (tmp_path / name).stat().st_size
+        assert spans[0][0] == 0 and spans[-1][1] == size
+        assert all(end == start for (_, end), (start, _) in zip(spans, spans[1:]))
+        assert all(end - start <= 100 for start, end in spans)
+    assert list(by_file) == ["a.log", "b.log"]
+    assert split_ranges(files, 100, starts={tmp_path / "a.log": 150})[0].start == 150
+
+
+@pytest.mark.parametrize("range_size", [1, 7, 64, 100, 10000])
+@pytest.mark.parametrize("chunk_size", [1, 5, 64, 4096])
+def test_ranges_cover_every_line_once(tmp_path, range_size, chunk_size):
+    path = tmp_path / "p" / "a.log"
+    lines = make_file(path)
+    blocks, readers = read_all(split_ranges([("p", path)], range_size), chunk_size)
+    data = b"".join(block for _, block in blocks)
+    assert data.split(b"\n")[:-1] == lines
+    # ブロックのオフセットはファイル上の位置と一致し、連続している
+    position = 0
+    for offset, block in blocks:
+        assert offset == position and block.endswith(b"\n")
+        position += len(block)
+    assert readers[-1].finished and readers[-1].tail == b""
+
+
+@pytest.mark.parametrize("range_size", [3, 50, 10000])
+def test_unterminated_tail(tmp_path, range_size):
+    path = tmp_path / "p" / "a.log"
+    lines = make_file(path, 20, terminated=False)
+    blocks, readers = read_all(split_ranges([("p", path)], range_size), 8)
+    # 書き込み途中の最終行は返さず、tail に残す
+    assert b"".join(block for _, block in blocks).split(b"\n")[:-1] == lines[:-1]
+    (owner,) = [reader for reader in readers if reader.tail]
+    # 最終行はその先頭を含む範囲のもの。position は最終行の先頭（続きが書かれたらそこから読む）
+    assert owner.tail == lines[-1] and owner.finished
+    assert owner.position == path.stat().st_size - len(lines[-1])
+    assert readers[-1].finished
+
+
+def test_range_starting_at_line_boundary(tmp_path):
+    path = tmp_path / "a.log"
+    path.write_bytes(b"aaa\nbbb\nccc\n")
+    # 範囲の先頭がちょうど行の先頭なら、その行はこの範囲のもの
+    assert list(RangeReader(ScanRange("p", path, 4, 6))) == [(4, b"bbb\n")]
+    assert list(RangeReader(ScanRange("p", path, 0, 4))) == [(0, b"aaa\n")]
+    # 行の途中から始まる範囲は次の行から読む
+    assert list(RangeReader(ScanRange("p", path, 5, 9))) == [(8, b"ccc\n")]
+    reader = RangeReader(ScanRange("p", path, 9, 12))
+    assert list(reader) == []
+    assert reader.position == 12 and reader.finished
+
+
+def test_missing_file(tmp_path):
+    reader = RangeReader(ScanRange("p", tmp_path / "missing.log", 0, 100))
+    assert list(reader) == [] and reader.finished
+
+
+def test_compressed_file_ranges(tmp_path):
+    path = tmp_path / "p" / "a.log"
+    lines = make_file(path, 200)
+    target = Compactor(tmp_path, min_age=0, block_size=128).compact_file(path)
+    blocks, _ = read_all(split_ranges([("p", target)], 300), 50)
+    assert b"".join(block for _, block in blocks).split(b"\n")[:-1] == lines
+
+
+def test_count_newlines_and_checkpoints(tmp_path):
+    path = tmp_path / "a.log"
+    lines = make_file(path, 50)
+    data = path.read_bytes()
+    middle = len(data) // 2
+    first, second = count_newlines(path, 0, middle), count_newlines(path, middle, len(data))
+    assert first[0] + second[0] == 50
+    assert second[1] == len(data)
+    checkpoints = find_checkpoints(path, 0, middle, 0, 10) + find_checkpoints(path, middle, len(data), first[0], 10)
+    starts = [sum(len(line) + 1 for line in lines[:n]) for n in range(10, 51, 10)]
+    # 最後の行の次（ファイル末尾）もチェックポイントになる（LineIndex の逐次走査と同じ）
+    assert checkpoints == starts
+
+
+def test_executor_runs_in_order_without_pool():
+    executor = ScanExecutor(workers=1)
+    executor.start()
+    assert not executor.parallel
+    assert list(executor.imap(pow, [(2, i) for i in range(5)])) == [1, 2, 4, 8, 16]
+    assert executor.stats()["tasks"] == 5
+
+
+def test_executor_workers_are_not_forked_from_server():
+    executor = ScanExecutor(workers=2)
+    executor.start()
+    try:
+        assert executor.parallel
+        assert executor._pool._mp_context.get_start_method() in ("forkserver", "spawn")
+        pids = set(executor.imap(os.getpid, [()] * 4))
+        assert os.getpid() not in pids
+    finally:
+        executor.shutdown()
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from scan_executor import ScanExecutor
+from search import SearchQuery, decode_cursor, encode_cursor, run_search
+
+
+def write_logs(path, logs):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("".join(json.dumps(log) + "\n" for log in logs), "utf-8")
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    """2プロジェクト・4ファイル。"hit" を含むログは全体で 20 件"""
+    n = 0
+    for project, names in (("alpha", ["a.log", "b.log"]), ("beta", ["c.log", "d.log.20240101_000000"])):
+        for name in names:
+            logs = []
+            for i in range(12):
+                message = f"{'hit' if i % 2 else 'miss'} {n}"
+                logs.append({"timestamp": f"2024-01-01T00:00:{n % 60:02d}+00:00", "level": "INFO",
+                             "operation": "op", "message": message})
+                n += 1
+            write_logs(tmp_path / project / name, logs[:-1] if name == "c.log" else logs)
+    (tmp_path / ".index").mkdir()
+    return tmp_path
+
+
+def page_through(log_dir, query, limit, cursor=None, **kwargs):
+    results, pages = [], 0
+    while True:
+        page, cursor = run_search(log_dir, query, limit, cursor, **kwargs)
+        assert len(page) <= limit
+        results.extend(page)
+        pages += 1
+        if cursor is None:
+            return results, pages
+
+
+def messages(results):
+    return [log["message"] for log in results]
+
+
+def expected_hits(log_dir):
+    return messages(run_search(log_dir, SearchQuery(text="hit"), 1000)[0])
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("alpha/a.log", 1234)) == ("alpha/a.log", 1234)
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_single_page(log_dir):
+    results, cursor = run_search(log_dir, SearchQuery(text="hit"), 1000)
+    assert cursor is None
+    assert len(results) == 23
+    assert {log["project"] for log in results} == {"alpha", "beta"}
+
+
+@pytest.mark.parametrize("limit", [1, 3, 6, 7])
+def test_pages_resume_without_gaps(log_dir, limit):
+    results, pages = page_through(log_dir, SearchQuery(text="hit"), limit)
+    assert messages(results) == expected_hits(log_dir)
+    assert pages >= -(-len(results) // limit)
+
+
+def test_resume_when_scan_budget_is_exhausted(log_dir):
+    # 1ページの走査バイト数の上限で止まっても、カーソルから続きを読めば欠けも重複もない
+    results, pages = page_through(log_dir, SearchQuery(text="hit"), 1000, max_scan_bytes=200)
+    assert messages(results) == expected_hits(log_dir)
+    assert pages > 4
+
+
+def test_resume_after_file_removed(log_dir):
+    page, cursor = run_search(log_dir, SearchQuery(text="hit"), 2)
+    assert decode_cursor(cursor)[0] == "alpha/a.log"
+    (log_dir / "alpha" / "a.log").unlink()
+    # カーソルのファイルが消えていたら、順序上その次のファイルの先頭から再開する
+    rest, _ = page_through(log_dir, SearchQuery(text="hit"), 5, cursor)
+    assert messages(rest) == expected_hits(log_dir)
+
+
+def test_project_filter(log_dir):
+    results, _ = page_through(log_dir, SearchQuery(projects={"beta"}, text="hit"), 4)
+    assert {log["project"] for log in results} == {"beta"}
+    assert len(results) == 11
+
+
+def test_parallel_pages_match_sequential(log_dir):
+    executor = ScanExecutor(workers=2, range_size=256)
+    executor.start()
+    try:
+        if not executor.parallel:
+            pytest.skip("fork is not available")
+        for limit in (1, 4, 1000):
+            results, _ = page_through(log_dir, SearchQuery(text="hit"), limit, executor=executor)
+            assert messages(results) == expected_hits(log_dir)
+        results, _ = page_through(log_dir, SearchQuery(text="hit"), 1000, max_scan_bytes=100, executor=executor)
+        assert messages(results) == expected_hits(log_dir)
+    finally:
+        executor.shutdown()
@@ -0,0 +1,91 @@
+import pytest
+
+from encoding import encode_event
+from shared_ring import SharedEventRing
+
+
+def record(ring, message, project="p"):
+    event = encode_event({"project": project, "message": message, "timestamp": f"2024-01-01T00:00:{message:0>2}"})
+    ring.record(event)
+    return event.id
+
+
+def messages(events):
+    return [event.payload["message"] for event in events]
+
+
+@pytest.fixture
+def ring(tmp_path):
+    rings = []
+
+    def open_ring(capacity=4096, name="events.ring"):
+        r = SharedEventRing(tmp_path / name, capacity)
+        rings.append(r)
+        return r
+
+    yield open_ring
+    for r in rings:
+        r.close()
+
+
+def test_record_and_replay(ring):
+    r = ring()
+    ids = [record(r, str(i), project="a" if i % 2 else "b") for i in range(10)]
+    assert ids == sorted(ids) and r.last_id == ids[-1]
+    assert messages(r.replay()) == [str(i) for i in range(10)]
+    assert messages(r.replay(after_id=ids[6])) == ["7", "8", "9"]
+    assert messages(r.replay(last=2)) == ["8", "9"]
+    assert messages(r.replay(last=2, projects=["b"])) == ["6", "8"]
+    assert messages(r.replay(since="2024-01-01T00:00:05")) == ["5", "6", "7", "8", "9"]
+    assert [event.id for event in r.replay()] == ids
+
+
+def test_wraparound_keeps_newest(ring):
+    r = ring(capacity=2048)
+    for i in range(200):
+        record(r, str(i))
+    replayed = messages(r.replay())
+    assert replayed and replayed[-1] == "199"
+    assert replayed == [str(i) for i in range(200 - len(replayed), 200)]
+    assert r.stats()["used_bytes"] <= r.capacity
+
+
+def test_shared_between_instances(ring):
+    first, second = ring(), ring()
+    record(first, "from first")
+    record(second, "from second")
+    assert messages(first.replay()) == ["from first", "from second"]
+    assert first.last_id == second.last_id
+
+
+def test_oversized_event_only_takes_an_id(ring):
+    r = ring(capacity=1024)
+    before = r.last_id
+    record(r, "x" * 4096)
+    assert r.last_id == before + 1
+    assert r.stats()["oversized"] == 1
+    assert list(r.replay()) == []
+
+
+def test_capacity_change_replaces_file(ring, tmp_path):
+    old = ring(capacity=4096)
+    record(old, "old")
+    new = ring(capacity=8192)
+    # 古いファイルを縮めずに置き換えるので、古い方を mmap しているインスタンスも読み書きできる
+    assert new.capacity == 8192 and list(new.replay()) == []
+    assert (tmp_path / "events.ring").stat().st_size > 8192
+    record(old, "still mapped")
+    assert messages(old.replay()) == ["old", "still mapped"]
+    record(new, "new")
+    assert messages(ring(capacity=8192).replay()) == ["new"]
+    assert [p.name for p in tmp_path.iterdir()] == ["events.ring"]
+
+
+def test_replay_does_not_copy_payload_twice(ring):
+    r = ring()
+    record(r, "view")
+    (event,) = r.replay()
+    # 配信用のフレームだけがペイロードのコピーを持ち、json_bytes はその一部を指す
+    assert isinstance(event.json_bytes, memoryview)
+    assert event.json_bytes.obj is event._data_frame
+    assert event.sse == b"id: %d\ndata: %s\n\n" % (event.id, event.json.encode("utf-8"))
@@ -0,0 +1,167 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import encoding  # noqa: E402
+import main  # noqa: E402
+from broadcast import ConnectionManager, EventHistory  # noqa: E402
+from encoding import encode_event  # noqa: E402
+from subscription import SubscriptionFilter  # noqa: E402
+
+
+def log(message, project="p", level="INFO", operation="op", **context):
+    return {"project": project, "level": level, "operation": operation, "message": message, "context": context}
+
+
+def messages(event):
+    return [item["message"] for item in event.logs]
+
+
+def drain(subscriber):
+    batch = list(subscriber.buffer)
+    subscriber.buffer.clear()
+    return [message for event in batch for message in messages(event)]
+
+
+def test_min_level_ranking():
+    warning = SubscriptionFilter(min_level="warning")
+    assert warning.min_level == "WARNING"
+    assert [level for level in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "")
+            if warning.accepts_key("p", level)] == ["WARNING", "ERROR", "CRITICAL"]
+    assert SubscriptionFilter(min_level="DEBUG").matches(log("x", level="debug"))
+    with pytest.raises(ValueError):
+        SubscriptionFilter(min_level="LOUD")
+
+
+def test_conditions_are_combined_with_and():
+    subscription = SubscriptionFilter(projects=["api", "web"], min_level="ERROR", operations=["db"],
+                                      context={"user": "alice", "retry": 1})
+    assert subscription.needs_log_check
+    assert subscription.matches(log("ok", "api", "ERROR", "db", user="alice", retry=1))
+    assert not subscription.matches(log("project", "other", "ERROR", "db", user="alice", retry=1))
+    assert not subscription.matches(log("level", "api", "WARNING", "db", user="alice", retry=1))
+    assert not subscription.matches(log("operation", "api", "ERROR", "http", user="alice", retry=1))
+    assert not subscription.matches(log("context value", "api", "ERROR", "db", user="bob", retry=1))
+    assert not subscription.matches(log("context key", "api", "ERROR", "db", user="alice"))
+    assert not subscription.matches({"project": "api", "level": "ERROR", "operation": "db", "context": "alice"})
+    # context.project もプロジェクトとして扱う
+    assert SubscriptionFilter(projects=["api"]).matches({"message": "x", "context": {"project": "api"}})
+
+
+def test_from_dict():
+    subscription = SubscriptionFilter.from_dict({"project": "a, b", "operations": ["x", " "], "min_level": "info"})
+    assert subscription.to_dict() == {"projects": ["a", "b"], "min_level": "INFO", "operations": ["x"], "context": None}
+    assert SubscriptionFilter.from_dict({}).is_empty
+    for data in ([], {"context": "user=alice"}, {"projects": 1}):
+        with pytest.raises(ValueError):
+            SubscriptionFilter.from_dict(data)
+
+
+def test_select_partial_batch_keeps_event_id():
+    event = encode_event([log("a", "api", "ERROR"), log("b", "web", "ERROR"), log("c", "api", "INFO")])
+    event.set_id(42)
+    selected = SubscriptionFilter(projects=["api"], min_level="ERROR").select(event)
+    assert messages(selected) == ["a"]
+    assert selected.id == 42
+    assert selected.sse.startswith(b"id: 42\n")
+    # すべて一致すればそのまま、1件も一致しなければ None
+    assert SubscriptionFilter(min_level="INFO").select(event) is event
+    assert SubscriptionFilter(projects=["none"]).select(event) is None
+    # ログ以外のイベントはフィルタの対象外
+    status = encode_event("status")
+    assert SubscriptionFilter(projects=["api"]).select(status) is status
+
+
+def test_cache_key_is_shared_by_equal_filters(monkeypatch):
+    first = SubscriptionFilter(projects=["b", "a"], context={"user": "alice", "region": "eu"})
+    second = SubscriptionFilter(projects=["a", "b"], context={"region": "eu", "user": "alice"})
+    assert first.cache_key == second.cache_key
+    assert first.cache_key != SubscriptionFilter(projects=["a", "b"]).cache_key
+
+    calls = []
+    original = encoding.EncodedEvent.__init__
+
+    def counting_init(self, payload, json_bytes):
+        calls.append(payload)
+        original(self, payload, json_bytes)
+
+    event = encode_event([log("a", "a", user="alice", region="eu"), log("b", "a", user="bob")])
+    monkeypatch.setattr(encoding.EncodedEvent, "__init__", counting_init)
+    cache = {}
+    selected = first.select(event, cache)
+    assert second.select(event, cache) is selected
+    assert messages(selected) == ["a"]
+    assert len(calls) == 1
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = ConnectionManager(history=EventHistory())
+    monkeypatch.setattr(main, "manager", manager)
+    return manager
+
+
+def subscribe(manager, subscription=None):
+    return asyncio.run(manager.connect_sse(filter=subscription))
+
+
+def test_routes_by_project_and_level(manager):
+    everything = subscribe(manager)
+    errors = subscribe(manager, SubscriptionFilter(min_level="ERROR"))
+    api_db = subscribe(manager, SubscriptionFilter(projects=["api"], operations=["db"]))
+
+    manager.deliver(encode_event(log("info", "api", "INFO", "db")))
+    manager.deliver(encode_event(log("error", "web", "ERROR", "db")))
+    manager.deliver(encode_event(log("http", "api", "ERROR", "http")))
+    assert drain(everything) == ["info", "error", "http"]
+    assert drain(errors) == ["error", "http"]
+    assert drain(api_db) == ["info"]
+    assert manager._route(("api", "INFO")) == [everything, api_db]
+
+    # 複数のプロジェクトを含むバッチは、一致した部分だけを同じ ID で受け取る
+    other = subscribe(manager, SubscriptionFilter(projects=["api"], operations=["db"]))
+    batch = encode_event([log("1", "api", "ERROR", "db"), log("2", "web", "INFO"), log("3", "api", "INFO", "http")])
+    manager.deliver(batch)
+    assert drain(everything) == ["1", "2", "3"]
+    assert drain(errors) == ["1"]
+    received = api_db.buffer[0]
+    assert messages(received) == ["1"]
+    assert received.id == batch.id
+    # 同じ条件の購読者は同じ再エンコード結果を受け取る
+    assert other.buffer[0] is received
+
+
+def test_control_message_rebuilds_routes(manager):
+    subscriber = subscribe(manager, SubscriptionFilter(projects=["api"]))
+    manager.deliver(encode_event(log("before", "web", "ERROR")))
+    assert drain(subscriber) == []
+    assert ("web", "ERROR") in manager._routes
+
+    main.handle_ws_control(subscriber, json.dumps({"type": "subscribe", "filter": {"projects": ["web"],
+                                                                                    "min_level": "ERROR"}}))
+    assert manager._routes == {}
+    reply = subscriber.buffer.popleft()
+    assert reply.payload == {"type": "subscribed", "filter": subscriber.filter.to_dict()}
+    manager.deliver(encode_event(log("web error", "web", "ERROR")))
+    manager.deliver(encode_event(log("web info", "web", "INFO")))
+    manager.deliver(encode_event(log("api error", "api", "ERROR")))
+    assert drain(subscriber) == ["web error"]
+
+    # 不正なフィルタはエラーを返し、今のフィルタのまま
+    main.handle_ws_control(subscriber, json.dumps({"type": "subscribe", "filter": {"min_level": "LOUD"}}))
+    assert subscriber.buffer.popleft().payload["type"] == "error"
+    assert subscriber.filter.projects == {"web"}
+
+    # 空のフィルタはすべてを受け取る
+    main.handle_ws_control(subscriber, json.dumps({"type": "subscribe", "filter": {}}))
+    subscriber.buffer.clear()
+    assert subscriber.filter is None
+    manager.deliver(encode_event(log("api info", "api", "INFO")))
+    assert drain(subscriber) == ["api info"]
+
+    # 切断すると配信テーブルから外れる
+    manager.disconnect_sse(subscriber)
+    assert manager._route(("api", "INFO")) == []
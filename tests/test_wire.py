@@ -0,0 +1,69 @@
+import zlib
+
+import pytest
+
+from encoding import encode_event
+from wire import WIRE_SUBPROTOCOL, WireDecoder, WireEncoder, negotiate
+
+
+def log(i, **extra):
+    entry = {"timestamp": f"2024-01-01T00:00:{i % 60:02d}+00:00", "message": f"message {i}",
+             "project_name": "proj", "project": f"p{i % 3}", "level": "INFO", "operation": "op"}
+    entry.update(extra)
+    return entry
+
+
+def round_trip(encoder, decoder, payloads):
+    return decoder.decode(encoder.encode([encode_event(payload) for payload in payloads]))
+
+
+def test_negotiate():
+    assert negotiate(["json", WIRE_SUBPROTOCOL]) == WIRE_SUBPROTOCOL
+    assert negotiate(["json"]) is None
+
+
+def test_round_trip_across_frames():
+    encoder, decoder = WireEncoder(), WireDecoder()
+    frames = [
+        [log(0)],
+        [log(1, context={"user": "alice", "latency_ms": 12.5}), {"type": "metrics", "windows": [1, 2]}],
+        [[log(2), log(3, level="ERROR")]],
+        # 文字列でない timestamp・辞書のフィールドが欠けたログ・日本語
+        [{"timestamp": 1700000000, "message": "ログ"}, {"level": None, "operation": "op"}],
+        ["plain string", 42],
+    ]
+    for payloads in frames:
+        assert round_trip(encoder, decoder, payloads) == payloads
+    assert encoder.frames == len(frames)
+    assert encoder.stats()["dictionary"] == len({"proj", "p0", "p1", "p2", "INFO", "ERROR", "op"})
+
+
+def test_repeated_strings_are_sent_once():
+    encoder, decoder = WireEncoder(), WireDecoder()
+    first = encoder.encode([encode_event(log(0))])
+    second = encoder.encode([encode_event(log(0))])
+    assert len(second) < len(first)
+    assert decoder.decode(first) == decoder.decode(second) == [log(0)]
+
+
+def test_dictionary_reset():
+    encoder, decoder = WireEncoder(max_dictionary=4), WireDecoder()
+    for i in range(20):
+        payloads = [log(i, operation=f"op{i}")]
+        assert round_trip(encoder, decoder, payloads) == payloads
+    assert encoder.resets > 0
+
+
+def test_decoder_must_see_every_frame():
+    encoder = WireEncoder()
+    encoder.encode([encode_event(log(0))])
+    second = encoder.encode([encode_event(log(1))])
+    # フレームは接続ごとの deflate ストリームの続きなので、途中からは展開できない
+    with pytest.raises((zlib.error, ValueError, IndexError)):
+        WireDecoder().decode(second)
+
+
+def test_truncated_frame():
+    data = WireEncoder().encode([encode_event(log(0))])
+    with pytest.raises(ValueError):
+        WireDecoder().decode(data[:len(data) // 2])
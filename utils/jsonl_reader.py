@@ -0,0 +1,322 @@
+"""Streaming reader for large JSON Lines files."""
+
+import json
+import mmap
+import os
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+# orjson is used for decoding when it is installed (optional)
+try:
+    import orjson
+
+    _orjson_installed = True
+except ImportError:
+    _orjson_installed = False
+
+JSON_PARSER = "orjson" if _orjson_installed else "json"
+
+# Bytes decoded per batch. Larger blocks fall out of the CPU cache and decode slower.
+DEFAULT_BLOCK_SIZE = 256 * 1024
+
+_MISSING = object()
+
+
+def _loads(data: bytes | memoryview) -> Any:
+    if _orjson_installed:
+        return orjson.loads(data)
+    return json.loads(bytes(data))
+
+
+def _parse_field(field: str) -> tuple[str, ...]:
+    return tuple(field.split("."))
+
+
+def _get_path(record: dict[str, Any], path: tuple[str, ...]) -> Any:
+    value: Any = record
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key, _MISSING)
+        if value is _MISSING:
+            return None
+    return value
+
+
+def _column(records: list[dict[str, Any]], path: tuple[str, ...]) -> list[Any]:
+    if len(path) == 1:
+        key = path[0]
+        return [record.get(key) for record in records]
+    if len(path) == 2:
+        outer, inner = path
+        column = []
+        for record in records:
+            value = record.get(outer)
+            column.append(value.get(inner) if isinstance(value, dict) else None)
+        return column
+    return [_get_path(record, path) for record in records]
+
+
+class RecordBatch:
+    """A batch of decoded records from one block of a JSONL file.
+
+    When the reader was created with ``fields``, only those fields are kept and
+    they are stored column by column; otherwise the decoded records are kept as
+    they are.
+
+    Attributes
+    ----------
+    fields : tuple[str, ...] | None
+        Selected fields (dotted paths such as ``context.latency_ms``), or None
+    columns : dict[str, list[Any]]
+        Values of each selected field, one entry per record (missing fields are None)
+    records : list[dict[str, Any]] | None
+        Decoded records when no fields were selected
+    start : int
+        Byte offset of the first line of the block
+    end : int
+        Byte offset just past the last line of the block
+    """
+
+    __slots__ = ("fields", "columns", "records", "start", "end", "_length")
+
+    def __init__(
+        self,
+        records: list[dict[str, Any]],
+        fields: tuple[str, ...] | None,
+        paths: list[tuple[str, ...]] | None,
+        start: int,
+        end: int,
+    ) -> None:
+        self.fields = fields
+        self.start = start
+        self.end = end
+        self._length = len(records)
+        if fields is None:
+            self.records: list[dict[str, Any]] | None = records
+            self.columns: dict[str, list[Any]] = {}
+        else:
+            self.records = None
+            self.columns = {
+                field: _column(records, path) for field, path in zip(fields, paths or [])
+            }
+
+    def __len__(self) -> int:
+        return self._length
+
+    def rows(self) -> Iterator[dict[str, Any]]:
+        """Iterate over the records of the batch.
+
+        Yields
+        ------
+        dict[str, Any]
+            Full records, or ``{field: value}`` for the selected fields
+        """
+        if self.records is not None:
+            yield from self.records
+            return
+        names = list(self.columns)
+        for values in zip(*self.columns.values()):
+            yield dict(zip(names, values))
+
+
+class JSONLReader:
+    """Read a JSON Lines file in large blocks and decode it batch by batch.
+
+    The file is memory-mapped and cut into blocks that end on a newline. Each
+    block is decoded with a single parser call by turning it into a JSON array
+    (newlines become commas), so there is no per-line Python string copy or
+    per-line parser call. A block that does not decode as a whole (corrupt or
+    blank lines) is decoded line by line and the bad lines are counted and
+    skipped. A trailing line without a newline (a file that is still being
+    written) is decoded if it is complete and otherwise skipped.
+
+    Parameters
+    ----------
+    path : str | Path
+        JSONL file to read
+    fields : Iterable[str] | None, default=None
+        Fields to keep (dotted paths such as ``context.latency_ms``); all fields if None
+    block_size : int, default=256 KiB
+        Approximate number of bytes decoded per batch (must be positive)
+    start : int, default=0
+        Byte offset to start reading from (the start of a line)
+
+    Attributes
+    ----------
+    lines : int
+        Non-empty lines read so far
+    records : int
+        Records decoded so far
+    errors : int
+        Lines that could not be decoded (or were not JSON objects)
+    partial_tail_bytes : int
+        Size of an incomplete trailing line that was skipped
+
+    Raises
+    ------
+    ValueError
+        If block_size is not positive
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        fields: Iterable[str] | None = None,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        start: int = 0,
+    ) -> None:
+        if block_size <= 0:
+            raise ValueError("Block size must be positive")
+        self.path = Path(path)
+        self.fields = tuple(fields) if fields is not None else None
+        self._paths = [_parse_field(field) for field in self.fields] if self.fields else None
+        self.block_size = block_size
+        self.start = start
+
+        self.lines = 0
+        self.records = 0
+        self.errors = 0
+        self.partial_tail_bytes = 0
+
+    def __iter__(self) -> Iterator[RecordBatch]:
+        with self.path.open("rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= self.start:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield from self._iter_blocks(mm, size)
+
+    def _iter_blocks(self, mm: mmap.mmap, size: int) -> Iterator[RecordBatch]:
+        position = self.start
+        while position < size:
+            end = min(position + self.block_size, size)
+            cut = mm.rfind(b"\n", position, end) + 1
+            while cut == 0 and end < size:
+                # A single line longer than the block: extend until its newline
+                end = min(end + self.block_size, size)
+                cut = mm.rfind(b"\n", position, end) + 1
+            if cut == 0:
+                # Trailing line without a newline
+                records = self._decode_tail(mm[position:size])
+                if records:
+                    yield self._batch(records, position, size)
+                return
+            records = self._decode_block(mm[position:cut])
+            if records:
+                yield self._batch(records, position, cut)
+            position = cut
+
+    def _batch(self, records: list[dict[str, Any]], start: int, end: int) -> RecordBatch:
+        return RecordBatch(records, self.fields, self._paths, start, end)
+
+    def _decode_block(self, block: bytes) -> list[dict[str, Any]]:
+        try:
+            values = _loads(b"[" + block.rstrip().replace(b"\n", b",") + b"]")
+        except ValueError:
+            return self._decode_lines(block)
+        if not all(isinstance(value, dict) for value in values):
+            return self._decode_lines(block)
+        # A block that decodes as a whole has one value per non-empty line (blank lines only at its end)
+        self.lines += len(values)
+        self.records += len(values)
+        return values
+
+    def _decode_lines(self, block: bytes) -> list[dict[str, Any]]:
+        records = []
+        view = memoryview(block)
+        position = 0
+        while position < len(block):
+            newline = block.find(b"\n", position)
+            end = len(block) if newline < 0 else newline
+            line = view[position:end]
+            position = end + 1
+            if not bytes(line).strip():
+                continue  # blank line
+            self.lines += 1
+            try:
+                value = _loads(line)
+            except ValueError:
+                self.errors += 1
+                continue
+            if not isinstance(value, dict):
+                self.errors += 1
+                continue
+            records.append(value)
+        self.records += len(records)
+        return records
+
+    def _decode_tail(self, tail: bytes) -> list[dict[str, Any]]:
+        if not tail.strip():
+            return []
+        try:
+            value = _loads(tail)
+        except ValueError:
+            self.partial_tail_bytes = len(tail)
+            return []
+        self.lines += 1
+        if not isinstance(value, dict):
+            self.errors += 1
+            return []
+        self.records += 1
+        return [value]
+
+    def stats(self) -> dict[str, Any]:
+        """Return reader counters.
+
+        Returns
+        -------
+        dict[str, Any]
+            Parser name and line, record, error and partial tail counts
+        """
+        return {
+            "parser": JSON_PARSER,
+            "lines": self.lines,
+            "records": self.records,
+            "errors": self.errors,
+            "partial_tail_bytes": self.partial_tail_bytes,
+        }
+
+
+def iter_jsonl_batches(
+    path: str | Path,
+    fields: Iterable[str] | None = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Iterator[RecordBatch]:
+    """Iterate over record batches of a JSONL file.
+
+    Parameters
+    ----------
+    path : str | Path
+        JSONL file to read
+    fields : Iterable[str] | None, default=None
+        Fields to keep (dotted paths); all fields if None
+    block_size : int, default=256 KiB
+        Approximate number of bytes decoded per batch
+
+    Yields
+    ------
+    RecordBatch
+        Decoded records of one block
+    """
+    yield from JSONLReader(path, fields=fields, block_size=block_size)
+
+
+def read_jsonl(path: str | Path, fields: Iterable[str] | None = None) -> Iterator[dict[str, Any]]:
+    """Iterate over the records of a JSONL file, skipping corrupt lines.
+
+    Parameters
+    ----------
+    path : str | Path
+        JSONL file to read
+    fields : Iterable[str] | None, default=None
+        Fields to keep (dotted paths); all fields if None
+
+    Yields
+    ------
+    dict[str, Any]
+        One record per valid line
+    """
+    for batch in JSONLReader(path, fields=fields):
+        yield from batch.rows()